@@ -6,200 +6,398 @@ Provides a program to help admins (i.e. lego store employees)
 interact with the lego store. 
 
 Admins (employees) can fulfill requests and view the total 
-revenue of the store.
+revenue of the store and its reports.
 """
 
-import sys 
-import mysql.connector
-import mysql.connector.errorcode as errorcode
+import argparse
+import datetime
+import json
+import sys
+
+import backends
+import backlog
+import batch
+import db
+import instrumentation
+import reports
+import sessions
+
+CURR_USERNAME = ""
+CURR_SESSION = None
 
 DEBUG = False
 
+# Statements listed by view_statement_stats.
+STATS_ROWS_SHOWN = 15
+
+# Products shown when counting the request backlog by product.
+BACKLOG_COUNTS_SHOWN = 15
+
+# Report rows shown per page by view_reports.
+REPORT_PAGE_SIZE = 20
+
 
 # ----------------------------------------------------------------------
-# SQL Utility Functions
+# Functions for Command-Line Options/Query Execution
 # ----------------------------------------------------------------------
-def get_conn():
+def ask_backlog_filters():
     """
-    Returns a connected MySQL connector instance, if connection is successful.
-    If unsuccessful, exits.
+    Helper function.
+    Asks which open requests to show. Blank answers mean no filter.
     """
-    try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="emin",
-            port="8889",  # this may change!
-            password="eminpw",
-            database="legos",
-        )
-        if DEBUG:
-            print("Successfully connected.")
-        return conn
-    except mysql.connector.Error as err:
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR and DEBUG:
-            sys.stderr("Incorrect username or password when connecting to DB.")
-        elif err.errno == errorcode.ER_BAD_DB_ERROR and DEBUG:
-            sys.stderr("Database does not exist.")
-        elif DEBUG:
-            sys.stderr(err)
-        else:
-            sys.stderr("An error occurred, please contact mySQL.")
-        sys.exit(1)
+    product_id = input("\nOnly requests for product ID (leave blank for all products): ")
+    while not (product_id == "" or product_id.isdigit()):
+        product_id = input("\nPlease enter a product ID, or leave it blank: ")
+    username = input("\nOnly requests made by customer (leave blank for all customers): ")
+    days = input("\nOnly requests older than how many days? (leave blank for any age): ")
+    while not (days == "" or days.isdigit()):
+        days = input("\nPlease enter a whole number of days, or leave it blank: ")
+    return backlog.filters(int(product_id) if product_id else None, username.strip(),
+                           int(days) if days else None)
 
 
-# ----------------------------------------------------------------------
-# Functions for Command-Line Options/Query Execution
-# ----------------------------------------------------------------------
 def view_requests():
     """
-    View UNFULFILLED requests.
+    View UNFULFILLED requests, a page at a time, optionally filtered by
+    product, customer and age, or counted by product.
     """
     print("\n-----------------------------------------------------\n")
-    print("Here is a list of unfulfilled request IDs and the products they are requesting:")
+    request_filters = ask_backlog_filters()
+    backend = backends.get_backend()
     try:
-        cursor = conn.cursor()
-        
-        sql = """SELECT request_id, product_id FROM requests WHERE request_status='U'"""
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        for row in rows:
-            (req_id, prod_id) = row 
-            print("\nRequest #{req} requesting product #{prod}.".format(req=req_id, prod=prod_id))
-
-    except mysql.connector.Error as err:
+        print("\n-----------------------------------------------------\n")
+        print("Here is a list of unfulfilled request IDs and the products they are requesting:")
+        shown = 0
+        for page in backlog.pages(backend, **request_filters):
+            for (req_id, prod_id, username, request_time) in page:
+                print("\nRequest #{req} requesting product #{prod} (by {user}, {time}).".format(
+                    req=req_id, prod=prod_id, user=username, time=request_time))
+            shown += len(page)
+            if len(page) == backlog.PAGE_SIZE:
+                ans = input("\nShown {n} so far. Enter [n] for the next page: ".format(n=shown))
+                if ans.lower() != "n":
+                    break
+        if shown == 0:
+            print("\nNo unfulfilled requests match.")
+            return
+
+        ans = input("\nEnter [c] to count these requests by product: ")
+        if ans.lower() == "c":
+            print("\n-----------------------------------------------------\n")
+            print("The {n} most requested products:".format(n=BACKLOG_COUNTS_SHOWN))
+            for (prod_id, num_requests) in backend.open_request_counts(BACKLOG_COUNTS_SHOWN,
+                                                                       **request_filters):
+                print("\nProduct #{prod}: {n} request(s).".format(prod=prod_id, n=num_requests))
+
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact technical support.")
+            print("An error occurred! Please contact technical support.", file=sys.stderr)
 
 
 def view_revenue():
     """
-    View total revenue of store.
+    View revenue of store: all-time, today, the last 30 days, or broken
+    down by theme. These are read from the daily revenue rollup, and the
+    all-time total from its shards.
     """
+    print("\n-----------------------------------------------------\n")
+    print("Which revenue would you like to see?\n")
+    print("  [a] - Total revenue of this store.")
+    print("  [b] - Revenue from today.")
+    print("  [c] - Revenue from the last 30 days.")
+    print("  [d] - Revenue by theme.")
+    print()
+    ans = input("Enter an option: ").lower()
+
+    today = datetime.date.today()
+    backend = backends.get_backend()
     try:
-        cursor = conn.cursor()
-        result = cursor.callproc("show_total_revenue", [0])
-        print("\n-----------------------------------------------------\n")
-        print("The total revenue from this store is: ${rev}.".format(rev=result[0]))
+        if ans == "b" or ans == "c":
+            start = today if ans == "b" else today - datetime.timedelta(days=29)
+            (revenue, num_purchases) = backend.show_revenue_between(start, today)
+            print("\n-----------------------------------------------------\n")
+            print("Revenue from {start} to {end}: ${rev} from {n} purchase(s).".format(
+                start=start, end=today, rev=revenue, n=num_purchases))
+        elif ans == "d":
+            days = input("\nHow many days back? (Leave blank for all time): ")
+            while not (days == "" or (days.isdigit() and int(days) > 0)):
+                days = input("\nPlease enter a positive whole number of days, or leave it blank: ")
+            start = datetime.date(1000, 1, 1) if days == "" else today - datetime.timedelta(days=int(days) - 1)
+            print("\n-----------------------------------------------------\n")
+            for (theme_name, num_purchases, theme_revenue) in backend.show_revenue_by_theme(start, today):
+                print("{theme}: ${rev} from {n} purchase(s).".format(
+                    theme=theme_name, rev=theme_revenue, n=num_purchases))
+        else:
+            print("\n-----------------------------------------------------\n")
+            print("The total revenue from this store is: ${rev}.".format(
+                rev=backend.show_total_revenue()))
 
-    except mysql.connector.Error as err:
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact technical support.")
+            print("An error occurred! Please contact technical support.", file=sys.stderr)
 
 
 def validate_request(request_id):
     """
     Helper function. 
     Checks whether request exists, and is unfulfilled.
+    This is one call to check_request_open, which also says why a request
+    can't be fulfilled; the reason is printed.
     """
     if not request_id.isdigit():
+        print("\nINVALID REQUEST ID! Request IDs are whole numbers.")
         return False 
     
     try:
-        cursor = conn.cursor()
-        
-        sql = """SELECT request_id FROM requests WHERE request_status='U'"""
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        for row in rows:
-            (req_id) = row 
-            if (int(request_id)==req_id[0]):
-                return True
-        return False 
-    
-    except mysql.connector.Error as err:
+        reason = backends.get_backend().check_request_open(int(request_id))
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact technical support.")
+            print("An error occurred! Please contact technical support.", file=sys.stderr)
+        return False
+
+    if reason is not None:
+        print("\nINVALID REQUEST ID! " + reason)
+        return False
+    return True
 
 
 def fulfill_request():
     """
     Fulfills request for a product.
     Increases inventory by 1.
-    Updates the log.
+    Updates the log with the current employee.
     """
     request_id = input("\nWhat is the ID of the request you're fulfilling? ")
     while not validate_request(request_id):
-        print("\nINVALID REQUEST ID!")
-        print("Most likely, that request doesn't exist, or you have already fulfilled it.")
         request_id = input("\nNow, please enter your desired request ID: ")
 
     try:
-        cursor = conn.cursor()
-        cursor.callproc("fulfill_request", [request_id])
-        conn.commit()  # Call to commit this change to log.
+        reason = backends.get_backend().fulfill_request(int(request_id), CURR_USERNAME)
 
         print("\n-----------------------------------------------------\n")
-        print("Request successfully fulfilled.")
-    except mysql.connector.Error as err:
+        if reason is not None:
+            # Someone else fulfilled it since it was checked.
+            print("Request not fulfilled. " + reason)
+        else:
+            print("Request successfully fulfilled.")
+    except db.Error as err:
         # If you're testing, it's helpful to see more details printed.
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
 
 
-# ----------------------------------------------------------------------
-# Functions for Logging Users In
-# ----------------------------------------------------------------------
-def is_employee(username):
+def fulfill_requests_bulk():
     """
-    Helper function.
-    Checks that person logging in is an employee.
+    Fulfills many requests at once, e.g. when a restock arrives: every
+    open request for a product (optionally only as many as arrived), or a
+    list of request IDs. Done in one transaction.
     """
-    cursor = conn.cursor()
-    sql = "SELECT employee_username FROM employees WHERE employee_username='%s';" % (username, )
-    cursor.execute(sql)
-    results = cursor.fetchall()
-    
-    return (len(results) > 0)
+    print("\n-----------------------------------------------------\n")
+    print("Which requests are you fulfilling?\n")
+    print("  [a] - Open requests for one product (a restock arrived).")
+    print("  [b] - A list of request IDs.")
+    print()
+    ans = input("Enter an option: ").lower()
+
+    product_id = None
+    request_ids = None
+    max_requests = None
+    if ans == "b":
+        ids = input("\nEnter the request IDs, separated by commas: ")
+        while not (ids.strip() and all(part.strip().isdigit() for part in ids.split(","))):
+            ids = input("\nPlease enter whole numbers separated by commas: ")
+        request_ids = [int(part) for part in ids.split(",")]
+    else:
+        product_id = input("\nWhat is the product ID that was restocked? ")
+        while not product_id.isdigit():
+            product_id = input("\nPlease enter a product ID: ")
+        product_id = int(product_id)
+        quantity = input("\nHow many arrived? (Leave blank to fulfill every open request): ")
+        while not (quantity == "" or (quantity.isdigit() and int(quantity) > 0)):
+            quantity = input("\nPlease enter a positive whole number, or leave it blank: ")
+        max_requests = int(quantity) if quantity else None
 
+    try:
+        fulfilled = backends.get_backend().fulfill_requests_bulk(
+            CURR_USERNAME, product_id, request_ids, max_requests)
 
+        print("\n-----------------------------------------------------\n")
+        print("{n} request(s) fulfilled.".format(n=len(fulfilled)))
+        if request_ids is not None and len(fulfilled) < len(set(request_ids)):
+            print("The others don't exist or were already fulfilled.")
+    except db.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        else:
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
+
+
+def view_statement_stats():
+    """
+    Shows per-statement latency, row and byte counts collected by
+    instrumentation.py, slowest total time first. Stats come from this
+    session, or from a JSON file written by another process
+    (LEGOS_STATS_OUT). This session's stats can be saved as JSON or
+    Prometheus text.
+    """
+    print("\n-----------------------------------------------------\n")
+    path = input("Stats file to view (press Enter for this session's stats): ").strip()
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, ValueError) as err:
+            print("\nCould not read {path}: {err}".format(path=path, err=err))
+            return
+    else:
+        stats = instrumentation.REGISTRY.snapshot()
+
+    if not stats:
+        print("\nNo statements have been recorded yet.")
+        return
+
+    print("\n{:<50} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9} {:>11}".format(
+        "statement", "calls", "errors", "p50 ms", "p95 ms", "p99 ms", "rows", "bytes"))
+    for statement, row in list(stats.items())[:STATS_ROWS_SHOWN]:
+        if len(statement) > 50:
+            statement = statement[:47] + "..."
+        print("{:<50} {:>7} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9} {:>11}".format(
+            statement, row["calls"], row["errors"], row["p50_ms"], row["p95_ms"],
+            row["p99_ms"], row["rows"], row["bytes"]))
+
+    if path:
+        return
+    print()
+    print("  [j] - Save these stats as JSON.")
+    print("  [p] - Save these stats as Prometheus text.")
+    print("  Press Enter to go back.")
+    ans = input("Enter an option: ").lower()
+    if ans in ("j", "p"):
+        default = "statement-stats.json" if ans == "j" else "statement-stats.prom"
+        out = input("File name [{default}]: ".format(default=default)).strip() or default
+        if ans == "p" and not out.endswith(".prom"):
+            out += ".prom"
+        try:
+            instrumentation.REGISTRY.write(out)
+            print("\nStats written to {out}.".format(out=out))
+        except OSError as err:
+            print("\nCould not write {out}: {err}".format(out=out, err=err))
+
+
+def view_reports():
+    """
+    Shows one of the store's reports (sets per theme, ratings per product,
+    spend per customer), a page at a time, after adding the purchases,
+    reviews and sets made since the reports were last refreshed. The
+    report can also be saved as CSV or JSON lines.
+    """
+    print("\n-----------------------------------------------------\n")
+    print("Which report would you like to see?\n")
+    names = sorted(reports.REPORTS)
+    for (i, name) in enumerate(names):
+        print("  [{key}] - {title}.".format(key=chr(ord("a") + i), title=reports.REPORTS[name][0]))
+    print()
+    ans = input("Enter an option: ").lower()
+    if len(ans) != 1 or not 0 <= ord(ans) - ord("a") < len(names):
+        return
+    name = names[ord(ans) - ord("a")]
+    (title, columns, _) = reports.REPORTS[name]
+
+    backend = backends.get_backend()
+    try:
+        added = reports.refresh(backend)
+        print("\n-----------------------------------------------------\n")
+        print("{title} (added {purchases} purchase(s), {reviews} review(s) and {sets} set(s) "
+              "since the last refresh):\n".format(title=title, **added))
+        print(" | ".join(columns))
+        shown = 0
+        stream = reports.chunks(backend, name)
+        try:
+            for rows in stream:
+                for row in rows:
+                    print(" | ".join(str(value) for value in row))
+                    shown += 1
+                    if shown % REPORT_PAGE_SIZE == 0:
+                        ans = input("\nShown {n} so far. Enter [n] for the next page: ".format(
+                            n=shown))
+                        if ans.lower() != "n":
+                            return
+        finally:
+            stream.close()
+        if shown == 0:
+            print("\nThis report is empty.")
+            return
+
+        ans = input("\nEnter [c] to save this report as CSV, [j] as JSON lines: ").lower()
+        if ans in ("c", "j"):
+            fmt = "csv" if ans == "c" else "jsonl"
+            default = "{name}.{fmt}".format(name=name, fmt=fmt)
+            out = input("File name [{default}]: ".format(default=default)).strip() or default
+            try:
+                with open(out, "w", newline="", encoding="utf-8") as f:
+                    count = reports.write(backend, name, f, fmt)
+                print("\n{n} row(s) written to {out}.".format(n=count, out=out))
+            except OSError as err:
+                print("\nCould not write {out}: {err}".format(out=out, err=err))
+
+    except db.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        else:
+            print("An error occurred! Please contact technical support.", file=sys.stderr)
+
+
+# ----------------------------------------------------------------------
+# Functions for Logging Users In
+# ----------------------------------------------------------------------
 def logging_in():
     """
     Prompts for login from admin user. 
     Checks database to make sure user and password are correct.
     Assumes employees are the only ones with access to this Python file.
+    Each attempt is one sp_login call (see sessions.py).
     """
-    cursor = conn.cursor()
-
     print("\n-------------------------- LEGO STORE ADMIN LOGIN --------------------------\n")
 
     while True:
         username = input("USERNAME: ").lower()
         password = input("PASSWORD: ").lower()
 
-        while not is_employee(username):
-            print("\nHmm, it doesn't look like you are an employee. Try again!\n")
-            username = input("USERNAME: ").lower()
-            password = input("PASSWORD: ").lower()
-
-        sql = "SELECT authenticate('%s', '%s');" % (username, password)
-
         try:
-            cursor.execute(sql)
-            check_response = cursor.fetchone()
-
-            if check_response[0] == 1:
+            status, session = sessions.get_manager().login(username, password, sessions.EMPLOYEE)
+            if status == sessions.OK:
+                global CURR_USERNAME, CURR_SESSION
+                CURR_USERNAME = username
+                CURR_SESSION = session.token
                 show_options()
+            elif status == sessions.NO_USER:
+                print("\nHmm, it doesn't look like you are an employee. Try again!\n")
+            elif status == sessions.LOCKED:
+                print("\nTOO MANY FAILED LOGINS. TRY AGAIN IN {s:.0f} SECONDS.\n".format(
+                    s=sessions.get_manager().retry_after(username)))
             else:
                 print("\nWRONG USERNAME OR PASSWORD. TRY AGAIN!\n")
 
-        except mysql.connector.Error as err:
+        except db.Error as err:
             if DEBUG:
-                sys.stderr(err)
+                print(err, file=sys.stderr)
                 sys.exit(1)
             else:
-                sys.stderr("Error logging in.")
+                print("Error logging in.", file=sys.stderr)
 
 
 # ----------------------------------------------------------------------
@@ -208,18 +406,26 @@ def logging_in():
 def show_options():
     """
     Helps admins navigate the store. They can:
-        1. Fulfill requests.
-        2. View total revenue of the store.
+        1. Fulfill requests, one at a time or in bulk.
+        2. View revenue of the store (total, recent, or by theme).
+        3. View database statement statistics.
+        4. View the store's reports.
     """
     print("\n-----------------------------------------------------\n")
     print("HELLO AND WELCOME TO LEGO ADMINISTRATION! :)")
 
     while True:
+        if sessions.get_manager().validate(CURR_SESSION, sessions.EMPLOYEE) is None:
+            print("\nYour session has expired. Please log in again.\n")
+            return
         print("\n-----------------------------------------------------\n")
         print("What best describes you?\n")
-        print("  [a] - I want to see all unfulfilled requests.")
+        print("  [a] - I want to browse the unfulfilled requests.")
         print("  [b] - I want to fulfill a request for a customer.")
-        print("  [c] - I want to see the total revenue of this store.")
+        print("  [c] - I want to see the revenue of this store.")
+        print("  [d] - I want to see which database statements are slow.")
+        print("  [e] - I want to fulfill many requests at once (a restock arrived).")
+        print("  [f] - I want to see the store's reports (themes, ratings, customers).")
         print("  [q] - Exit this app.")
         print()
         ans = input("Enter an option: ").lower()
@@ -229,6 +435,12 @@ def show_options():
             fulfill_request()
         elif ans == "c":
             view_revenue()
+        elif ans == "d":
+            view_statement_stats()
+        elif ans == "e":
+            fulfill_requests_bulk()
+        elif ans == "f":
+            view_reports()
         elif ans == "q":
             quit_ui()
 
@@ -240,16 +452,23 @@ def quit_ui():
     print("\n-----------------------------------------------------\n")
     print("Thanks for managing the LEGO Store!")
     print("\n-----------------------------------------------------\n")
+    if CURR_SESSION is not None:
+        sessions.get_manager().logout(CURR_SESSION)
     exit()
 
 
 def main():
     """
-    Main function for starting things up.
+    Main function for starting things up. With --batch, runs JSONL
+    commands headlessly instead of showing the menus.
     """
+    parser = argparse.ArgumentParser()
+    batch.add_arguments(parser)
+    args = parser.parse_args()
+    if args.batch:
+        sys.exit(batch.main(batch.ADMIN_OPS, args, sessions.EMPLOYEE))
     logging_in()
 
 
 if __name__ == "__main__":
-    conn = get_conn()
     main()
@@ -8,44 +8,114 @@ with the lego store.
 Customers can query, request, purchase, and review products.
 """
 
-import random
+import argparse
+import os
 import sys
-import mysql.connector
-import mysql.connector.errorcode as errorcode
+
+import backends
+import batch
+import catalog_cache
+import db
+import product_search
+import recommendations
+import sessions
+import theme_search
+import write_behind
 
 CURR_USERNAME = ""
+CURR_SESSION = None
+# Product IDs of the customer's newest purchases, read at login, which
+# seed their recommendations.
+CURR_PURCHASES = []
 
 DEBUG = False
 
+# Number of products shown when browsing by budget or theme.
+# The database samples them, so only this many rows are sent back.
+SAMPLE_SIZE = 5
+
+# Number of best matches shown for a search by product name.
+SEARCH_RESULTS = 10
+
+# Number of a customer's newest purchases their recommendations start from.
+RECENT_PURCHASES = 20
+
+# Set LEGOS_CATALOG_CACHE=1 to serve budget and theme searches from an
+# in-process copy of the catalog instead of the database.
+USE_CATALOG_CACHE = os.environ.get("LEGOS_CATALOG_CACHE") == "1"
+CATALOG = None
+THEME_INDEX = None
+
+# With write_behind.ENABLED (LEGOS_WRITE_BEHIND=1), reviews and requests are
+# queued and committed in groups. (description, future) for each write
+# whose outcome hasn't been shown to the customer yet.
+QUEUED_WRITES = []
+
+
 # ----------------------------------------------------------------------
 # SQL Utility Functions
 # ----------------------------------------------------------------------
-def get_conn():
-    """ "
-    Returns a connected MySQL connector instance, if connection is successful.
-    If unsuccessful, exits.
+def get_catalog():
     """
-    try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="emin",
-            port="8889",  # this may change!
-            password="eminpw",
-            database="legos",
-        )
-        if DEBUG:
-            print("Successfully connected.")
-        return conn
-    except mysql.connector.Error as err:
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR and DEBUG:
-            sys.stderr("Incorrect username or password when connecting to DB.")
-        elif err.errno == errorcode.ER_BAD_DB_ERROR and DEBUG:
-            sys.stderr("Database does not exist.")
+    Returns the catalog cache, loading it on first use.
+    """
+    global CATALOG
+    if CATALOG is None:
+        CATALOG = catalog_cache.CatalogCache()
+    return CATALOG
+
+
+def get_theme_index():
+    """
+    Returns the theme-name matcher, building it on first use.
+    """
+    global THEME_INDEX
+    if THEME_INDEX is None:
+        THEME_INDEX = theme_search.ThemeIndex.from_backend(backends.get_backend())
+    return THEME_INDEX
+
+
+def report_queued_writes():
+    """
+    Tells the customer how their queued reviews and requests went, for
+    those that have been committed (or failed) since the last report.
+    """
+    for (description, future) in list(QUEUED_WRITES):
+        if not future.done():
+            continue
+        QUEUED_WRITES.remove((description, future))
+        err = future.exception()
+        if err is None:
+            print("\n{desc} has been saved.".format(desc=description))
         elif DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
         else:
-            sys.stderr("An error occurred, please contact the administrator.")
-        sys.exit(1)
+            print("\n{desc} could not be saved! Please contact an employee.".format(
+                desc=description), file=sys.stderr)
+
+
+def choose_theme(theme_name):
+    """
+    Helper function.
+    Returns the theme name to search for: theme_name itself if a theme has
+    that name, otherwise one the customer picks from the closest matches
+    (or None if there are none, or they pick none).
+    """
+    index = get_theme_index()
+    exact = index.exact(theme_name)
+    if exact is not None:
+        return exact
+
+    matches = index.match(theme_name)
+    if not matches:
+        return None
+    print("\nWe couldn't find that exact theme. Did you mean:\n")
+    for (i, name) in enumerate(matches, 1):
+        print("  [{i}] - {name}".format(i=i, name=name))
+    ans = input("\nEnter a number (or anything else to go back): ")
+    if ans.isdigit() and 1 <= int(ans) <= len(matches):
+        return matches[int(ans) - 1]
+    return None
 
 
 # ----------------------------------------------------------------------
@@ -61,6 +131,7 @@ def search_for_sets():
     print("  [a] - I have a maximum price in mind. What can I buy?")
     print("  [b] - I have a theme I want to explore. What sets are in that theme?")
     print("  [c] - I have a product I want. How much does it cost? And what did other users rate it?")
+    print("  [d] - I'm looking for a product by name.")
     print("  [q] - Quit.")
     print()
 
@@ -85,110 +156,190 @@ def search_for_sets():
                             + "Part IDs are integers between 100000 and 125992.\n"
                             + "Again, enter the product ID you wish to query: ")
         get_price_rating(prod_id)
+    elif ans == "d":
+        query = input("\nWhat are you looking for? \n"
+                      + "(Examples: Millennium Falcon, 2 x 4 brick, castle)\n\n")
+        max_price = input("\nEnter your maximum budget ($), or leave blank for any price: ")
+        while max_price and not (max_price.isnumeric() and float(max_price) > 0):
+            max_price = input("\nSorry, your budget must be a positive whole number.\n"
+                              + "Again, enter your maximum budget ($), or leave blank: ")
+        in_stock = input("\nOnly show products in stock? (y/n): ").lower() == "y"
+        search_by_name(query, max_price or None, in_stock)
     else:
         quit_ui()
 
 
-def pick_n_random(n, rows):
-    """
-    Helper function to show users digestible data.
-    Picks n random rows from a dataset.
-    """
-    res = []
-    rand_indices = random.sample(range(len(rows)), n)
-    for i in rand_indices:
-        res.append(rows[i])
-    return res
-
-
 def get_price_rating(prod_id):
     """
     Gets the price and average rating for a product.
     """
     try:
-        cursor = conn.cursor()
-        result = cursor.callproc("get_price_and_rating", [prod_id, 0, 0])
+        (price, rating) = backends.get_backend().get_price_and_rating(int(prod_id))
 
         print("\n-----------------------------------------------------\n")
-        print("The set costs ${price}.".format(price=result[1]))
+        print("The set costs ${price}.".format(price=price))
 
-        rating = result[2]
         if rating == 0:
             print("There are currently no ratings for that product.")
         else:
             print("Its average rating is {star} stars.".format(star=rating))
 
-    except mysql.connector.Error as err:
+        print_recommendations([int(prod_id)])
+
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
 
 
-def search_for_themes(theme_name):
+def sample_sets(proc, args):
+    """
+    Helper function.
+    Calls one of the sampling procedures and returns its rows, or serves
+    the same query from the catalog cache when it is enabled.
+    """
+    backend = backends.get_backend()
+    if USE_CATALOG_CACHE and backend.name == "mysql":
+        if proc == "sample_sets_in_theme":
+            return get_catalog().sample_in_theme(args[0], SAMPLE_SIZE)
+        return get_catalog().sample_max_price(args[0], SAMPLE_SIZE)
+
+    return getattr(backend, proc)(*args, SAMPLE_SIZE)
+
+
+def print_sets(rows):
+    """
+    Helper function.
+    Prints (product_id, product_name, product_price) rows for customers.
+    """
+    for row in rows:
+        (product_id, product_name, product_price) = row
+        print('\nThe "{name}" set is ${price}.'.format(
+                name=product_name, price=product_price))
+        print("Remember this product ID to purchase: {id}.".format(
+                id=product_id))
+
+
+def print_recommendations(product_ids):
+    """
+    Helper function.
+    Prints the in-stock products most similar to product_ids and to the
+    customer's recent purchases (see recommendations.py), leaving out
+    what they already have. The results above it stay up if this fails.
     """
-    Searches for sets with a given theme.
+    try:
+        rows = recommendations.get_recommender().recommend(
+            list(product_ids) + CURR_PURCHASES, SAMPLE_SIZE, in_stock=True,
+            exclude=CURR_PURCHASES)
+    except db.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        return
+    if rows:
+        print("\nYou might also like:")
+        print_sets(rows)
+
+
+def remember_purchases(product_ids):
+    """
+    Helper function.
+    Adds newly bought products to the front of CURR_PURCHASES.
+    """
+    global CURR_PURCHASES
+    CURR_PURCHASES = (list(product_ids) + CURR_PURCHASES)[:RECENT_PURCHASES]
+
+
+def search_by_name(query, max_price=None, in_stock=False):
+    """
+    Shows the products whose names best match query, optionally costing
+    at most max_price and in stock.
     """
     print("\n-----------------------------------------------------\n")
+    if not product_search.tokenize(query):
+        print("Please enter a word or number to search for.")
+        return
+    try:
+        rows = product_search.get_index().search(query, max_price, in_stock, SEARCH_RESULTS)
+        if len(rows) == 0:
+            print("Sorry, no products match that search.")
+        else:
+            print("Here are the best matches:")
+            print_sets(rows)
 
+    except db.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        else:
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
+
+
+def search_for_themes(theme_name):
+    """
+    Searches for sets with a given theme, or any of its sub-themes.
+    Partial or misspelled theme names are matched to the closest themes.
+    """
     try:
-        cursor = conn.cursor()
-        cursor.callproc("get_sets_in_theme", [theme_name])
-        results = cursor.stored_results()
-
-        for result in results:
-            rows = result.fetchall()
-            if len(rows) == 0:
-                print("Sorry, there are no sets in that theme.")
-                print("Try again with another theme next time?")
-            else: 
-                print("Here are some sets you might get interested in.")
-                sample_rows = pick_n_random(min(len(rows), 5), rows)
-                for row in sample_rows:
-                    (product_id, product_name, product_price) = row
-                    print('\nThe "{name}" set is ${price}.'.format(
-                            name=product_name, price=product_price))
-                    print("Remember this product ID to purchase: {id}.".format(
-                            id=product_id))
-
-    except mysql.connector.Error as err:
+        theme_name = choose_theme(theme_name)
+        print("\n-----------------------------------------------------\n")
+        if theme_name is None:
+            print("Sorry, we don't have a theme by that name.")
+            print("Try again with another theme next time?")
+            return
+
+        rows = sample_sets("sample_sets_in_theme", [theme_name])
+        if len(rows) == 0:
+            print("Sorry, there are no sets in that theme.")
+            print("Try again with another theme next time?")
+        else: 
+            print("Here are some sets you might get interested in.")
+            print_sets(rows)
+            print_recommendations([row[0] for row in rows])
+
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
 
 
 def search_with_budget(max_price):
     """
-    Returns 5 random sets with a price under max_price.
+    Returns SAMPLE_SIZE random sets with a price under max_price.
     """
     print("\n-----------------------------------------------------\n")
     try:
-        cursor = conn.cursor()
-        cursor.callproc("get_sets_max_price", [max_price])
+        rows = sample_sets("sample_sets_max_price", [max_price])
+        if len(rows) == 0:
+            print("Actually, nevermind. There are no sets within your budget. Sorry!")
+        else:
+            print("Here are some options for you:")
+            print_sets(rows)
+            print_recommendations([row[0] for row in rows])
 
-        for result in cursor.stored_results():
-            rows = result.fetchall()
-            if len(rows) == 0:
-                print("Actually, nevermind. There are no sets within your budget. Sorry!")
-            else:
-                sample_rows = pick_n_random(min(len(rows), 5), rows)
-                print("Here are some options for you:")
-                for row in sample_rows:
-                    (product_id, product_name, product_price) = row
-                    print('\nThe "{name}" set is ${price}.'.format(
-                            name=product_name, price=product_price))
-                    print("Remember this product ID to purchase: {id}.".format(
-                            id=product_id))
-
-    except mysql.connector.Error as err:
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
+
+
+def is_product_id(product_id):
+    """
+    Helper function.
+    Checks whether a string is a well-formed set or part ID.
+    """
+    if not product_id.isdigit():
+        return False
+    is_set = int(product_id) >= 1 and int(product_id) <= 11673
+    is_part = int(product_id) >= 100000 and int(product_id) <= 125992
+    return is_set or is_part
+
 
 def valid_product_request(product_id, is_purchase):
     """
@@ -199,17 +350,12 @@ def valid_product_request(product_id, is_purchase):
     If is_purchase, then returns if there is > 0 in inventory.
     If is_request, then returns if there is < 1 in inventory.
     """
-    if not product_id.isdigit():
-        return False
-    is_set = int(product_id) >= 1 and int(product_id) <= 11673
-    is_part = int(product_id) >= 100000 and int(product_id) <= 125992
-    if not (is_set or is_part):
+    if not is_product_id(product_id):
         return False
 
-    cursor = conn.cursor()
-    sql = "SELECT quantity FROM product_inventory WHERE product_id=%s;" % (product_id, )
-    cursor.execute(sql)
-    available_inventory = cursor.fetchone()[0]
+    available_inventory = backends.get_backend().product_quantity(int(product_id))
+    if available_inventory is None:
+        return False
 
     if is_purchase:
         return (available_inventory > 0)
@@ -230,24 +376,74 @@ def make_purchase():
                         + "\nAgain, enter the product ID you wish to purchase: ")
 
     try:
-        cursor = conn.cursor()
-        cursor.callproc("make_purchase", [prod_id, CURR_USERNAME])
-        conn.commit()
+        result = backends.get_backend().make_purchase(int(prod_id), CURR_USERNAME)
 
-        sql = """SELECT purchase_id FROM purchases ORDER BY purchase_id DESC LIMIT 1"""
-        cursor.execute(sql)
-        pur_id = cursor.fetchone()[0]
+        print("\n-----------------------------------------------------\n")
+        if result.status == "OK":
+            remember_purchases([int(prod_id)])
+            print("Thanks for your purchase!\n")
+            print("Remember your purchase ID to write a review: {id}.".format(
+                id=result.purchase_id))
+        else:
+            # Someone else bought the last one since we checked.
+            print("SORRY, THAT ITEM JUST SOLD OUT.")
+            print("Remember, you can always request an out-of-stock product!")
+
+    except db.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        else:
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
+
+
+def checkout_cart():
+    """
+    Allows customers to buy several products at once.
+    The whole cart is bought in one transaction, or not at all.
+    """
+    print("\nAdd product IDs to your cart one at a time. "
+          + "Enter the same ID twice to buy two. Leave it blank when you're done.")
+    cart = []
+    while True:
+        prod_id = input("\nProduct ID (or blank to check out): ").strip()
+        if prod_id == "":
+            break
+        if not is_product_id(prod_id):
+            print("\nSet IDs are integers between 1 and 11673 (inclusive), and "
+                  + "part IDs are integers between 100000 and 125992.")
+            continue
+        cart.append(int(prod_id))
+        print("Your cart has {n} item(s).".format(n=len(cart)))
+
+    if not cart:
+        print("\nYour cart is empty, so nothing was bought.")
+        return
+
+    try:
+        result = backends.get_backend().checkout_cart(cart, CURR_USERNAME)
 
         print("\n-----------------------------------------------------\n")
-        print("Thanks for your purchase!\n")
-        print("Remember your purchase ID to write a review: {id}.".format(id=pur_id))
+        if result.status == "OK":
+            remember_purchases(product_id for (_, product_id, _) in result.purchases)
+            print("Thanks for your purchase!\n")
+            for (purchase_id, product_id, total) in result.purchases:
+                print("Product #{prod} for ${total}: purchase ID {id}.".format(
+                    prod=product_id, total=total, id=purchase_id))
+            print("\nRemember your purchase IDs to write reviews.")
+        else:
+            print("SORRY, SOME ITEMS IN YOUR CART ARE OUT OF STOCK, SO NOTHING WAS BOUGHT.\n")
+            for (product_id, requested, available) in result.shortages:
+                print("Product #{prod}: you wanted {req}, we have {avail}.".format(
+                    prod=product_id, req=requested, avail=available))
+            print("\nRemember, you can always request an out-of-stock product!")
 
-    except mysql.connector.Error as err:
+    except (ValueError, db.Error) as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
 
 
 def make_request():
@@ -261,19 +457,24 @@ def make_request():
                         + "Again, enter the product ID you wish to request: ")
 
     try:
-        cursor = conn.cursor()
-        cursor.callproc("request_additional_inventory", [prod_id, CURR_USERNAME])
-        conn.commit()
+        if write_behind.ENABLED:
+            future = write_behind.get_queue().request_additional_inventory(
+                int(prod_id), CURR_USERNAME)
+            QUEUED_WRITES.append(("Your request for product {id}".format(id=prod_id), future))
+            print("\n-----------------------------------------------------\n")
+            print("Request has been received.")
+            return
+        backends.get_backend().request_additional_inventory(int(prod_id), CURR_USERNAME)
 
         print("\n-----------------------------------------------------\n")
         print("Request has been successfully made.")
 
-    except mysql.connector.Error as err:
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
 
 
 def validate_review_purchase(purchase_id):
@@ -281,28 +482,27 @@ def validate_review_purchase(purchase_id):
     Helper function. 
     Checks whether purchase has been reviewed already,
     and whether current customer actually made that purchase.
+    This is one call to can_review_purchase, which also says why a
+    purchase can't be reviewed; the reason is printed.
     """
     if not (purchase_id.isdigit() and int(purchase_id) > 0):
+        print("\nINVALID PURCHASE ID! Purchase IDs are positive whole numbers.")
         return False 
-    
-    no_review_yet = False
-    matching_customer = False
 
-    cursor = conn.cursor()
-
-    sql = "SELECT * FROM reviews WHERE purchase_id=%s;" % (purchase_id, )
-    cursor.execute(sql)
-    potential_duplicate = cursor.fetchall()
-    no_review_yet = len(potential_duplicate) == 0
-
-    sql = "SELECT purchase_id FROM purchases WHERE customer_username='%s';" % (CURR_USERNAME, )
-    cursor.execute(sql)
-    customer_purchases = cursor.fetchall()
-    for purchase in customer_purchases:
-        if purchase[0]==int(purchase_id):
-            matching_customer = True
+    try:
+        reason = backends.get_backend().can_review_purchase(int(purchase_id), CURR_USERNAME)
+    except db.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        else:
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
+        return False
 
-    return (no_review_yet and matching_customer)
+    if reason is not None:
+        print("\nINVALID PURCHASE ID! " + reason)
+        return False
+    return True
 
 
 def write_review():
@@ -312,8 +512,6 @@ def write_review():
     """
     purchase_id = input("\nPlease enter the purchase ID of the purchase you're reviewing: ")
     while not validate_review_purchase(purchase_id):
-        print("\nINVALID PURCHASE ID!")
-        print("Most likely, that purchase already has a review, or you didn't make that purchase.")
         purchase_id = input("\nNow, please enter the desired purchase ID again: ")
 
     rating = input("\nHow would you rate this product? Please enter an integer 1-5: ")
@@ -324,74 +522,64 @@ def write_review():
     review = input("\nPlease enter a brief review that is less than 500 characters: ")
 
     try:
-        cursor = conn.cursor()
-        cursor.callproc("write_review", [purchase_id, rating, review])
-        conn.commit()
+        if write_behind.ENABLED:
+            future = write_behind.get_queue().write_review(int(purchase_id), int(rating), review)
+            QUEUED_WRITES.append(
+                ("Your review of purchase {id}".format(id=purchase_id), future))
+            print("\n-----------------------------------------------------\n")
+            print("Thanks for your review!")
+            return
+        backends.get_backend().write_review(int(purchase_id), int(rating), review)
 
         print("\n-----------------------------------------------------\n")
         print("Thanks for your review!")
 
-    except mysql.connector.Error as err:
+    except db.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr("An error occurred! Please contact an employee.")
+            print("An error occurred! Please contact an employee.", file=sys.stderr)
 
 
 # ----------------------------------------------------------------------
 # Functions for Logging Users In
 # ----------------------------------------------------------------------
-def is_customer(username):
-    """
-    Helper function.
-    Checks that person logging in is a customer.
-    """
-    cursor = conn.cursor()
-    sql = "SELECT customer_username FROM customers WHERE customer_username='%s';" % (username, )
-    cursor.execute(sql)
-    results = cursor.fetchall()
-    
-    return (len(results) > 0)
-
 def logging_in():
     """
     Prompts for login from user. 
     Checks database to make sure they enter valid username and password.
+    Each attempt is one sp_login call (see sessions.py).
     """
-    cursor = conn.cursor()
-
     print("\n-------------------------- LEGO STORE CUSTOMER LOGIN --------------------------\n")
 
     while True:
         username = input("USERNAME: ").lower()
-        global CURR_USERNAME
-        CURR_USERNAME = username
         password = input("PASSWORD: ").lower()
 
-        while not is_customer(username):
-            print("\nHmm, it doesn't look like you are a registered customer. Try again!\n")
-            username = input("USERNAME: ").lower()
-            CURR_USERNAME = username
-            password = input("PASSWORD: ").lower()
-
-        sql = """SELECT authenticate('%s', '%s');""" % (username, password)
-
         try:
-            cursor.execute(sql)
-            check_response = cursor.fetchone()
-
-            if check_response[0] == 1:
+            status, session = sessions.get_manager().login(username, password, sessions.CUSTOMER)
+            if status == sessions.OK:
+                global CURR_USERNAME, CURR_SESSION, CURR_PURCHASES
+                CURR_USERNAME = username
+                CURR_SESSION = session.token
+                CURR_PURCHASES = backends.get_backend().recent_purchases(username,
+                                                                         RECENT_PURCHASES)
                 show_options()
+            elif status == sessions.NO_USER:
+                print("\nHmm, it doesn't look like you are a registered customer. Try again!\n")
+            elif status == sessions.LOCKED:
+                print("\nTOO MANY FAILED LOGINS. TRY AGAIN IN {s:.0f} SECONDS.\n".format(
+                    s=sessions.get_manager().retry_after(username)))
             else:
                 print("\n-----------------------------------------------------\n")
                 print("WRONG USERNAME OR PASSWORD. TRY AGAIN!\n")
-        except mysql.connector.Error as err:
+        except db.Error as err:
             if DEBUG:
-                sys.stderr(err)
+                print(err, file=sys.stderr)
                 sys.exit(1)
             else:
-                sys.stderr("Error logging in.")
+                print("Error logging in.", file=sys.stderr)
 
 
 # ----------------------------------------------------------------------
@@ -404,17 +592,23 @@ def show_options():
         2. Purchase an item
         3. Make a request
         4. Write a review.
+        5. Check out a cart of several items.
     """
     print("\n-----------------------------------------------------\n")
     print("HELLO AND WELCOME TO THE LEGO STORE! :)")
 
     while True:
+        report_queued_writes()
+        if sessions.get_manager().validate(CURR_SESSION, sessions.CUSTOMER) is None:
+            print("\nYour session has expired. Please log in again.\n")
+            return
         print("\n-----------------------------------------------------\n")
         print("What best describes you?\n")
         print("  [a] - I want to learn more about some product(s).")
         print("  [b] - I know what I want to buy!")
         print("  [c] - I want to request an item that's out of stock.")
         print("  [d] - I want to review one of my purchases!")
+        print("  [e] - I want to buy several items at once.")
         print("  [q] - Exit this app.")
         print()
 
@@ -428,6 +622,8 @@ def show_options():
             make_request()
         elif ans == "d":
             write_review()
+        elif ans == "e":
+            checkout_cart()
         elif ans == "q":
             quit_ui()
 
@@ -435,7 +631,12 @@ def show_options():
 def quit_ui():
     """
     Quits the program, printing a good bye message to the user.
+    Queued reviews and requests are committed first.
     """
+    write_behind.close()
+    report_queued_writes()
+    if CURR_SESSION is not None:
+        sessions.get_manager().logout(CURR_SESSION)
     print("\n-----------------------------------------------------\n")
     print("Thanks for visiting the LEGO Store!")
     print("\n-----------------------------------------------------\n")
@@ -444,11 +645,16 @@ def quit_ui():
 
 def main():
     """
-    Main function for starting things up.
+    Main function for starting things up. With --batch, runs JSONL
+    commands headlessly instead of showing the menus.
     """
+    parser = argparse.ArgumentParser()
+    batch.add_arguments(parser)
+    args = parser.parse_args()
+    if args.batch:
+        sys.exit(batch.main(batch.CLIENT_OPS, args, sessions.CUSTOMER))
     logging_in()
 
 
 if __name__ == "__main__":
-    conn = get_conn()
     main()
\ No newline at end of file
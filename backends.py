@@ -0,0 +1,1473 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Backends for the store's procedure API.
+
+Each backend offers the stored procedures and functions from
+setup-routines.sql and setup-passwords.sql as methods with the same names:
+
+    get_sets_max_price(max_price)          -> [(product_id, product_name, product_price)]
+    get_sets_in_theme(theme_name)          -> [(product_id, product_name, product_price)]
+    sample_sets_max_price(max_price, k)    -> [(product_id, product_name, product_price)]
+    sample_sets_in_theme(theme_name, k)    -> [(product_id, product_name, product_price)]
+    get_price_and_rating(product_id)       -> (product_price, avg_rating)
+    make_purchase(product_id, username)    -> inventory.PurchaseResult
+    checkout_cart(product_ids, username)   -> checkout.CheckoutResult
+    request_additional_inventory(product_id, username) -> request_id
+    can_review_purchase(purchase_id, username) -> None, or why not
+    write_review(purchase_id, rating, review)
+    apply_writes(writes)                   -> [result or db.Error], one per
+                                              (name, args) in writes, all in one commit
+    check_request_open(request_id)         -> None, or why not
+    fulfill_request(request_id, employee_username) -> None, or why not
+    fulfill_requests_bulk(employee_username, product_id, request_ids, max_requests)
+                                           -> [(request_id, product_id)] fulfilled
+    open_requests(after_request_id, limit, product_id, username, before)
+                                           -> iterator of (request_id, product_id,
+                                              customer_username, request_time)
+    open_request_counts(limit, product_id, username, before)
+                                           -> [(product_id, num_requests)]
+    show_total_revenue()                   -> total
+    show_revenue_between(start, end)       -> (total, num_purchases)
+    show_revenue_by_theme(start, end)      -> [(theme_name, num_purchases, revenue)]
+    authenticate(username, password)       -> True or False
+    sp_login(username, password, role)     -> 'OK', 'NO_USER' or 'WRONG_PASSWORD'
+                                              (role 'C' customer or 'E' employee)
+    sp_change_password(username, password)
+    is_customer(username)                  -> True or False
+    is_employee(username)                  -> True or False
+    product_quantity(product_id)           -> quantity, or None if no such product
+    rebuild_theme_closure()
+    catalog_products(product_ids)          -> [(product_id, product_name, product_price)]
+    last_product_change()                  -> change_id
+    product_changes(after_change_id)       -> [(change_id, product_id)]
+    in_stock(product_ids)                  -> set of the product_ids with quantity > 0
+    catalog_version()                      -> version (bumped on catalog changes)
+    catalog_columns()                      -> [(product_id, product_name, product_price,
+                                               quantity, theme_id, num_parts,
+                                               year_released, category_id)]
+    catalog_quantities()                   -> [(product_id, quantity)]
+    recent_inventory_changes(n)            -> change_ids of the n newest inventory changes
+    inventory_snapshot(n)                  -> (recent_inventory_changes(n),
+                                               [(product_id, quantity)]), read together
+    inventory_changes(after_change_id, limit)
+                                           -> [(change_id, product_id, quantity, delta)]
+    trim_inventory_changes(before, upto_change_id)
+                                           -> number of changes deleted
+    inventory_trimmed_upto()               -> change_id the changes may be deleted up to
+    theme_subtrees()                       -> [(theme_id, theme_name, descendant_id)]
+    refresh_reports(rebuild)               -> (new_purchases, new_reviews, new_sets)
+    recent_interactions(n)                 -> (the n highest purchase_ids,
+                                               the n highest review_seqs)
+    interactions_after(after)              -> ([(purchase_id, customer_username)],
+                                               [(review_seq, customer_username)]) past
+                                               after=(purchase_id, review_seq), in order
+    interactions(usernames)                -> iterator of (customer_username, purchase_id,
+                                              product_id, rating or None,
+                                              review_seq or None), by customer
+    recent_purchases(username, n)          -> product_ids of the customer's n newest
+                                              purchases, newest first
+    recommendation_state()                 -> (last_purchase_id, last_review_seq, version)
+    interaction_norms()                    -> [(product_id, norm_sq, buyers)]
+    pair_sums(product_ids)                 -> [(product_id, neighbor_id, dot)] of the
+                                              pairs with either one in product_ids
+    neighbor_lists(product_ids)            -> [(product_id, neighbor_id, score)]
+    neighbor_holders(product_ids)          -> [(product_id, neighbor_id)] with neighbor_id
+                                              in product_ids
+    save_neighbors(lists, norms, watermarks, clear, pair_sums, since)
+    product_neighbors(product_id, k)       -> [(neighbor_id, product_name, product_price,
+                                               score)], best first
+
+connection() is a context manager giving a DB-API connection for the
+apps' plain SELECT statements, which both databases understand.
+
+MySQLBackend calls the real procedures through the connection pool.
+SQLiteBackend is an in-process stand-in: it loads the same CSV files into
+SQLite (schema and triggers in setup-sqlite.sql, users from
+setup-passwords.sql) and implements each procedure in Python, so tests,
+demos and benchmarks run with no MySQL server. Loading the CSVs takes
+about a second, mostly parsing them and inserting the rows. It can run in
+memory (loaded every time) or from a file, which is loaded once and then
+opened in milliseconds.
+Both raise db.Error subclasses (mysql.connector's errors) on database
+errors. Only MySQLBackend needs the MySQL driver installed.
+
+The apps use get_backend(), chosen by the environment:
+
+    LEGOS_BACKEND       mysql (default) or sqlite
+    LEGOS_SQLITE_PATH   SQLite database file (default: in memory)
+"""
+
+import collections
+import datetime
+import decimal
+import hashlib
+import itertools
+import os
+import random
+import re
+import sqlite3
+import threading
+
+import checkout
+import db
+import inventory
+import load_data
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CENTS = decimal.Decimal("0.01")
+
+# Rows fetched per round trip when streaming the request backlog.
+STREAM_CHUNK = 500
+
+
+def _backlog_filter(param, product_id=None, username=None, before=None):
+    """
+    Returns (WHERE clause, args) selecting open requests, optionally only
+    for one product, one customer, or made before a time. param is the
+    driver's placeholder ("%s" or "?").
+    """
+    clauses = ["request_status='U'"]
+    args = []
+    for (column, op, value) in (("product_id", "=", product_id),
+                                ("customer_username", "=", username),
+                                ("request_time", "<", before)):
+        if value is not None:
+            clauses.append("{col}{op}{param}".format(col=column, op=op, param=param))
+            args.append(value)
+    return " AND ".join(clauses), args
+
+
+def _backlog_page_sql(param, after_request_id, limit, **filters):
+    """
+    Returns (SQL, args) for open requests after after_request_id, in
+    request ID order. Paging by request_id (rather than OFFSET) means every
+    page is an index range scan, however deep into the backlog it is.
+    """
+    where, args = _backlog_filter(param, **filters)
+    sql = ("SELECT request_id, product_id, customer_username, request_time FROM requests "
+           "WHERE {where} AND request_id>{param} ORDER BY request_id").format(
+               where=where, param=param)
+    args.append(after_request_id)
+    if limit is not None:
+        sql += " LIMIT {param}".format(param=param)
+        args.append(limit)
+    return sql, args
+
+
+def _backlog_counts_sql(param, limit, **filters):
+    """
+    Returns (SQL, args) counting the matching open requests per product,
+    most requested first.
+    """
+    where, args = _backlog_filter(param, **filters)
+    sql = ("SELECT product_id, COUNT(*) AS num_requests FROM requests WHERE {where} "
+           "GROUP BY product_id ORDER BY num_requests DESC, product_id").format(where=where)
+    if limit is not None:
+        sql += " LIMIT {param}".format(param=param)
+        args.append(limit)
+    return sql, args
+
+
+def _id_list(param, product_ids):
+    """
+    Returns (placeholder list, args) for `product_id IN (...)`.
+    An empty list matches nothing.
+    """
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not product_ids:
+        return "NULL", []
+    return ", ".join([param] * len(product_ids)), product_ids
+
+
+def _catalog_products_sql(param, product_ids):
+    params, args = _id_list(param, product_ids)
+    return ("SELECT product_id, product_name, product_price FROM product_inventory "
+            "WHERE product_id IN ({params})".format(params=params), args)
+
+
+# Every product with its set or part columns (NULL for the other kind).
+_CATALOG_COLUMNS = (
+    "SELECT product_inventory.product_id, product_name, product_price, quantity, "
+    "       theme_id, num_parts, year_released, category_id "
+    "FROM product_inventory "
+    "  LEFT JOIN lego_sets ON (product_inventory.product_id=lego_sets.product_id) "
+    "  LEFT JOIN lego_parts ON (product_inventory.product_id=lego_parts.product_id)"
+)
+
+_THEME_SUBTREES = (
+    "SELECT theme_id, theme_name, descendant_id "
+    "FROM themes JOIN theme_closure ON (themes.theme_id=theme_closure.ancestor_id)"
+)
+
+
+# The apps' hot lookups, prepared once per connection by MySQLBackend.
+HOT_STATEMENTS = {
+    "product_quantity": "SELECT quantity FROM product_inventory WHERE product_id=%s",
+    "is_customer": "SELECT COUNT(*) FROM customers WHERE customer_username=%s",
+    "is_employee": "SELECT COUNT(*) FROM employees WHERE employee_username=%s",
+    "authenticate": "SELECT authenticate(%s, %s)",
+    "product_neighbors": (
+        "SELECT neighbor_id, product_name, product_price, score "
+        "FROM product_neighbors "
+        "  JOIN product_inventory ON (product_neighbors.neighbor_id=product_inventory.product_id) "
+        "WHERE product_neighbors.product_id=%s ORDER BY score DESC LIMIT %s"),
+}
+
+
+def _in_stock_sql(param, product_ids):
+    params, args = _id_list(param, product_ids)
+    return ("SELECT product_id FROM product_inventory "
+            "WHERE product_id IN ({params}) AND quantity>0".format(params=params), args)
+
+
+def _interactions_sql(param, usernames=None, after=None, limit=None):
+    """
+    Returns (SQL, args) for every purchase with its review's rating and
+    review_seq (or NULLs), in (customer_username, purchase_id) order, which
+    idx_purchase_customer reads without sorting. usernames limits it to
+    those customers; after=(customer_username, purchase_id) and limit page
+    through it.
+    """
+    clauses = ["purchases.customer_username IS NOT NULL",
+               "purchases.product_id IS NOT NULL"]
+    args = []
+    if usernames is not None:
+        usernames = list(usernames)
+        clauses.append("purchases.customer_username IN ({params})".format(
+            params=", ".join([param] * len(usernames)) if usernames else "NULL"))
+        args.extend(usernames)
+    if after is not None:
+        clauses.append("(purchases.customer_username>{p} OR (purchases.customer_username={p} "
+                       "AND purchases.purchase_id>{p}))".format(p=param))
+        args.extend([after[0], after[0], after[1]])
+    sql = ("SELECT purchases.customer_username, purchases.purchase_id, purchases.product_id, "
+           "       rating, review_seq "
+           "FROM purchases LEFT JOIN reviews ON (purchases.purchase_id=reviews.purchase_id) "
+           "WHERE {where} ORDER BY purchases.customer_username, purchases.purchase_id").format(
+               where=" AND ".join(clauses))
+    if limit is not None:
+        sql += " LIMIT {param}".format(param=param)
+        args.append(limit)
+    return sql, args
+
+
+def _recent_interactions_sql(param, n):
+    """
+    Returns the two (SQL, args) for recent_interactions(n).
+    """
+    return [("SELECT purchase_id FROM purchases ORDER BY purchase_id DESC "
+             "LIMIT {param}".format(param=param), [n]),
+            ("SELECT review_seq FROM reviews ORDER BY review_seq DESC "
+             "LIMIT {param}".format(param=param), [n])]
+
+
+def _interactions_after_sql(param, after):
+    """
+    Returns the two (SQL, args) for interactions_after(after). Every
+    purchase counts, with or without a customer, so readers can tell a
+    missing purchase_id from one that was committed.
+    """
+    return [("SELECT purchase_id, customer_username FROM purchases "
+             "WHERE purchase_id>{param} ORDER BY purchase_id".format(param=param), [after[0]]),
+            ("SELECT review_seq, purchases.customer_username FROM reviews "
+             "  JOIN purchases ON (reviews.purchase_id=purchases.purchase_id) "
+             "WHERE review_seq>{param} ORDER BY review_seq".format(param=param), [after[1]])]
+
+
+def _recent_purchases_sql(param, username, n):
+    """
+    Returns (SQL, args) for a customer's n newest purchases, read
+    backwards on idx_purchase_customer.
+    """
+    return ("SELECT product_id FROM purchases "
+            "WHERE customer_username={p} AND product_id IS NOT NULL "
+            "ORDER BY purchase_id DESC LIMIT {p}".format(p=param), [username, n])
+
+
+def _pair_sums_sql(param, product_ids):
+    params, args = _id_list(param, product_ids)
+    return ("SELECT product_id, neighbor_id, dot FROM product_pair_sums "
+            "WHERE product_id IN ({params}) "
+            "UNION ALL "
+            "SELECT product_id, neighbor_id, dot FROM product_pair_sums "
+            "WHERE neighbor_id IN ({params}) AND product_id NOT IN ({params})".format(
+                params=params), args * 3)
+
+
+def _neighbor_holders_sql(param, product_ids):
+    params, args = _id_list(param, product_ids)
+    return ("SELECT product_id, neighbor_id FROM product_neighbors "
+            "WHERE neighbor_id IN ({params})".format(params=params), args)
+
+
+def _neighbor_lists_sql(param, product_ids):
+    params, args = _id_list(param, product_ids)
+    return ("SELECT product_id, neighbor_id, score FROM product_neighbors "
+            "WHERE product_id IN ({params})".format(params=params), args)
+
+
+def _recent_inventory_changes_sql(param, n):
+    return ("SELECT change_id FROM inventory_changes ORDER BY change_id DESC "
+            "LIMIT {param}".format(param=param), [n])
+
+
+def _inventory_changes_sql(param, after_change_id, limit):
+    return ("SELECT change_id, product_id, quantity, delta FROM inventory_changes "
+            "WHERE change_id>{p} ORDER BY change_id LIMIT {p}".format(p=param),
+            [after_change_id, limit])
+
+
+def _trim_inventory_changes(cursor, param, before, upto_change_id):
+    """
+    Deletes the inventory changes made before `before` (and, if given, up
+    to upto_change_id) on cursor, and records how far in
+    inventory_trim_state. Returns the number deleted.
+    """
+    cursor.execute("SELECT MAX(change_id) FROM inventory_changes", ())
+    (newest, ) = cursor.fetchone()
+    cursor.execute("SELECT MAX(change_id) FROM inventory_changes WHERE change_time<{p}".format(
+        p=param), (before, ))
+    (cutoff, ) = cursor.fetchone()
+    if cutoff is None:
+        return 0
+    # Always keep the newest change: both databases number new rows from
+    # the highest change_id left (InnoDB after a restart), so emptying the
+    # table would reuse change_ids subscribers have already read.
+    cutoff = min(cutoff, newest - 1)
+    if upto_change_id is not None:
+        cutoff = min(cutoff, upto_change_id)
+    cursor.execute("DELETE FROM inventory_changes WHERE change_id<={p}".format(p=param),
+                   (cutoff, ))
+    deleted = cursor.rowcount
+    cursor.execute("UPDATE inventory_trim_state SET trimmed_upto={p} "
+                   "WHERE state_id=1 AND trimmed_upto<{p}".format(p=param), (cutoff, cutoff))
+    return deleted
+
+
+def _claim_recommendation_state_sql(param, watermarks, since=None):
+    """
+    Returns (SQL, args) recording the watermarks and bumping the version.
+    With since, the watermarks the caller started from, it only matches
+    the row if no other build or update has moved them meanwhile.
+    """
+    sql = ("UPDATE recommendation_state SET last_purchase_id={p}, last_review_seq={p}, "
+           "version=version + 1 WHERE state_id=1".format(p=param))
+    args = list(watermarks)
+    if since is not None:
+        sql += " AND last_purchase_id={p} AND last_review_seq={p}".format(p=param)
+        args.extend(since)
+    return sql, args
+
+
+def _check_claimed(rowcount, since):
+    """
+    Raises DatabaseError if _claim_recommendation_state_sql's since didn't
+    match, so the caller's transaction is rolled back.
+    """
+    if rowcount != 1:
+        raise db.DatabaseError(
+            msg="recommendation_state is no longer at {since}: another build or update "
+                "ran meanwhile, so run this one again".format(since=tuple(since)))
+
+
+def _save_neighbors_statements(param, lists, norms, clear=False, pair_sums=()):
+    """
+    Yields the (SQL, [args, ...]) statements save_neighbors runs after
+    claiming recommendation_state, in order: replace the neighbor lists
+    of the products in lists, the norms of the products in norms and the
+    given (product_id, neighbor_id, dot) pair sums (every row first, if
+    clear). Statements with many argument tuples are split into
+    STREAM_CHUNK-row batches, and pair_sums is read one batch at a time.
+    """
+    if clear:
+        for table in ("product_neighbors", "product_interaction_norms", "product_pair_sums"):
+            yield ("DELETE FROM {table}".format(table=table), [()])
+    for (table, keys) in (("product_neighbors", sorted(lists)),
+                          ("product_interaction_norms", sorted(norms))):
+        if clear or not keys:
+            continue
+        for start in range(0, len(keys), STREAM_CHUNK):
+            params, args = _id_list(param, keys[start:start + STREAM_CHUNK])
+            yield ("DELETE FROM {table} WHERE product_id IN ({params})".format(
+                table=table, params=params), [args])
+
+    rows = [(product_id, neighbor_id, score)
+            for (product_id, neighbors) in sorted(lists.items())
+            for (neighbor_id, score) in neighbors]
+    norm_rows = [(product_id, norm_sq, buyers)
+                 for (product_id, (norm_sq, buyers)) in sorted(norms.items()) if buyers > 0]
+    for (table, table_rows) in (("product_neighbors", rows),
+                                ("product_interaction_norms", norm_rows)):
+        sql = "INSERT INTO {table} VALUES ({p}, {p}, {p})".format(table=table, p=param)
+        for start in range(0, len(table_rows), STREAM_CHUNK):
+            yield (sql, table_rows[start:start + STREAM_CHUNK])
+
+    # REPLACE means the same in both databases: insert, or overwrite the
+    # row with the same key.
+    sql = "REPLACE INTO product_pair_sums VALUES ({p}, {p}, {p})".format(p=param)
+    pair_sums = iter(pair_sums)
+    while True:
+        batch = list(itertools.islice(pair_sums, STREAM_CHUNK))
+        if not batch:
+            return
+        yield (sql, batch)
+
+
+# ----------------------------------------------------------------------
+# MySQL
+# ----------------------------------------------------------------------
+class MySQLBackend:
+    """
+    The stored procedures in setup-routines.sql, called on pool connections.
+    """
+
+    name = "mysql"
+
+    def __init__(self, pool=None):
+        self._owns_pool = pool is None
+        self.pool = pool or db.ConnectionPool()
+        self.statements = db.StatementCache(HOT_STATEMENTS, self.pool)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def _call(self, proc, args, commit=False):
+        """
+        Calls a stored procedure and returns (OUT/INOUT values, result rows).
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            result = cursor.callproc(proc, args)
+            rows = []
+            for stored in cursor.stored_results():
+                rows.extend(stored.fetchall())
+            if commit:
+                conn.commit()
+            return result, rows
+
+    # Customer queries.
+    def get_sets_max_price(self, max_price):
+        return self._call("get_sets_max_price", [max_price])[1]
+
+    def get_sets_in_theme(self, theme_name):
+        return self._call("get_sets_in_theme", [theme_name])[1]
+
+    def sample_sets_max_price(self, max_price, k):
+        return self._call("sample_sets_max_price", [max_price, k])[1]
+
+    def sample_sets_in_theme(self, theme_name, k):
+        return self._call("sample_sets_in_theme", [theme_name, k])[1]
+
+    def get_price_and_rating(self, product_id):
+        result, _ = self._call("get_price_and_rating", [product_id, 0, 0])
+        return (result[1], result[2])
+
+    # Customer actions.
+    def make_purchase(self, product_id, username):
+        return inventory.purchase(username, product_id, pool=self.pool)
+
+    def checkout_cart(self, product_ids, username):
+        return checkout.checkout(username, product_ids, pool=self.pool)
+
+    def request_additional_inventory(self, product_id, username):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.callproc("request_additional_inventory", [product_id, username])
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            request_id = cursor.fetchone()[0]
+            conn.commit()
+        return request_id
+
+    def can_review_purchase(self, purchase_id, username):
+        return self._call("can_review_purchase", [purchase_id, username, None])[0][2]
+
+    def write_review(self, purchase_id, rating, review):
+        self._call("write_review", [purchase_id, rating, review], commit=True)
+
+    def apply_writes(self, writes):
+        """
+        Makes several writes, (name, args) pairs of write_review or
+        request_additional_inventory calls, in one transaction with one
+        commit. Each write has its own savepoint, so a failing write is
+        undone without undoing the others. Returns each write's result,
+        or its error.
+        """
+        results = []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for (name, args) in writes:
+                cursor.execute("SAVEPOINT group_write")
+                try:
+                    if name == "write_review":
+                        cursor.callproc("write_review", list(args))
+                        results.append(None)
+                    else:
+                        cursor.callproc("request_additional_inventory", list(args))
+                        cursor.execute("SELECT LAST_INSERT_ID()")
+                        results.append(cursor.fetchone()[0])
+                except db.Error as err:
+                    cursor.execute("ROLLBACK TO SAVEPOINT group_write")
+                    results.append(err)
+            conn.commit()
+        return results
+
+    # Employee actions.
+    def check_request_open(self, request_id):
+        return self._call("check_request_open", [request_id, None])[0][1]
+
+    def fulfill_request(self, request_id, employee_username):
+        return self._call("fulfill_request", [request_id, employee_username, None],
+                          commit=True)[0][2]
+
+    def fulfill_requests_bulk(self, employee_username, product_id=None, request_ids=None,
+                              max_requests=None):
+        if request_ids is not None:
+            request_ids = ",".join(str(int(request_id)) for request_id in request_ids)
+        return self._call("fulfill_requests_bulk",
+                          [product_id, request_ids, max_requests, employee_username, 0],
+                          commit=True)[1]
+
+    def open_requests(self, after_request_id=0, limit=None, **filters):
+        """
+        Streams the matching open requests on an unbuffered cursor, so only
+        STREAM_CHUNK rows are held at a time however large the backlog is.
+        The connection is held until the iterator is exhausted or closed.
+        """
+        sql, args = _backlog_page_sql("%s", after_request_id, limit, **filters)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(sql, args)
+            try:
+                while True:
+                    rows = cursor.fetchmany(STREAM_CHUNK)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                # Read what's left if the caller stopped early, so the
+                # connection can go back to the pool.
+                while cursor.fetchmany(STREAM_CHUNK):
+                    pass
+
+    def open_request_counts(self, limit=None, **filters):
+        sql, args = _backlog_counts_sql("%s", limit, **filters)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, args)
+            return cursor.fetchall()
+
+    def show_total_revenue(self):
+        return self._call("show_total_revenue", [0])[0][0]
+
+    def show_revenue_between(self, start_date, end_date):
+        result, _ = self._call("show_revenue_between", [start_date, end_date, 0, 0])
+        return (result[2], result[3])
+
+    def show_revenue_by_theme(self, start_date, end_date):
+        return self._call("show_revenue_by_theme", [start_date, end_date])[1]
+
+    # Logging in.
+    def authenticate(self, username, password):
+        return self._prepared("authenticate", (username, password))[0][0] == 1
+
+    def sp_login(self, username, password, role):
+        return self._call("sp_login", [username, password, role, None])[0][3]
+
+    def sp_change_password(self, username, password):
+        self._call("sp_change_password", [username, password], commit=True)
+
+    def is_customer(self, username):
+        return self._prepared("is_customer", (username, ))[0][0] > 0
+
+    def is_employee(self, username):
+        return self._prepared("is_employee", (username, ))[0][0] > 0
+
+    def product_quantity(self, product_id):
+        rows = self._prepared("product_quantity", (product_id, ))
+        return rows[0][0] if rows else None
+
+    # Catalog maintenance.
+    def rebuild_theme_closure(self):
+        self._call("rebuild_theme_closure", [], commit=True)
+
+    def refresh_reports(self, rebuild=False):
+        result, _ = self._call("refresh_reports", [1 if rebuild else 0, 0, 0, 0], commit=True)
+        return tuple(result[1:])
+
+    # Catalog reads for in-process indexes.
+    def _select(self, sql, args=()):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, args)
+            return cursor.fetchall()
+
+    def _prepared(self, name, args):
+        with self.pool.connection() as conn:
+            return self.statements.execute(conn, name, args)
+
+    def catalog_products(self, product_ids=None):
+        if product_ids is None:
+            return self._select("SELECT product_id, product_name, product_price "
+                                "FROM product_inventory")
+        return self._select(*_catalog_products_sql("%s", product_ids))
+
+    def last_product_change(self):
+        return self._select("SELECT IFNULL(MAX(change_id), 0) FROM product_changes")[0][0]
+
+    def product_changes(self, after_change_id):
+        return self._select("SELECT change_id, product_id FROM product_changes "
+                            "WHERE change_id>%s ORDER BY change_id", (after_change_id, ))
+
+    def in_stock(self, product_ids):
+        return {row[0] for row in self._select(*_in_stock_sql("%s", product_ids))}
+
+    def catalog_version(self):
+        return self._select("SELECT version FROM catalog_version WHERE version_id=1")[0][0]
+
+    def catalog_columns(self):
+        return self._select(_CATALOG_COLUMNS)
+
+    def catalog_quantities(self):
+        return self._select("SELECT product_id, quantity FROM product_inventory")
+
+    def theme_subtrees(self):
+        return self._select(_THEME_SUBTREES)
+
+    # Inventory change feed (see change_feed.py).
+    def recent_inventory_changes(self, n):
+        return [row[0] for row in self._select(*_recent_inventory_changes_sql("%s", n))]
+
+    def inventory_snapshot(self, n):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Both reads see the same committed changes.
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            cursor.execute(*_recent_inventory_changes_sql("%s", n))
+            recent = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT product_id, quantity FROM product_inventory")
+            quantities = cursor.fetchall()
+            conn.rollback()
+        return (recent, quantities)
+
+    def inventory_changes(self, after_change_id, limit):
+        return self._select(*_inventory_changes_sql("%s", after_change_id, limit))
+
+    def inventory_trimmed_upto(self):
+        return self._select("SELECT trimmed_upto FROM inventory_trim_state WHERE state_id=1")[0][0]
+
+    def trim_inventory_changes(self, before, upto_change_id=None):
+        with self.pool.connection() as conn:
+            deleted = _trim_inventory_changes(conn.cursor(), "%s", before, upto_change_id)
+            conn.commit()
+        return deleted
+
+    # Recommendations (see recommendations.py).
+    def recent_interactions(self, n):
+        return tuple([row[0] for row in self._select(sql, args)]
+                     for (sql, args) in _recent_interactions_sql("%s", n))
+
+    def interactions_after(self, after):
+        return tuple(self._select(sql, args)
+                     for (sql, args) in _interactions_after_sql("%s", after))
+
+    def interactions(self, usernames=None):
+        """
+        Streams purchases on an unbuffered cursor, like open_requests, so a
+        build over millions of purchases holds STREAM_CHUNK rows at a time.
+        """
+        sql, args = _interactions_sql("%s", usernames)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(sql, args)
+            try:
+                while True:
+                    rows = cursor.fetchmany(STREAM_CHUNK)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                while cursor.fetchmany(STREAM_CHUNK):
+                    pass
+
+    def recent_purchases(self, username, n):
+        return [row[0] for row in self._select(*_recent_purchases_sql("%s", username, n))]
+
+    def recommendation_state(self):
+        return tuple(self._select("SELECT last_purchase_id, last_review_seq, version "
+                                  "FROM recommendation_state WHERE state_id=1")[0])
+
+    def interaction_norms(self):
+        return self._select("SELECT product_id, norm_sq, buyers FROM product_interaction_norms")
+
+    def neighbor_lists(self, product_ids):
+        return self._select(*_neighbor_lists_sql("%s", product_ids))
+
+    def pair_sums(self, product_ids):
+        return self._select(*_pair_sums_sql("%s", product_ids))
+
+    def neighbor_holders(self, product_ids):
+        return self._select(*_neighbor_holders_sql("%s", product_ids))
+
+    def save_neighbors(self, lists, norms, watermarks=None, clear=False, pair_sums=(),
+                       since=None):
+        """
+        Replaces neighbor lists, norms and pair sums (see
+        _save_neighbors_statements) in one transaction, so readers see the
+        old lists until it commits. The watermarks are claimed first (see
+        _claim_recommendation_state_sql), which also makes concurrent
+        builds and updates take turns.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if watermarks is not None:
+                cursor.execute(*_claim_recommendation_state_sql("%s", watermarks, since))
+                if since is not None:
+                    _check_claimed(cursor.rowcount, since)
+            for (sql, many) in _save_neighbors_statements("%s", lists, norms, clear, pair_sums):
+                if len(many) == 1:
+                    cursor.execute(sql, many[0])
+                else:
+                    cursor.executemany(sql, many)
+            conn.commit()
+
+    def product_neighbors(self, product_id, k):
+        return self._prepared("product_neighbors", (product_id, k))
+
+    # Catalog lists for workload generators.
+    def product_ids(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT product_id FROM product_inventory")
+            return [row[0] for row in cursor.fetchall()]
+
+    def theme_names(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT theme_name FROM themes")
+            return [row[0] for row in cursor.fetchall()]
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
+
+
+# ----------------------------------------------------------------------
+# SQLite
+# ----------------------------------------------------------------------
+def _to_decimal(value):
+    return decimal.Decimal(value.decode()).quantize(CENTS)
+
+
+def _to_date(value):
+    return datetime.date.fromisoformat(value.decode())
+
+
+def _to_datetime(value):
+    return datetime.datetime.strptime(value.decode()[:19], "%Y-%m-%d %H:%M:%S")
+
+
+sqlite3.register_adapter(decimal.Decimal, str)
+sqlite3.register_adapter(datetime.datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(datetime.date, lambda value: value.strftime("%Y-%m-%d"))
+sqlite3.register_converter("DECIMAL", _to_decimal)
+sqlite3.register_converter("DATE", _to_date)
+sqlite3.register_converter("TIMESTAMP", _to_datetime)
+
+
+# Sets in every theme with a given name, or in its sub-themes.
+_THEME_SUBTREE = (
+    "themes JOIN theme_closure ON (themes.theme_id=theme_closure.ancestor_id) "
+    "JOIN lego_sets ON (theme_closure.descendant_id=lego_sets.theme_id)")
+
+# rebuild_theme_closure as one recursive query. Top-level themes are their
+# own parents; the depth limit stops a parent_id cycle from looping forever.
+_REBUILD_THEME_CLOSURE = """
+    INSERT INTO theme_closure
+    WITH RECURSIVE closure(ancestor_id, descendant_id, depth) AS (
+        SELECT theme_id, theme_id, 0 FROM themes
+      UNION ALL
+        SELECT closure.ancestor_id, themes.theme_id, closure.depth + 1
+        FROM closure JOIN themes ON (themes.parent_id=closure.descendant_id)
+        WHERE themes.theme_id<>themes.parent_id AND closure.depth < 100
+    )
+    SELECT ancestor_id, descendant_id, depth FROM closure
+"""
+
+
+# refresh_reports: (source table, its watermark column, report table,
+# statement folding the source rows with watermarks in (?, ?] into it).
+_REPORT_SOURCES = [
+    ("purchases", "purchase_id", "report_customer_spend", """
+        INSERT INTO report_customer_spend
+        SELECT customer_username, COUNT(*), ROUND(SUM(purchase_item_total), 2)
+        FROM purchases
+        WHERE purchase_id>? AND purchase_id<=? AND customer_username IS NOT NULL
+        GROUP BY customer_username
+        ON CONFLICT (customer_username) DO UPDATE SET
+          num_purchases=num_purchases + excluded.num_purchases,
+          total_spent=ROUND(total_spent + excluded.total_spent, 2)
+    """),
+    ("reviews", "review_seq", "report_product_ratings", """
+        INSERT INTO report_product_ratings
+        SELECT product_id, COUNT(*), SUM(rating)
+        FROM reviews JOIN purchases ON (reviews.purchase_id=purchases.purchase_id)
+        WHERE review_seq>? AND review_seq<=? AND product_id IS NOT NULL
+        GROUP BY product_id
+        ON CONFLICT (product_id) DO UPDATE SET
+          review_count=review_count + excluded.review_count,
+          rating_sum=rating_sum + excluded.rating_sum
+    """),
+    ("lego_sets", "set_seq", "report_theme_sets", """
+        INSERT INTO report_theme_sets
+        SELECT theme_id, COUNT(*)
+        FROM lego_sets
+        WHERE set_seq>? AND set_seq<=? AND theme_id IS NOT NULL
+        GROUP BY theme_id
+        ON CONFLICT (theme_id) DO UPDATE SET
+          num_sets=num_sets + excluded.num_sets
+    """),
+]
+
+
+def _now():
+    return datetime.datetime.now().replace(microsecond=0)
+
+
+def _money(value):
+    """
+    Rounds an SQLite SUM (a float, or None for no rows) to cents.
+    """
+    return decimal.Decimal(str(round(value or 0, 2))).quantize(CENTS)
+
+
+def _hash_password(salt, password):
+    # Same as SHA2(CONCAT(salt, password), 256) in setup-passwords.sql.
+    return hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
+
+
+def _make_salt(num_chars=8):
+    # Same characters as make_salt: ASCII 32 (space) through 126.
+    return "".join(chr(32 + random.randrange(95)) for _ in range(num_chars))
+
+
+# The users added at the end of setup-passwords.sql.
+_ADD_USER = re.compile(r"^CALL sp_add_user\('([^']*)', '([^']*)'\);", re.MULTILINE)
+
+
+class SQLiteBackend:
+    """
+    In-process stand-in for the MySQL procedures.
+
+    The database is created from setup-sqlite.sql and loaded from the CSV
+    files in csv_dir. A database file that has already been loaded is
+    reused as it is unless reload is set. One connection is shared by all
+    threads and each call holds a lock, so calls are serialized like a
+    single-writer server.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, csv_dir=HERE, path=":memory:", reload=False):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self.rejected = 0
+        if reload or not self._loaded():
+            with open(os.path.join(HERE, "setup-sqlite.sql"), encoding="utf-8") as f:
+                self._conn.executescript(f.read())
+            self.rejected = self._load(csv_dir)
+            self.refresh_reports(rebuild=True)
+
+    def _loaded(self):
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='user_info'"
+        ).fetchone()[0] == 1
+
+    def _load(self, csv_dir):
+        """
+        Loads every table's CSV file, in foreign-key order, and adds the
+        users from setup-passwords.sql. The triggers build the rating
+        summary and revenue ledger as rows go in; the theme closure is
+        built at the end, and the product change log emptied.
+        Returns the number of rejected rows.
+        """
+        rejects = load_data.Rejects()
+        rejected = 0
+        with self._conn:
+            for level in load_data.load_levels(load_data.TABLES):
+                for table in level:
+                    (filename, columns, _) = load_data.TABLES[table]
+                    rows, stats = load_data.read_rows(
+                        os.path.join(csv_dir, filename), columns, table, rejects)
+                    self._conn.executemany(
+                        "INSERT INTO {table} ({cols}) VALUES ({params})".format(
+                            table=table,
+                            cols=", ".join(name for (name, _) in columns),
+                            params=", ".join(["?"] * len(columns))),
+                        rows)
+                    rejected += stats["rejected"]
+            self._conn.execute(_REBUILD_THEME_CLOSURE)
+            # The initial load isn't a change: indexes start from a full build.
+            self._conn.execute("DELETE FROM product_changes")
+            self._conn.execute("DELETE FROM inventory_changes")
+
+            with open(os.path.join(HERE, "setup-passwords.sql"), encoding="utf-8") as f:
+                for (username, password) in _ADD_USER.findall(f.read()):
+                    self._add_user(self._conn, username, password)
+        return rejected
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._lock, self._conn)
+
+    def connection(self):
+        return self._transaction()
+
+    # Customer queries.
+    def _sample(self, conn, count_sql, pick_sql, args, k):
+        """
+        Picks up to k distinct rows at random offsets, like the
+        sample_sets_* procedures.
+        """
+        (num_matches, ) = conn.execute(count_sql, args).fetchone()
+        return [conn.execute(pick_sql, args + (offset, )).fetchone()
+                for offset in random.sample(range(num_matches), min(k, num_matches))]
+
+    def get_sets_max_price(self, max_price):
+        with self._transaction() as conn:
+            return conn.execute(
+                "SELECT product_id, product_name, product_price FROM product_inventory "
+                "WHERE product_price<=?", (max_price, )).fetchall()
+
+    def get_sets_in_theme(self, theme_name):
+        with self._transaction() as conn:
+            return conn.execute(
+                "SELECT DISTINCT product_inventory.product_id, product_name, product_price "
+                "FROM " + _THEME_SUBTREE + " "
+                "  JOIN product_inventory ON (lego_sets.product_id=product_inventory.product_id) "
+                "WHERE themes.theme_name=? ORDER BY product_inventory.product_id",
+                (theme_name, )).fetchall()
+
+    def sample_sets_max_price(self, max_price, k):
+        with self._transaction() as conn:
+            return self._sample(
+                conn,
+                "SELECT COUNT(*) FROM product_inventory WHERE product_price<=?",
+                "SELECT product_id, product_name, product_price FROM product_inventory "
+                "WHERE product_price<=? ORDER BY product_price, product_id LIMIT 1 OFFSET ?",
+                (max_price, ), k)
+
+    def sample_sets_in_theme(self, theme_name, k):
+        with self._transaction() as conn:
+            return self._sample(
+                conn,
+                "SELECT COUNT(*) FROM " + _THEME_SUBTREE + " WHERE themes.theme_name=?",
+                "SELECT product_inventory.product_id, product_name, product_price "
+                "FROM " + _THEME_SUBTREE + " "
+                "  JOIN product_inventory ON (lego_sets.product_id=product_inventory.product_id) "
+                "WHERE themes.theme_name=? "
+                "ORDER BY product_inventory.product_id LIMIT 1 OFFSET ?",
+                (theme_name, ), k)
+
+    def get_price_and_rating(self, product_id):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT product_price FROM product_inventory WHERE product_id=?",
+                (product_id, )).fetchone()
+            summary = conn.execute(
+                "SELECT CAST(rating_sum AS REAL) / review_count "
+                "FROM product_rating_summary WHERE product_id=? AND review_count<>0",
+                (product_id, )).fetchone()
+        return (row[0] if row else None, summary[0] if summary else 0)
+
+    # Customer actions.
+    def _discounted_prices(self, conn, username, product_ids):
+        """
+        Returns {product_id: price after the customer's discount}.
+        """
+        member_type = conn.execute(
+            "SELECT member_type FROM customers WHERE customer_username=?",
+            (username, )).fetchone()
+        # Same rule as find_customer_discount.
+        discount = 30 if member_type and member_type[0] == "V" else 0
+        prices = {}
+        for product_id in set(product_ids):
+            row = conn.execute("SELECT product_price FROM product_inventory "
+                               "WHERE product_id=?", (product_id, )).fetchone()
+            if row:
+                prices[product_id] = (row[0] * (100 - discount) / 100).quantize(
+                    CENTS, decimal.ROUND_HALF_UP)
+        return prices
+
+    def make_purchase(self, product_id, username):
+        with self._transaction() as conn:
+            # Same conditional decrement as update_inventory_purchase.
+            reserved = conn.execute(
+                "UPDATE product_inventory SET quantity=quantity - 1 "
+                "WHERE product_id=? AND quantity > 0", (product_id, )).rowcount
+            if reserved != 1:
+                return inventory.PurchaseResult("OUT_OF_STOCK", None, 0)
+            total = self._discounted_prices(conn, username, [product_id])[product_id]
+            purchase_id = conn.execute(
+                "INSERT INTO purchases VALUES (NULL, ?, ?, ?, ?)",
+                (product_id, username, total, _now())).lastrowid
+        return inventory.PurchaseResult("OK", purchase_id, 0)
+
+    def checkout_cart(self, product_ids, username):
+        cart = [int(product_id) for product_id in checkout.cart_string(product_ids).split(",")]
+        requested = {}
+        for product_id in cart:
+            requested[product_id] = requested.get(product_id, 0) + 1
+
+        with self._transaction() as conn:
+            shortages = []
+            for product_id in sorted(requested):
+                row = conn.execute("SELECT quantity FROM product_inventory WHERE product_id=?",
+                                   (product_id, )).fetchone()
+                available = row[0] if row else 0
+                if available < requested[product_id]:
+                    shortages.append((product_id, requested[product_id], available))
+            if shortages:
+                return checkout.CheckoutResult("OUT_OF_STOCK", [], shortages)
+
+            conn.executemany("UPDATE product_inventory SET quantity=quantity - ? "
+                             "WHERE product_id=?",
+                             [(count, product_id) for product_id, count in requested.items()])
+            prices = self._discounted_prices(conn, username, cart)
+            now = _now()
+            purchases = []
+            for product_id in cart:
+                purchase_id = conn.execute(
+                    "INSERT INTO purchases VALUES (NULL, ?, ?, ?, ?)",
+                    (product_id, username, prices[product_id], now)).lastrowid
+                purchases.append((purchase_id, product_id, prices[product_id]))
+        return checkout.CheckoutResult("OK", purchases, [])
+
+    def request_additional_inventory(self, product_id, username):
+        with self._transaction() as conn:
+            return self._request_additional_inventory(conn, product_id, username)
+
+    @staticmethod
+    def _request_additional_inventory(conn, product_id, username):
+        return conn.execute("INSERT INTO requests VALUES (NULL, ?, ?, 'U', ?)",
+                            (product_id, username, _now())).lastrowid
+
+    def can_review_purchase(self, purchase_id, username):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT customer_username=?, "
+                "       EXISTS (SELECT 1 FROM reviews WHERE purchase_id=purchases.purchase_id) "
+                "FROM purchases WHERE purchase_id=?", (username, purchase_id)).fetchone()
+        if row is None:
+            return "There is no purchase with that ID."
+        if not row[0]:
+            return "You did not make that purchase."
+        if row[1]:
+            return "That purchase already has a review."
+        return None
+
+    def write_review(self, purchase_id, rating, review):
+        with self._transaction() as conn:
+            self._write_review(conn, purchase_id, rating, review)
+
+    @staticmethod
+    def _write_review(conn, purchase_id, rating, review):
+        conn.execute(
+            "INSERT INTO reviews (purchase_id, customer_username, review_time, rating, review) "
+            "VALUES (?, (SELECT customer_username FROM purchases "
+            "WHERE purchase_id=?), ?, ?, ?)",
+            (purchase_id, purchase_id, _now(), rating, review))
+
+    def apply_writes(self, writes):
+        results = []
+        with self._transaction() as conn:
+            for (name, args) in writes:
+                conn.execute("SAVEPOINT group_write")
+                try:
+                    if name == "write_review":
+                        results.append(self._write_review(conn, *args))
+                    else:
+                        results.append(self._request_additional_inventory(conn, *args))
+                except sqlite3.Error as err:
+                    conn.execute("ROLLBACK TO group_write")
+                    results.append(_mysql_error(err))
+                conn.execute("RELEASE group_write")
+        return results
+
+    # Employee actions.
+    def check_request_open(self, request_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT request_status FROM requests WHERE request_id=?",
+                               (request_id, )).fetchone()
+        if row is None:
+            return "There is no request with that ID."
+        if row[0] == "F":
+            return "That request has already been fulfilled."
+        if row[0] == "P":
+            return "That request is already in progress."
+        return None
+
+    def fulfill_request(self, request_id, employee_username):
+        with self._transaction() as conn:
+            updated = conn.execute("UPDATE requests SET request_status='F' "
+                                   "WHERE request_id=? AND request_status='U'",
+                                   (request_id, )).rowcount
+            if updated == 1:
+                conn.execute(
+                    "UPDATE product_inventory SET quantity=quantity + 1 WHERE product_id="
+                    "(SELECT product_id FROM requests WHERE request_id=?)", (request_id, ))
+                conn.execute("INSERT INTO employee_log VALUES (?, ?, ?, 'Fulfilled request.')",
+                             (request_id, employee_username, _now()))
+                return None
+        return self.check_request_open(request_id)
+
+    def fulfill_requests_bulk(self, employee_username, product_id=None, request_ids=None,
+                              max_requests=None):
+        sql = "SELECT request_id, product_id FROM requests WHERE request_status='U'"
+        args = []
+        if product_id is not None:
+            sql += " AND product_id=?"
+            args.append(product_id)
+        if request_ids is not None:
+            request_ids = sorted(set(int(request_id) for request_id in request_ids))
+            sql += " AND request_id IN ({params})".format(params=", ".join("?" * len(request_ids)))
+            args.extend(request_ids)
+        sql += " ORDER BY request_id LIMIT ?"
+        args.append(-1 if max_requests is None else max_requests)
+
+        now = _now()
+        with self._transaction() as conn:
+            fulfilled = conn.execute(sql, args).fetchall()
+            restocked = collections.Counter(product for (_, product) in fulfilled)
+            conn.executemany("UPDATE product_inventory SET quantity=quantity + ? "
+                             "WHERE product_id=?",
+                             [(count, product) for (product, count) in restocked.items()])
+            conn.executemany("UPDATE requests SET request_status='F' WHERE request_id=?",
+                             [(request_id, ) for (request_id, _) in fulfilled])
+            conn.executemany("INSERT INTO employee_log VALUES (?, ?, ?, 'Fulfilled request.')",
+                             [(request_id, employee_username, now)
+                              for (request_id, _) in fulfilled])
+        return fulfilled
+
+    def open_requests(self, after_request_id=0, limit=None, **filters):
+        """
+        Yields the matching open requests, reading STREAM_CHUNK rows per
+        query so the database isn't locked while the caller works.
+        """
+        while limit is None or limit > 0:
+            chunk = STREAM_CHUNK if limit is None else min(limit, STREAM_CHUNK)
+            sql, args = _backlog_page_sql("?", after_request_id, chunk, **filters)
+            with self._transaction() as conn:
+                rows = conn.execute(sql, args).fetchall()
+            yield from rows
+            if len(rows) < chunk:
+                return
+            after_request_id = rows[-1][0]
+            if limit is not None:
+                limit -= len(rows)
+
+    def open_request_counts(self, limit=None, **filters):
+        sql, args = _backlog_counts_sql("?", limit, **filters)
+        with self._transaction() as conn:
+            return conn.execute(sql, args).fetchall()
+
+    def show_total_revenue(self):
+        with self._transaction() as conn:
+            return _money(conn.execute("SELECT SUM(revenue) FROM revenue_total_shards").fetchone()[0])
+
+    def show_revenue_between(self, start_date, end_date):
+        with self._transaction() as conn:
+            (total, count) = conn.execute(
+                "SELECT SUM(revenue), SUM(purchase_count) FROM revenue_product_daily "
+                "WHERE revenue_date BETWEEN ? AND ?", (start_date, end_date)).fetchone()
+        return (_money(total), count or 0)
+
+    def show_revenue_by_theme(self, start_date, end_date):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT IFNULL(theme_name, '(individual parts)') AS theme, "
+                "       SUM(purchase_count), SUM(revenue) AS theme_revenue "
+                "FROM revenue_product_daily "
+                "  LEFT JOIN lego_sets ON (revenue_product_daily.product_id=lego_sets.product_id) "
+                "  LEFT JOIN themes ON (lego_sets.theme_id=themes.theme_id) "
+                "WHERE revenue_date BETWEEN ? AND ? "
+                "GROUP BY theme ORDER BY theme_revenue DESC",
+                (start_date, end_date)).fetchall()
+        return [(theme, count, _money(revenue)) for (theme, count, revenue) in rows]
+
+    # Logging in.
+    def _add_user(self, conn, username, password):
+        salt = _make_salt()
+        conn.execute("INSERT INTO user_info VALUES (?, ?, ?)",
+                     (username, salt, _hash_password(salt, password)))
+
+    def authenticate(self, username, password):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT salt, password_hash FROM user_info WHERE username=?",
+                               (username, )).fetchone()
+        return row is not None and _hash_password(row[0], password) == row[1]
+
+    def sp_login(self, username, password, role):
+        table = {"C": ("customers", "customer_username"),
+                 "E": ("employees", "employee_username")}.get(role)
+        with self._transaction() as conn:
+            row = None
+            if table is not None:
+                row = conn.execute(
+                    "SELECT salt, password_hash FROM {table} LEFT JOIN user_info "
+                    "  ON ({table}.{column}=user_info.username) "
+                    "WHERE {column}=?".format(table=table[0], column=table[1]),
+                    (username, )).fetchone()
+        if row is None:
+            return "NO_USER"
+        if row[0] is None or _hash_password(row[0], password) != row[1]:
+            return "WRONG_PASSWORD"
+        return "OK"
+
+    def sp_change_password(self, username, password):
+        salt = _make_salt()
+        with self._transaction() as conn:
+            conn.execute("UPDATE user_info SET salt=?, password_hash=? WHERE username=?",
+                         (salt, _hash_password(salt, password), username))
+
+    # sqlite3 keeps its own cache of prepared statements, keyed by the SQL,
+    # so binding the values is all these need.
+    def _prepared(self, name, args):
+        return self._select(HOT_STATEMENTS[name].replace("%s", "?"), args)
+
+    def is_customer(self, username):
+        return self._prepared("is_customer", (username, ))[0][0] > 0
+
+    def is_employee(self, username):
+        return self._prepared("is_employee", (username, ))[0][0] > 0
+
+    def product_quantity(self, product_id):
+        rows = self._prepared("product_quantity", (product_id, ))
+        return rows[0][0] if rows else None
+
+    # Catalog maintenance.
+    def rebuild_theme_closure(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM theme_closure")
+            conn.execute(_REBUILD_THEME_CLOSURE)
+
+    def refresh_reports(self, rebuild=False):
+        added = []
+        with self._transaction() as conn:
+            if rebuild:
+                for (_, _, table, _) in _REPORT_SOURCES:
+                    conn.execute("DELETE FROM {table}".format(table=table))
+                conn.execute("UPDATE report_watermarks SET last_seq=0")
+            for (source, seq_column, _, fold) in _REPORT_SOURCES:
+                old_seq = conn.execute("SELECT last_seq FROM report_watermarks "
+                                       "WHERE source_table=?", (source, )).fetchone()[0]
+                (count, new_seq) = conn.execute(
+                    "SELECT COUNT(*), IFNULL(MAX({seq}), ?) FROM {source} WHERE {seq}>?".format(
+                        seq=seq_column, source=source), (old_seq, old_seq)).fetchone()
+                conn.execute(fold, (old_seq, new_seq))
+                conn.execute("UPDATE report_watermarks SET last_seq=? WHERE source_table=?",
+                             (new_seq, source))
+                added.append(count)
+        return tuple(added)
+
+    # Catalog reads for in-process indexes.
+    def _select(self, sql, args=()):
+        with self._transaction() as conn:
+            return conn.execute(sql, args).fetchall()
+
+    def catalog_products(self, product_ids=None):
+        if product_ids is None:
+            return self._select("SELECT product_id, product_name, product_price "
+                                "FROM product_inventory")
+        return self._select(*_catalog_products_sql("?", product_ids))
+
+    def last_product_change(self):
+        return self._select("SELECT IFNULL(MAX(change_id), 0) FROM product_changes")[0][0]
+
+    def product_changes(self, after_change_id):
+        return self._select("SELECT change_id, product_id FROM product_changes "
+                            "WHERE change_id>? ORDER BY change_id", (after_change_id, ))
+
+    def in_stock(self, product_ids):
+        return {row[0] for row in self._select(*_in_stock_sql("?", product_ids))}
+
+    def catalog_version(self):
+        return self._select("SELECT version FROM catalog_version WHERE version_id=1")[0][0]
+
+    def catalog_columns(self):
+        return self._select(_CATALOG_COLUMNS)
+
+    def catalog_quantities(self):
+        return self._select("SELECT product_id, quantity FROM product_inventory")
+
+    def theme_subtrees(self):
+        return self._select(_THEME_SUBTREES)
+
+    # Inventory change feed (see change_feed.py).
+    def recent_inventory_changes(self, n):
+        return [row[0] for row in self._select(*_recent_inventory_changes_sql("?", n))]
+
+    def inventory_snapshot(self, n):
+        with self._transaction() as conn:
+            recent = [row[0] for row in conn.execute(*_recent_inventory_changes_sql("?", n))]
+            quantities = conn.execute(
+                "SELECT product_id, quantity FROM product_inventory").fetchall()
+        return (recent, quantities)
+
+    def inventory_changes(self, after_change_id, limit):
+        return self._select(*_inventory_changes_sql("?", after_change_id, limit))
+
+    def inventory_trimmed_upto(self):
+        return self._select("SELECT trimmed_upto FROM inventory_trim_state WHERE state_id=1")[0][0]
+
+    def trim_inventory_changes(self, before, upto_change_id=None):
+        with self._transaction() as conn:
+            return _trim_inventory_changes(conn.cursor(), "?", before, upto_change_id)
+
+    # Recommendations (see recommendations.py).
+    def recent_interactions(self, n):
+        return tuple([row[0] for row in self._select(sql, args)]
+                     for (sql, args) in _recent_interactions_sql("?", n))
+
+    def interactions_after(self, after):
+        return tuple(self._select(sql, args)
+                     for (sql, args) in _interactions_after_sql("?", after))
+
+    def interactions(self, usernames=None):
+        """
+        Yields purchases STREAM_CHUNK rows per query, paging by
+        (customer_username, purchase_id) like open_requests.
+        """
+        after = None
+        while True:
+            sql, args = _interactions_sql("?", usernames, after, STREAM_CHUNK)
+            with self._transaction() as conn:
+                rows = conn.execute(sql, args).fetchall()
+            yield from rows
+            if len(rows) < STREAM_CHUNK:
+                return
+            after = rows[-1][:2]
+
+    def recent_purchases(self, username, n):
+        return [row[0] for row in self._select(*_recent_purchases_sql("?", username, n))]
+
+    def recommendation_state(self):
+        return tuple(self._select("SELECT last_purchase_id, last_review_seq, version "
+                                  "FROM recommendation_state WHERE state_id=1")[0])
+
+    def interaction_norms(self):
+        return self._select("SELECT product_id, norm_sq, buyers FROM product_interaction_norms")
+
+    def neighbor_lists(self, product_ids):
+        return self._select(*_neighbor_lists_sql("?", product_ids))
+
+    def pair_sums(self, product_ids):
+        return self._select(*_pair_sums_sql("?", product_ids))
+
+    def neighbor_holders(self, product_ids):
+        return self._select(*_neighbor_holders_sql("?", product_ids))
+
+    def save_neighbors(self, lists, norms, watermarks=None, clear=False, pair_sums=(),
+                       since=None):
+        with self._transaction() as conn:
+            if watermarks is not None:
+                cursor = conn.execute(*_claim_recommendation_state_sql("?", watermarks, since))
+                if since is not None:
+                    _check_claimed(cursor.rowcount, since)
+            for (sql, many) in _save_neighbors_statements("?", lists, norms, clear, pair_sums):
+                conn.executemany(sql, many)
+
+    def product_neighbors(self, product_id, k):
+        return self._prepared("product_neighbors", (product_id, k))
+
+    # Catalog lists for workload generators.
+    def product_ids(self):
+        with self._transaction() as conn:
+            return [row[0] for row in conn.execute("SELECT product_id FROM product_inventory")]
+
+    def theme_names(self):
+        with self._transaction() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT theme_name FROM themes")]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _mysql_error(exc):
+    """
+    Returns the db error (mysql.connector's) matching a sqlite3 error.
+    """
+    if isinstance(exc, sqlite3.IntegrityError):
+        return db.IntegrityError(msg=str(exc))
+    return db.DatabaseError(msg=str(exc))
+
+
+class _SQLiteTransaction:
+    """
+    Holds the backend's lock for one call, commits or rolls back at the
+    end, and reports SQLite errors as the matching db errors
+    so callers handle both backends the same way.
+    """
+
+    def __init__(self, lock, conn):
+        self._lock = lock
+        self._conn = conn
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+                return False
+            self._conn.rollback()
+            if isinstance(exc, sqlite3.Error):
+                raise _mysql_error(exc) from exc
+            return False
+        finally:
+            self._lock.release()
+
+
+# ----------------------------------------------------------------------
+# Choosing a Backend
+# ----------------------------------------------------------------------
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+def create(name, **kwargs):
+    """
+    Creates the backend called name ("mysql" or "sqlite").
+    """
+    if name not in BACKENDS:
+        raise ValueError("unknown backend {name!r}; expected one of {names}".format(
+            name=name, names=", ".join(sorted(BACKENDS))))
+    return BACKENDS[name](**kwargs)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process-wide backend, creating it on first use from
+    LEGOS_BACKEND (and LEGOS_SQLITE_PATH). The MySQL backend uses the
+    shared pool from db.get_pool().
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.environ.get("LEGOS_BACKEND", "mysql")
+            if name == "sqlite":
+                _backend = create(name, path=os.environ.get("LEGOS_SQLITE_PATH", ":memory:"))
+            else:
+                _backend = create(name, pool=db.get_pool())
+        return _backend
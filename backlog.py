@@ -0,0 +1,102 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+The request backlog: open (unfulfilled) requests, a page at a time.
+
+Pages are read with keyset pagination: each page asks for the requests
+after the last request ID already shown, which is an index range scan on
+(request_status, request_id), so page 1000 costs the same as page 1.
+Requests can be filtered by product, by customer, and by age. Rows are
+streamed from the database, so neither the apps nor an export hold the
+whole backlog in memory.
+
+Used by app_admin.py (menu option [a]), and from the command line to
+export the backlog as CSV:
+
+    $ python3 backlog.py [--product ID] [--customer NAME] [--older-than DAYS] > backlog.csv
+    $ python3 backlog.py --counts
+"""
+
+import argparse
+import csv
+import datetime
+import sys
+
+import backends
+import db
+
+PAGE_SIZE = 20
+
+
+def filters(product_id=None, username=None, older_than_days=None):
+    """
+    Returns the keyword filters for backend.open_requests() and
+    open_request_counts(). Blank arguments mean no filter.
+    """
+    before = None
+    if older_than_days is not None:
+        before = datetime.datetime.now().replace(microsecond=0) \
+            - datetime.timedelta(days=older_than_days)
+    return {"product_id": product_id, "username": username or None, "before": before}
+
+
+def pages(backend, page_size=PAGE_SIZE, **request_filters):
+    """
+    Yields the matching open requests as lists of at most page_size rows
+    (request_id, product_id, customer_username, request_time), one query
+    per page. Requests made while paging show up on later pages.
+    """
+    after_request_id = 0
+    while True:
+        page = list(backend.open_requests(after_request_id, page_size, **request_filters))
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after_request_id = page[-1][0]
+
+
+def export(backend, outfile, **request_filters):
+    """
+    Writes every matching open request to outfile as CSV, streaming rows
+    from the database. Returns the number of rows written.
+    """
+    writer = csv.writer(outfile)
+    writer.writerow(["request_id", "product_id", "customer_username", "request_time"])
+    count = 0
+    for row in backend.open_requests(0, None, **request_filters):
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the open request backlog as CSV.")
+    parser.add_argument("--product", type=int, help="only requests for this product ID")
+    parser.add_argument("--customer", help="only requests made by this customer")
+    parser.add_argument("--older-than", type=int, metavar="DAYS",
+                        help="only requests made more than DAYS days ago")
+    parser.add_argument("--counts", action="store_true",
+                        help="print the number of open requests per product instead")
+    parser.add_argument("--limit", type=int,
+                        help="with --counts, only the LIMIT most requested products")
+    args = parser.parse_args(argv)
+
+    request_filters = filters(args.product, args.customer, args.older_than)
+    backend = backends.get_backend()
+    try:
+        if args.counts:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(["product_id", "num_requests"])
+            writer.writerows(backend.open_request_counts(args.limit, **request_filters))
+        else:
+            count = export(backend, sys.stdout, **request_filters)
+            print("{n} open request(s).".format(n=count), file=sys.stderr)
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
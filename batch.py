@@ -0,0 +1,339 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Headless batch mode for the lego store apps.
+
+Reads one JSON command per line from a file (or stdin), runs the commands
+on a pool of worker threads, and writes one JSON result per line with the
+command's latency. Used for nightly batch jobs and as the driver for
+capacity tests.
+
+Commands (the "id" field is optional and is echoed back):
+
+    {"id": 0, "op": "login", "session": "s1", "username": "cpratt", "password": "..."}
+    {"id": 1, "op": "search", "max_price": 50}
+    {"id": 2, "op": "search", "theme": "Star Wars"}
+    {"id": 3, "op": "search", "query": "millennium falcon", "max_price": 200,
+     "in_stock": true}
+    {"id": 4, "op": "browse", "kind": "set", "max_price": 50, "in_stock": true,
+     "theme": "Star Wars", "min_year": 2010, "k": 10}
+    {"id": 5, "op": "price", "product_id": 3742}
+    {"id": 6, "op": "purchase", "session": "s1", "product_id": 3742}
+    {"id": 7, "op": "purchase", "session": "s1", "product_ids": [1, 2, 2]}
+    {"id": 8, "op": "request", "session": "s1", "product_id": 7}
+    {"id": 9, "op": "review", "session": "s1", "purchase_id": 6, "rating": 5,
+     "review": "Great!"}
+    {"id": 10, "op": "fulfill", "session": "e1", "request_id": 1}
+    {"id": 11, "op": "fulfill", "session": "e1", "product_id": 7, "max_requests": 10}
+    {"id": 12, "op": "fulfill", "session": "e1", "request_ids": [2, 3, 5]}
+    {"id": 13, "op": "revenue", "session": "e1", "start": "2024-01-01", "end": "2024-01-31"}
+    {"id": 14, "op": "recommend", "product_ids": [3742, 10179], "k": 5, "in_stock": true}
+    {"id": 15, "op": "logout", "session": "s1"}
+
+Purchases, requests, reviews, fulfillment and revenue act as the user of
+an authenticated session, given by "session": the name a login command
+earlier in the batch gave it, or a token from store.login(). Logins are
+customer logins in app_client.py and employee logins in app_admin.py, and
+are checked like interactive ones (sessions.py); later commands are only
+checked in memory. A login runs before any later command starts, and a
+logout after every earlier command has finished.
+
+Results:
+
+    {"id": 1, "op": "search", "ok": true, "result": [...], "latency_ms": 1.9}
+    {"id": 10, "op": "fulfill", "ok": false, "error": "...", "latency_ms": 0.8}
+
+Usage:
+
+    $ python3 app_client.py --batch commands.jsonl [--workers 8] [--out results.jsonl]
+    $ python3 app_admin.py --batch - < commands.jsonl
+"""
+
+import collections
+import concurrent.futures
+import json
+import sys
+import time
+
+import db
+import sessions
+import store
+
+CLIENT_OPS = ("login", "logout", "search", "browse", "price", "recommend", "purchase", "request",
+              "review")
+ADMIN_OPS = ("login", "logout", "search", "browse", "price", "recommend", "fulfill", "revenue")
+
+# Ops that need a session, and the role it must have.
+SESSION_ROLES = {
+    "purchase": sessions.CUSTOMER,
+    "request": sessions.CUSTOMER,
+    "review": sessions.CUSTOMER,
+    "fulfill": sessions.EMPLOYEE,
+    "revenue": sessions.EMPLOYEE,
+}
+
+# Keys of a browse command passed on to store.browse().
+BROWSE_KEYS = ("k", "order_by", "descending", "kind", "min_price", "max_price", "in_stock",
+               "theme", "category_id", "min_year", "max_year", "min_parts", "max_parts")
+
+
+# ----------------------------------------------------------------------
+# Command Handlers
+# ----------------------------------------------------------------------
+def rows_to_products(rows):
+    return [{"product_id": product_id, "product_name": name, "product_price": price}
+            for (product_id, name, price) in rows]
+
+
+def do_search(cmd):
+    if "query" in cmd:
+        return rows_to_products(store.search_name(cmd["query"], cmd.get("max_price"),
+                                                  bool(cmd.get("in_stock")), cmd.get("k", 10)))
+    if "theme" in cmd:
+        return rows_to_products(store.search_theme(cmd["theme"], cmd.get("k", store.SAMPLE_SIZE)))
+    if "max_price" in cmd:
+        return rows_to_products(store.search_budget(cmd["max_price"], cmd.get("k", store.SAMPLE_SIZE)))
+    raise ValueError("search needs a query, a theme or a max_price")
+
+
+def do_browse(cmd):
+    records = store.browse(**{key: cmd[key] for key in BROWSE_KEYS if key in cmd})
+    return [{"product_id": record.product_id, "product_name": record.product_name,
+             "product_price": record.product_price, "quantity": record.quantity,
+             "theme_id": record.theme_id, "num_parts": record.num_parts,
+             "year_released": record.year_released, "category_id": record.category_id}
+            for record in records]
+
+
+def do_price(cmd):
+    (price, rating) = store.price_and_rating(cmd["product_id"])
+    return {"product_price": price, "avg_rating": rating}
+
+
+def do_recommend(cmd):
+    return rows_to_products(store.recommend(cmd["product_ids"], cmd.get("k", store.SAMPLE_SIZE),
+                                            bool(cmd.get("in_stock"))))
+
+
+def do_purchase(cmd):
+    if "product_ids" in cmd:
+        result = store.checkout(cmd["username"], cmd["product_ids"])
+        return {"status": result.status,
+                "purchases": [{"purchase_id": purchase_id, "product_id": product_id, "total": total}
+                              for (purchase_id, product_id, total) in result.purchases],
+                "shortages": [{"product_id": product_id, "requested": requested,
+                               "available": available}
+                              for (product_id, requested, available) in result.shortages]}
+    result = store.purchase(cmd["username"], cmd["product_id"])
+    return {"status": result.status, "purchase_id": result.purchase_id,
+            "retries": result.retries}
+
+
+def do_request(cmd):
+    return {"status": "OK", "request_id": store.request(cmd["username"], cmd["product_id"])}
+
+
+def do_review(cmd):
+    store.review(cmd["username"], cmd["purchase_id"], cmd["rating"], cmd.get("review", ""))
+    return {"status": "OK"}
+
+
+def do_fulfill(cmd):
+    if "request_id" in cmd:
+        store.fulfill(cmd["username"], cmd["request_id"])
+        return {"status": "OK"}
+    fulfilled = store.fulfill_bulk(cmd["username"], cmd.get("product_id"),
+                                   cmd.get("request_ids"), cmd.get("max_requests"))
+    return {"status": "OK",
+            "fulfilled": [{"request_id": request_id, "product_id": product_id}
+                          for (request_id, product_id) in fulfilled]}
+
+
+def do_logout(cmd):
+    store.logout(cmd["token"])
+    return {"status": "OK"}
+
+
+def do_revenue(cmd):
+    (total, num_purchases) = store.revenue(cmd.get("start"), cmd.get("end"))
+    return {"revenue": total, "num_purchases": num_purchases}
+
+
+HANDLERS = {
+    "logout": do_logout,
+    "search": do_search,
+    "browse": do_browse,
+    "price": do_price,
+    "recommend": do_recommend,
+    "purchase": do_purchase,
+    "request": do_request,
+    "review": do_review,
+    "fulfill": do_fulfill,
+    "revenue": do_revenue,
+}
+
+
+def login(cmd, role, logins):
+    """
+    Runs a login command, naming its session cmd["session"] in logins
+    (session name -> token) for the rest of the batch.
+    """
+    token = store.login(cmd["username"], cmd["password"], role)
+    logins[cmd["session"]] = token
+    return {"status": "OK", "session": cmd["session"]}
+
+
+def execute(line, allowed_ops, role=sessions.CUSTOMER, logins=None):
+    """
+    Parses and runs one command line. Logins are for role, and logins
+    maps the batch's session names to tokens. Never raises: failures are
+    reported in the returned result dict.
+    """
+    start = time.perf_counter()
+    result = {}
+    logins = {} if logins is None else logins
+    try:
+        cmd = json.loads(line)
+        if not isinstance(cmd, dict):
+            raise ValueError("each line must be a JSON object")
+        if "id" in cmd:
+            result["id"] = cmd["id"]
+        result["op"] = cmd.get("op")
+        if cmd.get("op") not in allowed_ops:
+            raise ValueError("unknown or disallowed op {op!r}".format(op=cmd.get("op")))
+        if cmd["op"] == "login":
+            result["result"] = login(cmd, role, logins)
+        else:
+            if cmd["op"] == "logout" or cmd["op"] in SESSION_ROLES:
+                if "session" not in cmd:
+                    raise ValueError("{op} needs a session".format(op=cmd["op"]))
+                cmd["token"] = logins.get(cmd["session"], cmd["session"])
+            if cmd["op"] in SESSION_ROLES:
+                username = store.session_user(cmd["token"], SESSION_ROLES[cmd["op"]])
+                if cmd.get("username", username).lower() != username.lower():
+                    raise ValueError("username doesn't match the session")
+                cmd["username"] = username
+            result["result"] = HANDLERS[cmd["op"]](cmd)
+        result["ok"] = True
+    except KeyError as err:
+        result["ok"] = False
+        result["error"] = "missing field {field}".format(field=err)
+    except (ValueError, TypeError, db.Error) as err:
+        result["ok"] = False
+        result["error"] = str(err)
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+def _session_op(line):
+    """
+    Returns "login" or "logout" if line is one of those commands, or None.
+    """
+    if "log" not in line:
+        return None
+    try:
+        cmd = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(cmd, dict) and cmd.get("op") in ("login", "logout"):
+        return cmd["op"]
+    return None
+
+
+# ----------------------------------------------------------------------
+# Running Batches
+# ----------------------------------------------------------------------
+def run(infile, outfile, allowed_ops, workers=8, ordered=True, role=sessions.CUSTOMER):
+    """
+    Runs every command in infile on `workers` threads and writes results
+    to outfile as they finish (in input order if `ordered`). At most a few
+    commands per worker are in flight, so memory stays bounded for any
+    input size. Logins (for role) and logouts are run in turn, so the
+    commands after a login can use its session, and those before a logout
+    still can. Returns a summary dict.
+    """
+    window = workers * 4
+    in_flight = collections.deque()
+    summary = {"commands": 0, "errors": 0}
+    logins = {}
+
+    def emit(result):
+        summary["commands"] += 1
+        if not result["ok"]:
+            summary["errors"] += 1
+        outfile.write(json.dumps(result, default=str) + "\n")
+
+    def wait_for_one():
+        # In ordered mode results leave in input order; otherwise as soon
+        # as each one finishes.
+        if ordered:
+            emit(in_flight.popleft().result())
+            return
+        done, _ = concurrent.futures.wait(
+            in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            in_flight.remove(future)
+            emit(future.result())
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for line in infile:
+            if not line.strip():
+                continue
+            op = _session_op(line)
+            if op is not None:
+                if op == "logout":
+                    # Let the commands using the session finish first.
+                    concurrent.futures.wait(in_flight)
+                future = concurrent.futures.Future()
+                future.set_result(execute(line, allowed_ops, role, logins))
+            else:
+                future = executor.submit(execute, line, allowed_ops, role, logins)
+            in_flight.append(future)
+            while len(in_flight) >= window:
+                wait_for_one()
+        while in_flight:
+            wait_for_one()
+    outfile.flush()
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["commands_per_second"] = (summary["commands"] / summary["seconds"]
+                                      if summary["seconds"] else 0)
+    return summary
+
+
+def main(allowed_ops, args, role=sessions.CUSTOMER):
+    """
+    Entry point used by the apps' --batch option.
+    args has batch (path or "-"), out (path or None) and workers.
+    """
+    infile = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+    outfile = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        summary = run(infile, outfile, allowed_ops, workers=args.workers,
+                      ordered=not args.unordered, role=role)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    print("{n} command(s), {e} error(s), {s:.2f}s, {rate:.1f} commands/sec.".format(
+        n=summary["commands"], e=summary["errors"], s=summary["seconds"],
+        rate=summary["commands_per_second"]), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+def add_arguments(parser):
+    """
+    Adds the batch-mode options to an app's argument parser.
+    """
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run JSONL commands from FILE ('-' for stdin) instead of the menus")
+    parser.add_argument("--out", metavar="FILE",
+                        help="write JSONL results to FILE instead of stdout")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of commands to run at once in batch mode")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write results as they finish rather than in input order")
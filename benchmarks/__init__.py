@@ -0,0 +1,7 @@
+"""
+Benchmarks for the lego store database.
+
+Run each benchmark as a module from the repository root, e.g.
+
+    $ python3 -m benchmarks.bench_sampling
+"""
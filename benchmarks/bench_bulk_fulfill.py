@@ -0,0 +1,116 @@
+"""
+Compares fulfilling a restock's requests one call at a time with a single
+set-based fulfill_requests_bulk call.
+
+--requests open requests are made for one product, fulfilled with that
+many fulfill_request calls, then made again and fulfilled with one bulk
+call. Both ways must add --requests to the product's quantity. Runs
+against MySQL (the LEGOS_DB_* settings; the requests made are removed and
+the quantity restored afterwards) or the in-process SQLite stand-in:
+
+    $ python3 -m benchmarks.bench_bulk_fulfill --backend sqlite --requests 500
+"""
+
+import argparse
+import time
+
+import backends
+import db
+from benchmarks import bench_suite, common, synthetic
+
+EMPLOYEE = "emin"
+
+
+def quantity(backend, product_id):
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT quantity FROM product_inventory WHERE product_id={id}".format(
+            id=int(product_id)))
+        return cursor.fetchone()[0]
+
+
+def open_requests(backend, product_id, count):
+    """
+    Makes `count` open requests for product_id and returns their IDs.
+    """
+    customers = synthetic.CUSTOMERS
+    return [backend.request_additional_inventory(product_id, customers[i % len(customers)])
+            for i in range(count)]
+
+
+def run_single(backend, product_id, count):
+    request_ids = open_requests(backend, product_id, count)
+    before = quantity(backend, product_id)
+    latencies = []
+    for request_id in request_ids:
+        start = time.perf_counter()
+        backend.fulfill_request(request_id, EMPLOYEE)
+        latencies.append(time.perf_counter() - start)
+    return latencies, quantity(backend, product_id) - before
+
+
+def run_bulk(backend, product_id, count):
+    # Only the requests made here are named, so requests that were already
+    # open for the product are left alone.
+    request_ids = open_requests(backend, product_id, count)
+    before = quantity(backend, product_id)
+    fulfilled = []
+    latencies = common.timed(
+        lambda: fulfilled.extend(backend.fulfill_requests_bulk(EMPLOYEE, product_id,
+                                                               request_ids)), 1)
+    if len(fulfilled) != count:
+        raise AssertionError("bulk call fulfilled {n} of {count} requests".format(
+            n=len(fulfilled), count=count))
+    return latencies, quantity(backend, product_id) - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default="mysql")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="number of requests fulfilled each way")
+    parser.add_argument("--product", type=int, default=7, help="product ID to restock")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.backend == "mysql":
+        backend = backends.MySQLBackend(db.ConnectionPool(size=2))
+        checkpoint = bench_suite.mysql_checkpoint(backend.pool)
+    else:
+        backend = backends.create(args.backend)
+
+    try:
+        single, single_added = run_single(backend, args.product, args.requests)
+        bulk, bulk_added = run_bulk(backend, args.product, args.requests)
+    finally:
+        if args.backend == "mysql":
+            bench_suite.mysql_cleanup(backend.pool, checkpoint)
+        backend.close()
+
+    for (name, added) in (("single", single_added), ("bulk", bulk_added)):
+        if added != args.requests:
+            raise AssertionError("{name}: quantity went up by {added}, expected {n}".format(
+                name=name, added=added, n=args.requests))
+
+    single_total = sum(single) * 1000
+    bulk_total = sum(bulk) * 1000
+    results = {
+        "backend": args.backend,
+        "requests": args.requests,
+        "single": dict(common.summarize(single), total_ms=single_total),
+        "bulk": dict(common.summarize(bulk), total_ms=bulk_total),
+        "speedup": single_total / bulk_total if bulk_total else None,
+    }
+    print("{backend}: fulfilling {n} requests for product {p}".format(
+        backend=args.backend, n=args.requests, p=args.product))
+    print("  {n} x fulfill_request      {t:>10.1f} ms total ({per:.3f} ms per request)".format(
+        n=args.requests, t=single_total, per=single_total / args.requests))
+    print("  1 x fulfill_requests_bulk  {t:>10.1f} ms total ({per:.3f} ms per request)".format(
+        t=bulk_total, per=bulk_total / args.requests))
+    print("  speedup: {s:.1f}x".format(s=results["speedup"] or 0))
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
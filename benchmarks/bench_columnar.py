@@ -0,0 +1,122 @@
+"""
+Compares multi-filter browse queries sent to the database with the same
+queries answered by the columnar in-memory catalog (columnar_catalog.py).
+
+Each case is a compound filter ("price <= X AND in stock AND theme in
+subtree AND year >= Y") ordered by price, top-k. Both ways must return
+the same product IDs. Runs against MySQL (the LEGOS_DB_* settings) or the
+in-process SQLite stand-in:
+
+    $ python3 -m benchmarks.bench_columnar --backend sqlite --repeat 200
+"""
+
+import argparse
+
+import backends
+import columnar_catalog
+import db
+from benchmarks import common
+
+# (name, filters) pairs; every case is ordered by price, then product ID.
+CASES = [
+    ("sets <= $50, in stock, Star Wars, 2010+",
+     {"kind": "set", "max_price": 50, "in_stock": True, "theme": "Star Wars", "min_year": 2010}),
+    ("sets, Technic, 500-2000 parts",
+     {"kind": "set", "theme": "Technic", "min_parts": 500, "max_parts": 2000}),
+    ("in stock, $10-$20",
+     {"min_price": 10, "max_price": 20, "in_stock": True}),
+    ("parts <= $3, category 11, in stock",
+     {"kind": "part", "max_price": 3, "category_id": 11, "in_stock": True}),
+]
+
+
+def to_sql(filters, k):
+    """
+    Returns the SELECT answering filters in the database. The values are
+    this file's own constants, so they are formatted into the statement.
+    """
+    conditions = []
+    if filters.get("kind") == "set":
+        conditions.append("lego_sets.product_id IS NOT NULL")
+    elif filters.get("kind") == "part":
+        conditions.append("lego_parts.product_id IS NOT NULL")
+    if "min_price" in filters:
+        conditions.append("product_price>={0}".format(float(filters["min_price"])))
+    if "max_price" in filters:
+        conditions.append("product_price<={0}".format(float(filters["max_price"])))
+    if filters.get("in_stock"):
+        conditions.append("quantity>0")
+    if "theme" in filters:
+        conditions.append(
+            "theme_id IN (SELECT descendant_id FROM themes JOIN theme_closure "
+            "ON (themes.theme_id=theme_closure.ancestor_id) "
+            "WHERE theme_name='{0}')".format(filters["theme"].replace("'", "''")))
+    if "category_id" in filters:
+        conditions.append("category_id={0}".format(int(filters["category_id"])))
+    if "min_year" in filters:
+        conditions.append("year_released>={0}".format(int(filters["min_year"])))
+    if "min_parts" in filters:
+        conditions.append("num_parts>={0}".format(int(filters["min_parts"])))
+    if "max_parts" in filters:
+        conditions.append("num_parts<={0}".format(int(filters["max_parts"])))
+    return ("SELECT product_inventory.product_id, product_name, product_price "
+            "FROM product_inventory "
+            "  LEFT JOIN lego_sets ON (product_inventory.product_id=lego_sets.product_id) "
+            "  LEFT JOIN lego_parts ON (product_inventory.product_id=lego_parts.product_id) "
+            "WHERE {where} ORDER BY product_price, product_inventory.product_id "
+            "LIMIT {k}".format(where=" AND ".join(conditions), k=int(k)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default="mysql")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10, help="rows returned per query")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.backend == "mysql":
+        backend = backends.MySQLBackend(db.ConnectionPool(size=1))
+    else:
+        backend = backends.create(args.backend)
+
+    results = {"backend": args.backend, "k": args.k, "cases": {}}
+    try:
+        catalog = columnar_catalog.ColumnarCatalog(backend, refresh_interval=3600)
+        load = common.timed(catalog.load, 1)[0]
+        results["load_ms"] = load * 1000
+
+        with backend.connection() as conn:
+            cursor = conn.cursor()
+            for (name, filters) in CASES:
+                sql = to_sql(filters, args.k)
+
+                def query_database():
+                    cursor.execute(sql)
+                    return [row[0] for row in cursor.fetchall()]
+
+                def query_catalog():
+                    return [record.product_id for record in catalog.select(args.k, **filters)]
+
+                if query_database() != query_catalog():
+                    raise AssertionError("{name}: results differ".format(name=name))
+                results["cases"][name] = {
+                    "database": common.summarize(common.timed(query_database, args.repeat)),
+                    "columnar": common.summarize(common.timed(query_catalog, args.repeat)),
+                }
+    finally:
+        backend.close()
+
+    print("{backend}: catalog loaded in {t:.0f} ms".format(
+        backend=args.backend, t=results["load_ms"]))
+    for (name, row) in results["cases"].items():
+        database = row["database"]["p50_ms"] * 1000
+        columnar = row["columnar"]["p50_ms"] * 1000
+        print("  {name:<40} database {d:>9.1f} us   columnar {c:>7.1f} us   ({s:.0f}x)".format(
+            name=name, d=database, c=columnar, s=database / columnar if columnar else 0))
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Hammers a few "hot" products with concurrent purchases to check that the
+reservation path never oversells.
+
+Each hot product's quantity is set to --stock, then --threads workers buy
+random hot products until every one is sold out. Reports throughput,
+retries, out-of-stock answers and the oversell count (which must be 0).
+Quantities are restored and the benchmark's purchases removed afterwards.
+Best run against a scratch copy of the database (LEGOS_DB_NAME=...).
+
+    $ python3 -m benchmarks.bench_contention --threads 16 --products 3 --stock 200
+"""
+
+import argparse
+import collections
+import random
+import sys
+import threading
+import time
+
+import db
+import inventory
+from benchmarks import common, synthetic
+
+
+def worker(pool, products, sold_out, stats, lock, latencies):
+    """
+    Buys random hot products until all of them are sold out.
+    """
+    customer = random.choice(synthetic.CUSTOMERS)
+    while len(sold_out) < len(products):
+        product_id = random.choice(products)
+        start = time.perf_counter()
+        result = inventory.purchase(customer, product_id, pool=pool, max_retries=10)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            stats["retries"] += result.retries
+            if result.status == "OK":
+                stats["bought"][product_id] += 1
+            else:
+                stats["out_of_stock"] += 1
+                sold_out.add(product_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--products", type=int, default=3, help="number of hot products")
+    parser.add_argument("--stock", type=int, default=200, help="starting quantity of each")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    pool = db.ConnectionPool(size=args.threads + 1)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM product_inventory "
+                       "ORDER BY product_id LIMIT %s", (args.products, ))
+        saved = cursor.fetchall()
+        products = [product_id for (product_id, _) in saved]
+        first_id = synthetic.begin(conn)
+        cursor.executemany("UPDATE product_inventory SET quantity=%s WHERE product_id=%s",
+                           [(args.stock, product_id) for product_id in products])
+        conn.commit()
+
+    stats = {"bought": collections.Counter(), "retries": 0, "out_of_stock": 0}
+    sold_out = set()
+    lock = threading.Lock()
+    latencies = []
+    threads = [threading.Thread(target=worker,
+                                args=(pool, products, sold_out, stats, lock, latencies))
+               for _ in range(args.threads)]
+
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT product_id, quantity FROM product_inventory "
+                           "WHERE product_id IN ({})".format(",".join(["%s"] * len(products))),
+                           products)
+            final = dict(cursor.fetchall())
+    finally:
+        with pool.connection() as conn:
+            synthetic.cleanup(conn, first_id)
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE product_inventory SET quantity=%s WHERE product_id=%s",
+                               [(quantity, product_id) for (product_id, quantity) in saved])
+            conn.commit()
+        pool.close()
+
+    oversold = sum(max(0, stats["bought"][p] - args.stock) for p in products)
+    negative = sum(1 for p in products if final[p] < 0)
+    total_bought = sum(stats["bought"].values())
+    results = {
+        "threads": args.threads,
+        "products": products,
+        "stock_per_product": args.stock,
+        "purchases": total_bought,
+        "out_of_stock_answers": stats["out_of_stock"],
+        "retries": stats["retries"],
+        "seconds": elapsed,
+        "purchases_per_second": total_bought / elapsed if elapsed else 0,
+        "oversold": oversold,
+        "negative_quantities": negative,
+        "latency": common.summarize(latencies),
+    }
+
+    print("\n{n} purchases by {t} threads in {s:.2f}s ({rate:.0f}/s).".format(
+        n=total_bought, t=args.threads, s=elapsed, rate=results["purchases_per_second"]))
+    print("Retries: {r}. Out-of-stock answers: {o}.".format(
+        r=stats["retries"], o=stats["out_of_stock"]))
+    print("Latency p50/p95/p99: {p50:.2f} / {p95:.2f} / {p99:.2f} ms.".format(
+        **results["latency"]))
+    print("Oversold: {o}. Products with negative quantity: {n}.".format(
+        o=oversold, n=negative))
+    if args.out:
+        common.write_results(args.out, results)
+    if oversold or negative:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
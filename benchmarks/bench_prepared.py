@@ -0,0 +1,124 @@
+"""
+Compares the apps' hot lookups (is_customer, is_employee, product_quantity,
+authenticate) sent as SQL text with the values formatted in, as the apps
+used to, with the same lookups sent as prepared statements
+(db.StatementCache).
+
+Formatted SQL is new text for every value, so the server parses and plans
+each call from scratch; a prepared statement is parsed once per connection
+and then only executed. On MySQL the number of statements the server
+prepared is reported too (Com_stmt_prepare). On SQLite, "prepared" means
+bound values, which hit sqlite3's own statement cache:
+
+    $ python3 -m benchmarks.bench_prepared --repeat 2000
+    $ python3 -m benchmarks.bench_prepared --backend sqlite
+"""
+
+import argparse
+import itertools
+
+import backends
+import db
+from benchmarks import common
+
+
+def literal(value):
+    """
+    Returns value as an SQL literal, the way the old lookups built them.
+    """
+    if isinstance(value, str):
+        return "'{0}'".format(value.replace("'", "''"))
+    return str(int(value))
+
+
+def formatted(sql, args):
+    """
+    Returns sql (with %s placeholders) with args formatted in.
+    """
+    return sql.replace("%s", "{}").format(*map(literal, args))
+
+
+def session_status(cursor, name):
+    cursor.execute("SHOW SESSION STATUS LIKE '{0}'".format(name))
+    return int(cursor.fetchone()[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default="mysql")
+    parser.add_argument("--repeat", type=int, default=1000, help="calls per statement and way")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.backend == "mysql":
+        backend = backends.MySQLBackend(db.ConnectionPool(size=1))
+        param = "%s"
+    else:
+        backend = backends.create(args.backend)
+        param = "?"
+
+    results = {"backend": args.backend, "repeat": args.repeat, "cases": {}}
+    try:
+        with backend.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT customer_username FROM customers")
+            customers = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT employee_username FROM employees")
+            employees = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT product_id FROM product_inventory ORDER BY product_id LIMIT 1000")
+            products = [row[0] for row in cursor.fetchall()]
+
+            # Each call uses the next value, so formatted SQL differs
+            # from call to call as it does in the apps.
+            cases = [
+                ("is_customer", [(username, ) for username in customers]),
+                ("is_employee", [(username, ) for username in employees]),
+                ("product_quantity", [(product_id, ) for product_id in products]),
+            ]
+            if args.backend == "mysql":
+                cases.append(("authenticate", [(username, "wrong-password")
+                                               for username in customers]))
+
+            for (name, values) in cases:
+                template = backends.HOT_STATEMENTS[name]
+                sql = template.replace("%s", param)
+                formatted_calls = itertools.cycle(values)
+                prepared_calls = itertools.cycle(values)
+
+                def run_formatted():
+                    cursor.execute(formatted(template, next(formatted_calls)))
+                    return cursor.fetchall()
+
+                if args.backend == "mysql":
+                    def run_prepared():
+                        return backend.statements.execute(conn, name, next(prepared_calls))
+                else:
+                    def run_prepared():
+                        cursor.execute(sql, next(prepared_calls))
+                        return cursor.fetchall()
+
+                row = {}
+                for (way, fn) in (("formatted", run_formatted), ("prepared", run_prepared)):
+                    if args.backend == "mysql":
+                        before = session_status(cursor, "Com_stmt_prepare")
+                    fn()  # Warm up (and prepare, the first time).
+                    row[way] = common.summarize(common.timed(fn, args.repeat))
+                    if args.backend == "mysql":
+                        row[way]["server_prepares"] = \
+                            session_status(cursor, "Com_stmt_prepare") - before
+                results["cases"][name] = row
+    finally:
+        backend.close()
+
+    print("{backend}: {n} calls per statement".format(backend=args.backend, n=args.repeat))
+    for (name, row) in results["cases"].items():
+        before = row["formatted"]["mean_ms"] * 1000
+        after = row["prepared"]["mean_ms"] * 1000
+        print("  {name:<18} formatted {b:>8.1f} us   prepared {a:>8.1f} us   ({s:.1f}x)".format(
+            name=name, b=before, a=after, s=before / after if after else 0))
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the old AVG(rating) scan with the product_rating_summary lookup
+as the reviews table grows.
+
+Synthetic purchases and reviews are added in steps (by default up to
+1,000,000 reviews, half of them for one "hot" product), and both lookups
+are timed for the hot product at each step. The synthetic rows are removed
+afterwards unless --keep is given.
+Best run against a scratch copy of the database (LEGOS_DB_NAME=...).
+
+    $ python3 -m benchmarks.bench_rating_summary --sizes 10000,100000,1000000
+"""
+
+import argparse
+import random
+import time
+
+import db
+from benchmarks import common, synthetic
+
+OLD_AVG_SQL = ("SELECT IFNULL(AVG(rating), 0) FROM reviews NATURAL LEFT JOIN purchases "
+               "WHERE purchases.product_id=%s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated total review counts to measure at")
+    parser.add_argument("--hot-product", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the synthetic rows instead of removing them")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        products = synthetic.product_ids(cursor)
+        first_id = synthetic.begin(conn)
+
+        def pick_product(purchase_id):
+            return args.hot_product if purchase_id % 2 else random.choice(products)
+
+        def old_lookup():
+            cursor.execute(OLD_AVG_SQL, (args.hot_product, ))
+            cursor.fetchall()
+
+        def summary_lookup():
+            cursor.callproc("get_price_and_rating", [args.hot_product, 0, 0])
+
+        added = 0
+        try:
+            for size in [int(n) for n in args.sizes.split(",")]:
+                start = time.perf_counter()
+                synthetic.add_purchases(conn, first_id + added, size - added,
+                                        pick_product, with_reviews=True)
+                print("Loaded {n} reviews in {s:.1f}s.".format(
+                    n=size, s=time.perf_counter() - start))
+                added = size
+
+                results["AVG scan @ {}".format(size)] = common.summarize(
+                    common.timed(old_lookup, args.repeat))
+                results["summary lookup @ {}".format(size)] = common.summarize(
+                    common.timed(summary_lookup, args.repeat))
+        finally:
+            if not args.keep:
+                synthetic.cleanup(conn, first_id)
+
+    common.print_table("Average rating lookup for product #{}".format(args.hot_product), results)
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Measures the recommendation build (recommendations.py) on synthetic
+purchase histories, and serving a product's neighbors from the database
+versus the Recommender's cache.
+
+The build part needs no database: it generates customers with baskets of
+popular-skewed products, and reports time and peak traced memory for
+growing numbers of purchases. Peak memory should stay level (the
+neighbor lists plus --max-pairs pairs) rather than grow with the
+purchases. The serving part
+builds the real lists on --backend first:
+
+    $ python3 -m benchmarks.bench_recommendations --purchases 100000 1000000
+    $ python3 -m benchmarks.bench_recommendations --backend sqlite --repeat 2000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+import backends
+import db
+import recommendations
+from benchmarks import common
+
+
+def synthetic_baskets(num_purchases, num_products, basket_size, seed=1):
+    """
+    Yields baskets ({product_id: weight}) adding up to about num_purchases
+    purchases. Product popularity is skewed, like a real store's.
+    """
+    rng = random.Random(seed)
+    weights = [1.0, 1.0, 1.0, 5 / 3, 1 / 3]
+    made = 0
+    while made < num_purchases:
+        size = rng.randint(1, 2 * basket_size - 1)
+        basket = {}
+        for _ in range(size):
+            product_id = min(int(rng.paretovariate(1.2)), num_products)
+            basket[product_id] = rng.choice(weights)
+        made += size
+        yield basket
+
+
+def bench_build(args):
+    groups = {product_id: ("theme", product_id % 50)
+              for product_id in range(1, args.products + 1)}
+    rows = []
+    for num_purchases in args.purchases:
+        tracemalloc.start()
+        start = time.perf_counter()
+        baskets = synthetic_baskets(num_purchases, args.products, args.basket)
+        lists, _ = recommendations.build_neighbors(baskets, groups, max_pairs=args.max_pairs)
+        elapsed = time.perf_counter() - start
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rows.append({"purchases": num_purchases, "seconds": elapsed,
+                     "peak_mb": peak / 1e6, "products": len(lists)})
+    return rows
+
+
+def bench_serving(backend, args):
+    recommendations.build(backend)
+    product_ids = backend.product_ids()[:1000:10]
+    recommender = recommendations.Recommender(backend, refresh_interval=3600)
+    for product_id in product_ids:
+        recommender.neighbors(product_id)  # Warm up the cache.
+
+    lookups = iter(product_ids * (args.repeat // len(product_ids) + 1))
+    cached = iter(product_ids * (args.repeat // len(product_ids) + 1))
+    return {
+        "database": common.summarize(common.timed(
+            lambda: backend.product_neighbors(next(lookups), recommendations.NEIGHBORS),
+            args.repeat)),
+        "cached": common.summarize(common.timed(
+            lambda: recommender.neighbors(next(cached)), args.repeat)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--purchases", type=int, nargs="+", default=[10000, 100000, 300000],
+                        help="synthetic purchases per build")
+    parser.add_argument("--products", type=int, default=40000)
+    parser.add_argument("--basket", type=int, default=8, help="mean products per basket")
+    parser.add_argument("--max-pairs", type=int, default=recommendations.MAX_PAIRS)
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS),
+                        help="also time serving on this backend")
+    parser.add_argument("--repeat", type=int, default=1000, help="lookups per way")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {"build": bench_build(args)}
+    print("Build, {n} products, up to {p} pairs in memory:".format(
+        n=args.products, p=args.max_pairs))
+    for row in results["build"]:
+        print("  {purchases:>10} purchases  {seconds:8.1f} s  peak {peak_mb:8.1f} MB".format(**row))
+
+    if args.backend:
+        if args.backend == "mysql":
+            backend = backends.MySQLBackend(db.ConnectionPool(size=1))
+        else:
+            backend = backends.create(args.backend)
+        try:
+            results["serving"] = bench_serving(backend, args)
+        finally:
+            backend.close()
+        common.print_table("Neighbor lookups ({backend})".format(backend=args.backend),
+                           results["serving"])
+
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
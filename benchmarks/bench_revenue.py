@@ -0,0 +1,85 @@
+"""
+Compares the old full-table SUM over purchases with the revenue rollups
+as the purchases table grows.
+
+Synthetic purchases spread over the last two years are added in steps,
+and at each step the all-time total, last-30-days and by-theme revenue
+queries are timed against a plain SUM(purchase_item_total) scan. The
+synthetic rows are removed afterwards unless --keep is given.
+Best run against a scratch copy of the database (LEGOS_DB_NAME=...).
+
+    $ python3 -m benchmarks.bench_revenue --sizes 100000,1000000,10000000
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+import db
+from benchmarks import common, synthetic
+
+OLD_TOTAL_SQL = "SELECT SUM(purchase_item_total) FROM purchases"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100000,1000000,10000000",
+                        help="comma-separated total purchase counts to measure at")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the synthetic rows instead of removing them")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    today = datetime.date.today()
+    month_ago = today - datetime.timedelta(days=29)
+
+    results = {}
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        products = synthetic.product_ids(cursor)
+        first_id = synthetic.begin(conn)
+
+        def old_total():
+            cursor.execute(OLD_TOTAL_SQL)
+            cursor.fetchall()
+
+        def ledger_total():
+            cursor.callproc("show_total_revenue", [0])
+
+        def ledger_last_30_days():
+            cursor.callproc("show_revenue_between", [month_ago, today, 0, 0])
+
+        def ledger_by_theme():
+            cursor.callproc("show_revenue_by_theme", [month_ago, today])
+            for stored in cursor.stored_results():
+                stored.fetchall()
+
+        added = 0
+        try:
+            for size in [int(n) for n in args.sizes.split(",")]:
+                start = time.perf_counter()
+                synthetic.add_purchases(conn, first_id + added, size - added,
+                                        lambda _: random.choice(products))
+                print("Loaded {n} purchases in {s:.1f}s.".format(
+                    n=size, s=time.perf_counter() - start))
+                added = size
+
+                for name, fn in (("SUM scan", old_total),
+                                 ("show_total_revenue", ledger_total),
+                                 ("show_revenue_between 30d", ledger_last_30_days),
+                                 ("show_revenue_by_theme 30d", ledger_by_theme)):
+                    results["{} @ {}".format(name, size)] = common.summarize(
+                        common.timed(fn, args.repeat))
+        finally:
+            if not args.keep:
+                synthetic.cleanup(conn, first_id)
+
+    common.print_table("Revenue queries", results)
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares the old "fetch everything, keep five" browsing path with the
+server-side sampling procedures.
+
+For each budget and theme, reports per-call latency and the number of
+bytes the server sent back.
+
+    $ python3 -m benchmarks.bench_sampling --repeat 50 --out sampling.json
+"""
+
+import argparse
+import random
+
+import db
+from benchmarks import common
+
+SAMPLE_SIZE = 5
+
+
+def fetch_all_then_sample(cursor, proc, args):
+    """
+    The original path: the whole result set crosses the wire and is turned
+    into Python tuples, then all but SAMPLE_SIZE rows are thrown away.
+    """
+    cursor.callproc(proc, args)
+    for result in cursor.stored_results():
+        rows = result.fetchall()
+        random.sample(rows, min(len(rows), SAMPLE_SIZE))
+
+
+def sample_on_server(cursor, proc, args):
+    """
+    The sampling path: only SAMPLE_SIZE rows are returned.
+    """
+    cursor.callproc(proc, args + [SAMPLE_SIZE])
+    for result in cursor.stored_results():
+        result.fetchall()
+
+
+def run_case(cursor, name, fn, repeat):
+    """
+    Times fn and measures the bytes it transfers.
+    """
+    fn()  # Warm up caches and the procedure's query plan.
+    num_bytes = common.measure_bytes(cursor, fn)
+    row = common.summarize(common.timed(fn, repeat))
+    row["bytes_per_call"] = num_bytes
+    return name, row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--prices", default="10,50,200",
+                        help="comma-separated budgets to test")
+    parser.add_argument("--themes", default="Star Wars,Technic,Town",
+                        help="comma-separated theme names to test")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        for price in args.prices.split(","):
+            for label, fn in (
+                    ("get_sets_max_price", lambda: fetch_all_then_sample(
+                        cursor, "get_sets_max_price", [price])),
+                    ("sample_sets_max_price", lambda: sample_on_server(
+                        cursor, "sample_sets_max_price", [price]))):
+                name, row = run_case(cursor, "{} ${}".format(label, price), fn, args.repeat)
+                results[name] = row
+
+        for theme in args.themes.split(","):
+            for label, fn in (
+                    ("get_sets_in_theme", lambda: fetch_all_then_sample(
+                        cursor, "get_sets_in_theme", [theme])),
+                    ("sample_sets_in_theme", lambda: sample_on_server(
+                        cursor, "sample_sets_in_theme", [theme]))):
+                name, row = run_case(cursor, "{} {}".format(label, theme), fn, args.repeat)
+                results[name] = row
+
+    common.print_table("Browsing: fetch-all vs server-side sampling", results)
+    if args.out:
+        common.write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Load test for the store's procedures: simulated customers and employees
+running a realistic mix of calls, with throughput and p50/p95/p99 latency
+per procedure.
+
+--customers threads browse, check prices, buy, review their purchases
+and request restocks; --employees threads fulfill those requests. Runs
+for --seconds against either MySQL (the LEGOS_DB_* settings) or the
+in-process SQLite stand-in, which needs no server:
+
+    $ python3 -m benchmarks.bench_suite --backend sqlite --out run.json
+    $ python3 -m benchmarks.bench_suite --backend mysql --compare run.json
+
+With --compare, each procedure's p95 is checked against an earlier
+results file and the run exits 1 if any got more than --tolerance slower.
+Against MySQL, the run's purchases, reviews and requests are removed and
+quantities restored afterwards; a scratch database is still safest.
+"""
+
+import argparse
+import collections
+import json
+import queue
+import random
+import sys
+import threading
+import time
+
+import backends
+import db
+from benchmarks import common, synthetic
+
+# Employee the simulated employees log their work as.
+EMPLOYEE = "emin"
+
+# Relative weights of each customer call.
+CUSTOMER_MIX = [
+    ("get_sets_max_price", 25),
+    ("get_sets_in_theme", 25),
+    ("get_price_and_rating", 30),
+    ("make_purchase", 10),
+    ("write_review", 5),
+    ("request_additional_inventory", 5),
+]
+
+
+class Recorder:
+    """
+    Thread-safe latency and error counts per procedure.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def call(self, name, fn, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except db.Error:
+            with self._lock:
+                self.errors[name] += 1
+            return None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[name].append(elapsed)
+        return result
+
+
+def customer(backend, recorder, catalog, requests, deadline, seed):
+    """
+    One simulated customer, calling procedures until the deadline.
+    """
+    rng = random.Random(seed)
+    username = rng.choice(synthetic.CUSTOMERS)
+    names = [name for (name, _) in CUSTOMER_MIX]
+    weights = [weight for (_, weight) in CUSTOMER_MIX]
+    unreviewed = []
+
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        if name == "get_sets_max_price":
+            recorder.call(name, backend.get_sets_max_price, rng.choice((5, 10, 20, 50, 100)))
+        elif name == "get_sets_in_theme":
+            recorder.call(name, backend.get_sets_in_theme, rng.choice(catalog["themes"]))
+        elif name == "get_price_and_rating":
+            recorder.call(name, backend.get_price_and_rating, rng.choice(catalog["products"]))
+        elif name == "make_purchase":
+            result = recorder.call(name, backend.make_purchase,
+                                   rng.choice(catalog["products"]), username)
+            if result and result.status == "OK":
+                unreviewed.append(result.purchase_id)
+        elif name == "write_review" and unreviewed:
+            purchase_id = unreviewed.pop()
+            recorder.call("can_review_purchase", backend.can_review_purchase, purchase_id,
+                          username)
+            recorder.call(name, backend.write_review, purchase_id, rng.randint(1, 5),
+                          "Benchmark review.")
+        elif name == "request_additional_inventory":
+            request_id = recorder.call(name, backend.request_additional_inventory,
+                                       rng.choice(catalog["products"]), username)
+            if request_id is not None:
+                requests.put(request_id)
+
+
+def employee(backend, recorder, requests, deadline):
+    """
+    One simulated employee, fulfilling requests as customers make them.
+    """
+    while time.perf_counter() < deadline:
+        try:
+            request_id = requests.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        recorder.call("check_request_open", backend.check_request_open, request_id)
+        recorder.call("fulfill_request", backend.fulfill_request, request_id, EMPLOYEE)
+
+
+# ----------------------------------------------------------------------
+# MySQL Cleanup
+# ----------------------------------------------------------------------
+def mysql_checkpoint(pool):
+    """
+    Records where the run's rows start and the current quantities.
+    """
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT IFNULL(MAX(request_id), 0) + 1 FROM requests")
+        first_request_id = cursor.fetchone()[0]
+        cursor.execute("SELECT product_id, quantity FROM product_inventory")
+        quantities = dict(cursor.fetchall())
+        first_purchase_id = synthetic.begin(conn)
+    return (first_purchase_id, first_request_id, quantities)
+
+
+def mysql_cleanup(pool, checkpoint):
+    """
+    Removes the run's purchases, reviews and requests and puts back any
+    quantities it changed.
+    """
+    (first_purchase_id, first_request_id, quantities) = checkpoint
+    with pool.connection() as conn:
+        synthetic.cleanup(conn, first_purchase_id)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM employee_log WHERE request_id>=%s", (first_request_id, ))
+        cursor.execute("DELETE FROM requests WHERE request_id>=%s", (first_request_id, ))
+        cursor.execute("SELECT product_id, quantity FROM product_inventory")
+        changed = [(quantities[product_id], product_id)
+                   for (product_id, quantity) in cursor.fetchall()
+                   if product_id in quantities and quantities[product_id] != quantity]
+        cursor.executemany("UPDATE product_inventory SET quantity=%s WHERE product_id=%s",
+                           changed)
+        conn.commit()
+
+
+# ----------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------
+def compare(results, baseline_path, tolerance):
+    """
+    Prints each procedure's p95 next to the baseline's and returns the
+    names of procedures that got more than `tolerance` slower.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["procedures"]
+
+    regressions = []
+    print("\nCompared with {path} (p95 ms):".format(path=baseline_path))
+    for name, row in sorted(results["procedures"].items()):
+        if name not in baseline or not baseline[name]["p95_ms"]:
+            print("  {:<32} {:>10.3f}   (no baseline)".format(name, row["p95_ms"]))
+            continue
+        ratio = row["p95_ms"] / baseline[name]["p95_ms"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("  {:<32} {:>10.3f} vs {:>10.3f}  ({:+.0%}){flag}".format(
+            name, row["p95_ms"], baseline[name]["p95_ms"], ratio - 1, flag=flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default="mysql")
+    parser.add_argument("--customers", type=int, default=8)
+    parser.add_argument("--employees", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare p95 latencies with an earlier results file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed p95 slowdown before --compare fails (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.backend == "mysql":
+        backend = backends.MySQLBackend(
+            db.ConnectionPool(size=args.customers + args.employees + 1))
+        checkpoint = mysql_checkpoint(backend.pool)
+    else:
+        backend = backends.create(args.backend)
+    setup_seconds = time.perf_counter() - start
+    catalog = {"products": backend.product_ids(), "themes": backend.theme_names()}
+
+    recorder = Recorder()
+    requests = queue.Queue()
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=customer,
+                                args=(backend, recorder, catalog, requests, deadline,
+                                      args.seed + i))
+               for i in range(args.customers)]
+    threads += [threading.Thread(target=employee,
+                                 args=(backend, recorder, requests, deadline))
+                for _ in range(args.employees)]
+
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if args.backend == "mysql":
+            mysql_cleanup(backend.pool, checkpoint)
+        backend.close()
+
+    procedures = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        procedures[name] = common.summarize(latencies)
+        procedures[name]["calls_per_second"] = len(latencies) / elapsed
+        procedures[name]["errors"] = recorder.errors[name]
+    total_calls = sum(row["count"] for row in procedures.values())
+    results = {
+        "backend": args.backend,
+        "customers": args.customers,
+        "employees": args.employees,
+        "seconds": elapsed,
+        "setup_seconds": setup_seconds,
+        "calls": total_calls,
+        "calls_per_second": total_calls / elapsed if elapsed else 0,
+        "errors": sum(recorder.errors.values()),
+        "procedures": procedures,
+    }
+
+    common.print_table("{backend}: {c} customers, {e} employees, {s:.0f}s".format(
+        backend=args.backend, c=args.customers, e=args.employees, s=elapsed), procedures)
+    print("\n{n} calls ({rate:.0f}/s), {err} errors; setup took {setup:.2f}s.".format(
+        n=total_calls, rate=results["calls_per_second"], err=results["errors"],
+        setup=setup_seconds))
+    if args.out:
+        common.write_results(args.out, results)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
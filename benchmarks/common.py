@@ -0,0 +1,92 @@
+"""
+Helpers shared by the benchmark scripts: latency summaries, server-side
+byte counters and JSON result files.
+"""
+
+import json
+import math
+import time
+
+
+def percentile(sorted_values, p):
+    """
+    Returns the p-th percentile (0-100) of an already sorted list,
+    using the nearest-rank method.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies):
+    """
+    Summarizes a list of latencies (in seconds) as milliseconds.
+    """
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "count": count,
+        "mean_ms": (sum(values) / count * 1000) if count else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] * 1000) if count else 0.0,
+    }
+
+
+def timed(fn, repeat):
+    """
+    Calls fn() `repeat` times and returns the list of latencies in seconds.
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bytes_sent(cursor):
+    """
+    Returns how many bytes the server has sent on this session so far.
+    """
+    cursor.execute("SHOW SESSION STATUS LIKE 'Bytes_sent'")
+    return int(cursor.fetchone()[1])
+
+
+def measure_bytes(cursor, fn):
+    """
+    Returns the number of bytes the server sent while running fn(),
+    excluding the cost of reading the counter itself.
+    """
+    # Reading the counter costs one status row; measure it once so it can
+    # be subtracted.
+    before = bytes_sent(cursor)
+    overhead = bytes_sent(cursor) - before
+
+    before = bytes_sent(cursor)
+    fn()
+    return bytes_sent(cursor) - before - overhead
+
+
+def print_table(title, rows):
+    """
+    Prints {name: summary} rows as an aligned table.
+    """
+    print("\n" + title)
+    print("  {:<32} {:>8} {:>10} {:>10} {:>10} {:>12}".format(
+        "name", "count", "p50 ms", "p95 ms", "p99 ms", "bytes/call"))
+    for name, row in rows.items():
+        print("  {:<32} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>12}".format(
+            name, row["count"], row["p50_ms"], row["p95_ms"], row["p99_ms"],
+            row.get("bytes_per_call", "-")))
+
+
+def write_results(path, results):
+    """
+    Writes benchmark results to a JSON file so runs can be compared.
+    """
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True, default=str)
+    print("\nResults written to {path}.".format(path=path))
@@ -0,0 +1,71 @@
+"""
+Synthetic order history for benchmarks.
+
+Benchmarks add purchases (and reviews) in bulk to see how queries behave
+as history grows, then remove them again. Rows are inserted directly, so
+inventory is left alone (only the purchase procedures decrement it), while
+the triggers keep the rating summary and revenue ledger up to date.
+Best run against a scratch copy of the database.
+"""
+
+import datetime
+import random
+
+CUSTOMERS = ["cpratt", "warnett", "ebanks", "mfreeman", "wferrell"]
+BATCH_SIZE = 5000
+
+
+def product_ids(cursor):
+    """
+    Returns every product ID in the catalog.
+    """
+    cursor.execute("SELECT product_id FROM product_inventory")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def begin(conn):
+    """
+    Returns the first free purchase ID.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT IFNULL(MAX(purchase_id), 0) + 1 FROM purchases")
+    return cursor.fetchone()[0]
+
+
+def add_purchases(conn, first_id, count, pick_product, days=730, with_reviews=False):
+    """
+    Inserts `count` purchases starting at purchase ID first_id, spread over
+    the last `days` days. pick_product(purchase_id) chooses each product.
+    If with_reviews, every purchase also gets a review.
+    """
+    cursor = conn.cursor()
+    now = datetime.datetime.now().replace(microsecond=0)
+    for start in range(first_id, first_id + count, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, first_id + count)
+        purchases = []
+        reviews = []
+        for purchase_id in range(start, end):
+            customer = random.choice(CUSTOMERS)
+            when = now - datetime.timedelta(seconds=random.randint(0, days * 86400))
+            purchases.append((purchase_id, pick_product(purchase_id), customer,
+                              round(random.uniform(1, 200), 2), when))
+            if with_reviews:
+                reviews.append((purchase_id, customer, when, random.randint(1, 5),
+                                "Synthetic benchmark review."))
+        cursor.executemany("INSERT INTO purchases VALUES (%s, %s, %s, %s, %s)", purchases)
+        if reviews:
+            cursor.executemany("INSERT INTO reviews (purchase_id, customer_username, "
+                               "review_time, rating, review) VALUES (%s, %s, %s, %s, %s)",
+                               reviews)
+        conn.commit()
+
+
+def cleanup(conn, first_id):
+    """
+    Deletes synthetic reviews and purchases.
+    Reviews are deleted first so their triggers keep summaries correct.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM reviews WHERE purchase_id>=%s", (first_id, ))
+    cursor.execute("DELETE FROM purchases WHERE purchase_id>=%s", (first_id, ))
+    conn.commit()
@@ -0,0 +1,216 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Optional in-process cache of the product catalog.
+
+Loads product_inventory, lego_sets and themes once, and then answers
+budget, theme and price lookups from memory:
+
+  - product IDs are kept sorted by price (in cents) in compact arrays, so
+    "everything under $X" is one bisect,
+  - each product ID maps to its (name, price),
+  - each theme name maps to an array of the product IDs of its sets and
+    its sub-themes' sets (from theme_closure).
+
+Per-query results (theme lookups, budget cut-offs) are kept in a small LRU.
+The cache checks the catalog_version counter in the database at most once
+every `refresh_interval` seconds, and reloads everything when it changes.
+Quantities are not cached, since they change with every purchase.
+"""
+
+import bisect
+import collections
+import random
+import threading
+import time
+from array import array
+
+import db
+
+
+class LRU:
+    """
+    A small least-recently-used mapping.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+def to_cents(price):
+    """
+    Converts a price (Decimal, float or numeric string) to integer cents.
+    """
+    return int(round(float(price) * 100))
+
+
+class CatalogCache:
+    """
+    In-memory copy of the catalog, kept fresh by the database's
+    catalog_version counter.
+    """
+
+    def __init__(self, pool=None, refresh_interval=5.0, lru_size=256):
+        self.pool = pool or db.get_pool()
+        self.refresh_interval = refresh_interval
+        self.version = None
+
+        self._lock = threading.RLock()
+        self._last_check = 0.0
+        self._results = LRU(lru_size)
+
+        # Parallel arrays, sorted by price.
+        self._prices = array("l")
+        self._ids_by_price = array("l")
+        # product_id -> (product_name, product_price)
+        self._products = {}
+        # lowercased theme name -> array of set product IDs in every theme
+        # with that name or under it, sorted
+        self._theme_sets = {}
+
+    # ------------------------------------------------------------------
+    # Loading and invalidation
+    # ------------------------------------------------------------------
+    def _fetch_version(self, cursor):
+        cursor.execute("SELECT version FROM catalog_version WHERE version_id=1")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def load(self):
+        """
+        (Re)loads the whole catalog from the database.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            version = self._fetch_version(cursor)
+
+            cursor.execute("SELECT product_id, product_name, product_price "
+                           "FROM product_inventory ORDER BY product_price, product_id")
+            products = {}
+            prices = array("l")
+            ids_by_price = array("l")
+            for (product_id, product_name, product_price) in cursor:
+                products[product_id] = (product_name, product_price)
+                prices.append(to_cents(product_price))
+                ids_by_price.append(product_id)
+
+            # Same subtree as get_sets_in_theme.
+            cursor.execute("SELECT DISTINCT LOWER(theme_name), lego_sets.product_id "
+                           "FROM themes "
+                           "  JOIN theme_closure ON (themes.theme_id=theme_closure.ancestor_id) "
+                           "  JOIN lego_sets ON (theme_closure.descendant_id=lego_sets.theme_id) "
+                           "ORDER BY LOWER(theme_name), lego_sets.product_id")
+            theme_sets = {}
+            for (theme_name, product_id) in cursor:
+                theme_sets.setdefault(theme_name, array("l")).append(product_id)
+
+        with self._lock:
+            self._products = products
+            self._prices = prices
+            self._ids_by_price = ids_by_price
+            self._theme_sets = theme_sets
+            self._results.clear()
+            self.version = version
+            self._last_check = time.monotonic()
+
+    def refresh(self, force=False):
+        """
+        Reloads the catalog if its version changed in the database.
+        Checks at most once every refresh_interval seconds unless forced.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.version is not None and not force \
+                    and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+
+        if self.version is None:
+            self.load()
+            return
+        with self.pool.connection() as conn:
+            version = self._fetch_version(conn.cursor())
+        if version != self.version:
+            self.load()
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    def _row(self, product_id):
+        (product_name, product_price) = self._products[product_id]
+        return (product_id, product_name, product_price)
+
+    def price(self, product_id):
+        """
+        Returns the price of a product, or None if it doesn't exist.
+        """
+        self.refresh()
+        product = self._products.get(int(product_id))
+        return product[1] if product else None
+
+    def count_max_price(self, max_price):
+        """
+        Returns how many products cost at most max_price.
+        """
+        self.refresh()
+        cents = to_cents(max_price)
+        with self._lock:
+            key = ("max_price", cents)
+            count = self._results.get(key)
+            if count is None:
+                count = bisect.bisect_right(self._prices, cents)
+                self._results.put(key, count)
+            return count
+
+    def sample_max_price(self, max_price, k):
+        """
+        Returns up to k random (product_id, product_name, product_price)
+        rows costing at most max_price, like sample_sets_max_price.
+        """
+        count = self.count_max_price(max_price)
+        with self._lock:
+            picks = random.sample(range(count), min(k, count))
+            return [self._row(self._ids_by_price[i]) for i in picks]
+
+    def sets_in_theme(self, theme_name):
+        """
+        Returns the (product_id, product_name, product_price) rows of all
+        sets with the given theme name or under it, like get_sets_in_theme.
+        """
+        self.refresh()
+        key = ("theme", theme_name.lower())
+        with self._lock:
+            rows = self._results.get(key)
+            if rows is None:
+                rows = [self._row(product_id)
+                        for product_id in self._theme_sets.get(theme_name.lower(), ())]
+                self._results.put(key, rows)
+            return rows
+
+    def sample_in_theme(self, theme_name, k):
+        """
+        Returns up to k random sets with the given theme name,
+        like sample_sets_in_theme.
+        """
+        rows = self.sets_in_theme(theme_name)
+        return random.sample(rows, min(k, len(rows)))
@@ -0,0 +1,321 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Inventory change feed: follows inventory_changes, the log of every change
+to a product's quantity, from a watermark.
+
+The product_inventory triggers (trg_catalog_* in setup-routines.sql) log
+a row for every quantity change, whichever path made it: purchases and
+checkouts, fulfilled requests (one at a time or in bulk), and products
+added or deleted. change_id increases with every change and is the feed's
+version, so a consumer that has applied the changes up to some change_id
+catches up by reading only the rows after it, rather than re-reading the
+whole catalog.
+
+A Subscriber reads up to batch_size changes per poll() and compacts them:
+several changes to one product become one Change carrying its latest
+quantity and the sum of its deltas, so a consumer can either overwrite
+(quantity) or accumulate (delta):
+
+    subscriber = change_feed.Subscriber()
+    quantities = subscriber.snapshot()      # every quantity, and its place in the feed
+    ...
+    change_feed.apply(quantities, subscriber.poll())
+
+MySQL numbers a change when it is made, not when it commits, so a reader
+can see change N + 1 before change N. A Subscriber doesn't move past a
+missing change_id until it shows up, or for GAP_TIMEOUT seconds (the
+change of a rolled-back transaction never will).
+
+trim() deletes old changes, and records how far. A Subscriber stuck at a
+missing change_id behind that point raises FeedTrimmed rather than wait
+and skip changes it can no longer read; its consumer has to start again
+from snapshot(). The log is trimmed e.g. daily from cron:
+
+    $ python3 change_feed.py tail [--after CHANGE_ID]
+    $ python3 change_feed.py trim --keep-days 7 [--upto CHANGE_ID]
+"""
+
+import argparse
+import collections
+import datetime
+import sys
+import time
+
+import backends
+import db
+
+# Changes read per poll.
+BATCH_SIZE = 1000
+
+# Seconds to wait for a missing change_id before skipping it.
+GAP_TIMEOUT = 5.0
+
+# Newest changes a new Subscriber checks for ones still being committed.
+LOOKBACK = 1000
+
+POLL_INTERVAL = 1.0
+
+# One product's changes in a batch: its quantity after the last of them
+# (None if it was deleted), their total delta, and the last change_id.
+Change = collections.namedtuple("Change", ["product_id", "quantity", "delta", "version"])
+
+
+def compact(rows):
+    """
+    Merges (change_id, product_id, quantity, delta) rows, in change_id
+    order, into one Change per product, in order of their versions.
+    """
+    latest = {}
+    for (change_id, product_id, quantity, delta) in rows:
+        previous = latest.pop(product_id, None)
+        if previous is not None:
+            delta += previous.delta
+        latest[product_id] = Change(product_id, quantity, delta, change_id)
+    return list(latest.values())
+
+
+def apply(quantities, changes):
+    """
+    Applies changes to a {product_id: quantity} dict, removing deleted
+    products.
+    """
+    for change in changes:
+        if change.quantity is None:
+            quantities.pop(change.product_id, None)
+        else:
+            quantities[change.product_id] = change.quantity
+
+
+def resume_point(recent):
+    """
+    Returns (watermark, read) for a reader starting after the given
+    newest change_ids. Any numbers missing among them belong to changes
+    that weren't committed yet, so the watermark is just before the first
+    missing one, and read holds the change_ids after it already seen.
+    """
+    recent = sorted(recent)
+    watermark = recent[-1] if recent else 0
+    for (previous, change_id) in zip(recent, recent[1:]):
+        if change_id != previous + 1:
+            watermark = previous
+            break
+    return watermark, {change_id for change_id in recent if change_id > watermark}
+
+
+def advance(watermark, change_ids, passed):
+    """
+    Returns (watermark, waiting) for a reader at watermark that read the
+    given change_ids, in order. It moves up to the first missing number,
+    or past it if passed(number) says to stop waiting for it; waiting is
+    whether it stopped there.
+    """
+    for change_id in change_ids:
+        if change_id != watermark + 1 and not passed(watermark + 1):
+            return watermark, True
+        watermark = change_id
+    return watermark, False
+
+
+class FeedTrimmed(Exception):
+    """
+    Raised by Subscriber.poll() when changes after its watermark were
+    trimmed before it read them.
+    """
+
+    def __init__(self, watermark):
+        super().__init__("Inventory changes after #{w} were trimmed before they were read; "
+                         "start again from a snapshot.".format(w=watermark))
+        self.watermark = watermark
+
+
+class GapTimer:
+    """
+    Times how long a reader has been stuck at a missing change_id, so it
+    can move past one that will never show up.
+    """
+
+    def __init__(self, timeout=GAP_TIMEOUT, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        # Missing change_id being waited for, and since when.
+        self._gap = None
+        self._since = 0.0
+
+    def passed(self, change_id):
+        """
+        Returns whether change_id has been missing for the timeout.
+        """
+        now = self.clock()
+        if self._gap != change_id:
+            self._gap = change_id
+            self._since = now
+        return now - self._since >= self.timeout
+
+
+class Subscriber:
+    """
+    Reads the inventory change feed in order, one batch per poll(), from
+    its watermark: the change_id of the last change it has read.
+
+    Without a watermark it starts at the newest change, so it only sees
+    changes made from now on; snapshot() starts it from a copy of every
+    quantity instead.
+    """
+
+    def __init__(self, backend=None, watermark=None, batch_size=BATCH_SIZE,
+                 gap_timeout=GAP_TIMEOUT, clock=time.monotonic):
+        self.backend = backend or backends.get_backend()
+        self.batch_size = batch_size
+        self.gaps = GapTimer(gap_timeout, clock)
+        # Changes read, and Changes returned after compacting them.
+        self.read = 0
+        self.returned = 0
+        # Whether the last poll read a full batch, so more may be waiting,
+        # and whether it stopped at a missing change_id.
+        self.behind = False
+        self.waiting = False
+
+        # change_ids after the watermark that were already read.
+        self._skip = set()
+        if watermark is None:
+            self._start(self.backend.recent_inventory_changes(LOOKBACK))
+        else:
+            self.watermark = watermark
+
+    def _start(self, recent):
+        (self.watermark, self._skip) = resume_point(recent)
+
+    def snapshot(self):
+        """
+        Returns every product's {product_id: quantity}, and starts the
+        feed right after the changes it includes.
+        """
+        (recent, quantities) = self.backend.inventory_snapshot(LOOKBACK)
+        self._start(recent)
+        return dict(quantities)
+
+    def poll(self):
+        """
+        Returns the compacted Changes after the watermark, from at most
+        batch_size changes, and moves the watermark past them. Raises
+        FeedTrimmed if the next change was trimmed.
+        """
+        rows = self.backend.inventory_changes(self.watermark, self.batch_size)
+        # Read after the rows, so a trim in between is seen too.
+        if rows and rows[0][0] != self.watermark + 1 \
+                and self.backend.inventory_trimmed_upto() > self.watermark:
+            raise FeedTrimmed(self.watermark)
+        ready = []
+        expected = self.watermark + 1
+        self.waiting = False
+        for row in rows:
+            change_id = row[0]
+            if change_id != expected and not self.gaps.passed(expected):
+                self.waiting = True
+                break
+            expected = change_id + 1
+            if change_id in self._skip:
+                self._skip.discard(change_id)
+            else:
+                ready.append(row)
+        self.watermark = expected - 1
+        self.behind = len(rows) == self.batch_size
+
+        changes = compact(ready)
+        self.read += len(ready)
+        self.returned += len(changes)
+        return changes
+
+    def catch_up(self):
+        """
+        Polls until the end of the feed (or a change still being
+        committed), and returns all the Changes, compacted.
+        """
+        changes = {}
+        while True:
+            for change in self.poll():
+                previous = changes.pop(change.product_id, None)
+                if previous is not None:
+                    change = change._replace(delta=change.delta + previous.delta)
+                changes[change.product_id] = change
+            if self.waiting or not self.behind:
+                return list(changes.values())
+
+    def tail(self, interval=POLL_INTERVAL):
+        """
+        Yields batches of Changes as they are made, forever.
+        """
+        while True:
+            changes = self.poll()
+            if changes:
+                yield changes
+            if self.waiting or not self.behind:
+                time.sleep(interval)
+
+
+def trim(backend=None, keep_days=7, upto_change_id=None):
+    """
+    Deletes the changes older than keep_days (and, if given, only those
+    up to upto_change_id, e.g. the slowest consumer's watermark).
+    Returns the number deleted.
+    """
+    backend = backend or backends.get_backend()
+    before = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(days=keep_days)
+    return backend.trim_inventory_changes(before, upto_change_id)
+
+
+# ----------------------------------------------------------------------
+# Command Line
+# ----------------------------------------------------------------------
+def tail_command(backend, args):
+    subscriber = Subscriber(backend, args.after)
+    try:
+        for changes in subscriber.tail(args.interval):
+            for change in changes:
+                print("#{version:<10} product {id:<8} quantity {q!s:<6} ({delta:+d})".format(
+                    version=change.version, id=change.product_id, q=change.quantity,
+                    delta=change.delta))
+            sys.stdout.flush()
+    except FeedTrimmed as err:
+        print(err, file=sys.stderr)
+        return 1
+    return 0
+
+
+def trim_command(backend, args):
+    deleted = trim(backend, args.keep_days, args.upto)
+    print("Deleted {n} inventory changes.".format(n=deleted))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Follow or trim the inventory change feed.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("tail", help="print quantity changes as they happen")
+    cmd.add_argument("--after", type=int, metavar="CHANGE_ID",
+                     help="start after this change (default: the newest)")
+    cmd.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                     help="seconds between polls when caught up")
+    cmd.set_defaults(func=tail_command)
+
+    cmd = commands.add_parser("trim", help="delete old changes")
+    cmd.add_argument("--keep-days", type=int, default=7)
+    cmd.add_argument("--upto", type=int, metavar="CHANGE_ID",
+                     help="keep changes after this one (the slowest consumer's watermark)")
+    cmd.set_defaults(func=trim_command)
+
+    args = parser.parse_args(argv)
+    try:
+        sys.exit(args.func(backends.get_backend(), args))
+    except KeyboardInterrupt:
+        sys.exit(0)
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
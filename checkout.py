@@ -0,0 +1,66 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Multi-item cart checkout.
+
+A customer collects product IDs in a cart, and checkout buys them all in
+one transaction through the checkout_cart procedure: stock is checked and
+decremented for the whole cart at once, the customer's discount is looked
+up once, and the new purchase IDs come back from the insert itself. The
+number of round trips is the same however many items are in the cart.
+"""
+
+import collections
+
+import inventory
+
+# status is "OK" or "OUT_OF_STOCK".
+# purchases: [(purchase_id, product_id, purchase_item_total)] when OK.
+# shortages: [(product_id, requested, available)] when OUT_OF_STOCK.
+CheckoutResult = collections.namedtuple("CheckoutResult", ["status", "purchases", "shortages"])
+
+# checkout_cart takes the cart as a VARCHAR(4000) list.
+MAX_CART_CHARS = 4000
+
+
+def cart_string(product_ids):
+    """
+    Returns the cart as the comma-separated list checkout_cart takes.
+    Raises ValueError for an empty or oversized cart.
+    """
+    if not product_ids:
+        raise ValueError("The cart is empty.")
+    cart = ",".join(str(int(product_id)) for product_id in product_ids)
+    if len(cart) > MAX_CART_CHARS:
+        raise ValueError("The cart is too large to check out at once.")
+    return cart
+
+
+def checkout(username, product_ids, pool=None):
+    """
+    Buys every product in product_ids (a list of ints; repeats buy more
+    than one) for the given customer, all or nothing.
+    Returns a CheckoutResult. Raises ValueError for an empty or oversized
+    cart, and db.Error if the database fails (deadlocks are retried
+    first).
+    """
+    cart = cart_string(product_ids)
+
+    def work(conn):
+        cursor = conn.cursor()
+        result = cursor.callproc("checkout_cart", [cart, username, "", 0, 0])
+        rows = []
+        for stored in cursor.stored_results():
+            rows.extend(stored.fetchall())
+
+        status = result[2]
+        if status == "OK":
+            conn.commit()
+            return CheckoutResult(status, rows, [])
+        conn.rollback()
+        return CheckoutResult(status, [], rows)
+
+    # Carts lock several rows, so they can deadlock with each other.
+    result, _ = inventory.retry_transaction(work, pool)
+    return result
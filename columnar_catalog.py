@@ -0,0 +1,421 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Columnar in-memory copy of the catalog, for browsing with several filters
+at once ("sets under $50, in stock, in Star Wars or below, from 2010 on").
+
+Every product is one row, and each column (price, quantity, theme, number
+of parts, year, category) is a typed array, about 2 MB for the whole
+catalog. Rows are sorted by price, so a price range is a contiguous run
+of rows.
+
+Filters are evaluated as bitmaps: Python ints with one bit per row. Each
+filter becomes a bitmap (a price range is a run of bits, a theme is the
+bits of its sets, ...), the filters are combined with one & per filter,
+each of which works on whole machine words at a time, and the answer is
+read out of the final bitmap. Bitmaps for themes, categories and year or
+part-count ranges are kept in a small LRU, so a repeated browse costs a
+few big-integer operations: tens of microseconds.
+
+Results are Record views onto the columns. Like catalog_cache.py, the
+copy reloads when the catalog_version counter changes, checking at most
+once every `refresh_interval` seconds. Quantities aren't catalog changes:
+on the same schedule, the products whose quantity changed since the last
+check are read from the inventory change feed (change_feed.py) and
+updated, so quantities may be that many seconds old. If the feed was
+trimmed past the last check, the copy reloads instead.
+"""
+
+import bisect
+import decimal
+import heapq
+import threading
+import time
+from array import array
+
+import backends
+import catalog_cache
+import change_feed
+
+CENTS = decimal.Decimal("0.01")
+
+# Stored in integer columns for NULL (parts have no theme, sets no category).
+MISSING = -1
+
+# Columns results can be ordered by.
+ORDER_COLUMNS = ("product_price", "product_id", "quantity", "num_parts", "year_released")
+
+
+def _bitmap(rows, num_rows):
+    """
+    Returns the int with the bits of rows set.
+    """
+    bits = bytearray((num_rows + 7) // 8)
+    for row in rows:
+        bits[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _set_bits(bitmap):
+    """
+    Returns the rows (bit positions) set in bitmap, in increasing order.
+    """
+    digits = bin(bitmap)[:1:-1]
+    rows = []
+    row = digits.find("1")
+    while row >= 0:
+        rows.append(row)
+        row = digits.find("1", row + 1)
+    return rows
+
+
+class Record:
+    """
+    A view of one row of the catalog's columns.
+    """
+
+    __slots__ = ("_columns", "_row")
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    def _value(self, column):
+        value = getattr(self._columns, column)[self._row]
+        return None if value == MISSING else value
+
+    @property
+    def product_id(self):
+        return self._columns.product_id[self._row]
+
+    @property
+    def product_name(self):
+        return self._columns.product_name[self._row]
+
+    @property
+    def product_price(self):
+        return decimal.Decimal(self._columns.product_price[self._row]) * CENTS
+
+    @property
+    def quantity(self):
+        return self._columns.quantity[self._row]
+
+    @property
+    def theme_id(self):
+        return self._value("theme_id")
+
+    @property
+    def num_parts(self):
+        return self._value("num_parts")
+
+    @property
+    def year_released(self):
+        return self._value("year_released")
+
+    @property
+    def category_id(self):
+        return self._value("category_id")
+
+    def as_tuple(self):
+        """
+        Returns (product_id, product_name, product_price), like the
+        search procedures' rows.
+        """
+        return (self.product_id, self.product_name, self.product_price)
+
+    def __repr__(self):
+        return "Record(product_id={id}, product_name={name!r}, product_price={price})".format(
+            id=self.product_id, name=self.product_name, price=self.product_price)
+
+
+class _SortedColumn:
+    """
+    The rows of an integer column sorted by value, so a value range is a
+    run of them. Rows with no value are left out.
+    """
+
+    def __init__(self, values):
+        rows = sorted((row for row in range(len(values)) if values[row] != MISSING),
+                      key=values.__getitem__)
+        self.rows = array("l", rows)
+        self.values = array("l", (values[row] for row in rows))
+
+    def span(self, low, high):
+        """
+        Returns (start, end) such that rows[start:end] have values in
+        [low, high]; None means unbounded.
+        """
+        start = 0 if low is None else bisect.bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect.bisect_right(self.values, high)
+        return (start, max(start, end))
+
+
+class _Columns:
+    """
+    One load of the catalog: the columns and the indexes over them.
+    Never modified after it is built, except for the quantities.
+    """
+
+    def __init__(self, rows, subtrees, version):
+        # Rows are ordered by price (then product ID).
+        rows = sorted(rows, key=lambda row: (catalog_cache.to_cents(row[2]), row[0]))
+        self.version = version
+        self.num_rows = len(rows)
+        self.product_id = array("l", (row[0] for row in rows))
+        self.product_name = [row[1] for row in rows]
+        self.product_price = array("l", (catalog_cache.to_cents(row[2]) for row in rows))
+        self.quantity = array("l", (row[3] for row in rows))
+        self.theme_id, self.num_parts, self.year_released, self.category_id = (
+            array("l", (MISSING if row[i] is None else int(row[i]) for row in rows))
+            for i in range(4, 8))
+        self.row_of = {product_id: row for (row, product_id) in enumerate(self.product_id)}
+
+        self.all_rows = (1 << self.num_rows) - 1
+        # Only sets have a number of parts.
+        self.sets = _bitmap((row for row in range(self.num_rows)
+                             if self.num_parts[row] != MISSING), self.num_rows)
+        self.in_stock = self._stock_bitmap()
+
+        # theme ID -> rows of the sets directly in it;
+        # category ID -> rows of its parts
+        self.theme_rows = {}
+        self.category_rows = {}
+        for row in range(self.num_rows):
+            if self.theme_id[row] != MISSING:
+                self.theme_rows.setdefault(self.theme_id[row], array("l")).append(row)
+            if self.category_id[row] != MISSING:
+                self.category_rows.setdefault(self.category_id[row], array("l")).append(row)
+
+        # lowercased theme name, or theme ID -> the theme IDs under it
+        self.subtrees = {}
+        for (theme_id, theme_name, descendant_id) in subtrees:
+            self.subtrees.setdefault(theme_name.lower(), set()).add(descendant_id)
+            self.subtrees.setdefault(theme_id, set()).add(descendant_id)
+
+        self.sorted_columns = {
+            "num_parts": _SortedColumn(self.num_parts),
+            "year_released": _SortedColumn(self.year_released),
+        }
+
+    def _stock_bitmap(self):
+        return _bitmap((row for row in range(self.num_rows) if self.quantity[row] > 0),
+                       self.num_rows)
+
+    def set_quantities(self, quantities):
+        """
+        Updates the quantity column, and the in-stock bitmap, from
+        (product_id, quantity) rows. A quantity of None (a deleted
+        product) is skipped; the catalog version changes with it.
+        """
+        in_stock = self.in_stock
+        for (product_id, quantity) in quantities:
+            row = self.row_of.get(product_id)
+            if row is not None and quantity is not None:
+                self.quantity[row] = quantity
+                if quantity > 0:
+                    in_stock |= 1 << row
+                else:
+                    in_stock &= ~(1 << row)
+        self.in_stock = in_stock
+
+
+class ColumnarCatalog:
+    """
+    Columnar copy of the catalog with bitmap filtering, kept fresh by the
+    database's catalog_version counter.
+    """
+
+    def __init__(self, backend=None, refresh_interval=5.0, lru_size=256):
+        self.backend = backend or backends.get_backend()
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.RLock()
+        self._last_check = 0.0
+        self._columns = None
+        # Quantity changes since the columns were read.
+        self._feed = None
+        self._feed_lock = threading.Lock()
+        # Bitmaps for themes, categories and value ranges.
+        self._bitmaps = catalog_cache.LRU(lru_size)
+
+    # ------------------------------------------------------------------
+    # Loading and invalidation
+    # ------------------------------------------------------------------
+    def load(self):
+        """
+        (Re)loads the whole catalog from the database.
+        """
+        # Joined before the columns are read, so no change is missed;
+        # changes the columns already have are applied again, harmlessly.
+        feed = change_feed.Subscriber(self.backend)
+        version = self.backend.catalog_version()
+        columns = _Columns(self.backend.catalog_columns(), self.backend.theme_subtrees(),
+                           version)
+        with self._lock:
+            self._columns = columns
+            self._feed = feed
+            self._bitmaps.clear()
+            self._last_check = time.monotonic()
+
+    def refresh(self, force=False):
+        """
+        Reloads the catalog if its version changed in the database, and
+        applies the quantity changes since the last check otherwise.
+        Checks at most once every refresh_interval seconds unless forced.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._columns is not None and not force \
+                    and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+            columns = self._columns
+            feed = self._feed
+
+        if columns is None or self.backend.catalog_version() != columns.version:
+            self.load()
+            return
+        with self._feed_lock:
+            try:
+                changes = feed.catch_up()
+            except change_feed.FeedTrimmed:
+                changes = None
+        if changes is None:
+            # The changes since the columns were read are gone, so read
+            # the columns again.
+            self.load()
+            return
+        with self._lock:
+            columns.set_quantities((change.product_id, change.quantity) for change in changes)
+
+    def __len__(self):
+        self.refresh()
+        return self._columns.num_rows
+
+    # ------------------------------------------------------------------
+    # Filtering
+    # ------------------------------------------------------------------
+    def _cached(self, key, build):
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            bitmap = build()
+            self._bitmaps.put(key, bitmap)
+        return bitmap
+
+    def _theme_bitmap(self, columns, theme):
+        """
+        Bitmap of the sets in every theme named theme (or with that theme
+        ID), or under one, like get_sets_in_theme.
+        """
+        key = theme.lower() if isinstance(theme, str) else int(theme)
+
+        def build():
+            theme_ids = columns.subtrees.get(key, ())
+            return _bitmap((row for theme_id in theme_ids
+                            for row in columns.theme_rows.get(theme_id, ())),
+                           columns.num_rows)
+        return self._cached(("theme", key), build)
+
+    def _range_bitmap(self, columns, column, low, high):
+        sorted_column = columns.sorted_columns[column]
+        (start, end) = sorted_column.span(low, high)
+        return self._cached((column, start, end), lambda: _bitmap(
+            sorted_column.rows[start:end], columns.num_rows))
+
+    def _filter(self, columns, kind=None, min_price=None, max_price=None, in_stock=False,
+                theme=None, category_id=None, min_year=None, max_year=None,
+                min_parts=None, max_parts=None):
+        """
+        Returns the bitmap of the rows passing every given filter.
+        """
+        bitmap = columns.all_rows
+        if min_price is not None or max_price is not None:
+            start = 0 if min_price is None else bisect.bisect_left(
+                columns.product_price, catalog_cache.to_cents(min_price))
+            end = columns.num_rows if max_price is None else bisect.bisect_right(
+                columns.product_price, catalog_cache.to_cents(max_price))
+            bitmap &= ((1 << end) - 1) >> start << start
+        if kind == "set":
+            bitmap &= columns.sets
+        elif kind == "part":
+            bitmap &= columns.all_rows ^ columns.sets
+        elif kind is not None:
+            raise ValueError("kind must be 'set' or 'part'")
+        if in_stock:
+            bitmap &= columns.in_stock
+        if theme is not None:
+            bitmap &= self._theme_bitmap(columns, theme)
+        if category_id is not None:
+            bitmap &= self._cached(("category", category_id), lambda: _bitmap(
+                columns.category_rows.get(category_id, ()), columns.num_rows))
+        if min_year is not None or max_year is not None:
+            bitmap &= self._range_bitmap(columns, "year_released", min_year, max_year)
+        if min_parts is not None or max_parts is not None:
+            bitmap &= self._range_bitmap(columns, "num_parts", min_parts, max_parts)
+        return bitmap
+
+    def count(self, **filters):
+        """
+        Returns how many products pass the filters (see select()).
+        """
+        self.refresh()
+        with self._lock:
+            return bin(self._filter(self._columns, **filters)).count("1")
+
+    def select(self, k=None, order_by="product_price", descending=False, **filters):
+        """
+        Returns Records for the products passing every filter, ordered by
+        order_by (ties by price), at most k of them if k is given.
+
+        Filters: kind ("set" or "part"), min_price, max_price, in_stock,
+        theme (name or ID; includes its sub-themes), category_id,
+        min_year, max_year, min_parts, max_parts. Ranges are inclusive.
+        """
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError("order_by must be one of {columns}".format(
+                columns=", ".join(ORDER_COLUMNS)))
+        self.refresh()
+        with self._lock:
+            columns = self._columns
+            bitmap = self._filter(columns, **filters)
+
+            if order_by == "product_price" and k is not None:
+                # Rows are in price order: take the lowest (or highest) bits.
+                rows = []
+                while bitmap and len(rows) < k:
+                    if descending:
+                        row = bitmap.bit_length() - 1
+                        bitmap ^= 1 << row
+                    else:
+                        lowest = bitmap & -bitmap
+                        row = lowest.bit_length() - 1
+                        bitmap ^= lowest
+                    rows.append(row)
+            else:
+                rows = _set_bits(bitmap)
+                if order_by != "product_price":
+                    values = getattr(columns, order_by)
+                    if k is not None:
+                        pick = heapq.nlargest if descending else heapq.nsmallest
+                        rows = pick(k, rows, key=values.__getitem__)
+                    else:
+                        rows.sort(key=values.__getitem__, reverse=descending)
+                elif descending:
+                    rows.reverse()
+            return [Record(columns, row) for row in rows[:k]]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Returns the process-wide columnar catalog, loaded on first use.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ColumnarCatalog()
+        return _catalog
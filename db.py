@@ -0,0 +1,350 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Shared connection layer for the lego store.
+
+Both app_client.py and app_admin.py (and any batch tooling) borrow
+connections from one bounded pool instead of each opening a single global
+connection at import time. Connections are health-checked when they are
+borrowed, reconnected when the server drops them, and set up once per
+session when they are first opened.
+
+Configuration is read from the environment:
+
+    LEGOS_DB_HOST          (default: localhost)
+    LEGOS_DB_PORT          (default: 8889, the MAMP port)
+    LEGOS_DB_USER          (default: emin)
+    LEGOS_DB_PASSWORD      (default: eminpw)
+    LEGOS_DB_NAME          (default: legos)
+    LEGOS_DB_POOL_SIZE     (default: 5)
+    LEGOS_DB_POOL_TIMEOUT  (seconds to wait for a free connection, default: 10)
+
+Usage:
+
+    import db
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.callproc("get_price_and_rating", [prod_id, 0, 0])
+
+Hot lookups that run on almost every prompt (is this a customer, how many
+of this product are in stock, ...) go through a StatementCache instead:
+each is prepared on the server once per connection and then only executed,
+with its values bound rather than formatted into the SQL.
+
+The MySQL driver is optional: without it the SQLite backend still works
+(see backends.py). Code catches db.Error and its subclasses, which are the
+driver's error classes when it is installed and stand-ins with the same
+names when it isn't.
+"""
+
+import contextlib
+import os
+import queue
+import threading
+import time
+
+try:
+    import mysql.connector
+    from mysql.connector.errors import (DatabaseError, Error, IntegrityError, InterfaceError,
+                                        OperationalError)
+except ImportError:
+    mysql = None
+
+    class Error(Exception):
+        """
+        Stand-in for mysql.connector.Error when the driver isn't installed.
+        """
+
+        def __init__(self, msg=None, errno=None, values=None, sqlstate=None):
+            super().__init__(msg)
+            self.msg = msg
+            self.errno = errno
+            self.sqlstate = sqlstate
+
+    class DatabaseError(Error):
+        pass
+
+    class IntegrityError(DatabaseError):
+        pass
+
+    class OperationalError(DatabaseError):
+        pass
+
+    class InterfaceError(Error):
+        pass
+
+import instrumentation
+
+# Connections that have sat idle for longer than this are pinged before
+# they are handed out again.
+IDLE_CHECK_SECONDS = 30
+
+# How many times to try (re)connecting before giving up.
+CONNECT_ATTEMPTS = 3
+CONNECT_BACKOFF_SECONDS = 0.5
+
+# Statements run once on every new connection.
+SESSION_SETUP = [
+    "SET NAMES utf8mb4",
+]
+
+
+class DatabaseUnavailable(Error):
+    """
+    Raised when no healthy connection can be handed out, either because
+    the server cannot be reached (or the driver isn't installed) or because
+    the pool stayed exhausted. Subclasses Error so existing error handling
+    catches it.
+    """
+
+
+def config_from_env():
+    """
+    Returns the connection settings, read from the environment with the
+    defaults the apps have always used.
+    """
+    return {
+        "host": os.environ.get("LEGOS_DB_HOST", "localhost"),
+        "port": int(os.environ.get("LEGOS_DB_PORT", "8889")),
+        "user": os.environ.get("LEGOS_DB_USER", "emin"),
+        "password": os.environ.get("LEGOS_DB_PASSWORD", "eminpw"),
+        "database": os.environ.get("LEGOS_DB_NAME", "legos"),
+    }
+
+
+# ----------------------------------------------------------------------
+# Connection Pool
+# ----------------------------------------------------------------------
+class ConnectionPool:
+    """
+    A bounded pool of MySQL connections.
+
+    At most `size` connections are open (or borrowed) at once. Connections
+    are opened lazily, reused most-recently-returned first, and discarded
+    if they fail a health check or break while borrowed.
+    """
+
+    def __init__(self, config=None, size=None, timeout=None):
+        self.config = config or config_from_env()
+        self.size = size or int(os.environ.get("LEGOS_DB_POOL_SIZE", "5"))
+        self.timeout = timeout or float(os.environ.get("LEGOS_DB_POOL_TIMEOUT", "10"))
+
+        # Functions called with every newly opened connection, after
+        # SESSION_SETUP has run, and with every connection being closed.
+        self.on_connect = []
+        self.on_discard = []
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+
+    def _connect(self):
+        """
+        Opens and sets up a new connection, retrying with backoff.
+        """
+        if mysql is None:
+            raise DatabaseUnavailable(msg="The MySQL driver (mysql-connector-python) is not "
+                                          "installed; set LEGOS_BACKEND=sqlite to run without it.")
+        last_err = None
+        for attempt in range(CONNECT_ATTEMPTS):
+            try:
+                conn = mysql.connector.connect(**self.config)
+                cursor = conn.cursor()
+                for sql in SESSION_SETUP:
+                    cursor.execute(sql)
+                cursor.close()
+                for hook in self.on_connect:
+                    hook(conn)
+                return conn
+            except Error as err:
+                last_err = err
+                time.sleep(CONNECT_BACKOFF_SECONDS * (2 ** attempt))
+        raise DatabaseUnavailable(msg="Could not connect to the database: %s" % (last_err, ),
+                                  errno=getattr(last_err, "errno", None))
+
+    def _healthy(self, conn, last_used):
+        """
+        Checks that an idle connection is still usable.
+        Recently used connections are trusted without a round trip.
+        """
+        if time.monotonic() - last_used < IDLE_CHECK_SECONDS:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    def _discard(self, conn):
+        for hook in self.on_discard:
+            hook(conn)
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def acquire(self):
+        """
+        Borrows a healthy connection, waiting up to `timeout` seconds for
+        one to be returned if the pool is at capacity.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise DatabaseUnavailable(msg="Connection pool exhausted (%d in use)." % (self.size, ))
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._healthy(conn, last_used):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        """
+        Returns a borrowed connection to the pool. Any transaction left
+        open is rolled back so the next borrower starts clean. Once the
+        pool is closed, returned connections are closed instead.
+        """
+        try:
+            if broken or self._closed:
+                self._discard(conn)
+                return
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Error:
+                self._discard(conn)
+                return
+            self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager that borrows a connection and always returns it.
+        Connections that lose their link to the server are discarded
+        rather than returned.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except (OperationalError, InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def close(self):
+        """
+        Closes every idle connection. Borrowed connections are closed as
+        they come back.
+        """
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+# ----------------------------------------------------------------------
+# Prepared Statements
+# ----------------------------------------------------------------------
+class StatementCache:
+    """
+    A registry of named statements, prepared server-side on first use on
+    each connection and reused after that.
+
+    MySQL prepared statements belong to the session that prepared them, so
+    the handles (one prepared cursor per statement) are kept per
+    connection. They are dropped when the pool discards the connection
+    (pass the pool to have evict() hooked up), and dropped and prepared
+    again if the connection is ever reconnected to a new session.
+    """
+
+    def __init__(self, statements, pool=None):
+        # name -> SQL with %s placeholders
+        self.statements = dict(statements)
+        # Statements prepared and executions, for benchmarks.
+        self.prepares = 0
+        self.executions = 0
+
+        self._lock = threading.Lock()
+        # connection -> (server connection ID, {name: prepared cursor})
+        self._handles = {}
+        if pool is not None:
+            pool.on_discard.append(self.evict)
+
+    def _cursor(self, conn, name):
+        session = conn.connection_id
+        with self._lock:
+            entry = self._handles.get(conn)
+            if entry is None or entry[0] != session:
+                entry = (session, {})
+                self._handles[conn] = entry
+            cursor = entry[1].get(name)
+            if cursor is None:
+                cursor = conn.cursor(prepared=True)
+                entry[1][name] = cursor
+                self.prepares += 1
+            self.executions += 1
+        return cursor
+
+    def evict(self, conn):
+        """
+        Forgets the statements prepared on conn.
+        """
+        with self._lock:
+            self._handles.pop(conn, None)
+
+    def execute(self, conn, name, args=()):
+        """
+        Runs statement `name` on conn with args bound to its placeholders
+        and returns all of its rows.
+        """
+        cursor = self._cursor(conn, name)
+        try:
+            cursor.execute(self.statements[name], tuple(args))
+            return cursor.fetchall()
+        except (OperationalError, InterfaceError):
+            self.evict(conn)
+            raise
+
+
+# ----------------------------------------------------------------------
+# Module-Level Pool
+# ----------------------------------------------------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide pool, creating it on first use.
+    Its connections are instrumented (see instrumentation.py) unless
+    LEGOS_INSTRUMENT=0.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+            if instrumentation.enabled():
+                instrumentation.install(_pool)
+        return _pool
+
+
+def connection():
+    """
+    Borrows a connection from the process-wide pool.
+    Use as `with db.connection() as conn: ...`.
+    """
+    return get_pool().connection()
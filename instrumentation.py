@@ -0,0 +1,346 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Per-statement timing for every query the store runs.
+
+Connections from the process-wide pool (db.get_pool()) hand out cursors
+that time each execute, executemany and callproc and count the rows and
+bytes fetched afterwards. Results are grouped by statement: stored
+procedure calls by name ("CALL make_purchase") and plain SQL with its
+literals replaced by "?", so values such as passwords never appear in the
+stats or the log. For each statement we keep:
+
+    - a latency histogram of the execute/callproc calls, in milliseconds
+    - the number of calls and errors
+    - rows and bytes fetched (bytes are the size of the values as
+      Python strings, a close estimate of the result payload)
+    - time spent in fetch calls
+
+Calls slower than LEGOS_SLOW_QUERY_MS (default 100) are appended to the
+slow-query log, LEGOS_SLOW_QUERY_LOG (default: stderr), one JSON object
+per line. Set LEGOS_STATS_OUT to a file path to have the stats written
+there when the process exits (Prometheus text if the path ends in .prom,
+JSON otherwise). Set LEGOS_INSTRUMENT=0 to turn all of this off.
+
+The admin app shows the stats under menu option [d].
+"""
+
+import atexit
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+# Histogram bucket upper bounds, in milliseconds.
+BUCKETS_MS = (0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+              float("inf"))
+
+SLOW_QUERY_MS = float(os.environ.get("LEGOS_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("LEGOS_SLOW_QUERY_LOG")
+
+# Literals to strip from SQL text: quoted strings, then numbers.
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(sql):
+    """
+    Returns the statement text used to group calls: whitespace collapsed
+    and literals replaced with ?, so calls differing only in their values
+    are counted together.
+    """
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8", "replace")
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _value_bytes(value):
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return len(str(value))
+
+
+def _row_bytes(row):
+    if isinstance(row, dict):
+        row = row.values()
+    return sum(_value_bytes(value) for value in row)
+
+
+# ----------------------------------------------------------------------
+# Statistics
+# ----------------------------------------------------------------------
+class StatementStats:
+    """
+    Counters and a latency histogram for one statement.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.rows = 0
+        self.bytes = 0
+        self.fetch_ms = 0.0
+
+    def percentile(self, p):
+        """
+        Estimates the p-th percentile as the upper bound of the bucket
+        holding it (capped at the slowest call seen).
+        """
+        if not self.calls:
+            return 0.0
+        rank = p / 100.0 * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": self.total_ms,
+            "mean_ms": self.total_ms / self.calls if self.calls else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "fetch_ms": self.fetch_ms,
+            "buckets": {str(bound): count for bound, count in zip(BUCKETS_MS, self.buckets)},
+        }
+
+
+class Registry:
+    """
+    Thread-safe collection of StatementStats, keyed by statement.
+    """
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_query_log=SLOW_QUERY_LOG):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+
+    def _get(self, statement):
+        stats = self._stats.get(statement)
+        if stats is None:
+            stats = self._stats[statement] = StatementStats()
+        return stats
+
+    def record_call(self, statement, elapsed_ms, error=None):
+        with self._lock:
+            stats = self._get(statement)
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.buckets[bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+            if error is not None:
+                stats.errors += 1
+        if elapsed_ms >= self.slow_query_ms or error is not None:
+            self._log(statement, elapsed_ms, error)
+
+    def record_fetch(self, statement, rows, num_bytes, elapsed_ms):
+        with self._lock:
+            stats = self._get(statement)
+            stats.rows += rows
+            stats.bytes += num_bytes
+            stats.fetch_ms += elapsed_ms
+
+    def _log(self, statement, elapsed_ms, error):
+        """
+        Appends a slow or failed call to the slow-query log.
+        """
+        entry = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "statement": statement,
+            "ms": round(elapsed_ms, 3),
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self.slow_query_log:
+                with open(self.slow_query_log, "a", encoding="utf-8") as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+
+    def snapshot(self):
+        """
+        Returns {statement: stats dict}, slowest total time first.
+        """
+        with self._lock:
+            items = [(statement, stats.to_dict()) for statement, stats in self._stats.items()]
+        items.sort(key=lambda item: item[1]["total_ms"], reverse=True)
+        return dict(items)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Returns the stats in the Prometheus text exposition format.
+        """
+        def label(statement):
+            return statement.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        lines = [
+            "# HELP legos_statement_duration_seconds Time spent in execute/callproc.",
+            "# TYPE legos_statement_duration_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        for statement, stats in snapshot.items():
+            cumulative = 0
+            for bound, count in stats["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == "inf" else repr(float(bound) / 1000)
+                lines.append('legos_statement_duration_seconds_bucket{{statement="{s}",le="{le}"}} '
+                             '{n}'.format(s=label(statement), le=le, n=cumulative))
+            lines.append('legos_statement_duration_seconds_sum{{statement="{s}"}} {v}'.format(
+                s=label(statement), v=stats["total_ms"] / 1000))
+            lines.append('legos_statement_duration_seconds_count{{statement="{s}"}} {v}'.format(
+                s=label(statement), v=stats["calls"]))
+
+        for (name, key, help_text) in (
+                ("legos_statement_errors_total", "errors", "Failed calls."),
+                ("legos_statement_rows_total", "rows", "Rows fetched."),
+                ("legos_statement_bytes_total", "bytes", "Approximate bytes fetched.")):
+            lines.append("# HELP {name} {help}".format(name=name, help=help_text))
+            lines.append("# TYPE {name} counter".format(name=name))
+            for statement, stats in snapshot.items():
+                lines.append('{name}{{statement="{s}"}} {v}'.format(
+                    name=name, s=label(statement), v=stats[key]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the stats to path: Prometheus text for .prom, else JSON.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+
+REGISTRY = Registry()
+
+
+# ----------------------------------------------------------------------
+# Cursor Wrappers
+# ----------------------------------------------------------------------
+class _FetchCounter:
+    """
+    Counts the rows and bytes fetched from a cursor (or a stored result of
+    a callproc) against the statement that produced them.
+    """
+
+    def __init__(self, cursor, registry):
+        self._cursor = cursor
+        self._registry = registry
+        self._statement = None
+
+    def _fetched(self, rows, start):
+        if self._statement is not None and rows:
+            self._registry.record_fetch(self._statement, len(rows),
+                                        sum(_row_bytes(row) for row in rows),
+                                        (time.perf_counter() - start) * 1000)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched([row] if row is not None else [], start)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched(rows, start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(rows, start)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedCursor(_FetchCounter):
+    """
+    Wraps a mysql.connector cursor, timing execute, executemany and
+    callproc. Everything else is passed through to the real cursor.
+    """
+
+    def _timed(self, statement, fn, *args, **kwargs):
+        self._statement = statement
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as err:
+            self._registry.record_call(statement, (time.perf_counter() - start) * 1000, err)
+            raise
+        self._registry.record_call(statement, (time.perf_counter() - start) * 1000)
+        return result
+
+    def execute(self, operation, *args, **kwargs):
+        return self._timed(normalize(operation), self._cursor.execute, operation,
+                           *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        return self._timed(normalize(operation), self._cursor.executemany, operation,
+                           *args, **kwargs)
+
+    def callproc(self, procname, *args, **kwargs):
+        return self._timed("CALL " + procname, self._cursor.callproc, procname,
+                           *args, **kwargs)
+
+    def stored_results(self):
+        for result in self._cursor.stored_results():
+            counter = _FetchCounter(result, self._registry)
+            counter._statement = self._statement
+            yield counter
+
+
+def install(pool, registry=REGISTRY):
+    """
+    Makes every connection the pool opens from now on hand out
+    instrumented cursors.
+    """
+    def instrument(conn):
+        make_cursor = conn.cursor
+
+        def cursor(*args, **kwargs):
+            return InstrumentedCursor(make_cursor(*args, **kwargs), registry)
+        conn.cursor = cursor
+
+    pool.on_connect.append(instrument)
+
+
+def enabled():
+    return os.environ.get("LEGOS_INSTRUMENT", "1") != "0"
+
+
+if enabled() and os.environ.get("LEGOS_STATS_OUT"):
+    atexit.register(REGISTRY.write, os.environ["LEGOS_STATS_OUT"])
@@ -0,0 +1,76 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Stock reservation for purchases.
+
+The make_purchase procedure reserves stock with a conditional decrement
+(quantity > 0), so the check and the decrement can't be split by another
+buyer and quantities never go negative. Out of stock is reported by the
+purchase itself rather than by a separate check beforehand.
+
+Transactions that hit a deadlock or lock-wait timeout are rolled back and
+retried a bounded number of times with jittered backoff.
+"""
+
+import collections
+import random
+import time
+
+import db
+
+# Errors that mean "try the whole transaction again": MySQL's
+# ER_LOCK_DEADLOCK and ER_LOCK_WAIT_TIMEOUT.
+RETRYABLE_ERRORS = (1213, 1205)
+
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.05
+
+# status is "OK" or "OUT_OF_STOCK"; purchase_id is None unless OK.
+PurchaseResult = collections.namedtuple("PurchaseResult", ["status", "purchase_id", "retries"])
+
+
+def retry_transaction(work, pool=None, max_retries=MAX_RETRIES):
+    """
+    Runs work(conn) on a borrowed connection, retrying the whole
+    transaction on deadlocks and lock-wait timeouts. A connection that
+    breaks is discarded, and the next attempt borrows another.
+    work is responsible for committing. Returns (work's result, retries).
+    """
+    pool = pool or db.get_pool()
+    attempt = 0
+    while True:
+        conn = pool.acquire()
+        broken = False
+        try:
+            return work(conn), attempt
+        except db.Error as err:
+            broken = isinstance(err, (db.OperationalError, db.InterfaceError))
+            try:
+                conn.rollback()
+            except db.Error:
+                # The connection is gone. Drop it, and go on with the
+                # original error rather than the rollback's.
+                broken = True
+            if err.errno not in RETRYABLE_ERRORS or attempt >= max_retries:
+                raise
+        finally:
+            pool.release(conn, broken)
+        attempt += 1
+        time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt) * random.random())
+
+
+def purchase(username, product_id, pool=None, max_retries=MAX_RETRIES):
+    """
+    Buys one of product_id for the given customer.
+    Returns a PurchaseResult; raises db.Error if the purchase
+    fails for any reason other than being out of stock.
+    """
+    def work(conn):
+        cursor = conn.cursor()
+        result = cursor.callproc("make_purchase", [product_id, username, 0, ""])
+        conn.commit()
+        return result
+
+    result, retries = retry_transaction(work, pool, max_retries)
+    return PurchaseResult(result[3], result[2], retries)
@@ -31,16 +31,19 @@ LOAD DATA LOCAL INFILE 'themes.csv' INTO TABLE themes
 FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n';
 
 LOAD DATA LOCAL INFILE 'lego_sets.csv' INTO TABLE lego_sets
-FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n';
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n'
+(product_id, num_parts, time_to_complete, year_released, theme_id);
 
 LOAD DATA LOCAL INFILE 'lego_parts.csv' INTO TABLE lego_parts
 FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n';
 
 LOAD DATA LOCAL INFILE 'requests.csv' INTO TABLE requests
-FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n';
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n'
+(request_id, product_id, customer_username, request_status);
 
 LOAD DATA LOCAL INFILE 'purchases.csv' INTO TABLE purchases
 FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n';
 
 LOAD DATA LOCAL INFILE 'reviews.csv' INTO TABLE reviews
-FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES TERMINATED BY '\r\n';
\ No newline at end of file
+FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES TERMINATED BY '\r\n'
+(purchase_id, customer_username, review_time, rating, review);
\ No newline at end of file
@@ -0,0 +1,363 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Bulk loader for the lego store CSV files. Replaces load-data.sql, which
+needs LOAD DATA LOCAL INFILE (disabled on many servers) and a different
+line-ending setting for each file.
+
+Each CSV is streamed in chunks, every row is validated and coerced to its
+column type, and chunks are inserted with multi-row INSERT statements.
+Tables that don't depend on each other are loaded in parallel, in the
+foreign-key order from setup.sql. Memory use depends on the chunk size,
+not the file size.
+
+Run it after setup.sql, in place of load-data.sql:
+
+    $ python3 load_data.py [--dir .] [--workers 4] [--chunk-size 5000]
+                           [--truncate] [--rejects rejects.csv]
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import decimal
+import os
+import sys
+import threading
+import time
+
+import db
+
+
+# ----------------------------------------------------------------------
+# Column Types
+# ----------------------------------------------------------------------
+# Each coercer turns one CSV field into a Python value for its column,
+# or raises ValueError with the reason the row is rejected.
+NULLS = ("", "\\N", "NULL")
+
+
+def integer(low=None, high=None, nullable=False):
+    def coerce(value):
+        if value in NULLS:
+            if nullable:
+                return None
+            raise ValueError("missing integer")
+        number = int(value)
+        if (low is not None and number < low) or (high is not None and number > high):
+            raise ValueError("{n} is out of range".format(n=number))
+        return number
+    return coerce
+
+
+def numeric(precision, scale):
+    limit = decimal.Decimal(10) ** (precision - scale)
+
+    def coerce(value):
+        try:
+            number = decimal.Decimal(value).quantize(decimal.Decimal(1).scaleb(-scale))
+        except decimal.InvalidOperation:
+            raise ValueError("{v!r} is not a number".format(v=value))
+        if abs(number) >= limit:
+            raise ValueError("{n} does not fit NUMERIC({p}, {s})".format(
+                n=number, p=precision, s=scale))
+        return number
+    return coerce
+
+
+def string(max_length, nullable=False, choices=None):
+    def coerce(value):
+        if value in NULLS and nullable:
+            return None
+        if len(value) > max_length:
+            raise ValueError("longer than {n} characters".format(n=max_length))
+        if choices is not None and value not in choices:
+            raise ValueError("{v!r} is not one of {c}".format(v=value, c=", ".join(choices)))
+        return value
+    return coerce
+
+
+def timestamp(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+# ----------------------------------------------------------------------
+# Table Definitions (mirrors setup.sql)
+# ----------------------------------------------------------------------
+# table -> (csv file, [(column, coercer)], tables it references)
+TABLES = {
+    "employees": ("employees.csv", [
+        ("employee_username", string(50)),
+        ("employee_name", string(100)),
+        ("employee_permissions", string(2, choices=("R", "W", "RW"))),
+    ], []),
+    "discounts": ("discounts.csv", [
+        ("member_type", string(1, choices=("V", "R"))),
+        ("discount_amount", integer(0, 100)),
+    ], []),
+    "customers": ("customers.csv", [
+        ("customer_username", string(50)),
+        ("customer_name", string(100)),
+        ("customer_email", string(50)),
+        ("member_type", string(1, nullable=True, choices=("V", "R"))),
+    ], ["discounts"]),
+    "product_inventory": ("product_inventory.csv", [
+        ("product_id", integer()),
+        ("product_price", numeric(6, 2)),
+        ("product_name", string(255)),
+        ("quantity", integer()),
+    ], []),
+    "categories": ("categories.csv", [
+        ("category_id", integer()),
+        ("category_name", string(100)),
+    ], []),
+    "themes": ("themes.csv", [
+        ("theme_id", integer()),
+        ("theme_name", string(70)),
+        ("parent_id", integer(nullable=True)),
+    ], []),
+    "lego_sets": ("lego_sets.csv", [
+        ("product_id", integer()),
+        ("num_parts", integer()),
+        ("time_to_complete", integer()),
+        ("year_released", integer(1901, 2155)),
+        ("theme_id", integer(nullable=True)),
+    ], ["product_inventory", "themes"]),
+    "lego_parts": ("lego_parts.csv", [
+        ("product_id", integer()),
+        ("category_id", integer(nullable=True)),
+    ], ["product_inventory", "categories"]),
+    "requests": ("requests.csv", [
+        ("request_id", integer(1)),
+        ("product_id", integer(nullable=True)),
+        ("customer_username", string(50, nullable=True)),
+        ("request_status", string(1, choices=("F", "P", "U"))),
+    ], ["product_inventory", "customers"]),
+    "purchases": ("purchases.csv", [
+        ("purchase_id", integer(1)),
+        ("product_id", integer(nullable=True)),
+        ("customer_username", string(50, nullable=True)),
+        ("purchase_item_total", numeric(6, 2)),
+        ("purchase_time", timestamp),
+    ], ["product_inventory", "customers"]),
+    "reviews": ("reviews.csv", [
+        ("purchase_id", integer(1)),
+        ("customer_username", string(50, nullable=True)),
+        ("review_time", timestamp),
+        ("rating", integer(1, 5)),
+        ("review", string(500, nullable=True)),
+    ], ["purchases", "customers"]),
+}
+
+
+def load_levels(tables):
+    """
+    Groups tables into levels so that every table's references are
+    loaded in an earlier level. Tables in the same level are independent.
+    """
+    levels = []
+    done = set()
+    remaining = set(tables)
+    while remaining:
+        level = sorted(t for t in remaining if set(tables[t][2]) & set(tables) <= done)
+        if not level:
+            raise ValueError("circular references between " + ", ".join(sorted(remaining)))
+        levels.append(level)
+        done.update(level)
+        remaining.difference_update(level)
+    return levels
+
+
+# ----------------------------------------------------------------------
+# Loading
+# ----------------------------------------------------------------------
+class Rejects:
+    """
+    Collects rejected rows, optionally writing them to a CSV file.
+    Shared by all loader threads.
+    """
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._file = open(path, "w", newline="", encoding="utf-8") if path else None
+        self._writer = csv.writer(self._file) if self._file else None
+        if self._writer:
+            self._writer.writerow(["table", "line", "reason", "row"])
+
+    def add(self, table, line, reason, row):
+        with self._lock:
+            if self._writer:
+                self._writer.writerow([table, line, reason, ",".join(row)])
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def read_rows(path, columns, table, rejects):
+    """
+    Streams coerced rows from a CSV file.
+    Returns (generator of row tuples, stats dict). Rejected rows are
+    reported and skipped, and counted in stats["rejected"].
+    """
+    stats = {"rejected": 0}
+
+    def rows():
+        # newline="" lets the csv module handle both \r\n and \n files.
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for line, row in enumerate(csv.reader(f), start=1):
+                if not row:
+                    continue
+                try:
+                    if len(row) != len(columns):
+                        raise ValueError("expected {n} fields, found {m}".format(
+                            n=len(columns), m=len(row)))
+                    yield tuple(coerce(value) for value, (_, coerce) in zip(row, columns))
+                except ValueError as err:
+                    stats["rejected"] += 1
+                    rejects.add(table, line, str(err), row)
+
+    return rows(), stats
+
+
+def load_table(pool, directory, table, chunk_size, rejects):
+    """
+    Loads one table from its CSV file in chunks, committing each chunk.
+    Returns (table, rows loaded, rows rejected, seconds).
+    """
+    (filename, columns, _) = TABLES[table]
+    sql = "INSERT INTO {table} ({cols}) VALUES ({params})".format(
+        table=table,
+        cols=", ".join(name for (name, _) in columns),
+        params=", ".join(["%s"] * len(columns)))
+
+    start = time.perf_counter()
+    loaded = 0
+    rows, stats = read_rows(os.path.join(directory, filename), columns, table, rejects)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                # executemany sends a single multi-row INSERT per chunk.
+                cursor.executemany(sql, chunk)
+                conn.commit()
+                loaded += len(chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany(sql, chunk)
+            conn.commit()
+            loaded += len(chunk)
+    return (table, loaded, stats["rejected"], time.perf_counter() - start)
+
+
+def truncate(pool, tables):
+    """
+    Empties the given tables, most-dependent first.
+    """
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        for level in reversed(load_levels(tables)):
+            for table in level:
+                cursor.execute("DELETE FROM {table}".format(table=table))
+        conn.commit()
+
+
+# Routine -> (its arguments, the tables it recomputes from). bump_catalog_version
+# has no sources and always runs.
+DERIVED = [
+    ("rebuild_rating_summary", [1, 0], {"purchases", "reviews"}),
+    ("rebuild_revenue_ledger", [], {"purchases"}),
+    ("rebuild_theme_closure", [], {"themes"}),
+    ("refresh_reports", [1, 0, 0, 0], {"purchases", "reviews", "lego_sets"}),
+    ("bump_catalog_version", [], None),
+]
+
+
+def rebuild_derived(pool, tables):
+    """
+    Rebuilds the trigger-maintained summary tables fed by the loaded
+    tables, if setup-routines.sql has been run, since bulk loads may
+    bypass or predate the triggers. The others are left alone: after
+    partitions.py archive, the revenue, rating and report rebuilds refuse
+    to run, since they would drop the archived months.
+    """
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ROUTINE_NAME FROM information_schema.ROUTINES "
+                       "WHERE ROUTINE_SCHEMA=DATABASE()")
+        routines = {row[0] for row in cursor.fetchall()}
+        for (routine, args, sources) in DERIVED:
+            if routine not in routines or (sources is not None and not sources & set(tables)):
+                continue
+            cursor.callproc(routine, args)
+            for stored in cursor.stored_results():
+                stored.fetchall()
+        conn.commit()
+
+
+def load_all(pool, directory, tables, workers, chunk_size, rejects):
+    """
+    Loads the given tables level by level, in parallel within a level.
+    Returns a list of (table, loaded, rejected, seconds).
+    """
+    report = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for level in load_levels(tables):
+            futures = [executor.submit(load_table, pool, directory, table, chunk_size, rejects)
+                       for table in level]
+            for future in futures:
+                report.append(future.result())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the lego store CSV files.")
+    parser.add_argument("--dir", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory holding the CSV files")
+    parser.add_argument("--tables", help="comma-separated subset of tables to load")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--truncate", action="store_true",
+                        help="empty the tables before loading (for reloads)")
+    parser.add_argument("--rejects", help="write rejected rows to this CSV file")
+    args = parser.parse_args()
+
+    tables = {name: TABLES[name] for name in
+              (args.tables.split(",") if args.tables else TABLES)}
+    pool = db.ConnectionPool(size=args.workers)
+    rejects = Rejects(args.rejects)
+
+    start = time.perf_counter()
+    try:
+        if args.truncate:
+            truncate(pool, tables)
+        report = load_all(pool, args.dir, tables, args.workers, args.chunk_size, rejects)
+        rebuild_derived(pool, tables)
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        rejects.close()
+        pool.close()
+    elapsed = time.perf_counter() - start
+
+    print("{:<20} {:>10} {:>10} {:>10} {:>12}".format(
+        "table", "loaded", "rejected", "seconds", "rows/sec"))
+    for (table, loaded, rejected, seconds) in report:
+        print("{:<20} {:>10} {:>10} {:>10.2f} {:>12.0f}".format(
+            table, loaded, rejected, seconds, loaded / seconds if seconds else 0))
+    total_loaded = sum(r[1] for r in report)
+    total_rejected = sum(r[2] for r in report)
+    print("\nLoaded {n} rows ({r} rejected) in {s:.2f}s, {rate:.0f} rows/sec.".format(
+        n=total_loaded, r=total_rejected, s=elapsed,
+        rate=total_loaded / elapsed if elapsed else 0))
+    if total_rejected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
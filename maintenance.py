@@ -0,0 +1,119 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Command-line maintenance tasks for the lego store database.
+
+    $ python3 maintenance.py rating-summary          (report drift only)
+    $ python3 maintenance.py rating-summary --fix    (report and rebuild)
+    $ python3 maintenance.py revenue-ledger          (rebuild the revenue rollup)
+    $ python3 maintenance.py theme-closure           (rebuild theme hierarchy)
+
+Once partitions.py archive has moved months out of purchases and reviews,
+the rating summary and revenue ledger can't be rebuilt (the database
+refuses), since the archived months would drop out of them.
+"""
+
+import argparse
+import sys
+
+import db
+
+
+# ----------------------------------------------------------------------
+# Rating Summary
+# ----------------------------------------------------------------------
+def rating_summary(args):
+    """
+    Recomputes product_rating_summary from reviews and reports every
+    product whose stored totals have drifted. Rebuilds it with --fix.
+    """
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        result = cursor.callproc("rebuild_rating_summary", [1 if args.fix else 0, 0])
+        drifted = result[1]
+
+        for stored in cursor.stored_results():
+            for row in stored.fetchall():
+                (product_id, stored_count, actual_count, stored_sum, actual_sum) = row
+                print("Product #{id}: stored {sc} reviews / {ss} stars, "
+                      "actual {ac} reviews / {as_} stars.".format(
+                          id=product_id, sc=stored_count, ss=stored_sum,
+                          ac=actual_count, as_=actual_sum))
+        conn.commit()
+
+    print("\n{n} product(s) had drifted.".format(n=drifted))
+    if args.fix and drifted:
+        print("The rating summary has been rebuilt.")
+    return 1 if drifted and not args.fix else 0
+
+
+# ----------------------------------------------------------------------
+# Revenue Ledger
+# ----------------------------------------------------------------------
+def revenue_ledger(args):
+    """
+    Rebuilds the daily revenue rollup and the sharded all-time total from
+    purchases and reports how far the total had drifted.
+    """
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        before = cursor.callproc("show_total_revenue", [0])[0]
+        cursor.callproc("rebuild_revenue_ledger", [])
+        after = cursor.callproc("show_total_revenue", [0])[0]
+        conn.commit()
+
+    print("Total revenue before rebuild: ${before}.".format(before=before))
+    print("Total revenue after rebuild:  ${after}.".format(after=after))
+    if before != after:
+        print("The ledger had drifted by ${diff}.".format(diff=after - before))
+    return 0
+
+
+# ----------------------------------------------------------------------
+# Theme Hierarchy
+# ----------------------------------------------------------------------
+def theme_closure(args):
+    """
+    Rebuilds theme_closure from themes.parent_id, e.g. after themes are
+    added or moved.
+    """
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.callproc("rebuild_theme_closure", [])
+        cursor.execute("SELECT COUNT(*), MAX(depth) FROM theme_closure")
+        (pairs, depth) = cursor.fetchone()
+        conn.commit()
+
+    print("theme_closure rebuilt: {n} (ancestor, descendant) pairs, "
+          "at most {d} level(s) deep.".format(n=pairs, d=depth))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lego store maintenance tasks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("rating-summary",
+                              help="verify (and optionally rebuild) product_rating_summary")
+    cmd.add_argument("--fix", action="store_true", help="rebuild the summary")
+    cmd.set_defaults(func=rating_summary)
+
+    cmd = commands.add_parser("revenue-ledger",
+                              help="rebuild the revenue rollup from purchases")
+    cmd.set_defaults(func=revenue_ledger)
+
+    cmd = commands.add_parser("theme-closure",
+                              help="rebuild the theme hierarchy table from themes")
+    cmd.set_defaults(func=theme_closure)
+
+    args = parser.parse_args()
+    try:
+        sys.exit(args.func(args))
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
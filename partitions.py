@@ -0,0 +1,431 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Monthly partitions of purchases and reviews, and their cold archive.
+
+After setup-partitions.sql, purchases and reviews are RANGE partitioned
+by month on purchase_time / review_time: partition p201802 holds February
+2018 (UTC), and p_future everything past the last month. A query on a
+time range, like the last 30 days of purchases, only reads the partitions
+it covers.
+
+    $ python3 partitions.py status             (partitions, rows, pruning check)
+    $ python3 partitions.py roll [--ahead 3]   (add months up to 3 ahead)
+    $ python3 partitions.py archive --older-than 24 [--out archive] [--dry-run]
+
+roll splits p_future into the months from the oldest row (or the last
+month partition) through --ahead months from now; run it monthly, so new
+rows never land in p_future.
+
+archive detaches every month that ended more than --older-than months ago
+and writes it to a compressed columnar file, keeping the live tables small
+enough to stay in the buffer pool. Each month is exchanged into a plain
+table (purchases_p201802), which is instant, and its now empty partition
+dropped; the table is then streamed to archive/purchases-p201802.zip and
+dropped. A failed run leaves the detached table behind, and the next run
+picks up where it stopped, so rows are never lost in between.
+
+An archive holds one zip member per column, so a column can be read
+without the others: <column>.jsonl has one JSON value per row, in
+primary-key order, and meta.json the table, month, column types and row
+count. read_archive() reads one back.
+
+The rollups and reports (revenue_product_daily, product_rating_summary, the
+report tables) already count archived rows and keep them. Each archived
+month is recorded in archived_partitions, and while it has rows the
+routines that rebuild those from the live tables (maintenance.py,
+reports.py --rebuild, load_data.py after loading purchases or reviews)
+refuse to, rather than drop the archived months.
+"""
+
+import argparse
+import calendar
+import datetime
+import decimal
+import json
+import os
+import re
+import sys
+import zipfile
+
+import backends
+import db
+
+# Partitioned table -> the TIMESTAMP column it is partitioned by.
+TABLES = {
+    "purchases": "purchase_time",
+    "reviews": "review_time",
+}
+
+MONTHS_AHEAD = 3
+ARCHIVE_DIR = "archive"
+
+# Rows read at a time while streaming a column out.
+CHUNK_SIZE = backends.STREAM_CHUNK
+
+FUTURE = "p_future"
+_MONTH_PARTITION = re.compile(r"^p(\d{4})(\d{2})$")
+
+
+# ----------------------------------------------------------------------
+# Months
+# ----------------------------------------------------------------------
+def add_months(month, n):
+    """
+    Returns the first day of the month n months after month (a date on
+    the first of a month).
+    """
+    index = month.year * 12 + month.month - 1 + n
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_of(timestamp):
+    """
+    Returns the first day of the UTC month containing a Unix timestamp.
+    """
+    day = datetime.datetime.fromtimestamp(float(timestamp), datetime.timezone.utc).date()
+    return day.replace(day=1)
+
+
+def partition_name(month):
+    return "p{y:04d}{m:02d}".format(y=month.year, m=month.month)
+
+
+def partition_month(name):
+    """
+    Returns the month partition `name` holds, or None for p_future.
+    """
+    match = _MONTH_PARTITION.match(name)
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _this_month():
+    return datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+
+
+def _boundary(month):
+    # VALUES LESS THAN for a month: the Unix time its next month starts.
+    return calendar.timegm(add_months(month, 1).timetuple())
+
+
+# ----------------------------------------------------------------------
+# Partition Maintenance
+# ----------------------------------------------------------------------
+def partitions(cursor, table):
+    """
+    Returns [(partition name, estimated rows)] for table, oldest first,
+    or [] if it isn't partitioned (see setup-partitions.sql).
+    """
+    cursor.execute("SELECT partition_name, table_rows FROM information_schema.PARTITIONS "
+                   "WHERE table_schema=DATABASE() AND table_name=%s "
+                   "  AND partition_name IS NOT NULL "
+                   "ORDER BY partition_ordinal_position", (table, ))
+    return cursor.fetchall()
+
+
+def _require_partitioned(cursor, table):
+    names = [name for (name, _) in partitions(cursor, table)]
+    if not names:
+        raise ValueError("{table} isn't partitioned; run setup-partitions.sql first".format(
+            table=table))
+    return names
+
+
+def roll(cursor, table, ahead=MONTHS_AHEAD):
+    """
+    Splits p_future into month partitions, through `ahead` months after
+    this one. Returns the names of the partitions added.
+    """
+    this_month = _this_month()
+    names = _require_partitioned(cursor, table)
+    months = [partition_month(name) for name in names if partition_month(name)]
+    if months:
+        start = add_months(months[-1], 1)
+    else:
+        cursor.execute("SELECT MIN(UNIX_TIMESTAMP({column})) FROM {table}".format(
+            column=TABLES[table], table=table))
+        oldest = cursor.fetchone()[0]
+        start = month_of(oldest) if oldest is not None else this_month
+    end = add_months(this_month, ahead)
+
+    added = []
+    month = start
+    while month <= end:
+        added.append(month)
+        month = add_months(month, 1)
+    if not added:
+        return []
+
+    definitions = ["PARTITION {name} VALUES LESS THAN ({bound})".format(
+        name=partition_name(month), bound=_boundary(month)) for month in added]
+    definitions.append("PARTITION {future} VALUES LESS THAN MAXVALUE".format(future=FUTURE))
+    cursor.execute("ALTER TABLE {table} REORGANIZE PARTITION {future} INTO ({defs})".format(
+        table=table, future=FUTURE, defs=", ".join(definitions)))
+    return [partition_name(month) for month in added]
+
+
+def pruned_partitions(cursor, table, days=30):
+    """
+    Returns the partitions MySQL reads for "the last `days` days of"
+    table, as listed by EXPLAIN.
+    """
+    cursor.execute("EXPLAIN SELECT COUNT(*) FROM {table} "
+                   "WHERE {column}>=NOW() - INTERVAL {days} DAY".format(
+                       table=table, column=TABLES[table], days=int(days)))
+    row = dict(zip(cursor.column_names, cursor.fetchone()))
+    cursor.fetchall()
+    return row.get("partitions")
+
+
+# ----------------------------------------------------------------------
+# Archiving
+# ----------------------------------------------------------------------
+def detached_name(table, partition):
+    return "{table}_{partition}".format(table=table, partition=partition)
+
+
+def _table_exists(cursor, table):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES "
+                   "WHERE table_schema=DATABASE() AND table_name=%s", (table, ))
+    return cursor.fetchone()[0] > 0
+
+
+def _count(cursor, sql):
+    cursor.execute(sql)
+    return cursor.fetchone()[0]
+
+
+def detach(cursor, table, partition):
+    """
+    Moves the rows of one month partition into their own table and drops
+    the partition. Safe to run again after a failure part way through.
+    Returns the detached table's name.
+    """
+    detached = detached_name(table, partition)
+    if not _table_exists(cursor, detached):
+        # LIKE copies the partitioning too, which EXCHANGE doesn't allow.
+        cursor.execute("CREATE TABLE {detached} LIKE {table}".format(
+            detached=detached, table=table))
+    if partitions(cursor, detached):
+        cursor.execute("ALTER TABLE {detached} REMOVE PARTITIONING".format(detached=detached))
+
+    if partition in _require_partitioned(cursor, table):
+        # The detached table only ever gets rows from the exchange, so if
+        # it has some, the exchange has already happened.
+        if _count(cursor, "SELECT COUNT(*) FROM {detached}".format(detached=detached)) == 0:
+            cursor.execute("ALTER TABLE {table} EXCHANGE PARTITION {partition} "
+                           "WITH TABLE {detached}".format(
+                               table=table, partition=partition, detached=detached))
+        late = _count(cursor, "SELECT COUNT(*) FROM {table} PARTITION ({partition})".format(
+            table=table, partition=partition))
+        if late:
+            raise ValueError("{n} row(s) were added to {table} {partition} after it was "
+                             "detached; archive {detached} and run again".format(
+                                 n=late, table=table, partition=partition, detached=detached))
+        cursor.execute("ALTER TABLE {table} DROP PARTITION {partition}".format(
+            table=table, partition=partition))
+    return detached
+
+
+def _columns(cursor, table):
+    cursor.execute("SELECT column_name, data_type FROM information_schema.COLUMNS "
+                   "WHERE table_schema=DATABASE() AND table_name=%s "
+                   "ORDER BY ordinal_position", (table, ))
+    return cursor.fetchall()
+
+
+def _primary_key(cursor, table):
+    cursor.execute("SELECT column_name FROM information_schema.KEY_COLUMN_USAGE "
+                   "WHERE table_schema=DATABASE() AND table_name=%s "
+                   "  AND constraint_name='PRIMARY' ORDER BY ordinal_position", (table, ))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _json_value(value):
+    if isinstance(value, (decimal.Decimal, datetime.date, datetime.datetime)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8")
+    return value
+
+
+def write_archive(cursor, table, partition, detached, path):
+    """
+    Streams the detached table to a columnar zip at path, one column at a
+    time, and returns the number of rows written.
+    """
+    columns = _columns(cursor, detached)
+    key = _primary_key(cursor, detached)
+    num_rows = _count(cursor, "SELECT COUNT(*) FROM {detached}".format(detached=detached))
+
+    partial = path + ".partial"
+    with zipfile.ZipFile(partial, "w", zipfile.ZIP_DEFLATED) as archive:
+        for (column, _) in columns:
+            written = 0
+            with archive.open(column + ".jsonl", "w") as member:
+                cursor.execute("SELECT {column} FROM {detached} ORDER BY {key}".format(
+                    column=column, detached=detached, key=", ".join(key)))
+                while True:
+                    rows = cursor.fetchmany(CHUNK_SIZE)
+                    if not rows:
+                        break
+                    member.write("".join(json.dumps(_json_value(row[0])) + "\n"
+                                         for row in rows).encode("utf-8"))
+                    written += len(rows)
+            if written != num_rows:
+                raise ValueError("{detached}.{column}: wrote {w} of {n} rows".format(
+                    detached=detached, column=column, w=written, n=num_rows))
+        meta = {
+            "table": table,
+            "partition": partition,
+            "month": str(partition_month(partition)),
+            "rows": num_rows,
+            "order": key,
+            "columns": [{"name": column, "type": data_type} for (column, data_type) in columns],
+        }
+        archive.writestr("meta.json", json.dumps(meta, indent=2))
+    os.replace(partial, path)
+    return num_rows
+
+
+def archive(cursor, older_than, out_dir=ARCHIVE_DIR, dry_run=False):
+    """
+    Detaches and archives the months that ended more than older_than
+    months before this one began, and finishes any earlier run that
+    stopped part way. Returns [(table, partition, rows, path)], with rows
+    None for a dry run of an already detached month.
+    """
+    cutoff = add_months(_this_month(), -older_than)
+    if not dry_run:
+        os.makedirs(out_dir, exist_ok=True)
+
+    archived = []
+    for table in TABLES:
+        names = _require_partitioned(cursor, table)
+        old = [name for name in names if partition_month(name) and partition_month(name) < cutoff]
+        # Tables left detached by a run that stopped part way.
+        cursor.execute("SELECT table_name FROM information_schema.TABLES "
+                       "WHERE table_schema=DATABASE() AND table_name LIKE %s",
+                       (table + "\\_p%", ))
+        for (detached, ) in cursor.fetchall():
+            partition = detached[len(table) + 1:]
+            if partition_month(partition) and partition not in old:
+                old.append(partition)
+
+        for partition in sorted(old):
+            path = os.path.join(out_dir, "{table}-{partition}.zip".format(
+                table=table, partition=partition))
+            if dry_run:
+                rows = _count(cursor, "SELECT COUNT(*) FROM {table} PARTITION ({partition})".format(
+                    table=table, partition=partition)) if partition in names else None
+                archived.append((table, partition, rows, path))
+                continue
+            detached = detach(cursor, table, partition)
+            rows = write_archive(cursor, table, partition, detached, path)
+            # Committed by the DROP TABLE, which MySQL commits before.
+            cursor.execute("INSERT INTO archived_partitions (table_name, partition_name, num_rows) "
+                           "VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE num_rows=VALUES(num_rows)",
+                           (table, partition, rows))
+            cursor.execute("DROP TABLE {detached}".format(detached=detached))
+            archived.append((table, partition, rows, path))
+    return archived
+
+
+_DECODERS = {
+    "decimal": decimal.Decimal,
+    "timestamp": lambda value: datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S"),
+    "datetime": lambda value: datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S"),
+    "date": lambda value: datetime.datetime.strptime(value, "%Y-%m-%d").date(),
+}
+
+
+def read_archive(path, columns=None):
+    """
+    Returns (meta, {column: [values]}) for an archive, reading only the
+    given columns (default: all of them).
+    """
+    with zipfile.ZipFile(path) as archive:
+        meta = json.loads(archive.read("meta.json"))
+        types = {column["name"]: column["type"] for column in meta["columns"]}
+        values = {}
+        for column in columns or list(types):
+            decode = _DECODERS.get(types[column])
+            with archive.open(column + ".jsonl") as member:
+                values[column] = [
+                    decode(value) if decode and value is not None else value
+                    for value in (json.loads(line) for line in member)]
+    return meta, values
+
+
+# ----------------------------------------------------------------------
+# Command Line
+# ----------------------------------------------------------------------
+def status_command(cursor, args):
+    for table in TABLES:
+        rows = partitions(cursor, table)
+        if not rows:
+            print("{table}: not partitioned.".format(table=table))
+            continue
+        print("{table}: {n} partition(s), about {r} row(s).".format(
+            table=table, n=len(rows), r=sum(count or 0 for (_, count) in rows)))
+        for (name, count) in rows:
+            print("  {name:<10} ~{count} row(s)".format(name=name, count=count or 0))
+        print("  Last 30 days read: {parts}".format(parts=pruned_partitions(cursor, table)))
+    return 0
+
+
+def roll_command(cursor, args):
+    for table in TABLES:
+        added = roll(cursor, table, args.ahead)
+        print("{table}: added {n} partition(s){names}.".format(
+            table=table, n=len(added),
+            names=" ({0} to {1})".format(added[0], added[-1]) if added else ""))
+    return 0
+
+
+def archive_command(cursor, args):
+    archived = archive(cursor, args.older_than, args.out, args.dry_run)
+    for (table, partition, rows, path) in archived:
+        print("{verb} {table} {partition}: {rows} row(s) -> {path}".format(
+            verb="Would archive" if args.dry_run else "Archived", table=table,
+            partition=partition, rows="?" if rows is None else rows, path=path))
+    if not archived:
+        print("Nothing to archive.")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Maintain and archive the monthly partitions of purchases and reviews.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("status", help="list partitions and check pruning")
+    cmd.set_defaults(func=status_command)
+
+    cmd = commands.add_parser("roll", help="add month partitions")
+    cmd.add_argument("--ahead", type=int, default=MONTHS_AHEAD,
+                     help="months after this one to add (default {0})".format(MONTHS_AHEAD))
+    cmd.set_defaults(func=roll_command)
+
+    cmd = commands.add_parser("archive", help="detach and archive old months")
+    cmd.add_argument("--older-than", type=int, required=True, metavar="MONTHS",
+                     help="archive months that ended more than this many months ago")
+    cmd.add_argument("--out", default=ARCHIVE_DIR, help="archive directory")
+    cmd.add_argument("--dry-run", action="store_true", help="only list what would be archived")
+    cmd.set_defaults(func=archive_command)
+
+    args = parser.parse_args(argv)
+    try:
+        with db.connection() as conn:
+            sys.exit(args.func(conn.cursor(), args))
+    except ValueError as err:
+        print("Error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(1)
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Ranked search over product names ("2 x 4 brick", "millennium falcon").
+
+An inverted index is kept in memory: each word maps to the products whose
+name contains it (and how often). A query only looks at the products
+containing all of its words (or, if there are too few, any of them), and
+ranks them with BM25, which favours names containing more of the query's
+rarer words, and shorter names. The
+last word of a query, if it isn't a whole word, matches the words it
+starts, so "millen" finds "Millennium" while the customer is still typing.
+
+The index is built once from product_inventory (about 37k names, a second
+or so), then kept up to date incrementally: triggers add a row to
+product_changes whenever a product is added, renamed, repriced or
+deleted, and refresh() re-indexes only the products changed since the
+last change it saw. change_ids are numbered before their transactions
+commit, so refresh() tails the log the way change_feed.py does: it
+doesn't move past a missing change_id until it shows up (or
+change_feed.GAP_TIMEOUT passes), and re-reads the changes after it,
+skipping those already applied. Results can be limited to a maximum price (from the
+index) and to products in stock (checked in the database, since
+quantities change with every purchase).
+
+MySQL's FULLTEXT indexes would also work, but InnoDB's default tokenizer
+drops words shorter than three letters, which are exactly the "2", "x"
+and "4" in part names.
+"""
+
+import bisect
+import collections
+import math
+import re
+import threading
+import time
+
+import backends
+import catalog_cache
+import change_feed
+
+# BM25 parameters: term-frequency saturation and length normalization.
+K1 = 1.2
+B = 0.75
+
+# If the last word of a query isn't a word of any name, and has at least
+# MIN_PREFIX letters, it matches up to MAX_PREFIX_EXPANSIONS words starting
+# with it instead. Numbers aren't expanded: "400" shouldn't match "4005".
+MIN_PREFIX = 3
+MAX_PREFIX_EXPANSIONS = 20
+
+# Candidates are checked for stock this many at a time, best first.
+STOCK_BATCH = 50
+
+# With more pending changes than this, a full rebuild is cheaper.
+MAX_INCREMENTAL_CHANGES = 5000
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Returns the lowercased words of text. Single letters and digits are
+    kept, since part names are full of them ("Brick 2 x 4").
+    """
+    return _TOKEN.findall(text.lower())
+
+
+class ProductIndex:
+    """
+    BM25-ranked inverted index over product names, refreshed from the
+    product_changes log.
+    """
+
+    def __init__(self, backend=None, refresh_interval=5.0):
+        self.backend = backend or backends.get_backend()
+        self.refresh_interval = refresh_interval
+        # product_changes.change_id up to which every change is reflected
+        # in the index, or None before the first build, and the
+        # change_ids after it already applied.
+        self.last_change = None
+        self._applied = set()
+        self._gaps = change_feed.GapTimer()
+
+        self._lock = threading.RLock()
+        self._last_check = 0.0
+        # word -> {product_id: number of times the word is in the name}
+        self._postings = {}
+        # product_id -> (product_name, product_price, price in cents)
+        self._products = {}
+        # product_id -> Counter of its words, and how many words it has
+        self._terms = {}
+        self._lengths = {}
+        self._total_length = 0
+        # product_id -> BM25 length normalization, recomputed after changes
+        self._norms = None
+        # Sorted words with at least one posting, for prefix expansion.
+        self._vocabulary = []
+
+    # ------------------------------------------------------------------
+    # Building and refreshing
+    # ------------------------------------------------------------------
+    def _add(self, product_id, product_name, product_price):
+        terms = collections.Counter(tokenize(product_name))
+        self._products[product_id] = (product_name, product_price,
+                                      catalog_cache.to_cents(product_price))
+        self._terms[product_id] = terms
+        self._lengths[product_id] = sum(terms.values())
+        self._total_length += self._lengths[product_id]
+        for (term, count) in terms.items():
+            self._postings.setdefault(term, {})[product_id] = count
+
+    def _remove(self, product_id):
+        terms = self._terms.pop(product_id, None)
+        if terms is None:
+            return
+        del self._products[product_id]
+        self._total_length -= self._lengths.pop(product_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[product_id]
+            if not postings:
+                del self._postings[term]
+
+    def build(self):
+        """
+        (Re)builds the whole index from product_inventory.
+        """
+        # Read the change log first: changes made during the build are
+        # then applied again by the next refresh, which is harmless.
+        newest = self.backend.last_product_change()
+        recent = self.backend.product_changes(max(newest - change_feed.LOOKBACK, 0))
+        (last_change, applied) = change_feed.resume_point(
+            [change_id for (change_id, _) in recent])
+        rows = self.backend.catalog_products()
+        with self._lock:
+            self._postings = {}
+            self._products = {}
+            self._terms = {}
+            self._lengths = {}
+            self._total_length = 0
+            for (product_id, product_name, product_price) in rows:
+                self._add(product_id, product_name, product_price)
+            self._vocabulary = sorted(self._postings)
+            self._norms = None
+            self.last_change = last_change
+            self._applied = applied
+            self._last_check = time.monotonic()
+
+    def refresh(self, force=False):
+        """
+        Re-indexes the products changed since the last build or refresh.
+        Checks at most once every refresh_interval seconds unless forced.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.last_change is not None and not force \
+                    and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+            last_change = self.last_change
+
+        if last_change is None:
+            self.build()
+            return
+        changes = self.backend.product_changes(last_change)
+        if len(changes) > MAX_INCREMENTAL_CHANGES:
+            self.build()
+            return
+
+        # Move up to the first change_id still missing, and apply only the
+        # changes not applied by an earlier refresh.
+        (watermark, _) = change_feed.advance(
+            last_change, [change_id for (change_id, _) in changes], self._gaps.passed)
+        product_ids = sorted({product_id for (change_id, product_id) in changes
+                              if change_id not in self._applied})
+        # Deleted products are simply missing from the rows.
+        rows = self.backend.catalog_products(product_ids) if product_ids else []
+        with self._lock:
+            for product_id in product_ids:
+                self._remove(product_id)
+            for (product_id, product_name, product_price) in rows:
+                self._add(product_id, product_name, product_price)
+            if product_ids:
+                self._vocabulary = sorted(self._postings)
+                self._norms = None
+            self.last_change = watermark
+            self._applied = {change_id for (change_id, _) in changes if change_id > watermark}
+
+    def __len__(self):
+        return len(self._products)
+
+    # ------------------------------------------------------------------
+    # Searching
+    # ------------------------------------------------------------------
+    def _expand(self, prefix):
+        """
+        Returns the words the last word of a query matches: itself if it
+        is indexed, otherwise the indexed words starting with it.
+        """
+        if prefix in self._postings or len(prefix) < MIN_PREFIX or prefix.isdigit():
+            return [prefix]
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        words = self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]
+        return [word for word in words if word.startswith(prefix)]
+
+    def _length_norms(self):
+        """
+        Returns product_id -> K1 * (1 - B + B * length / average length),
+        the part of each product's BM25 weight that only depends on it.
+        """
+        if self._norms is None:
+            average_length = self._total_length / len(self._products)
+            self._norms = {product_id: K1 * (1 - B + B * length / average_length)
+                           for (product_id, length) in self._lengths.items()}
+        return self._norms
+
+    def _rank(self, query, max_cents, match_all):
+        """
+        Returns the IDs of the products matching query, best first. If
+        match_all, only products matching every word of query are ranked.
+        """
+        terms = tokenize(query)
+        if not terms or not self._products:
+            return []
+        num_products = len(self._products)
+        norms = self._length_norms()
+
+        # One slot per query word: [(postings, idf)] for the word, or for
+        # the expansions of the last word. A product scores the BM25
+        # weight of its best match in each slot.
+        slots = []
+        for (i, term) in enumerate(terms):
+            words = self._expand(term) if i == len(terms) - 1 else [term]
+            slot = []
+            for word in words:
+                postings = self._postings.get(word)
+                if postings:
+                    slot.append((postings, math.log(
+                        1 + (num_products - len(postings) + 0.5) / (len(postings) + 0.5))))
+            slots.append(slot)
+
+        # Scoring loops over candidates, so with match_all the common
+        # words ("x", "2") only cost a set intersection.
+        matches = [set().union(*(postings for (postings, _) in slot)) for slot in slots]
+        if match_all:
+            candidates = set.intersection(*sorted(matches, key=len))
+        else:
+            candidates = set().union(*matches)
+
+        scored = []
+        for product_id in candidates:
+            if max_cents is not None and self._products[product_id][2] > max_cents:
+                continue
+            norm = norms[product_id]
+            score = 0.0
+            for slot in slots:
+                best = 0.0
+                for (postings, idf) in slot:
+                    count = postings.get(product_id)
+                    if count:
+                        best = max(best, idf * count * (K1 + 1) / (count + norm))
+                score += best
+            scored.append((-score, product_id))
+        scored.sort()
+        return [product_id for (_, product_id) in scored]
+
+    def _top(self, query, max_cents, in_stock, k, match_all):
+        """
+        Returns up to k (product_id, product_name, product_price) rows for
+        _rank(), keeping only products in stock if in_stock.
+        """
+        with self._lock:
+            ranked = self._rank(query, max_cents, match_all)
+            products = {product_id: self._products[product_id][:2] for product_id in ranked}
+
+        if in_stock:
+            # Only the best candidates are checked, STOCK_BATCH at a time,
+            # until k in-stock products are found.
+            found = []
+            for start in range(0, len(ranked), STOCK_BATCH):
+                batch = ranked[start:start + STOCK_BATCH]
+                stocked = self.backend.in_stock(batch)
+                found.extend(product_id for product_id in batch if product_id in stocked)
+                if len(found) >= k:
+                    break
+            ranked = found
+        return [(product_id, ) + products[product_id] for product_id in ranked[:k]]
+
+    def search(self, query, max_price=None, in_stock=False, k=10):
+        """
+        Returns up to k (product_id, product_name, product_price) rows whose
+        names best match query, optionally costing at most max_price and
+        with at least one in stock. Products matching every word of query
+        come first; others are only ranked if there are fewer than k such.
+        """
+        self.refresh()
+        max_cents = None if max_price is None else catalog_cache.to_cents(max_price)
+        rows = self._top(query, max_cents, in_stock, k, True)
+        if len(rows) < k and len(tokenize(query)) > 1:
+            rows = self._top(query, max_cents, in_stock, k, False)
+        return rows
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the process-wide product index, built on first use.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ProductIndex()
+        return _index
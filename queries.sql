@@ -1,24 +1,22 @@
+-- The store's analytics, read from the materialized report tables (see
+-- refresh_reports in setup-routines.sql and reports.py). The refresh only
+-- adds the purchases, reviews and sets made since the last one.
+CALL refresh_reports(0, @new_purchases, @new_reviews, @new_sets);
+
 -- Computes the number of sets in each given theme.
-SELECT theme_name, 
-       COUNT(DISTINCT product_id) AS num_sets 
-       FROM themes NATURAL JOIN lego_sets
+SELECT theme_name, SUM(num_sets) AS num_sets
+FROM report_theme_sets JOIN themes ON (report_theme_sets.theme_id=themes.theme_id)
 GROUP BY theme_name
 ORDER BY theme_name;
 
 -- Computes the average rating for products that have received reviews.
-SELECT product_name, AVG(rating) AS avg_rating 
-  FROM reviews NATURAL LEFT JOIN 
-  purchases JOIN 
-  product_inventory ON (purchases.product_id=product_inventory.product_id)
+SELECT product_name, SUM(rating_sum) / SUM(review_count) AS avg_rating
+FROM report_product_ratings JOIN product_inventory
+  ON (report_product_ratings.product_id=product_inventory.product_id)
 GROUP BY product_name;
 
 -- Lists each customer and amount of money they have spent.
-SELECT customer_name, SUM(purchase_item_total) AS total_spent
-FROM customers LEFT JOIN purchases ON (customers.customer_username=purchases.customer_username)
-GROUP BY customer_name
+SELECT customer_name, total_spent
+FROM customers LEFT JOIN report_customer_spend
+  ON (customers.customer_username=report_customer_spend.customer_username)
 ORDER BY customer_name;
-
--- Decreases inventory of purchased items by 1 (i.e. when it's purchased).
-UPDATE product_inventory 
-SET quantity=quantity - 1
-WHERE product_id IN (SELECT product_id FROM purchases);
\ No newline at end of file
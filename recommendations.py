@@ -0,0 +1,719 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Item-to-item recommendations ("customers who bought this also liked"),
+precomputed into product_neighbors and served from an in-process cache.
+
+Two products are similar when the same customers bought them. Each
+product is a sparse vector over customers: 1 for a purchase, or rating/3
+once it is reviewed (so five stars count more than a purchase and one
+star less), and the similarity of two products is the cosine of their
+vectors. Sets in the same theme, or parts in the same category, get
+AFFINITY on top. Products with fewer than NEIGHBORS co-purchased
+neighbors are filled up with the most bought products of their theme or
+category, scored below AFFINITY, so new and rarely bought products still
+get recommendations.
+
+build() computes every list from scratch in bounded memory:
+  - purchases are streamed in customer order, so one customer's basket
+    (at most MAX_BASKET products of it) is held at a time,
+  - co-purchase sums are kept in a dict of at most MAX_PAIRS product
+    pairs, which is sorted and spilled to a temporary file when full; the
+    sorted runs are merged at the end, one pair at a time,
+  - each product keeps only its NEIGHBORS best pairs, in a heap.
+So it needs O(products * NEIGHBORS + MAX_PAIRS) memory however many
+purchases there are.
+
+build() also keeps every pair's sum in product_pair_sums and every
+product's norm in product_interaction_norms. update() folds the purchases
+and reviews made since then (past the watermarks in recommendation_state)
+into them as deltas: for each customer who made one, it compares their
+basket at the old and the new watermarks, and adds the difference to the
+sums of the pairs it changes and the norms of the products whose weight
+changed. Those products get their lists recomputed from their pair sums,
+and their new scores are merged into the lists of the products paired
+with them or holding them. So an update reads the new customers' baskets
+and the touched products' pairs, however many purchases came before.
+
+A product whose score against a touched product dropped keeps it where a
+full build might pick another neighbor instead, untouched products keep
+their fill-ins when their group's most bought products change, and
+purchases deleted or archived after they were counted stay in the sums,
+so run build() now and then (e.g. nightly) to make everything exact
+again. Like a
+change_feed.Subscriber, neither moves its watermarks past a purchase_id
+or review_seq still being committed; update() waits up to GAP_TIMEOUT
+seconds for one before taking it for rolled back.
+
+Recommender serves a product's list with one primary-key lookup on
+product_neighbors, and keeps it in an LRU until the lists' version
+changes.
+
+    $ python3 recommendations.py build
+    $ python3 recommendations.py update          (run often, e.g. from cron)
+    $ python3 recommendations.py show 10179
+
+With LEGOS_BACKEND=sqlite, set LEGOS_SQLITE_PATH so the lists outlive the
+process.
+"""
+
+import argparse
+import collections
+import heapq
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import backends
+import catalog_cache
+import change_feed
+import db
+
+# Neighbors kept per product.
+NEIGHBORS = 10
+
+# Bonus for sharing a theme (sets) or category (parts).
+AFFINITY = 0.05
+
+# Products counted per basket. Larger baskets keep their highest weighted
+# products, since a basket of n products has n * (n - 1) / 2 pairs.
+MAX_BASKET = 200
+
+# Product pairs summed in memory before spilling to a temporary file.
+MAX_PAIRS = 500000
+
+# Touched products recomputed together by update().
+UPDATE_CHUNK = 50
+
+CACHE_SIZE = 4096
+REFRESH_INTERVAL = 5.0
+
+# A spilled pair: (p << 32 | q with p < q, sum of weight products).
+_PAIR = struct.Struct("<qd")
+_READ_PAIRS = 4096
+
+
+# ----------------------------------------------------------------------
+# Weights and Scores
+# ----------------------------------------------------------------------
+def weight(rating):
+    """
+    Returns how much a purchase counts: 1, or rating/3 once reviewed.
+    """
+    return 1.0 if rating is None else rating / 3.0
+
+
+def basket(rows, watermarks=None):
+    """
+    Returns one customer's {product_id: weight} from their (customer_username,
+    purchase_id, product_id, rating, review_seq) rows. A product bought
+    more than once keeps its highest weight. With watermarks
+    (last_purchase_id, last_review_seq), only the purchases and reviews up
+    to them count.
+    """
+    items = {}
+    for (_, purchase_id, product_id, rating, review_seq) in rows:
+        if watermarks is not None:
+            if purchase_id > watermarks[0]:
+                continue
+            if review_seq is not None and review_seq > watermarks[1]:
+                rating = None
+        items[product_id] = max(items.get(product_id, 0.0), weight(rating))
+    return items
+
+
+def _by_customer(rows):
+    """
+    Groups rows, in customer order, into one list per customer.
+    """
+    customer = None
+    group = []
+    for row in rows:
+        # Usernames compare case-insensitively, as in the database.
+        key = row[0].lower()
+        if key != customer:
+            if group:
+                yield group
+            customer = key
+            group = []
+        group.append(row)
+    if group:
+        yield group
+
+
+def baskets(rows, watermarks=None):
+    """
+    Yields the basket() of each customer in rows, in customer order,
+    skipping empty ones.
+    """
+    for customer_rows in _by_customer(rows):
+        items = basket(customer_rows, watermarks)
+        if items:
+            yield items
+
+
+def _trim(basket, max_basket):
+    """
+    Returns the basket's (product_id, weight) items sorted by product,
+    keeping only its max_basket highest weighted products.
+    """
+    items = basket.items()
+    if len(basket) > max_basket:
+        items = heapq.nlargest(max_basket, items, key=lambda item: (item[1], -item[0]))
+    return sorted(items)
+
+
+def product_groups(backend):
+    """
+    Returns {product_id: group}: ("theme", theme_id) for sets and
+    ("category", category_id) for parts.
+    """
+    groups = {}
+    for (product_id, _, _, _, theme_id, _, _, category_id) in backend.catalog_columns():
+        if theme_id is not None:
+            groups[product_id] = ("theme", theme_id)
+        elif category_id is not None:
+            groups[product_id] = ("category", category_id)
+    return groups
+
+
+def score(dot, norm_p, norm_q, same_group):
+    """
+    Returns the similarity of two products: the cosine of their customer
+    vectors, plus AFFINITY if they share a theme or category.
+    """
+    cosine = 0.0
+    if dot > 0 and norm_p > 0 and norm_q > 0:
+        cosine = dot / math.sqrt(norm_p * norm_q)
+    return cosine + (AFFINITY if same_group else 0.0)
+
+
+def _same_group(groups, p, q):
+    group = groups.get(p)
+    return group is not None and group == groups.get(q)
+
+
+def _push(heap, k, value, item):
+    """
+    Keeps the k highest (value, item) entries in a min-heap, preferring
+    lower items on ties.
+    """
+    entry = (value, -item)
+    if len(heap) < k:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+
+def _ranked(heap):
+    """
+    Returns a _push heap as [(item, value)], highest first.
+    """
+    return [(-item, value) for (value, item) in sorted(heap, reverse=True)]
+
+
+def _best(scores, k):
+    """
+    Returns the k best (product_id, score) items of {product_id: score}.
+    """
+    heap = []
+    for (product_id, value) in scores.items():
+        _push(heap, k, value, product_id)
+    return _ranked(heap)
+
+
+def popular_by_group(groups, norms, k=NEIGHBORS):
+    """
+    Returns {group: [(product_id, buyers)]}, the k + 1 most bought products
+    of each group, most bought first. norms is {product_id: (norm_sq,
+    buyers)}.
+    """
+    heaps = collections.defaultdict(list)
+    for (product_id, group) in groups.items():
+        _push(heaps[group], k + 1, norms.get(product_id, (0.0, 0))[1], product_id)
+    return {group: _ranked(heap) for (group, heap) in heaps.items()}
+
+
+def _fill(neighbors, product_id, groups, popular, k):
+    """
+    Returns neighbors ([(neighbor_id, score)]) filled up to k with the
+    most bought products of product_id's group, best first.
+    """
+    if len(neighbors) < k and product_id in groups:
+        have = {neighbor_id for (neighbor_id, _) in neighbors}
+        have.add(product_id)
+        for (neighbor_id, buyers) in popular.get(groups[product_id], ()):
+            if len(neighbors) >= k:
+                break
+            if neighbor_id not in have:
+                # Below AFFINITY, so co-purchases in the group rank first.
+                neighbors.append((neighbor_id, AFFINITY * buyers / (buyers + 1)))
+    return sorted(neighbors, key=lambda item: (-item[1], item[0]))
+
+
+# ----------------------------------------------------------------------
+# Full Build
+# ----------------------------------------------------------------------
+class PairSums:
+    """
+    Sums of w_p * w_q for every pair of products bought by the same
+    customer. At most max_pairs pairs are kept in memory; when full they
+    are written, sorted, to a temporary file as one run.
+    """
+
+    def __init__(self, max_pairs=MAX_PAIRS):
+        self.max_pairs = max_pairs
+        self.spills = 0
+        self._sums = {}
+        # (offset, number of pairs) of each run in _file
+        self._runs = []
+        self._file = None
+
+    def add(self, items):
+        """
+        Adds a basket's pairs; items is [(product_id, weight)] sorted by
+        product.
+        """
+        sums = self._sums
+        for (i, (p, w_p)) in enumerate(items):
+            for (q, w_q) in items[i + 1:]:
+                key = p << 32 | q
+                sums[key] = sums.get(key, 0.0) + w_p * w_q
+            if len(sums) >= self.max_pairs:
+                self._spill()
+                sums = self._sums
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(0, os.SEEK_END)
+        self._runs.append((self._file.tell(), len(self._sums)))
+        self._file.write(b"".join(_PAIR.pack(key, value)
+                                  for (key, value) in sorted(self._sums.items())))
+        self._sums = {}
+        self.spills += 1
+
+    def _read_run(self, offset, count):
+        done = 0
+        while done < count:
+            n = min(_READ_PAIRS, count - done)
+            # Runs share the file, so seek before every read.
+            self._file.seek(offset + done * _PAIR.size)
+            yield from _PAIR.iter_unpack(self._file.read(n * _PAIR.size))
+            done += n
+
+    def pairs(self):
+        """
+        Yields (p, q, sum) for every pair with p < q, in (p, q) order. The
+        pairs still in memory are spilled first, so it can be called again.
+        """
+        if self._sums:
+            self._spill()
+        runs = [self._read_run(offset, count) for (offset, count) in self._runs]
+        current = None
+        total = 0.0
+        for (key, value) in heapq.merge(*runs):
+            if key != current:
+                if current is not None:
+                    yield (current >> 32, current & 0xFFFFFFFF, total)
+                current = key
+                total = 0.0
+            total += value
+        if current is not None:
+            yield (current >> 32, current & 0xFFFFFFFF, total)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def build_neighbors(all_baskets, groups, k=NEIGHBORS, max_pairs=MAX_PAIRS,
+                    max_basket=MAX_BASKET, sums=None):
+    """
+    Computes every product's k best neighbors from customer baskets
+    ({product_id: weight}, see baskets()) and product groups (see
+    product_groups()). Returns (lists, norms): {product_id: [(neighbor_id,
+    score)]}, best first, and {product_id: (norm_sq, buyers)}.
+
+    The pairs are summed in sums, a PairSums the caller reads again and
+    closes, or else in a new one of max_pairs.
+    """
+    norms = collections.defaultdict(lambda: [0.0, 0])
+    owned = sums is None
+    if owned:
+        sums = PairSums(max_pairs)
+    heaps = collections.defaultdict(list)
+    try:
+        for items in all_baskets:
+            for (product_id, w) in items.items():
+                norm = norms[product_id]
+                norm[0] += w * w
+                norm[1] += 1
+            sums.add(_trim(items, max_basket))
+
+        for (p, q, dot) in sums.pairs():
+            value = score(dot, norms[p][0], norms[q][0], _same_group(groups, p, q))
+            _push(heaps[p], k, value, q)
+            _push(heaps[q], k, value, p)
+    finally:
+        if owned:
+            sums.close()
+
+    norms = {product_id: tuple(norm) for (product_id, norm) in norms.items()}
+    popular = popular_by_group(groups, norms, k)
+    lists = {}
+    for product_id in set(groups) | set(heaps):
+        neighbors = _fill(_ranked(heaps.pop(product_id, [])), product_id, groups, popular, k)
+        if neighbors:
+            lists[product_id] = neighbors
+    return lists, norms
+
+
+def build(backend=None, k=NEIGHBORS, max_pairs=MAX_PAIRS, max_basket=MAX_BASKET):
+    """
+    Recomputes every product's neighbors, norm and pair sums from all
+    purchases and reviews, and replaces the old ones in one transaction.
+    Returns the number of products with neighbors.
+    """
+    backend = backend or backends.get_backend()
+    # Count up to the first ID still being committed; update() picks up
+    # the rest.
+    watermarks = tuple(change_feed.resume_point(ids)[0]
+                       for ids in backend.recent_interactions(change_feed.LOOKBACK))
+    groups = product_groups(backend)
+    sums = PairSums(max_pairs)
+    try:
+        lists, norms = build_neighbors(baskets(backend.interactions(), watermarks), groups, k,
+                                       max_basket=max_basket, sums=sums)
+        backend.save_neighbors(lists, norms, watermarks, clear=True, pair_sums=sums.pairs())
+    finally:
+        sums.close()
+    return len(lists)
+
+
+# ----------------------------------------------------------------------
+# Incremental Update
+# ----------------------------------------------------------------------
+def _settle(backend, after, gap_timeout, clock, sleep):
+    """
+    Returns (upto, usernames): how far past the watermarks after the
+    purchases and reviews are committed without gaps, and the customers
+    who made the ones in between. Waits up to gap_timeout seconds for
+    missing IDs below the newest ones seen on the first read.
+    """
+    deadline = clock() + gap_timeout
+    newest = None
+    while True:
+        logs = backend.interactions_after(after)
+        if newest is None:
+            newest = tuple(log[-1][0] if log else last for (log, last) in zip(logs, after))
+        logs = [[row for row in log if row[0] <= last] for (log, last) in zip(logs, newest)]
+        expired = clock() >= deadline
+        settled = [change_feed.advance(last, [row[0] for row in log], lambda _: expired)
+                   for (log, last) in zip(logs, after)]
+        if not any(waiting for (_, waiting) in settled):
+            break
+        sleep(change_feed.POLL_INTERVAL)
+
+    upto = tuple(last for (last, _) in settled)
+    usernames = {username.lower() for (log, last) in zip(logs, upto)
+                 for (row_id, username) in log if row_id <= last and username is not None}
+    return upto, sorted(usernames)
+
+
+def _basket_deltas(rows, after, upto, max_basket, norm_deltas, pair_deltas):
+    """
+    Adds the change in one customer's basket between the watermarks after
+    and upto to norm_deltas ({product_id: [norm_sq, buyers]}) and
+    pair_deltas ({(p, q): sum} with p < q). Returns the products whose
+    weight changed, in the basket or in its trimmed pairs.
+    """
+    old = basket(rows, after)
+    new = basket(rows, upto)
+    touched = set()
+    for product_id in set(old) | set(new):
+        (w_old, w_new) = (old.get(product_id, 0.0), new.get(product_id, 0.0))
+        if w_old != w_new:
+            delta = norm_deltas[product_id]
+            delta[0] += w_new * w_new - w_old * w_old
+            delta[1] += (product_id in new) - (product_id in old)
+            touched.add(product_id)
+
+    old = dict(_trim(old, max_basket))
+    new = dict(_trim(new, max_basket))
+    products = sorted(set(old) | set(new))
+    changed = {product_id for product_id in products
+               if old.get(product_id) != new.get(product_id)}
+    for p in sorted(changed):
+        for q in products:
+            # Pairs of two changed products are added once.
+            if q == p or (q in changed and q < p):
+                continue
+            pair_deltas[min(p, q), max(p, q)] += \
+                new.get(p, 0.0) * new.get(q, 0.0) - old.get(p, 0.0) * old.get(q, 0.0)
+    return touched | changed
+
+
+def _rescore(backend, products, touched, changes, groups, norms, popular, k, lists, pair_sums,
+             merges):
+    """
+    Recomputes the lists of products (a chunk of the touched products)
+    from their pair sums plus changes ({product_id: {other product: delta}}),
+    and records their new scores against the untouched products paired
+    with them or holding them in merges ({untouched product: {touched
+    product: score}}). Every pair in changes has a touched product, so its
+    new sum lands in pair_sums ({(p, q): sum}) along the way.
+    """
+    dots = {product_id: {} for product_id in products}
+    for (p, q, dot) in backend.pair_sums(products):
+        if p in dots:
+            dots[p][q] = dot
+        if q in dots:
+            dots[q][p] = dot
+    for p in products:
+        row = dots[p]
+        for (q, delta) in changes.get(p, {}).items():
+            row[q] = row.get(q, 0.0) + delta
+            pair_sums[min(p, q), max(p, q)] = row[q]
+
+    holders = collections.defaultdict(list)
+    for (product_id, neighbor_id) in backend.neighbor_holders(products):
+        if product_id not in touched:
+            holders[neighbor_id].append(product_id)
+
+    for (p, row) in dots.items():
+        norm_p = norms.get(p, (0.0, 0))[0]
+        scores = {q: score(dot, norm_p, norms.get(q, (0.0, 0))[0], _same_group(groups, p, q))
+                  for (q, dot) in row.items()}
+        lists[p] = _fill(_best(scores, k), p, groups, popular, k)
+        for q in changes.get(p, {}):
+            if q not in touched:
+                merges[q][p] = scores[q]
+        buyers = norms.get(p, (0.0, 0))[1]
+        for q in holders[p]:
+            # Not bought together, so p was filled in from q's group.
+            merges[q][p] = scores.get(q, AFFINITY * buyers / (buyers + 1))
+
+
+def update(backend=None, k=NEIGHBORS, chunk=UPDATE_CHUNK, max_basket=MAX_BASKET,
+           gap_timeout=change_feed.GAP_TIMEOUT, clock=time.monotonic, sleep=time.sleep):
+    """
+    Folds the purchases and reviews made since the last build or update
+    into the pair sums, norms and neighbor lists, in one transaction.
+    Returns the number of products touched.
+    """
+    backend = backend or backends.get_backend()
+    after = backend.recommendation_state()[:2]
+    (upto, usernames) = _settle(backend, after, gap_timeout, clock, sleep)
+    if upto == after:
+        return 0
+
+    norm_deltas = collections.defaultdict(lambda: [0.0, 0])
+    pair_deltas = collections.defaultdict(float)
+    touched = set()
+    for start in range(0, len(usernames), backends.STREAM_CHUNK):
+        rows = backend.interactions(usernames[start:start + backends.STREAM_CHUNK])
+        for customer_rows in _by_customer(rows):
+            touched |= _basket_deltas(customer_rows, after, upto, max_basket, norm_deltas,
+                                      pair_deltas)
+    # product -> {product paired with it: delta}
+    changes = collections.defaultdict(dict)
+    for ((p, q), delta) in pair_deltas.items():
+        changes[p][q] = delta
+        changes[q][p] = delta
+
+    norms = {product_id: (norm_sq, buyers)
+             for (product_id, norm_sq, buyers) in backend.interaction_norms()}
+    for (product_id, (norm_sq, buyers)) in norm_deltas.items():
+        (old_sq, old_buyers) = norms.get(product_id, (0.0, 0))
+        norms[product_id] = (old_sq + norm_sq, old_buyers + buyers)
+    groups = product_groups(backend)
+    popular = popular_by_group(groups, norms, k)
+
+    lists = {}
+    pair_sums = {}
+    merges = collections.defaultdict(dict)
+    products = sorted(touched)
+    for start in range(0, len(products), chunk):
+        _rescore(backend, products[start:start + chunk], touched, changes, groups, norms,
+                 popular, k, lists, pair_sums, merges)
+
+    others = sorted(merges)
+    for start in range(0, len(others), backends.STREAM_CHUNK):
+        stored = collections.defaultdict(dict)
+        for (product_id, neighbor_id, value) in \
+                backend.neighbor_lists(others[start:start + backends.STREAM_CHUNK]):
+            stored[product_id][neighbor_id] = value
+        for q in others[start:start + backends.STREAM_CHUNK]:
+            stored[q].update(merges[q])
+            lists[q] = _best(stored[q], k)
+
+    pair_rows = [(p, q, dot) for ((p, q), dot) in sorted(pair_sums.items())]
+    backend.save_neighbors(lists, {product_id: norms[product_id] for product_id in norm_deltas},
+                           upto, pair_sums=pair_rows, since=after)
+    return len(touched)
+
+
+# ----------------------------------------------------------------------
+# Serving
+# ----------------------------------------------------------------------
+class Recommender:
+    """
+    Serves neighbor lists from product_neighbors, cached per product
+    until recommendation_state's version changes. The version is checked
+    at most once every refresh_interval seconds.
+    """
+
+    def __init__(self, backend=None, cache_size=CACHE_SIZE, refresh_interval=REFRESH_INTERVAL):
+        self.backend = backend or backends.get_backend()
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        # product_id -> [(neighbor_id, product_name, product_price, score)]
+        self._lists = catalog_cache.LRU(cache_size)
+
+    def refresh(self, force=False):
+        """
+        Empties the cache if the lists were rebuilt or updated.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.version is not None and not force \
+                    and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+
+        version = self.backend.recommendation_state()[2]
+        with self._lock:
+            if version != self.version:
+                self._lists.clear()
+                self.version = version
+
+    def neighbors(self, product_id):
+        """
+        Returns product_id's [(neighbor_id, product_name, product_price,
+        score)], best first.
+        """
+        self.refresh()
+        product_id = int(product_id)
+        with self._lock:
+            rows = self._lists.get(product_id)
+            if rows is not None:
+                self.hits += 1
+                return rows
+            self.misses += 1
+        rows = self.backend.product_neighbors(product_id, NEIGHBORS)
+        with self._lock:
+            self._lists.put(product_id, rows)
+        return rows
+
+    def recommend(self, product_ids, k=5, in_stock=False, exclude=()):
+        """
+        Returns up to k (product_id, product_name, product_price) rows for
+        someone looking at product_ids: their neighbors, ranked by the sum
+        of their scores. product_ids and exclude are left out, and so are
+        products out of stock if in_stock is set.
+        """
+        seeds = sorted({int(product_id) for product_id in product_ids})
+        skip = set(seeds) | {int(product_id) for product_id in exclude}
+        totals = collections.defaultdict(float)
+        rows = {}
+        for product_id in seeds:
+            for (neighbor_id, product_name, product_price, value) in self.neighbors(product_id):
+                if neighbor_id not in skip:
+                    totals[neighbor_id] += value
+                    rows[neighbor_id] = (neighbor_id, product_name, product_price)
+
+        ranked = sorted(totals, key=lambda neighbor_id: (-totals[neighbor_id], neighbor_id))
+        if in_stock and ranked:
+            # Quantities change with every purchase, so they aren't cached.
+            stocked = self.backend.in_stock(ranked)
+            ranked = [neighbor_id for neighbor_id in ranked if neighbor_id in stocked]
+        return [rows[neighbor_id] for neighbor_id in ranked[:k]]
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+
+
+def get_recommender():
+    """
+    Returns the process-wide recommender, created on first use.
+    """
+    global _recommender
+    with _recommender_lock:
+        if _recommender is None:
+            _recommender = Recommender()
+        return _recommender
+
+
+# ----------------------------------------------------------------------
+# Command Line
+# ----------------------------------------------------------------------
+def build_command(backend, args):
+    start = time.perf_counter()
+    count = build(backend, args.k, args.max_pairs)
+    print("Built neighbor lists for {n} products in {s:.1f} s.".format(
+        n=count, s=time.perf_counter() - start))
+    return 0
+
+
+def update_command(backend, args):
+    start = time.perf_counter()
+    count = update(backend, args.k)
+    print("Updated neighbor lists for {n} touched products in {s:.1f} s.".format(
+        n=count, s=time.perf_counter() - start))
+    return 0
+
+
+def show_command(backend, args):
+    rows = backend.product_neighbors(args.product_id, args.k)
+    if not rows:
+        print("Product #{id} has no neighbors yet.".format(id=args.product_id))
+        return 1
+    for (neighbor_id, product_name, product_price, value) in rows:
+        print("{score:8.4f}  #{id:<8} ${price:<8} {name}".format(
+            score=value, id=neighbor_id, price=product_price, name=product_name))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build, update and inspect the item-to-item recommendations.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("build", help="recompute every neighbor list")
+    cmd.add_argument("--k", type=int, default=NEIGHBORS, help="neighbors per product")
+    cmd.add_argument("--max-pairs", type=int, default=MAX_PAIRS,
+                     help="product pairs held in memory before spilling to disk")
+    cmd.set_defaults(func=build_command)
+
+    cmd = commands.add_parser("update", help="fold in new purchases and reviews")
+    cmd.add_argument("--k", type=int, default=NEIGHBORS, help="neighbors per product")
+    cmd.set_defaults(func=update_command)
+
+    cmd = commands.add_parser("show", help="list a product's neighbors")
+    cmd.add_argument("product_id", type=int)
+    cmd.add_argument("--k", type=int, default=NEIGHBORS, help="neighbors to list")
+    cmd.set_defaults(func=show_command)
+
+    args = parser.parse_args(argv)
+    try:
+        sys.exit(args.func(backends.get_backend(), args))
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+The store's analytics reports (the queries in queries.sql), read from
+materialized report tables.
+
+refresh_reports (setup-routines.sql) keeps running totals per theme,
+product and customer, and a watermark per source table: the last
+purchase, review and set it has counted. A refresh only aggregates the
+rows past the watermarks, so it stays cheap however long the purchase
+history gets, and reading a report touches one row per theme, product or
+customer. Reports never write to anything but the report tables.
+
+Rows are streamed in chunks as CSV or JSON lines. Used by app_admin.py
+(menu option [f]), and from the command line:
+
+    $ python3 reports.py customer-spend > spend.csv
+    $ python3 reports.py product-ratings --format jsonl --no-refresh
+    $ python3 reports.py --rebuild theme-sets   (after editing or deleting rows)
+
+--rebuild is refused once partitions.py archive has moved months out of
+purchases and reviews, since they would drop out of the reports.
+"""
+
+import argparse
+import csv
+import decimal
+import json
+import sys
+
+import backends
+import db
+
+# Rows read and written at a time.
+CHUNK_SIZE = backends.STREAM_CHUNK
+
+# name -> (title, column names, SELECT over the report tables)
+REPORTS = {
+    "theme-sets": (
+        "Number of sets in each theme",
+        ["theme_name", "num_sets"],
+        "SELECT theme_name, SUM(num_sets) "
+        "FROM report_theme_sets JOIN themes ON (report_theme_sets.theme_id=themes.theme_id) "
+        "GROUP BY theme_name ORDER BY theme_name"),
+    "product-ratings": (
+        "Average rating of each reviewed product",
+        ["product_name", "avg_rating", "num_reviews"],
+        "SELECT product_name, ROUND(SUM(rating_sum) * 1.0 / SUM(review_count), 2), "
+        "       SUM(review_count) "
+        "FROM report_product_ratings JOIN product_inventory "
+        "  ON (report_product_ratings.product_id=product_inventory.product_id) "
+        "GROUP BY product_name ORDER BY product_name"),
+    "customer-spend": (
+        "Money spent by each customer",
+        ["customer_username", "customer_name", "num_purchases", "total_spent"],
+        "SELECT customers.customer_username, customer_name, IFNULL(num_purchases, 0), "
+        "       IFNULL(total_spent, 0) "
+        "FROM customers LEFT JOIN report_customer_spend "
+        "  ON (customers.customer_username=report_customer_spend.customer_username) "
+        "ORDER BY customer_name"),
+}
+
+FORMATS = ("csv", "jsonl")
+
+# name -> the columns holding money or averages, written to 2 decimal
+# places whichever backend produced them (SQLite returns floats).
+DECIMAL_COLUMNS = {
+    "product-ratings": ("avg_rating", ),
+    "customer-spend": ("total_spent", ),
+}
+
+
+def refresh(backend, rebuild=False):
+    """
+    Adds the rows made since the last refresh to the reports (or
+    recomputes them, if rebuild). Returns a dict of how many purchases,
+    reviews and sets were added.
+    """
+    (purchases, reviews, sets) = backend.refresh_reports(rebuild)
+    return {"purchases": purchases, "reviews": reviews, "sets": sets}
+
+
+def chunks(backend, name):
+    """
+    Yields the rows of report `name` as lists of at most CHUNK_SIZE rows,
+    with its DECIMAL_COLUMNS as Decimals to the cent, as MySQL returns
+    them. The connection is held until the generator is exhausted or
+    closed.
+    """
+    (_, columns, sql) = REPORTS[name]
+    decimals = [columns.index(column) for column in DECIMAL_COLUMNS.get(name, ())]
+    with backend.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        try:
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    return
+                if decimals:
+                    rows = [_to_cents(row, decimals) for row in rows]
+                yield rows
+        finally:
+            # Read what's left if the caller stopped early, so the
+            # connection can go back to the pool.
+            while cursor.fetchmany(CHUNK_SIZE):
+                pass
+
+
+def _to_cents(row, decimals):
+    row = list(row)
+    for i in decimals:
+        if row[i] is not None:
+            row[i] = decimal.Decimal(str(row[i])).quantize(backends.CENTS,
+                                                           decimal.ROUND_HALF_UP)
+    return tuple(row)
+
+
+def _json_value(value):
+    return str(value) if isinstance(value, decimal.Decimal) else value
+
+
+def write(backend, name, outfile, fmt="csv"):
+    """
+    Streams report `name` to outfile as CSV (with a header row) or JSON
+    lines. Returns the number of rows written.
+    """
+    (_, columns, _) = REPORTS[name]
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(outfile)
+        writer.writerow(columns)
+        for rows in chunks(backend, name):
+            writer.writerows(rows)
+            count += len(rows)
+    elif fmt == "jsonl":
+        for rows in chunks(backend, name):
+            outfile.writelines(
+                json.dumps(dict(zip(columns, map(_json_value, row)))) + "\n" for row in rows)
+            count += len(rows)
+    else:
+        raise ValueError("format must be one of {formats}".format(formats=", ".join(FORMATS)))
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a store report as CSV or JSON lines.")
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="don't add new purchases, reviews and sets first")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the reports from scratch first")
+    args = parser.parse_args(argv)
+
+    backend = backends.get_backend()
+    try:
+        if args.rebuild or not args.no_refresh:
+            added = refresh(backend, args.rebuild)
+            print("Added {purchases} purchase(s), {reviews} review(s) and {sets} set(s) "
+                  "to the reports.".format(**added), file=sys.stderr)
+        count = write(backend, args.report, sys.stdout, args.format)
+        print("{n} row(s).".format(n=count), file=sys.stderr)
+    except db.Error as err:
+        print("Database error: {err}".format(err=err), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Logging in, with sessions kept in process.
+
+A login is one call to sp_login (setup-passwords.sql), which checks both
+that the user has the role (customer or employee) and the password. A
+successful login returns a session token, valid for SESSION_TTL seconds.
+Scripts and repeated logins in the same process don't go back to the
+database: validate() checks a token in memory (the apps' menus, and every
+batch command that acts as a user, see batch.py), and logging in again with
+the same password within SESSION_TTL is answered from the last successful
+check (the password itself is never kept, only a keyed hash of it).
+
+change_password() changes the password with sp_change_password and revokes
+the user's sessions and cached check. A password changed elsewhere (another
+process, or the mysql client) takes effect here once the TTL runs out.
+
+Failed logins are counted per username in memory: after MAX_FAILURES
+failures within FAILURE_WINDOW seconds, further attempts are refused
+without asking the database until the oldest failure is FAILURE_WINDOW
+seconds old. Usernames compare case-insensitively, as in the database,
+so every spelling of one counts against the same limit.
+
+Expired sessions, password checks and failures are swept out during a
+login at most once every PRUNE_INTERVAL seconds, so a long-running
+process doesn't keep every login it has seen.
+"""
+
+import collections
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+import backends
+
+# How long a session (and a successful password check) lasts, in seconds.
+SESSION_TTL = 30 * 60
+
+MAX_FAILURES = 5
+FAILURE_WINDOW = 5 * 60
+
+PRUNE_INTERVAL = 60
+
+CUSTOMER = "C"
+EMPLOYEE = "E"
+
+# Login statuses: sp_login's, and LOCKED for too many failed attempts.
+OK = "OK"
+NO_USER = "NO_USER"
+WRONG_PASSWORD = "WRONG_PASSWORD"
+LOCKED = "LOCKED"
+
+Session = collections.namedtuple("Session", ["token", "username", "role", "expires"])
+
+
+class SessionManager:
+    """
+    Issues, checks and revokes session tokens, and rate-limits failed
+    logins.
+    """
+
+    def __init__(self, backend=None, ttl=SESSION_TTL, max_failures=MAX_FAILURES,
+                 failure_window=FAILURE_WINDOW, clock=time.monotonic):
+        self.backend = backend or backends.get_backend()
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._next_prune = clock() + PRUNE_INTERVAL
+        # Key for the password hashes below; new in every process.
+        self._key = secrets.token_bytes(32)
+        # Usernames below are lower-cased.
+        # token -> Session
+        self._sessions = {}
+        # username -> tokens of their sessions
+        self._tokens = collections.defaultdict(set)
+        # (username, role) -> (keyed hash of the password, expiry time)
+        self._verified = {}
+        # username -> times of recent failed logins, oldest first
+        self._failures = collections.defaultdict(collections.deque)
+
+    def _digest(self, username, password):
+        return hmac.new(self._key, "{0}\0{1}".format(username, password).encode("utf-8"),
+                        hashlib.sha256).digest()
+
+    def _recent_failures(self, username, now):
+        failures = self._failures.get(username)
+        if failures is None:
+            return 0
+        while failures and failures[0] <= now - self.failure_window:
+            failures.popleft()
+        if not failures:
+            del self._failures[username]
+            return 0
+        return len(failures)
+
+    def _prune(self, now):
+        """
+        Drops expired sessions and password checks, and usernames with no
+        recent failures. Called with the lock held.
+        """
+        for session in [session for session in self._sessions.values()
+                        if session.expires <= now]:
+            self._drop(session.token)
+        for (key, (_, expires)) in list(self._verified.items()):
+            if expires <= now:
+                del self._verified[key]
+        for username in list(self._failures):
+            self._recent_failures(username, now)
+        self._next_prune = now + PRUNE_INTERVAL
+
+    def retry_after(self, username):
+        """
+        Returns how many seconds until username may try to log in again,
+        or 0 if they may now.
+        """
+        username = username.lower()
+        with self._lock:
+            now = self.clock()
+            if self._recent_failures(username, now) < self.max_failures:
+                return 0
+            return self._failures[username][0] + self.failure_window - now
+
+    def login(self, username, password, role):
+        """
+        Logs username in as a customer (CUSTOMER) or employee (EMPLOYEE).
+        Returns (status, session): OK and a new Session, or NO_USER,
+        WRONG_PASSWORD or LOCKED and None.
+        """
+        username = username.lower()
+        digest = self._digest(username, password)
+        with self._lock:
+            now = self.clock()
+            if now >= self._next_prune:
+                self._prune(now)
+            if self._recent_failures(username, now) >= self.max_failures:
+                return (LOCKED, None)
+            cached = self._verified.get((username, role))
+            verified = cached is not None and cached[1] > now \
+                and hmac.compare_digest(cached[0], digest)
+
+        status = OK if verified else self.backend.sp_login(username, password, role)
+
+        with self._lock:
+            now = self.clock()
+            if status != OK:
+                self._failures[username].append(now)
+                return (status, None)
+            self._failures.pop(username, None)
+            if not verified:
+                self._verified[(username, role)] = (digest, now + self.ttl)
+            session = Session(secrets.token_urlsafe(32), username, role, now + self.ttl)
+            self._sessions[session.token] = session
+            self._tokens[username].add(session.token)
+            return (OK, session)
+
+    def validate(self, token, role=None):
+        """
+        Returns the unexpired Session for token (with the given role, if
+        any), or None.
+        """
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.expires <= self.clock():
+                self._drop(token)
+                return None
+        if role is not None and session.role != role:
+            return None
+        return session
+
+    def _drop(self, token):
+        session = self._sessions.pop(token, None)
+        if session is not None:
+            tokens = self._tokens[session.username]
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[session.username]
+
+    def logout(self, token):
+        with self._lock:
+            self._drop(token)
+
+    def revoke(self, username):
+        """
+        Ends every session of username and forgets their password check.
+        Returns the number of sessions ended.
+        """
+        username = username.lower()
+        with self._lock:
+            tokens = list(self._tokens.get(username, ()))
+            for token in tokens:
+                self._drop(token)
+            for role in (CUSTOMER, EMPLOYEE):
+                self._verified.pop((username, role), None)
+            return len(tokens)
+
+    def change_password(self, username, password):
+        """
+        Changes username's password (sp_change_password) and revokes their
+        sessions.
+        """
+        self.backend.sp_change_password(username, password)
+        self.revoke(username)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """
+    Returns the process-wide session manager, created on first use.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionManager()
+        return _manager
@@ -0,0 +1,131 @@
+-- Optional: partitions purchases and reviews by month, so queries over
+-- recent purchases and reviews only read the recent partitions and old
+-- months can be detached and archived (see partitions.py). Run it after
+-- setup-routines.sql, then create the monthly partitions:
+--
+--   mysql> source setup-partitions.sql;
+--   $ python3 partitions.py roll
+--
+-- MySQL's partitioning rules change both tables:
+--   - Partitioned tables can't have foreign keys, so purchases and reviews
+--     lose theirs. Deleting a product or customer no longer deletes their
+--     purchases and reviews, and a review's purchase isn't checked by the
+--     database (the apps check it with can_review_purchase first).
+--   - Every unique key must include the partitioning column, so the
+--     primary keys become (purchase_id, purchase_time) and
+--     (purchase_id, review_time). One review per purchase is enforced by
+--     review_keys instead: an unpartitioned table of reviewed purchase
+--     IDs, written by a trigger in the same statement as the review, so a
+--     second review of a purchase fails with a duplicate key error however
+--     it gets in (batch, write-behind, or a race past can_review_purchase).
+--     Archiving a month keeps its keys.
+--   - purchase_time and review_time are TIMESTAMPs, which RANGE
+--     partitioning only accepts through UNIX_TIMESTAMP(). Months are UTC.
+--
+-- Re-running setup.sql recreates both tables unpartitioned.
+
+DROP PROCEDURE IF EXISTS drop_partitioning_blockers;
+DROP TRIGGER IF EXISTS trg_review_key_insert;
+DROP TRIGGER IF EXISTS trg_review_key_update;
+DROP TRIGGER IF EXISTS trg_review_key_delete;
+DROP TABLE IF EXISTS review_keys;
+
+
+-- Drops the foreign keys on tbl and referencing it, and its unique keys
+-- other than the primary key: partitioned tables can't have either.
+DELIMITER !
+CREATE PROCEDURE drop_partitioning_blockers(IN tbl VARCHAR(64))
+BEGIN
+  DECLARE blocker_table VARCHAR(64);
+  DECLARE blocker VARCHAR(64);
+
+  fk_loop: LOOP
+    SET blocker_table=NULL;
+    SELECT table_name, constraint_name INTO blocker_table, blocker
+    FROM information_schema.REFERENTIAL_CONSTRAINTS
+    WHERE constraint_schema=DATABASE()
+      AND (table_name=tbl OR referenced_table_name=tbl)
+    LIMIT 1;
+    IF blocker_table IS NULL THEN
+      LEAVE fk_loop;
+    END IF;
+    SET @drop_blocker=CONCAT('ALTER TABLE `', blocker_table,
+                             '` DROP FOREIGN KEY `', blocker, '`');
+    PREPARE drop_stmt FROM @drop_blocker;
+    EXECUTE drop_stmt;
+    DEALLOCATE PREPARE drop_stmt;
+  END LOOP;
+
+  unique_loop: LOOP
+    SET blocker=NULL;
+    SELECT index_name INTO blocker
+    FROM information_schema.STATISTICS
+    WHERE table_schema=DATABASE() AND table_name=tbl
+      AND non_unique=0 AND index_name<>'PRIMARY'
+    LIMIT 1;
+    IF blocker IS NULL THEN
+      LEAVE unique_loop;
+    END IF;
+    SET @drop_blocker=CONCAT('ALTER TABLE `', tbl, '` DROP INDEX `', blocker, '`');
+    PREPARE drop_stmt FROM @drop_blocker;
+    EXECUTE drop_stmt;
+    DEALLOCATE PREPARE drop_stmt;
+  END LOOP;
+END !
+DELIMITER ;
+
+
+-- Purchases that have a review: one review per purchase, once the reviews
+-- primary key includes review_time.
+CREATE TABLE review_keys (
+  purchase_id BIGINT UNSIGNED PRIMARY KEY
+);
+
+INSERT INTO review_keys SELECT purchase_id FROM reviews;
+
+DELIMITER !
+CREATE TRIGGER trg_review_key_insert
+  BEFORE INSERT ON reviews FOR EACH ROW
+BEGIN
+  INSERT INTO review_keys VALUES (NEW.purchase_id);
+END !
+
+CREATE TRIGGER trg_review_key_update
+  BEFORE UPDATE ON reviews FOR EACH ROW
+BEGIN
+  IF NEW.purchase_id <> OLD.purchase_id THEN
+    INSERT INTO review_keys VALUES (NEW.purchase_id);
+    DELETE FROM review_keys WHERE purchase_id=OLD.purchase_id;
+  END IF;
+END !
+
+CREATE TRIGGER trg_review_key_delete
+  AFTER DELETE ON reviews FOR EACH ROW
+  FOLLOWS trg_review_delete
+BEGIN
+  DELETE FROM review_keys WHERE purchase_id=OLD.purchase_id;
+END !
+DELIMITER ;
+
+
+-- review_seq is AUTO_INCREMENT, so it needs an index once SERIAL's unique
+-- key is gone.
+ALTER TABLE reviews ADD INDEX idx_review_seq (review_seq);
+
+CALL drop_partitioning_blockers('reviews');
+CALL drop_partitioning_blockers('purchases');
+
+ALTER TABLE purchases DROP PRIMARY KEY, ADD PRIMARY KEY (purchase_id, purchase_time);
+ALTER TABLE reviews DROP PRIMARY KEY, ADD PRIMARY KEY (purchase_id, review_time);
+
+-- Everything starts in p_future; `partitions.py roll` splits it into
+-- months, from the oldest row's month to a few months ahead.
+ALTER TABLE purchases PARTITION BY RANGE (UNIX_TIMESTAMP(purchase_time)) (
+  PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+ALTER TABLE reviews PARTITION BY RANGE (UNIX_TIMESTAMP(review_time)) (
+  PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+DROP PROCEDURE drop_partitioning_blockers;
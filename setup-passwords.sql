@@ -6,6 +6,7 @@ DROP FUNCTION IF EXISTS authenticate;
 
 DROP PROCEDURE IF EXISTS sp_add_user;
 DROP PROCEDURE IF EXISTS sp_change_password;
+DROP PROCEDURE IF EXISTS sp_login;
 
 
 -- File for Password Management section of Final Project
@@ -137,6 +138,31 @@ END !
 
 DELIMITER ;
 
+
+-- Logs a user in with one call: checks that they are a customer (role 'C')
+-- or an employee (role 'E'), and that the password is theirs. Sets status
+-- to 'OK', 'NO_USER' if the username doesn't have that role, or
+-- 'WRONG_PASSWORD'. The password is only hashed for users with the role.
+DELIMITER !
+
+CREATE PROCEDURE sp_login(usr VARCHAR(20), pass VARCHAR(20), user_role CHAR(1),
+                          OUT status VARCHAR(20))
+BEGIN
+    IF (user_role = 'C' AND NOT EXISTS(
+            SELECT * FROM customers WHERE customer_username = usr))
+       OR (user_role = 'E' AND NOT EXISTS(
+            SELECT * FROM employees WHERE employee_username = usr))
+       OR user_role NOT IN ('C', 'E') THEN
+        SET status = 'NO_USER';
+    ELSEIF authenticate(usr, pass) = 1 THEN
+        SET status = 'OK';
+    ELSE
+        SET status = 'WRONG_PASSWORD';
+    END IF;
+END !
+
+DELIMITER ;
+
 -- Add at least two users into your user_info table so that when we 
 -- run this file, we will have examples users in the database.
 CALL sp_add_user('emin', 'eminpw');
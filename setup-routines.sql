@@ -5,18 +5,41 @@
       - get_sets_max_price
       - get_sets_in_theme
       - get_price_and_rating
+      - sample_sets_max_price
+      - sample_sets_in_theme
   2. PURCHASE
       - make_purchase
+      - checkout_cart
   3. MAKE REQUEST
       - request_additional_inventory
   4. WRITE REVIEW
-      - write_review
+      - can_review_purchase
+      - write_review (automatically updates product_rating_summary)
 
   ---------------- EMPLOYEES ----------------------
   1. FULFILL REQUEST
-      - fulfill_request (automatically updates log)
+      - check_request_open
+      - fulfill_request (updates log)
+      - fulfill_requests_bulk (updates log)
   2. VIEW REVENUE
       - show_total_revenue
+      - show_revenue_between
+      - show_revenue_by_theme
+      - rebuild_revenue_ledger
+
+  ---------------- CATALOG ------------------------
+  1. CACHE INVALIDATION
+      - bump_catalog_version (automatically called on catalog changes)
+      - record_product_change (automatically called on product changes)
+      - record_inventory_change (automatically called on quantity changes)
+  2. RATING SUMMARY
+      - rebuild_rating_summary
+  3. THEME HIERARCHY
+      - rebuild_theme_closure
+
+  ---------------- REPORTS ------------------------
+  1. MATERIALIZED REPORTS
+      - refresh_reports
       
 */
 
@@ -29,6 +52,8 @@ DROP FUNCTION IF EXISTS find_product_name;
 DROP PROCEDURE IF EXISTS get_sets_in_theme;
 DROP PROCEDURE IF EXISTS get_sets_max_price;
 DROP PROCEDURE IF EXISTS get_price_and_rating;
+DROP PROCEDURE IF EXISTS sample_sets_max_price;
+DROP PROCEDURE IF EXISTS sample_sets_in_theme;
 
 -- SECTION 2: CUSTOMER ACTIONS
 DROP FUNCTION IF EXISTS find_retail_price;
@@ -36,21 +61,54 @@ DROP FUNCTION IF EXISTS find_customer_discount;
 DROP FUNCTION IF EXISTS find_customer_username_purchase;
 
 DROP PROCEDURE IF EXISTS make_purchase;
+DROP PROCEDURE IF EXISTS checkout_cart;
 DROP PROCEDURE IF EXISTS update_inventory_purchase;
 DROP PROCEDURE IF EXISTS request_additional_inventory;
+DROP PROCEDURE IF EXISTS can_review_purchase;
 DROP PROCEDURE IF EXISTS write_review;
 
 DROP TRIGGER IF EXISTS trg_purchase_update_inventory;
+DROP TRIGGER IF EXISTS trg_purchase_insert;
 
 -- SECTION 3: EMPLOYEE ACTIONS
 DROP FUNCTION IF EXISTS find_product_id_request;
 
 DROP PROCEDURE IF EXISTS update_employee_log;
+DROP PROCEDURE IF EXISTS check_request_open;
 DROP PROCEDURE IF EXISTS fulfill_request;
+DROP PROCEDURE IF EXISTS fulfill_requests_bulk;
 DROP PROCEDURE IF EXISTS show_total_revenue;
+DROP PROCEDURE IF EXISTS show_revenue_between;
+DROP PROCEDURE IF EXISTS show_revenue_by_theme;
+DROP PROCEDURE IF EXISTS record_purchase_revenue;
+DROP PROCEDURE IF EXISTS rebuild_revenue_ledger;
+
+DROP TRIGGER IF EXISTS trg_purchase_delete;
 
 DROP TRIGGER IF EXISTS trg_fulfill_request;
 
+-- SECTION 4: CATALOG
+DROP PROCEDURE IF EXISTS bump_catalog_version;
+DROP PROCEDURE IF EXISTS record_product_change;
+DROP PROCEDURE IF EXISTS record_inventory_change;
+
+DROP TRIGGER IF EXISTS trg_catalog_insert;
+DROP TRIGGER IF EXISTS trg_catalog_update;
+DROP TRIGGER IF EXISTS trg_catalog_delete;
+DROP TRIGGER IF EXISTS trg_catalog_set_update;
+DROP TRIGGER IF EXISTS trg_catalog_theme_update;
+
+DROP PROCEDURE IF EXISTS apply_review_to_summary;
+DROP PROCEDURE IF EXISTS rebuild_rating_summary;
+DROP PROCEDURE IF EXISTS rebuild_theme_closure;
+
+DROP TRIGGER IF EXISTS trg_review_insert;
+DROP TRIGGER IF EXISTS trg_review_update;
+DROP TRIGGER IF EXISTS trg_review_delete;
+
+-- SECTION 5: REPORTS
+DROP PROCEDURE IF EXISTS refresh_reports;
+
 
 -- --------------------- SECTION 1: CUSTOMER QUERIES ---------------------
 
@@ -96,25 +154,30 @@ END !
 DELIMITER ;
 
 
--- Returns the name, product name, and price of all sets with a given theme name.
+-- Returns the name, product name, and price of all sets with a given theme
+-- name, including the sets of its sub-themes. Every theme with that name
+-- is searched (e.g. both the top-level "Star Wars" and Technic's), using
+-- theme_closure, so the whole subtree is one indexed join.
 DELIMITER !
 CREATE PROCEDURE get_sets_in_theme(
   IN theme_name VARCHAR(70)
 )
 BEGIN
-  DECLARE desired_theme_id INT;
-  SET desired_theme_id=find_theme_id(theme_name);
-
-  SELECT product_id, product_name, product_price
-  FROM lego_sets NATURAL JOIN product_inventory 
-  WHERE desired_theme_id=lego_sets.theme_id
-  ORDER BY product_id;
+  SELECT DISTINCT product_inventory.product_id, product_name, product_price
+  FROM themes
+    JOIN theme_closure ON (themes.theme_id=theme_closure.ancestor_id)
+    JOIN lego_sets ON (theme_closure.descendant_id=lego_sets.theme_id)
+    JOIN product_inventory ON (lego_sets.product_id=product_inventory.product_id)
+  WHERE themes.theme_name=theme_name
+  ORDER BY product_inventory.product_id;
 END !
 DELIMITER ;
 
 
 -- Returns the price and average rating of a set.
 -- If no ratings available, then default to 0.
+-- The rating comes from product_rating_summary, so this reads one row
+-- no matter how many reviews the product has.
 DELIMITER !
 CREATE PROCEDURE get_price_and_rating(
   IN product_id INT,
@@ -127,10 +190,100 @@ BEGIN
   FROM product_inventory 
   WHERE product_id=product_inventory.product_id;
 
-  SELECT IFNULL(AVG(rating), 0) AS avg_rating 
+  SET desired_avg_rating=0;
+  SELECT IFNULL(rating_sum / review_count, 0)
   INTO desired_avg_rating
-  FROM reviews NATURAL LEFT JOIN purchases 
-  WHERE product_id=purchases.product_id;
+  FROM product_rating_summary
+  WHERE product_id=product_rating_summary.product_id;
+END !
+DELIMITER ;
+
+
+-- Returns up to k random products under a given price point.
+-- Unlike get_sets_max_price, only the sampled rows leave the server:
+-- each pick is a random offset into idx_prod_price, so only the index is
+-- walked and only k full rows are read.
+DELIMITER !
+CREATE PROCEDURE sample_sets_max_price(
+  IN max_price NUMERIC(6,2),
+  IN k INT
+)
+BEGIN
+  DECLARE num_matches INT;
+  DECLARE num_picked INT DEFAULT 0;
+  DECLARE attempts INT DEFAULT 0;
+  DECLARE pick INT;
+
+  DROP TEMPORARY TABLE IF EXISTS sampled_products;
+  CREATE TEMPORARY TABLE sampled_products (product_id INT PRIMARY KEY);
+
+  SELECT COUNT(*) INTO num_matches
+  FROM product_inventory WHERE product_price<=max_price;
+  SET k=LEAST(k, num_matches);
+
+  -- Duplicate picks are ignored, so allow a few extra attempts.
+  WHILE num_picked < k AND attempts < 4*k DO
+    SET pick=FLOOR(RAND()*num_matches);
+    INSERT IGNORE INTO sampled_products
+      SELECT product_id FROM product_inventory
+      WHERE product_price<=max_price
+      ORDER BY product_price, product_id
+      LIMIT pick, 1;
+    SET num_picked=num_picked + ROW_COUNT();
+    SET attempts=attempts + 1;
+  END WHILE;
+
+  SELECT product_id, product_name, product_price
+  FROM sampled_products NATURAL JOIN product_inventory;
+
+  DROP TEMPORARY TABLE sampled_products;
+END !
+DELIMITER ;
+
+
+-- Returns up to k random sets with a given theme name (or its sub-themes,
+-- as in get_sets_in_theme).
+-- Picks random offsets into the theme's lego_sets rows instead of
+-- returning the whole theme like get_sets_in_theme.
+DELIMITER !
+CREATE PROCEDURE sample_sets_in_theme(
+  IN theme_name VARCHAR(70),
+  IN k INT
+)
+BEGIN
+  DECLARE num_matches INT;
+  DECLARE num_picked INT DEFAULT 0;
+  DECLARE attempts INT DEFAULT 0;
+  DECLARE pick INT;
+
+  DROP TEMPORARY TABLE IF EXISTS sampled_products;
+  CREATE TEMPORARY TABLE sampled_products (product_id INT PRIMARY KEY);
+
+  SELECT COUNT(*) INTO num_matches
+  FROM themes
+    JOIN theme_closure ON (themes.theme_id=theme_closure.ancestor_id)
+    JOIN lego_sets ON (theme_closure.descendant_id=lego_sets.theme_id)
+  WHERE themes.theme_name=theme_name;
+  SET k=LEAST(k, num_matches);
+
+  WHILE num_picked < k AND attempts < 4*k DO
+    SET pick=FLOOR(RAND()*num_matches);
+    INSERT IGNORE INTO sampled_products
+      SELECT lego_sets.product_id
+      FROM themes
+        JOIN theme_closure ON (themes.theme_id=theme_closure.ancestor_id)
+        JOIN lego_sets ON (theme_closure.descendant_id=lego_sets.theme_id)
+      WHERE themes.theme_name=theme_name
+      ORDER BY lego_sets.product_id
+      LIMIT pick, 1;
+    SET num_picked=num_picked + ROW_COUNT();
+    SET attempts=attempts + 1;
+  END WHILE;
+
+  SELECT product_id, product_name, product_price
+  FROM sampled_products NATURAL JOIN product_inventory;
+
+  DROP TEMPORARY TABLE sampled_products;
 END !
 DELIMITER ;
 
@@ -172,43 +325,172 @@ DELIMITER ;
 
 
 -- Update inventory quantity to reflect one purchase.
+-- The decrement only happens while there is stock left, and checking and
+-- decrementing is one statement, so concurrent buyers can't both take
+-- the last item. reserved is 1 if an item was reserved, 0 if out of stock.
 DELIMITER !
 CREATE PROCEDURE update_inventory_purchase(
-  IN product_id INT
+  IN product_id INT,
+  OUT reserved TINYINT
 )
 BEGIN 
   UPDATE product_inventory 
   SET quantity=quantity - 1
-  WHERE product_id=product_inventory.product_id;
+  WHERE product_id=product_inventory.product_id
+    AND product_inventory.quantity > 0;
+
+  SET reserved=ROW_COUNT();
 END !
 DELIMITER ;
 
 
 -- Trigger to handle purchases.
+-- Updates the revenue ledger. Inventory is updated by the purchase
+-- procedures themselves, so a cart can be decremented in one statement.
 DELIMITER !
-CREATE TRIGGER trg_purchase_update_inventory
+CREATE TRIGGER trg_purchase_insert
   AFTER INSERT ON purchases FOR EACH ROW
 BEGIN
-  CALL update_inventory_purchase(NEW.product_id);
+  CALL record_purchase_revenue(NEW.product_id, NEW.purchase_time, 1, NEW.purchase_item_total);
 END !
 DELIMITER ;
 
 
 -- Make a purchase and update the purchases relation.
+-- purchase_status is 'OK' and new_purchase_id is set if the item was
+-- bought, or purchase_status is 'OUT_OF_STOCK' and nothing is inserted.
 DELIMITER !
 CREATE PROCEDURE make_purchase(
   IN product_id INT,
-  IN customer_username VARCHAR(50)
+  IN customer_username VARCHAR(50),
+  OUT new_purchase_id BIGINT UNSIGNED,
+  OUT purchase_status VARCHAR(20)
 )
 BEGIN
   DECLARE retail_price NUMERIC(6,2);
   DECLARE customer_discount INT;
+  DECLARE reserved TINYINT;
 
+  SET new_purchase_id=NULL;
   SET retail_price=find_retail_price(product_id);
   SET customer_discount=find_customer_discount(customer_username);
 
-  INSERT INTO purchases 
-    VALUES (DEFAULT, product_id, customer_username, retail_price*(1-0.01*customer_discount), NOW());
+  CALL update_inventory_purchase(product_id, reserved);
+
+  IF reserved = 1 THEN
+    INSERT INTO purchases 
+      VALUES (DEFAULT, product_id, customer_username, retail_price*(1-0.01*customer_discount), NOW());
+    SET new_purchase_id=LAST_INSERT_ID();
+    SET purchase_status='OK';
+  ELSE
+    SET purchase_status='OUT_OF_STOCK';
+  END IF;
+END !
+DELIMITER ;
+
+
+-- Buys every item in a cart in one go.
+-- product_ids is a comma-separated list; an ID listed twice buys two.
+-- Stock is checked and decremented for the whole cart at once, and the
+-- discount is looked up once. If any item is short, nothing is bought,
+-- checkout_status is 'OUT_OF_STOCK' and the short items are returned as
+-- (product_id, requested, available). Otherwise checkout_status is 'OK'
+-- and the new purchases are returned as (purchase_id, product_id,
+-- purchase_item_total).
+-- The caller should commit (or roll back) afterwards, which releases the
+-- row locks taken on the cart's inventory.
+DELIMITER !
+CREATE PROCEDURE checkout_cart(
+  IN product_ids VARCHAR(4000),
+  IN customer_username VARCHAR(50),
+  OUT checkout_status VARCHAR(20),
+  OUT first_purchase_id BIGINT UNSIGNED,
+  OUT num_items INT
+)
+BEGIN
+  DECLARE customer_discount INT;
+  DECLARE remaining_ids VARCHAR(4000);
+  DECLARE next_id VARCHAR(20);
+  DECLARE num_short INT;
+  DECLARE num_locked INT;
+
+  SET num_items=0;
+  SET first_purchase_id=NULL;
+
+  -- One row per item in the cart, in the order they were added.
+  DROP TEMPORARY TABLE IF EXISTS cart_items;
+  CREATE TEMPORARY TABLE cart_items (
+    line_no INT AUTO_INCREMENT PRIMARY KEY,
+    product_id INT NOT NULL
+  );
+
+  SET remaining_ids=product_ids;
+  WHILE LENGTH(remaining_ids) > 0 DO
+    SET next_id=TRIM(SUBSTRING_INDEX(remaining_ids, ',', 1));
+    IF LOCATE(',', remaining_ids) > 0 THEN
+      SET remaining_ids=SUBSTRING(remaining_ids, LOCATE(',', remaining_ids) + 1);
+    ELSE
+      SET remaining_ids='';
+    END IF;
+    IF next_id <> '' THEN
+      INSERT INTO cart_items (product_id) VALUES (CAST(next_id AS UNSIGNED));
+    END IF;
+  END WHILE;
+
+  -- Lock the cart's inventory rows until the caller commits.
+  SELECT COUNT(*) INTO num_locked
+  FROM product_inventory
+  WHERE product_inventory.product_id IN (SELECT cart_items.product_id FROM cart_items)
+  FOR UPDATE;
+
+  DROP TEMPORARY TABLE IF EXISTS cart_shortages;
+  CREATE TEMPORARY TABLE cart_shortages
+    SELECT cart_items.product_id,
+           COUNT(*) AS requested,
+           IFNULL(MAX(product_inventory.quantity), 0) AS available
+    FROM cart_items LEFT JOIN product_inventory
+      ON (cart_items.product_id=product_inventory.product_id)
+    GROUP BY cart_items.product_id
+    HAVING available < requested;
+
+  SELECT COUNT(*) INTO num_short FROM cart_shortages;
+
+  IF num_short > 0 THEN
+    SET checkout_status='OUT_OF_STOCK';
+    SELECT product_id, requested, available FROM cart_shortages ORDER BY product_id;
+  ELSE
+    SET customer_discount=find_customer_discount(customer_username);
+
+    -- The rows are locked and were just checked, but keep the same
+    -- never-below-zero guard as update_inventory_purchase.
+    UPDATE product_inventory JOIN (
+        SELECT cart_items.product_id, COUNT(*) AS requested
+        FROM cart_items GROUP BY cart_items.product_id
+      ) AS cart_counts ON (product_inventory.product_id=cart_counts.product_id)
+    SET product_inventory.quantity=product_inventory.quantity - cart_counts.requested
+    WHERE product_inventory.quantity >= cart_counts.requested;
+
+    -- A single INSERT ... SELECT gets consecutive purchase IDs (MySQL 5.7's
+    -- default innodb_autoinc_lock_mode=1), starting at LAST_INSERT_ID().
+    INSERT INTO purchases (product_id, customer_username, purchase_item_total, purchase_time)
+      SELECT cart_items.product_id, customer_username,
+             product_inventory.product_price*(1-0.01*customer_discount), NOW()
+      FROM cart_items JOIN product_inventory
+        ON (cart_items.product_id=product_inventory.product_id)
+      ORDER BY cart_items.line_no;
+
+    SET num_items=ROW_COUNT();
+    SET first_purchase_id=LAST_INSERT_ID();
+    SET checkout_status='OK';
+
+    SELECT purchase_id, product_id, purchase_item_total
+    FROM purchases
+    WHERE purchase_id BETWEEN first_purchase_id AND first_purchase_id + num_items - 1
+    ORDER BY purchase_id;
+  END IF;
+
+  DROP TEMPORARY TABLE cart_shortages;
+  DROP TEMPORARY TABLE cart_items;
 END !
 DELIMITER ;
 
@@ -223,7 +505,7 @@ CREATE PROCEDURE request_additional_inventory(
 )
 BEGIN 
   INSERT INTO requests
-    VALUES (DEFAULT, product_id, customer_username, 'U');
+    VALUES (DEFAULT, product_id, customer_username, 'U', NOW());
 END !
 DELIMITER ;
 
@@ -243,6 +525,40 @@ END !
 DELIMITER ;
 
 
+-- Checks whether a customer may review a purchase: it must exist, be
+-- theirs, and not be reviewed yet. Sets reason to why not, or to NULL if
+-- the review is allowed. Both lookups are on primary keys, so this takes
+-- the same time however many purchases the customer has made.
+DELIMITER !
+CREATE PROCEDURE can_review_purchase(
+  IN purchase_id BIGINT UNSIGNED,
+  IN customer_username VARCHAR(50),
+  OUT reason VARCHAR(100)
+)
+BEGIN
+  DECLARE purchase_owner VARCHAR(50) DEFAULT NULL;
+  DECLARE num_reviews INT DEFAULT 0;
+
+  SELECT purchases.customer_username INTO purchase_owner
+  FROM purchases WHERE purchase_id=purchases.purchase_id;
+
+  SELECT COUNT(*) INTO num_reviews
+  FROM reviews WHERE purchase_id=reviews.purchase_id;
+
+  SET reason=CASE
+    WHEN purchase_owner IS NULL THEN 'There is no purchase with that ID.'
+    WHEN purchase_owner<>customer_username THEN 'You did not make that purchase.'
+    WHEN num_reviews > 0 THEN 'That purchase already has a review.'
+    ELSE NULL
+  END;
+END !
+DELIMITER ;
+
+
+-- Writes a review. A purchase has at most one: a second review fails with
+-- a duplicate key error, from the reviews primary key (or review_keys once
+-- reviews is partitioned, see setup-partitions.sql), even if it raced past
+-- can_review_purchase.
 DELIMITER !
 CREATE PROCEDURE write_review(
   IN purchase_id BIGINT UNSIGNED,
@@ -253,7 +569,7 @@ BEGIN
   DECLARE matching_customer_username VARCHAR(50);
   SET matching_customer_username=find_customer_username_purchase(purchase_id);
 
-  INSERT INTO reviews
+  INSERT INTO reviews (purchase_id, customer_username, review_time, rating, review)
     VALUES (purchase_id, matching_customer_username, NOW(), rating, review);
 END !
 DELIMITER ;
@@ -262,80 +578,656 @@ DELIMITER ;
 -- --------------------- SECTION 3: EMPLOYEE ACTIONS ---------------------
 
 -- -------------- ACTION 1: FULFILL A REQUEST ----------------------
--- Update log when employee fulflls a request.
+-- The fulfill procedures write employee_log themselves, with the employee
+-- who did the work. (This used to be a trigger on requests, which could
+-- only log a hard-coded employee and logged one row at a time.)
+
+-- Find matching product ID given a request ID.
+DELIMITER !
+CREATE FUNCTION find_product_id_request(request_id BIGINT UNSIGNED) RETURNS INT DETERMINISTIC
+BEGIN
+  DECLARE matching_product_id INT;
+
+  SELECT requests.product_id INTO matching_product_id 
+  FROM requests WHERE request_id=requests.request_id;
+
+  RETURN matching_product_id;
+END !
+DELIMITER ;
+
+
+-- Checks whether a request can be fulfilled, i.e. it exists and is still
+-- unfulfilled. Sets reason to why not, or to NULL if it is open.
+-- A primary key lookup, so it doesn't depend on how many requests are open.
 DELIMITER !
-CREATE PROCEDURE update_employee_log(
-  IN request_id BIGINT UNSIGNED 
+CREATE PROCEDURE check_request_open(
+  IN request_id BIGINT UNSIGNED,
+  OUT reason VARCHAR(100)
 )
-BEGIN 
- -- Updates the employee log.
-  DECLARE curr_employee_username VARCHAR(50);
+BEGIN
+  DECLARE current_status CHAR(1) DEFAULT NULL;
 
-  -- TODO: Set to actual current employee.
-  SET curr_employee_username='emin';
+  SELECT request_status INTO current_status
+  FROM requests WHERE request_id=requests.request_id;
 
-  INSERT INTO employee_log
-    VALUES (request_id, curr_employee_username, NOW(), 'Fulfilled request.');
+  SET reason=CASE
+    WHEN current_status IS NULL THEN 'There is no request with that ID.'
+    WHEN current_status='F' THEN 'That request has already been fulfilled.'
+    WHEN current_status='P' THEN 'That request is already in progress.'
+    ELSE NULL
+  END;
 END !
 DELIMITER ;
 
 
--- Trigger to execute when 'request' updates (i.e. a request is fulfilled).
+-- Fulfill request by increasing product inventory and updating status,
+-- and log which employee fulfilled it. The status changes first, and only
+-- while the request is open, so a request fulfilled twice at once (or by
+-- two employees) is only restocked once. Sets reason as check_request_open
+-- does: NULL if the request was fulfilled, otherwise why not.
 DELIMITER !
-CREATE TRIGGER trg_fulfill_request
-  AFTER UPDATE ON requests FOR EACH ROW 
+CREATE PROCEDURE fulfill_request(
+  IN request_id BIGINT UNSIGNED,
+  IN employee_username VARCHAR(50),
+  OUT reason VARCHAR(100)
+)
 BEGIN 
-  CALL update_employee_log(NEW.request_id);
+  DECLARE requested_product_id INT;
+  SET reason=NULL;
+
+  -- Updates status of request in requests, if it is still open.
+  UPDATE requests
+  SET request_status='F'
+  WHERE request_id=requests.request_id AND request_status='U';
+
+  IF ROW_COUNT()=1 THEN
+    -- Find product ID for the request.
+    SET requested_product_id=find_product_id_request(request_id);
+
+    -- Increases inventory.
+    UPDATE product_inventory 
+    SET quantity=quantity+1
+    WHERE requested_product_id=product_inventory.product_id;
+
+    INSERT INTO employee_log
+      VALUES (request_id, employee_username, NOW(), 'Fulfilled request.');
+  ELSE
+    CALL check_request_open(request_id, reason);
+  END IF;
 END !
 DELIMITER ;
 
 
--- Find matching product ID given a request ID.
+-- Fulfills many open requests at once, e.g. when a restock arrives:
+--   - every open request for for_product_id (request_ids NULL), or
+--   - the open requests among request_ids, a comma-separated list
+--     (for_product_id NULL, or set to keep only that product's requests),
+-- oldest first and at most max_requests of them (NULL for no limit, or
+-- the quantity that arrived). Inventory, request statuses and the
+-- employee log are each updated with one set-based statement.
+-- The fulfilled requests are returned as (request_id, product_id) and
+-- their number in num_fulfilled. The caller should commit afterwards.
 DELIMITER !
-CREATE FUNCTION find_product_id_request(request_id BIGINT UNSIGNED) RETURNS INT DETERMINISTIC
+CREATE PROCEDURE fulfill_requests_bulk(
+  IN for_product_id INT,
+  IN request_ids TEXT,
+  IN max_requests INT,
+  IN fulfilling_employee VARCHAR(50),
+  OUT num_fulfilled INT
+)
 BEGIN
-  DECLARE matching_product_id INT;
+  DECLARE row_limit BIGINT UNSIGNED;
+  DECLARE remaining_ids TEXT;
+  DECLARE next_id VARCHAR(20);
+
+  SET row_limit=IFNULL(max_requests, 18446744073709551615);
+
+  DROP TEMPORARY TABLE IF EXISTS bulk_requests;
+  CREATE TEMPORARY TABLE bulk_requests (
+    request_id BIGINT UNSIGNED PRIMARY KEY,
+    product_id INT
+  );
+
+  IF request_ids IS NULL THEN
+    -- Served by idx_request_product.
+    INSERT INTO bulk_requests
+      SELECT requests.request_id, requests.product_id
+      FROM requests
+      WHERE requests.request_status='U' AND requests.product_id=for_product_id
+      ORDER BY requests.request_id
+      LIMIT row_limit
+      FOR UPDATE;
+  ELSE
+    DROP TEMPORARY TABLE IF EXISTS bulk_request_ids;
+    CREATE TEMPORARY TABLE bulk_request_ids (
+      request_id BIGINT UNSIGNED PRIMARY KEY
+    );
+
+    SET remaining_ids=request_ids;
+    WHILE LENGTH(remaining_ids) > 0 DO
+      SET next_id=TRIM(SUBSTRING_INDEX(remaining_ids, ',', 1));
+      IF LOCATE(',', remaining_ids) > 0 THEN
+        SET remaining_ids=SUBSTRING(remaining_ids, LOCATE(',', remaining_ids) + 1);
+      ELSE
+        SET remaining_ids='';
+      END IF;
+      IF next_id <> '' THEN
+        INSERT IGNORE INTO bulk_request_ids VALUES (CAST(next_id AS UNSIGNED));
+      END IF;
+    END WHILE;
+
+    INSERT INTO bulk_requests
+      SELECT requests.request_id, requests.product_id
+      FROM bulk_request_ids JOIN requests
+        ON (bulk_request_ids.request_id=requests.request_id)
+      WHERE requests.request_status='U'
+        AND (for_product_id IS NULL OR requests.product_id=for_product_id)
+      ORDER BY requests.request_id
+      LIMIT row_limit
+      FOR UPDATE;
+
+    DROP TEMPORARY TABLE bulk_request_ids;
+  END IF;
 
-  SELECT requests.product_id INTO matching_product_id 
-  FROM requests WHERE request_id=requests.request_id;
+  UPDATE product_inventory JOIN (
+      SELECT bulk_requests.product_id, COUNT(*) AS num_requests
+      FROM bulk_requests GROUP BY bulk_requests.product_id
+    ) AS restocked ON (product_inventory.product_id=restocked.product_id)
+  SET product_inventory.quantity=product_inventory.quantity + restocked.num_requests;
 
-  RETURN matching_product_id;
+  UPDATE requests JOIN bulk_requests ON (requests.request_id=bulk_requests.request_id)
+  SET requests.request_status='F';
+
+  INSERT INTO employee_log
+    SELECT bulk_requests.request_id, fulfilling_employee, NOW(), 'Fulfilled request.'
+    FROM bulk_requests;
+
+  SELECT COUNT(*) INTO num_fulfilled FROM bulk_requests;
+  SELECT request_id, product_id FROM bulk_requests ORDER BY request_id;
+
+  DROP TEMPORARY TABLE bulk_requests;
 END !
 DELIMITER ;
 
 
--- Fulfill request by increasing product inventory and updating status.
+-- -------------- ACTION 2: VIEW REVENUE ----------------------
+-- Revenue is read from the revenue_product_daily rollup, which holds one
+-- row per day and product, so these stay fast however many purchases
+-- there are. Daily totals are summed when read. The all-time total is
+-- kept in revenue_total_shards, so reading it doesn't grow with history.
+
+-- Adds (or, with negative deltas, removes) purchases from the rollup and
+-- from this connection's revenue total shard.
 DELIMITER !
-CREATE PROCEDURE fulfill_request(
-  IN request_id BIGINT UNSIGNED
+CREATE PROCEDURE record_purchase_revenue(
+  IN product_id INT,
+  IN purchase_time TIMESTAMP,
+  IN count_delta INT,
+  IN revenue_delta NUMERIC(14,2)
 )
-BEGIN 
-  -- Find product ID for the request.
-  DECLARE requested_product_id INT;
-  SET requested_product_id=find_product_id_request(request_id);
+BEGIN
+  INSERT INTO revenue_product_daily
+    VALUES (DATE(purchase_time), product_id, count_delta, revenue_delta)
+  ON DUPLICATE KEY UPDATE
+    purchase_count=purchase_count + count_delta,
+    revenue=revenue + revenue_delta;
+
+  UPDATE revenue_total_shards
+  SET purchase_count=purchase_count + count_delta,
+      revenue=revenue + revenue_delta
+  WHERE shard=CONNECTION_ID() % 16;
+END !
+DELIMITER ;
 
-  -- Increases inventory.
-  UPDATE product_inventory 
-  SET quantity=quantity+1
-  WHERE requested_product_id=product_inventory.product_id;
 
-  -- Updates status of request in requests.
-  UPDATE requests
-  SET request_status='F'
-  WHERE request_id=requests.request_id;
+-- Trigger to take deleted purchases back out of the ledger.
+DELIMITER !
+CREATE TRIGGER trg_purchase_delete
+  AFTER DELETE ON purchases FOR EACH ROW
+BEGIN
+  CALL record_purchase_revenue(OLD.product_id, OLD.purchase_time, -1, -OLD.purchase_item_total);
 END !
 DELIMITER ;
 
 
--- -------------- ACTION 2: VIEW REVENUE ----------------------
--- Displays total revenue.
+-- Displays total revenue: the sum of the 16 shards.
 DELIMITER !
 CREATE PROCEDURE show_total_revenue(
-  OUT total_revenue NUMERIC(6,2)
+  OUT total_revenue NUMERIC(14,2)
 )
 BEGIN 
-  SELECT SUM(purchase_item_total) 
-  FROM purchases
+  SELECT IFNULL(SUM(revenue), 0)
+  FROM revenue_total_shards
   INTO total_revenue;
 END !
-DELIMITER ;
\ No newline at end of file
+DELIMITER ;
+
+
+-- Displays revenue and number of purchases between two dates (inclusive).
+DELIMITER !
+CREATE PROCEDURE show_revenue_between(
+  IN start_date DATE,
+  IN end_date DATE,
+  OUT total_revenue NUMERIC(14,2),
+  OUT num_purchases INT
+)
+BEGIN
+  SELECT IFNULL(SUM(revenue), 0), IFNULL(SUM(purchase_count), 0)
+  FROM revenue_product_daily
+  WHERE revenue_date BETWEEN start_date AND end_date
+  INTO total_revenue, num_purchases;
+END !
+DELIMITER ;
+
+
+-- Returns revenue per theme between two dates (inclusive), highest first.
+-- Parts have no theme, so they are grouped together.
+DELIMITER !
+CREATE PROCEDURE show_revenue_by_theme(
+  IN start_date DATE,
+  IN end_date DATE
+)
+BEGIN
+  SELECT IFNULL(theme_name, '(individual parts)') AS theme_name,
+         SUM(purchase_count) AS num_purchases,
+         SUM(revenue) AS theme_revenue
+  FROM revenue_product_daily
+    LEFT JOIN lego_sets ON (revenue_product_daily.product_id=lego_sets.product_id)
+    LEFT JOIN themes ON (lego_sets.theme_id=themes.theme_id)
+  WHERE revenue_date BETWEEN start_date AND end_date
+  GROUP BY IFNULL(theme_name, '(individual parts)')
+  ORDER BY theme_revenue DESC;
+END !
+DELIMITER ;
+
+
+-- Recomputes the revenue rollup and total from purchases, putting the
+-- whole total in shard 0. Refuses once months have been archived, since
+-- they are no longer in purchases.
+DELIMITER !
+CREATE PROCEDURE rebuild_revenue_ledger()
+BEGIN
+  IF EXISTS (SELECT * FROM archived_partitions) THEN
+    SIGNAL SQLSTATE '45000'
+      SET MESSAGE_TEXT = 'Rebuilding revenue_product_daily would drop the archived months (see archived_partitions)';
+  END IF;
+
+  DELETE FROM revenue_product_daily;
+
+  INSERT INTO revenue_product_daily
+    SELECT DATE(purchase_time), product_id, COUNT(*), SUM(purchase_item_total)
+    FROM purchases
+    GROUP BY DATE(purchase_time), product_id;
+
+  UPDATE revenue_total_shards SET purchase_count=0, revenue=0;
+  UPDATE revenue_total_shards
+    JOIN (SELECT IFNULL(SUM(purchase_count), 0) AS purchase_count,
+                 IFNULL(SUM(revenue), 0) AS revenue
+          FROM revenue_product_daily) totals
+  SET revenue_total_shards.purchase_count=totals.purchase_count,
+      revenue_total_shards.revenue=totals.revenue
+  WHERE shard=0;
+END !
+DELIMITER ;
+
+
+-- --------------------- SECTION 4: CATALOG ---------------------
+
+-- -------------- ACTION 1: CACHE INVALIDATION ----------------------
+-- Marks the catalog as changed so in-process caches reload it.
+-- Call this by hand after editing catalog tables in bulk.
+DELIMITER !
+CREATE PROCEDURE bump_catalog_version()
+BEGIN
+  UPDATE catalog_version
+  SET version=version + 1
+  WHERE version_id=1;
+END !
+DELIMITER ;
+
+
+-- Logs a product whose name or price changed, for indexes that update
+-- product by product (see product_changes in setup.sql).
+DELIMITER !
+CREATE PROCEDURE record_product_change(
+  IN product_id INT
+)
+BEGIN
+  INSERT INTO product_changes (product_id) VALUES (product_id);
+END !
+DELIMITER ;
+
+
+-- Logs a change to a product's quantity in inventory_changes, the feed
+-- read by change_feed.py. new_quantity is NULL if the product was deleted.
+DELIMITER !
+CREATE PROCEDURE record_inventory_change(
+  IN product_id INT,
+  IN new_quantity INT,
+  IN delta INT
+)
+BEGIN
+  INSERT INTO inventory_changes (product_id, quantity, delta)
+    VALUES (product_id, new_quantity, delta);
+END !
+DELIMITER ;
+
+
+-- Triggers to bump the catalog version when products change.
+-- Quantity changes (purchases, fulfilled requests) are not catalog
+-- changes, so updates only count if the price or name changed; they go
+-- to the inventory change feed instead, whichever procedure made them.
+DELIMITER !
+CREATE TRIGGER trg_catalog_insert
+  AFTER INSERT ON product_inventory FOR EACH ROW
+BEGIN
+  CALL bump_catalog_version();
+  CALL record_product_change(NEW.product_id);
+  CALL record_inventory_change(NEW.product_id, NEW.quantity, NEW.quantity);
+END !
+DELIMITER ;
+
+
+DELIMITER !
+CREATE TRIGGER trg_catalog_update
+  AFTER UPDATE ON product_inventory FOR EACH ROW
+BEGIN
+  IF NEW.product_price <> OLD.product_price
+     OR NEW.product_name <> OLD.product_name THEN
+    CALL bump_catalog_version();
+    CALL record_product_change(NEW.product_id);
+  END IF;
+  IF NOT (NEW.quantity <=> OLD.quantity) THEN
+    CALL record_inventory_change(NEW.product_id, NEW.quantity, NEW.quantity - OLD.quantity);
+  END IF;
+END !
+DELIMITER ;
+
+
+DELIMITER !
+CREATE TRIGGER trg_catalog_delete
+  AFTER DELETE ON product_inventory FOR EACH ROW
+BEGIN
+  CALL bump_catalog_version();
+  CALL record_product_change(OLD.product_id);
+  CALL record_inventory_change(OLD.product_id, NULL, -OLD.quantity);
+END !
+DELIMITER ;
+
+
+-- Sets moving to another theme, and renamed themes, also change
+-- what theme searches return.
+DELIMITER !
+CREATE TRIGGER trg_catalog_set_update
+  AFTER UPDATE ON lego_sets FOR EACH ROW
+BEGIN
+  IF NOT (NEW.theme_id <=> OLD.theme_id) THEN
+    CALL bump_catalog_version();
+  END IF;
+END !
+DELIMITER ;
+
+
+DELIMITER !
+CREATE TRIGGER trg_catalog_theme_update
+  AFTER UPDATE ON themes FOR EACH ROW
+BEGIN
+  CALL bump_catalog_version();
+END !
+DELIMITER ;
+
+
+-- -------------- ACTION 2: RATING SUMMARY ----------------------
+-- Adds (or, with negative deltas, removes) one review's contribution
+-- to its product's running totals.
+DELIMITER !
+CREATE PROCEDURE apply_review_to_summary(
+  IN purchase_id BIGINT UNSIGNED,
+  IN count_delta INT,
+  IN rating_delta INT
+)
+BEGIN
+  DECLARE reviewed_product_id INT;
+
+  SELECT purchases.product_id INTO reviewed_product_id
+  FROM purchases WHERE purchase_id=purchases.purchase_id;
+
+  IF reviewed_product_id IS NOT NULL THEN
+    INSERT INTO product_rating_summary
+      VALUES (reviewed_product_id, count_delta, rating_delta)
+    ON DUPLICATE KEY UPDATE
+      review_count=review_count + count_delta,
+      rating_sum=rating_sum + rating_delta;
+  END IF;
+END !
+DELIMITER ;
+
+
+-- Triggers to keep product_rating_summary in step with reviews.
+-- Note: rows removed by ON DELETE CASCADE don't fire triggers, so
+-- rebuild_rating_summary should be run after deleting purchases.
+DELIMITER !
+CREATE TRIGGER trg_review_insert
+  AFTER INSERT ON reviews FOR EACH ROW
+BEGIN
+  CALL apply_review_to_summary(NEW.purchase_id, 1, NEW.rating);
+END !
+DELIMITER ;
+
+
+DELIMITER !
+CREATE TRIGGER trg_review_update
+  AFTER UPDATE ON reviews FOR EACH ROW
+BEGIN
+  IF NEW.rating <> OLD.rating OR NEW.purchase_id <> OLD.purchase_id THEN
+    CALL apply_review_to_summary(OLD.purchase_id, -1, -OLD.rating);
+    CALL apply_review_to_summary(NEW.purchase_id, 1, NEW.rating);
+  END IF;
+END !
+DELIMITER ;
+
+
+DELIMITER !
+CREATE TRIGGER trg_review_delete
+  AFTER DELETE ON reviews FOR EACH ROW
+BEGIN
+  CALL apply_review_to_summary(OLD.purchase_id, -1, -OLD.rating);
+END !
+DELIMITER ;
+
+
+-- Recomputes product_rating_summary from reviews in bulk.
+-- Returns how many products' summaries differ from the recomputed
+-- values, and the recomputed rows that differ.
+-- If fix_drift is 1, the summary is then replaced by the recomputed values;
+-- that is refused once months have been archived, since their reviews
+-- would drop out of it.
+DELIMITER !
+CREATE PROCEDURE rebuild_rating_summary(
+  IN fix_drift TINYINT,
+  OUT drifted_products INT
+)
+BEGIN
+  IF fix_drift = 1 AND EXISTS (SELECT * FROM archived_partitions) THEN
+    SIGNAL SQLSTATE '45000'
+      SET MESSAGE_TEXT = 'Rebuilding product_rating_summary would drop the archived months (see archived_partitions)';
+  END IF;
+
+  DROP TEMPORARY TABLE IF EXISTS recomputed_rating_summary;
+  CREATE TEMPORARY TABLE recomputed_rating_summary (
+    product_id INT PRIMARY KEY,
+    review_count INT NOT NULL,
+    rating_sum INT NOT NULL
+  );
+
+  INSERT INTO recomputed_rating_summary
+    SELECT purchases.product_id, COUNT(*), SUM(rating)
+    FROM reviews JOIN purchases ON (reviews.purchase_id=purchases.purchase_id)
+    GROUP BY purchases.product_id;
+
+  -- Products whose stored totals are missing, stale, or shouldn't exist.
+  -- (Two inserts, since MySQL can't open a temporary table twice in one query.)
+  DROP TEMPORARY TABLE IF EXISTS rating_summary_drift;
+  CREATE TEMPORARY TABLE rating_summary_drift (
+    product_id INT PRIMARY KEY,
+    stored_count INT,
+    actual_count INT NOT NULL,
+    stored_sum INT,
+    actual_sum INT NOT NULL
+  );
+
+  INSERT INTO rating_summary_drift
+    SELECT r.product_id, s.review_count, r.review_count, s.rating_sum, r.rating_sum
+    FROM recomputed_rating_summary r
+      LEFT JOIN product_rating_summary s ON (r.product_id=s.product_id)
+    WHERE NOT (s.review_count <=> r.review_count AND s.rating_sum <=> r.rating_sum);
+
+  INSERT INTO rating_summary_drift
+    SELECT s.product_id, s.review_count, 0, s.rating_sum, 0
+    FROM product_rating_summary s
+      LEFT JOIN recomputed_rating_summary r ON (r.product_id=s.product_id)
+    WHERE r.product_id IS NULL AND s.review_count <> 0;
+
+  SELECT COUNT(*) INTO drifted_products FROM rating_summary_drift;
+  SELECT * FROM rating_summary_drift ORDER BY product_id;
+
+  IF fix_drift = 1 THEN
+    DELETE FROM product_rating_summary;
+    INSERT INTO product_rating_summary
+      SELECT product_id, review_count, rating_sum FROM recomputed_rating_summary;
+  END IF;
+
+  DROP TEMPORARY TABLE rating_summary_drift;
+  DROP TEMPORARY TABLE recomputed_rating_summary;
+END !
+DELIMITER ;
+
+
+-- -------------- THEME HIERARCHY ----------------------
+-- Rebuilds theme_closure from themes.parent_id, one level of depth per
+-- pass (MySQL 5.7 has no recursive queries). Top-level themes are their
+-- own parents. The hierarchy is only a few levels deep, so this is a
+-- handful of INSERT ... SELECTs.
+DELIMITER !
+CREATE PROCEDURE rebuild_theme_closure()
+BEGIN
+  DECLARE current_depth INT DEFAULT 0;
+  DECLARE num_added INT DEFAULT 1;
+
+  DELETE FROM theme_closure;
+  INSERT INTO theme_closure
+    SELECT theme_id, theme_id, 0 FROM themes;
+
+  -- The depth limit stops a parent_id cycle from looping forever.
+  WHILE num_added > 0 AND current_depth < 100 DO
+    INSERT INTO theme_closure
+      SELECT theme_closure.ancestor_id, themes.theme_id, current_depth + 1
+      FROM theme_closure JOIN themes ON (themes.parent_id=theme_closure.descendant_id)
+      WHERE theme_closure.depth=current_depth AND themes.theme_id<>themes.parent_id;
+    SET num_added=ROW_COUNT();
+    SET current_depth=current_depth + 1;
+  END WHILE;
+END !
+DELIMITER ;
+
+
+-- --------------------- SECTION 5: REPORTS ---------------------
+
+-- -------------- ACTION 1: MATERIALIZED REPORTS ----------------------
+-- Adds the purchases, reviews and sets made since the last refresh to
+-- the report tables, and moves each watermark past them, so a refresh
+-- costs as much as the new rows, not the whole history. Only the report
+-- tables are written. Rows edited or deleted after they were counted
+-- aren't seen; rebuild=1 empties the reports and recounts everything,
+-- and is refused once months have been archived.
+-- The new_* OUT parameters are the numbers of rows added.
+DELIMITER !
+CREATE PROCEDURE refresh_reports(
+  IN rebuild TINYINT,
+  OUT new_purchases INT,
+  OUT new_reviews INT,
+  OUT new_sets INT
+)
+BEGIN
+  DECLARE old_seq BIGINT UNSIGNED;
+  DECLARE new_seq BIGINT UNSIGNED;
+
+  IF rebuild AND EXISTS (SELECT * FROM archived_partitions) THEN
+    SIGNAL SQLSTATE '45000'
+      SET MESSAGE_TEXT = 'Rebuilding the reports would drop the archived months (see archived_partitions)';
+  END IF;
+
+  IF rebuild THEN
+    DELETE FROM report_customer_spend;
+    DELETE FROM report_product_ratings;
+    DELETE FROM report_theme_sets;
+    UPDATE report_watermarks SET last_seq=0;
+  END IF;
+
+  -- Each source: lock its watermark (so refreshes run one at a time),
+  -- find the new rows, fold them in, move the watermark. The new rows
+  -- are read with a locking read, which waits for transactions still
+  -- inserting lower IDs, so no row commits behind the watermark.
+
+  -- Spend per customer, from purchases.
+  SELECT last_seq INTO old_seq FROM report_watermarks
+  WHERE source_table='purchases' FOR UPDATE;
+  SELECT COUNT(*), IFNULL(MAX(purchase_id), old_seq) INTO new_purchases, new_seq
+  FROM purchases WHERE purchase_id > old_seq LOCK IN SHARE MODE;
+
+  INSERT INTO report_customer_spend
+    SELECT * FROM (
+      SELECT customer_username, COUNT(*) AS num_purchases,
+             SUM(purchase_item_total) AS total_spent
+      FROM purchases
+      WHERE purchase_id > old_seq AND purchase_id <= new_seq
+        AND customer_username IS NOT NULL
+      GROUP BY customer_username) AS added
+  ON DUPLICATE KEY UPDATE
+    num_purchases=report_customer_spend.num_purchases + added.num_purchases,
+    total_spent=report_customer_spend.total_spent + added.total_spent;
+  UPDATE report_watermarks SET last_seq=new_seq WHERE source_table='purchases';
+
+  -- Average rating per product, from reviews.
+  SELECT last_seq INTO old_seq FROM report_watermarks
+  WHERE source_table='reviews' FOR UPDATE;
+  SELECT COUNT(*), IFNULL(MAX(review_seq), old_seq) INTO new_reviews, new_seq
+  FROM reviews WHERE review_seq > old_seq LOCK IN SHARE MODE;
+
+  INSERT INTO report_product_ratings
+    SELECT * FROM (
+      SELECT product_id, COUNT(*) AS review_count, SUM(rating) AS rating_sum
+      FROM reviews JOIN purchases ON (reviews.purchase_id=purchases.purchase_id)
+      WHERE review_seq > old_seq AND review_seq <= new_seq
+        AND product_id IS NOT NULL
+      GROUP BY product_id) AS added
+  ON DUPLICATE KEY UPDATE
+    review_count=report_product_ratings.review_count + added.review_count,
+    rating_sum=report_product_ratings.rating_sum + added.rating_sum;
+  UPDATE report_watermarks SET last_seq=new_seq WHERE source_table='reviews';
+
+  -- Sets per theme, from lego_sets.
+  SELECT last_seq INTO old_seq FROM report_watermarks
+  WHERE source_table='lego_sets' FOR UPDATE;
+  SELECT COUNT(*), IFNULL(MAX(set_seq), old_seq) INTO new_sets, new_seq
+  FROM lego_sets WHERE set_seq > old_seq LOCK IN SHARE MODE;
+
+  INSERT INTO report_theme_sets
+    SELECT * FROM (
+      SELECT theme_id, COUNT(*) AS num_sets
+      FROM lego_sets
+      WHERE set_seq > old_seq AND set_seq <= new_seq AND theme_id IS NOT NULL
+      GROUP BY theme_id) AS added
+  ON DUPLICATE KEY UPDATE
+    num_sets=report_theme_sets.num_sets + added.num_sets;
+  UPDATE report_watermarks SET last_seq=new_seq WHERE source_table='lego_sets';
+END !
+DELIMITER ;
+
+
+-- --------------------- BUILD DERIVED TABLES ---------------------
+-- Summaries for the data that was loaded before these triggers existed.
+CALL rebuild_rating_summary(1, @drifted_products);
+CALL rebuild_revenue_ledger();
+CALL rebuild_theme_closure();
+CALL refresh_reports(1, @new_purchases, @new_reviews, @new_sets);
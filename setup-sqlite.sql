@@ -0,0 +1,445 @@
+-- SQLite version of setup.sql, used by the in-process SQLite backend
+-- (backends.py). Column comments are in setup.sql; this file only notes
+-- where SQLite differs.
+--
+-- Differences from MySQL:
+--   - Strings compared with = use COLLATE NOCASE where MySQL's default
+--     case-insensitive collation matters (usernames, theme names).
+--   - DECIMAL columns are read back as decimal.Decimal by backends.py.
+--   - Timestamps are stored as 'YYYY-MM-DD HH:MM:SS' text.
+--   - The triggers from setup-routines.sql are written out in full here,
+--     since SQLite triggers can't call procedures.
+--   - theme_closure is built with a recursive query (backends.py) instead
+--     of rebuild_theme_closure's loop.
+--   - SQLite only numbers primary keys by itself, so triggers number the
+--     SERIAL columns set_seq and review_seq.
+--   - user_info is from setup-passwords.sql; backends.py adds the same
+--     users and hashes passwords the same way as sp_add_user.
+
+-- DROP TABLE commands:
+DROP TABLE IF EXISTS recommendation_state;
+DROP TABLE IF EXISTS product_interaction_norms;
+DROP TABLE IF EXISTS product_pair_sums;
+DROP TABLE IF EXISTS product_neighbors;
+DROP TABLE IF EXISTS user_info;
+DROP TABLE IF EXISTS report_watermarks;
+DROP TABLE IF EXISTS report_theme_sets;
+DROP TABLE IF EXISTS report_product_ratings;
+DROP TABLE IF EXISTS report_customer_spend;
+DROP TABLE IF EXISTS product_rating_summary;
+DROP TABLE IF EXISTS revenue_total_shards;
+DROP TABLE IF EXISTS revenue_product_daily;
+DROP TABLE IF EXISTS revenue_daily;
+DROP TABLE IF EXISTS reviews;
+DROP TABLE IF EXISTS purchases;
+DROP TABLE IF EXISTS employee_log;
+DROP TABLE IF EXISTS requests;
+DROP TABLE IF EXISTS lego_parts;
+DROP TABLE IF EXISTS lego_sets;
+DROP TABLE IF EXISTS theme_closure;
+DROP TABLE IF EXISTS themes;
+DROP TABLE IF EXISTS categories;
+DROP TABLE IF EXISTS product_inventory;
+DROP TABLE IF EXISTS customers;
+DROP TABLE IF EXISTS discounts;
+DROP TABLE IF EXISTS employees;
+DROP TABLE IF EXISTS catalog_version;
+DROP TABLE IF EXISTS product_changes;
+DROP TABLE IF EXISTS inventory_trim_state;
+DROP TABLE IF EXISTS inventory_changes;
+
+-- CREATE TABLE commands:
+CREATE TABLE themes (
+  theme_id INTEGER PRIMARY KEY,
+  theme_name VARCHAR(70) NOT NULL COLLATE NOCASE,
+  parent_id INTEGER
+);
+
+CREATE TABLE theme_closure (
+  ancestor_id INTEGER,
+  descendant_id INTEGER,
+  depth INTEGER NOT NULL,
+  PRIMARY KEY (ancestor_id, descendant_id),
+  FOREIGN KEY (ancestor_id) REFERENCES themes(theme_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (descendant_id) REFERENCES themes(theme_id)
+    ON DELETE CASCADE
+);
+
+CREATE TABLE categories (
+  category_id INTEGER PRIMARY KEY,
+  category_name VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE product_inventory (
+  product_id INTEGER PRIMARY KEY,
+  product_price DECIMAL(6, 2) NOT NULL,
+  product_name VARCHAR(255) NOT NULL,
+  quantity INTEGER NOT NULL
+);
+
+CREATE TABLE lego_sets (
+  product_id INTEGER PRIMARY KEY,
+  num_parts INTEGER NOT NULL,
+  time_to_complete INTEGER NOT NULL,
+  year_released INTEGER NOT NULL,
+  theme_id INTEGER,
+  set_seq INTEGER UNIQUE,
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+      ON DELETE CASCADE,
+  FOREIGN KEY (theme_id) REFERENCES themes(theme_id)
+      ON DELETE CASCADE
+);
+
+CREATE TABLE lego_parts (
+  product_id INTEGER PRIMARY KEY,
+  category_id INTEGER,
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+      ON DELETE CASCADE,
+  FOREIGN KEY (category_id) REFERENCES categories(category_id)
+      ON DELETE CASCADE
+);
+
+CREATE TABLE discounts (
+  member_type CHAR(1) PRIMARY KEY,
+  discount_amount INTEGER NOT NULL,
+  CHECK(member_type IN ('V', 'R')),
+  CHECK(discount_amount >=0 AND discount_amount <= 100)
+);
+
+CREATE TABLE customers (
+  customer_username VARCHAR(50) PRIMARY KEY COLLATE NOCASE,
+  customer_name VARCHAR(100) NOT NULL,
+  customer_email VARCHAR(50) NOT NULL,
+  member_type CHAR(1),
+  FOREIGN KEY (member_type) REFERENCES discounts(member_type)
+    ON UPDATE CASCADE
+    ON DELETE CASCADE
+);
+
+-- INTEGER PRIMARY KEY is SQLite's auto-increment column (SERIAL in MySQL).
+CREATE TABLE purchases (
+  purchase_id INTEGER PRIMARY KEY,
+  product_id INTEGER,
+  customer_username VARCHAR(50) COLLATE NOCASE,
+  purchase_item_total DECIMAL(6, 2) NOT NULL,
+  purchase_time TIMESTAMP NOT NULL,
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (customer_username) REFERENCES customers(customer_username)
+    ON DELETE CASCADE
+);
+
+CREATE TABLE reviews (
+  purchase_id INTEGER PRIMARY KEY,
+  customer_username VARCHAR(50) COLLATE NOCASE,
+  review_time TIMESTAMP NOT NULL,
+  rating INTEGER NOT NULL,
+  review VARCHAR(500),
+  review_seq INTEGER UNIQUE,
+  FOREIGN KEY (purchase_id) REFERENCES purchases(purchase_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (customer_username) REFERENCES customers(customer_username)
+    ON UPDATE CASCADE
+    ON DELETE CASCADE,
+  CHECK (rating <= 5 AND rating >= 1)
+);
+
+CREATE TABLE product_rating_summary (
+  product_id INTEGER PRIMARY KEY,
+  review_count INTEGER NOT NULL,
+  rating_sum INTEGER NOT NULL,
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE
+);
+
+CREATE TABLE revenue_product_daily (
+  revenue_date DATE,
+  product_id INTEGER,
+  purchase_count INTEGER NOT NULL,
+  revenue DECIMAL(14, 2) NOT NULL,
+  PRIMARY KEY (revenue_date, product_id),
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE
+);
+
+-- SQLite has one writer at a time, so the total needs only shard 0.
+CREATE TABLE revenue_total_shards (
+  shard INTEGER PRIMARY KEY,
+  purchase_count INTEGER NOT NULL,
+  revenue DECIMAL(14, 2) NOT NULL
+);
+
+INSERT INTO revenue_total_shards VALUES (0, 0, 0);
+
+CREATE TABLE requests (
+  request_id INTEGER PRIMARY KEY,
+  product_id INTEGER,
+  customer_username VARCHAR(50) COLLATE NOCASE,
+  request_status CHAR(1) NOT NULL,
+  request_time TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (customer_username) REFERENCES customers(customer_username)
+    ON UPDATE CASCADE
+    ON DELETE CASCADE,
+  CHECK(request_status IN ('F', 'P', 'U'))
+);
+
+CREATE TABLE employees (
+  employee_username VARCHAR(50) PRIMARY KEY COLLATE NOCASE,
+  employee_name VARCHAR(100) NOT NULL,
+  employee_permissions VARCHAR(2) NOT NULL,
+  CHECK ((employee_permissions) IN ('R', 'W', 'RW'))
+);
+
+CREATE TABLE employee_log (
+  request_id INTEGER,
+  employee_username VARCHAR(50) COLLATE NOCASE,
+  log_time TIMESTAMP NOT NULL,
+  change_made VARCHAR(255) NOT NULL,
+  PRIMARY KEY (request_id, employee_username),
+  FOREIGN KEY (request_id) REFERENCES requests(request_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (employee_username) REFERENCES employees(employee_username)
+    ON UPDATE CASCADE
+    ON DELETE CASCADE
+);
+
+CREATE TABLE catalog_version (
+  version_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL
+);
+
+INSERT INTO catalog_version VALUES (1, 1);
+
+CREATE TABLE product_changes (
+  change_id INTEGER PRIMARY KEY,
+  product_id INTEGER NOT NULL
+);
+
+CREATE TABLE inventory_changes (
+  change_id INTEGER PRIMARY KEY,
+  product_id INTEGER NOT NULL,
+  quantity INTEGER,
+  delta INTEGER NOT NULL,
+  change_time TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE inventory_trim_state (
+  state_id INTEGER PRIMARY KEY,
+  trimmed_upto INTEGER NOT NULL
+);
+
+INSERT INTO inventory_trim_state VALUES (1, 0);
+
+CREATE TABLE report_watermarks (
+  source_table VARCHAR(20) PRIMARY KEY,
+  last_seq INTEGER NOT NULL
+);
+
+INSERT INTO report_watermarks VALUES ('purchases', 0), ('reviews', 0), ('lego_sets', 0);
+
+CREATE TABLE report_theme_sets (
+  theme_id INTEGER PRIMARY KEY,
+  num_sets INTEGER NOT NULL
+);
+
+CREATE TABLE report_product_ratings (
+  product_id INTEGER PRIMARY KEY,
+  review_count INTEGER NOT NULL,
+  rating_sum INTEGER NOT NULL
+);
+
+CREATE TABLE report_customer_spend (
+  customer_username VARCHAR(50) PRIMARY KEY COLLATE NOCASE,
+  num_purchases INTEGER NOT NULL,
+  total_spent DECIMAL(14, 2) NOT NULL
+);
+
+CREATE TABLE product_neighbors (
+  product_id INTEGER,
+  neighbor_id INTEGER,
+  score DOUBLE NOT NULL,
+  PRIMARY KEY (product_id, neighbor_id),
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (neighbor_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE
+);
+
+CREATE TABLE product_interaction_norms (
+  product_id INTEGER PRIMARY KEY,
+  norm_sq DOUBLE NOT NULL,
+  buyers INTEGER NOT NULL
+);
+
+CREATE TABLE product_pair_sums (
+  product_id INTEGER,
+  neighbor_id INTEGER,
+  dot DOUBLE NOT NULL,
+  PRIMARY KEY (product_id, neighbor_id)
+);
+
+CREATE TABLE recommendation_state (
+  state_id INTEGER PRIMARY KEY,
+  last_purchase_id INTEGER NOT NULL,
+  last_review_seq INTEGER NOT NULL,
+  version INTEGER NOT NULL
+);
+
+INSERT INTO recommendation_state VALUES (1, 0, 0, 0);
+
+CREATE TABLE user_info (
+  username VARCHAR(20) PRIMARY KEY COLLATE NOCASE,
+  salt CHAR(8) NOT NULL,
+  password_hash CHAR(64) NOT NULL
+);
+
+CREATE INDEX idx_theme_name ON themes(theme_name);
+CREATE INDEX idx_theme_descendant ON theme_closure(descendant_id, ancestor_id);
+-- MySQL indexes foreign keys automatically; SQLite needs these for theme
+-- lookups, for deleting a product's neighbor rows, and for finding the
+-- lists and pair sums a product is in (recommendations.py).
+CREATE INDEX idx_set_theme ON lego_sets(theme_id, product_id);
+CREATE INDEX idx_neighbor ON product_neighbors(neighbor_id);
+CREATE INDEX idx_pair_neighbor ON product_pair_sums(neighbor_id);
+CREATE INDEX idx_purchase_product ON purchases(product_id);
+CREATE INDEX idx_prod_price ON product_inventory(product_price);
+CREATE INDEX idx_purchase_customer ON purchases(customer_username, purchase_id);
+CREATE INDEX idx_request_status
+  ON requests(request_status, request_id, product_id, customer_username, request_time);
+CREATE INDEX idx_request_product
+  ON requests(request_status, product_id, request_id, customer_username, request_time);
+
+
+-- TRIGGERS (see setup-routines.sql):
+
+-- trg_purchase_insert / trg_purchase_delete: record_purchase_revenue.
+CREATE TRIGGER trg_purchase_insert
+  AFTER INSERT ON purchases FOR EACH ROW
+BEGIN
+  INSERT INTO revenue_product_daily
+    VALUES (DATE(NEW.purchase_time), NEW.product_id, 1, NEW.purchase_item_total)
+  ON CONFLICT (revenue_date, product_id) DO UPDATE SET
+    purchase_count=purchase_count + 1,
+    revenue=ROUND(revenue + NEW.purchase_item_total, 2);
+  UPDATE revenue_total_shards
+  SET purchase_count=purchase_count + 1,
+      revenue=ROUND(revenue + NEW.purchase_item_total, 2)
+  WHERE shard=0;
+END;
+
+CREATE TRIGGER trg_purchase_delete
+  AFTER DELETE ON purchases FOR EACH ROW
+BEGIN
+  UPDATE revenue_product_daily
+  SET purchase_count=purchase_count - 1,
+      revenue=ROUND(revenue - OLD.purchase_item_total, 2)
+  WHERE revenue_date=DATE(OLD.purchase_time) AND product_id=OLD.product_id;
+  UPDATE revenue_total_shards
+  SET purchase_count=purchase_count - 1,
+      revenue=ROUND(revenue - OLD.purchase_item_total, 2)
+  WHERE shard=0;
+END;
+
+-- trg_review_insert / update / delete: apply_review_to_summary.
+CREATE TRIGGER trg_review_insert
+  AFTER INSERT ON reviews FOR EACH ROW
+BEGIN
+  INSERT INTO product_rating_summary
+    SELECT product_id, 1, NEW.rating FROM purchases
+    WHERE purchase_id=NEW.purchase_id AND product_id IS NOT NULL
+  ON CONFLICT (product_id) DO UPDATE SET
+    review_count=review_count + 1,
+    rating_sum=rating_sum + NEW.rating;
+END;
+
+CREATE TRIGGER trg_review_update
+  AFTER UPDATE ON reviews FOR EACH ROW
+  WHEN NEW.rating <> OLD.rating OR NEW.purchase_id <> OLD.purchase_id
+BEGIN
+  UPDATE product_rating_summary
+  SET review_count=review_count - 1, rating_sum=rating_sum - OLD.rating
+  WHERE product_id=(SELECT product_id FROM purchases WHERE purchase_id=OLD.purchase_id);
+
+  INSERT INTO product_rating_summary
+    SELECT product_id, 1, NEW.rating FROM purchases
+    WHERE purchase_id=NEW.purchase_id AND product_id IS NOT NULL
+  ON CONFLICT (product_id) DO UPDATE SET
+    review_count=review_count + 1,
+    rating_sum=rating_sum + NEW.rating;
+END;
+
+CREATE TRIGGER trg_review_delete
+  AFTER DELETE ON reviews FOR EACH ROW
+BEGIN
+  UPDATE product_rating_summary
+  SET review_count=review_count - 1, rating_sum=rating_sum - OLD.rating
+  WHERE product_id=(SELECT product_id FROM purchases WHERE purchase_id=OLD.purchase_id);
+END;
+
+-- trg_set_seq / trg_review_seq: number rows like MySQL's SERIAL.
+CREATE TRIGGER trg_set_seq
+  AFTER INSERT ON lego_sets FOR EACH ROW WHEN NEW.set_seq IS NULL
+BEGIN
+  UPDATE lego_sets SET set_seq=(SELECT IFNULL(MAX(set_seq), 0) + 1 FROM lego_sets)
+  WHERE product_id=NEW.product_id;
+END;
+
+CREATE TRIGGER trg_review_seq
+  AFTER INSERT ON reviews FOR EACH ROW WHEN NEW.review_seq IS NULL
+BEGIN
+  UPDATE reviews SET review_seq=(SELECT IFNULL(MAX(review_seq), 0) + 1 FROM reviews)
+  WHERE purchase_id=NEW.purchase_id;
+END;
+
+-- trg_catalog_*: bump_catalog_version, record_product_change and
+-- record_inventory_change.
+CREATE TRIGGER trg_catalog_insert
+  AFTER INSERT ON product_inventory FOR EACH ROW
+BEGIN
+  UPDATE catalog_version SET version=version + 1 WHERE version_id=1;
+  INSERT INTO product_changes (product_id) VALUES (NEW.product_id);
+  INSERT INTO inventory_changes (product_id, quantity, delta)
+    VALUES (NEW.product_id, NEW.quantity, NEW.quantity);
+END;
+
+CREATE TRIGGER trg_catalog_update
+  AFTER UPDATE ON product_inventory FOR EACH ROW
+  WHEN NEW.product_price <> OLD.product_price OR NEW.product_name <> OLD.product_name
+BEGIN
+  UPDATE catalog_version SET version=version + 1 WHERE version_id=1;
+  INSERT INTO product_changes (product_id) VALUES (NEW.product_id);
+END;
+
+CREATE TRIGGER trg_catalog_delete
+  AFTER DELETE ON product_inventory FOR EACH ROW
+BEGIN
+  UPDATE catalog_version SET version=version + 1 WHERE version_id=1;
+  INSERT INTO product_changes (product_id) VALUES (OLD.product_id);
+  INSERT INTO inventory_changes (product_id, quantity, delta)
+    VALUES (OLD.product_id, NULL, -OLD.quantity);
+END;
+
+-- trg_catalog_update's quantity branch: an SQLite trigger has one WHEN.
+CREATE TRIGGER trg_catalog_quantity_update
+  AFTER UPDATE ON product_inventory FOR EACH ROW
+  WHEN NEW.quantity IS NOT OLD.quantity
+BEGIN
+  INSERT INTO inventory_changes (product_id, quantity, delta)
+    VALUES (NEW.product_id, NEW.quantity, NEW.quantity - OLD.quantity);
+END;
+
+CREATE TRIGGER trg_catalog_set_update
+  AFTER UPDATE ON lego_sets FOR EACH ROW
+  WHEN NEW.theme_id IS NOT OLD.theme_id
+BEGIN
+  UPDATE catalog_version SET version=version + 1 WHERE version_id=1;
+END;
+
+CREATE TRIGGER trg_catalog_theme_update
+  AFTER UPDATE ON themes FOR EACH ROW
+BEGIN
+  UPDATE catalog_version SET version=version + 1 WHERE version_id=1;
+END;
@@ -1,16 +1,35 @@
 -- DROP TABLE commands:
+DROP TABLE IF EXISTS recommendation_state;
+DROP TABLE IF EXISTS product_interaction_norms;
+DROP TABLE IF EXISTS product_pair_sums;
+DROP TABLE IF EXISTS product_neighbors;
+DROP TABLE IF EXISTS archived_partitions;
+DROP TABLE IF EXISTS report_watermarks;
+DROP TABLE IF EXISTS report_theme_sets;
+DROP TABLE IF EXISTS report_product_ratings;
+DROP TABLE IF EXISTS report_customer_spend;
+DROP TABLE IF EXISTS product_rating_summary;
+DROP TABLE IF EXISTS revenue_total_shards;
+DROP TABLE IF EXISTS revenue_product_daily;
+DROP TABLE IF EXISTS revenue_daily;
+DROP TABLE IF EXISTS review_keys;
 DROP TABLE IF EXISTS reviews; 
 DROP TABLE IF EXISTS purchases;
 DROP TABLE IF EXISTS employee_log;
 DROP TABLE IF EXISTS requests;
 DROP TABLE IF EXISTS lego_parts; 
 DROP TABLE IF EXISTS lego_sets; 
+DROP TABLE IF EXISTS theme_closure;
 DROP TABLE IF EXISTS themes;
 DROP TABLE IF EXISTS categories; 
 DROP TABLE IF EXISTS product_inventory;
 DROP TABLE IF EXISTS customers;
 DROP TABLE IF EXISTS discounts;
 DROP TABLE IF EXISTS employees;
+DROP TABLE IF EXISTS catalog_version;
+DROP TABLE IF EXISTS product_changes;
+DROP TABLE IF EXISTS inventory_trim_state;
+DROP TABLE IF EXISTS inventory_changes;
 
 -- CREATE TABLE commands:
 
@@ -27,6 +46,27 @@ CREATE TABLE themes (
 );
 
 
+-- Every (ancestor, descendant) pair of themes, including each theme with
+-- itself at depth 0, so a theme's whole subtree is one indexed join.
+-- Derived from themes.parent_id by rebuild_theme_closure (top-level
+-- themes are their own parents); rebuilt whenever data is loaded.
+CREATE TABLE theme_closure (
+  ancestor_id INT,
+
+  descendant_id INT,
+
+  -- Number of parent links between them.
+  depth INT NOT NULL,
+
+  PRIMARY KEY (ancestor_id, descendant_id),
+
+  FOREIGN KEY (ancestor_id) REFERENCES themes(theme_id)
+    ON DELETE CASCADE,
+  FOREIGN KEY (descendant_id) REFERENCES themes(theme_id)
+    ON DELETE CASCADE
+);
+
+
 -- Categories for the lego parts.
 CREATE TABLE categories (
   -- Unique ID for each category.
@@ -70,6 +110,10 @@ CREATE TABLE lego_sets (
   -- Theme of the set.
   theme_id INT,
 
+  -- Increasing number in the order sets were added, which product IDs
+  -- don't follow. The reports refresh from it (see report_watermarks).
+  set_seq SERIAL,
+
   -- Specialization of product.
   -- No cascade on UPDATE because product IDs don't change often.
   FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
@@ -180,6 +224,10 @@ CREATE TABLE reviews (
   -- Can be NULL.
   review VARCHAR(500),
 
+  -- Increasing number in the order reviews were written, which purchase
+  -- IDs don't follow. The reports refresh from it (see report_watermarks).
+  review_seq SERIAL,
+
   -- Review is only for a given purchase.
   FOREIGN KEY (purchase_id) REFERENCES purchases(purchase_id)
     ON DELETE CASCADE,
@@ -194,6 +242,72 @@ CREATE TABLE reviews (
 );
 
 
+-- Running review totals for each reviewed product.
+-- Kept up to date by triggers on reviews, so average ratings can be
+-- read from one row instead of aggregating every review.
+CREATE TABLE product_rating_summary (
+  -- Product that was reviewed.
+  product_id INT PRIMARY KEY,
+
+  -- Number of reviews for the product.
+  review_count INT NOT NULL,
+
+  -- Sum of the ratings of those reviews.
+  -- Average rating is rating_sum / review_count.
+  rating_sum INT NOT NULL,
+
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE
+);
+
+
+-- Revenue per product per day.
+-- Kept up to date by triggers on purchases, so revenue totals, date
+-- ranges and themes don't need to scan every purchase. There is no
+-- per-day total row: every purchase would update the same row for today,
+-- and concurrent purchases would queue on its lock (the all-time total is
+-- sharded instead; see revenue_total_shards).
+CREATE TABLE revenue_product_daily (
+  -- Day the purchases were made.
+  revenue_date DATE,
+
+  -- Product that was purchased.
+  product_id INT,
+
+  -- Number of purchases of the product that day.
+  purchase_count INT NOT NULL,
+
+  -- Sum of purchase_item_total for the product that day.
+  revenue NUMERIC(14, 2) NOT NULL,
+
+  PRIMARY KEY (revenue_date, product_id),
+
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE
+);
+
+
+-- All-time revenue, split over 16 shards so show_total_revenue reads 16
+-- rows instead of the whole rollup. Each purchase updates the shard
+-- picked by its connection (CONNECTION_ID() % 16), so concurrent
+-- purchases from different connections don't queue on one row's lock.
+-- The total is the sum of the shards.
+CREATE TABLE revenue_total_shards (
+  -- 0 to 15.
+  shard TINYINT PRIMARY KEY,
+
+  -- Number of purchases counted in this shard.
+  purchase_count INT NOT NULL,
+
+  -- Sum of their purchase_item_total.
+  revenue NUMERIC(14, 2) NOT NULL
+);
+
+INSERT INTO revenue_total_shards VALUES
+  (0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0), (4, 0, 0), (5, 0, 0), (6, 0, 0), (7, 0, 0),
+  (8, 0, 0), (9, 0, 0), (10, 0, 0), (11, 0, 0), (12, 0, 0), (13, 0, 0), (14, 0, 0), (15, 0, 0);
+
+
 -- Request made for ONE product.
 -- Possible idea: Check that each product requested has 0 inventory.
 CREATE TABLE requests (
@@ -210,6 +324,9 @@ CREATE TABLE requests (
   -- Fulfilled: 'F', In Progress: 'P', Unfulfilled: 'U'
   request_status CHAR(1) NOT NULL,
 
+  -- Time the request was made.
+  request_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
   FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
     ON DELETE CASCADE,
   FOREIGN KEY (customer_username) REFERENCES customers(customer_username)
@@ -259,5 +376,201 @@ CREATE TABLE employee_log (
     ON DELETE CASCADE
 );
 
+-- Version counter for the product catalog (prices, names, set themes).
+-- Bumped whenever catalog data changes, so in-process caches of the
+-- catalog know when to reload.
+CREATE TABLE catalog_version (
+  -- Always 1; this table holds a single row.
+  version_id TINYINT PRIMARY KEY,
+
+  -- Incremented on every catalog change.
+  version BIGINT UNSIGNED NOT NULL
+);
+
+INSERT INTO catalog_version VALUES (1, 1);
+
+-- Products whose name or price changed (or that were added or removed),
+-- in order. Lets in-process indexes of the catalog (product_search.py)
+-- update just those products instead of reloading everything.
+-- No foreign key, since deleted products are logged too.
+CREATE TABLE product_changes (
+  -- Increasing change number.
+  change_id SERIAL PRIMARY KEY,
+
+  -- Product that changed.
+  product_id INT NOT NULL
+);
+
+-- Every change to a product's quantity, in order: purchases, fulfilled
+-- requests, and products added or removed. Lets caches of the quantities
+-- (and other consumers) catch up from the last change they saw instead of
+-- re-reading product_inventory (see change_feed.py). Separate from
+-- product_changes, which only logs name and price changes.
+-- No foreign key, since deleted products are logged too.
+CREATE TABLE inventory_changes (
+  -- Increasing change number; the feed's version.
+  change_id SERIAL PRIMARY KEY,
+
+  -- Product whose quantity changed.
+  product_id INT NOT NULL,
+
+  -- Quantity after the change, or NULL if the product was deleted.
+  quantity INT,
+
+  -- How much the quantity changed by.
+  delta INT NOT NULL,
+
+  -- When the change was made.
+  change_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- How far inventory_changes has been trimmed (see change_feed.trim), so a
+-- subscriber stuck at a missing change_id can tell a deleted change from
+-- one still being committed.
+CREATE TABLE inventory_trim_state (
+  -- Always 1; this table holds a single row.
+  state_id TINYINT PRIMARY KEY,
+
+  -- Changes up to this change_id may have been deleted.
+  trimmed_upto BIGINT UNSIGNED NOT NULL
+);
+
+INSERT INTO inventory_trim_state VALUES (1, 0);
+
+-- Materialized reports (see reports.py): the analytics in queries.sql,
+-- kept as totals and refreshed by refresh_reports from the rows added
+-- since the last refresh, so they don't re-aggregate the whole history.
+-- No foreign keys: a report is a snapshot, and archiving old purchases
+-- must not change it.
+
+-- How far each source table has been folded into the reports: the
+-- highest purchase_id, review_seq or set_seq already counted.
+CREATE TABLE report_watermarks (
+  -- 'purchases', 'reviews' or 'lego_sets'.
+  source_table VARCHAR(20) PRIMARY KEY,
+
+  -- Rows with a higher ID are not counted yet.
+  last_seq BIGINT UNSIGNED NOT NULL
+);
+
+INSERT INTO report_watermarks VALUES ('purchases', 0), ('reviews', 0), ('lego_sets', 0);
+
+-- Number of sets directly in each theme.
+CREATE TABLE report_theme_sets (
+  theme_id INT PRIMARY KEY,
+  num_sets INT NOT NULL
+);
+
+-- Review totals for each reviewed product.
+CREATE TABLE report_product_ratings (
+  product_id INT PRIMARY KEY,
+  review_count INT NOT NULL,
+  rating_sum INT NOT NULL
+);
+
+-- Purchase totals for each customer who has bought something.
+CREATE TABLE report_customer_spend (
+  customer_username VARCHAR(50) PRIMARY KEY,
+  num_purchases INT NOT NULL,
+  total_spent NUMERIC(14, 2) NOT NULL
+);
+
+-- Months of purchases and reviews moved out to archive files by
+-- partitions.py archive. The rollups and reports still count them, so
+-- rebuilding those from the live tables would lose them: the rebuild
+-- routines refuse to while this table has rows.
+CREATE TABLE archived_partitions (
+  -- 'purchases' or 'reviews'.
+  table_name VARCHAR(20),
+
+  -- Month partition archived, e.g. p201802.
+  partition_name VARCHAR(10),
+
+  -- Rows written to the archive file.
+  num_rows INT NOT NULL,
+
+  archived_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (table_name, partition_name)
+);
+
+-- Item-to-item recommendations (see recommendations.py): the k most
+-- similar products to each product, from customers who bought (and
+-- reviewed) both, and from sharing a theme or part category.
+CREATE TABLE product_neighbors (
+  -- Product the recommendations are for.
+  product_id INT,
+
+  -- Recommended product.
+  neighbor_id INT,
+
+  -- Higher is more similar.
+  score DOUBLE NOT NULL,
+
+  PRIMARY KEY (product_id, neighbor_id),
+
+  FOREIGN KEY (product_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE,
+
+  FOREIGN KEY (neighbor_id) REFERENCES product_inventory(product_id)
+    ON DELETE CASCADE
+);
+
+-- Per-product totals the similarities are normalized by, kept so
+-- incremental updates don't have to re-read every customer.
+CREATE TABLE product_interaction_norms (
+  product_id INT PRIMARY KEY,
+
+  -- Sum of the squared weights of the product's customers.
+  norm_sq DOUBLE NOT NULL,
+
+  -- Number of customers who bought the product.
+  buyers INT NOT NULL
+);
+
+-- Co-purchase sums behind the scores, so incremental updates add a new
+-- purchase's pairs instead of re-reading its products' customers.
+CREATE TABLE product_pair_sums (
+  -- The pair, with product_id < neighbor_id.
+  product_id INT,
+  neighbor_id INT,
+
+  -- Sum over the customers who bought both of their weights' product.
+  dot DOUBLE NOT NULL,
+
+  PRIMARY KEY (product_id, neighbor_id),
+  INDEX idx_pair_neighbor (neighbor_id)
+);
+
+-- How far purchases and reviews have been folded into product_neighbors.
+CREATE TABLE recommendation_state (
+  -- Always 1; this table holds a single row.
+  state_id TINYINT PRIMARY KEY,
+
+  -- Purchases and reviews with higher IDs are not counted yet.
+  last_purchase_id BIGINT UNSIGNED NOT NULL,
+  last_review_seq BIGINT UNSIGNED NOT NULL,
+
+  -- Incremented on every build or update, so caches know to reload.
+  version BIGINT UNSIGNED NOT NULL
+);
+
+INSERT INTO recommendation_state VALUES (1, 0, 0, 0);
+
 CREATE INDEX idx_theme_name ON themes(theme_name);
-CREATE INDEX idx_prod_price ON product_inventory(product_price);
\ No newline at end of file
+CREATE INDEX idx_theme_descendant ON theme_closure(descendant_id, ancestor_id);
+CREATE INDEX idx_prod_price ON product_inventory(product_price);
+
+-- Point lookups used to validate reviews and request fulfillment, and to
+-- list a customer's purchases without scanning history.
+CREATE INDEX idx_purchase_customer ON purchases(customer_username, purchase_id);
+
+-- The request backlog is paged by (request_status, request_id). Both
+-- indexes hold every column the backlog reads, so pages and per-product
+-- counts are served from the index without touching the table:
+--   idx_request_status   pages, optionally filtered by customer or age
+--   idx_request_product  pages for one product, and counts by product
+CREATE INDEX idx_request_status
+  ON requests(request_status, request_id, product_id, customer_username, request_time);
+CREATE INDEX idx_request_product
+  ON requests(request_status, product_id, request_id, customer_username, request_time);
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+Programmatic API for the lego store.
+
+The same operations the interactive apps offer, without input() or
+print(), so the store can be driven by scripts and batch jobs. Calls go
+to the backend chosen by LEGOS_BACKEND (see backends.py), and are safe to
+make from several threads at once.
+
+Invalid arguments raise ValueError; database failures raise db.Error.
+"""
+
+import datetime
+import decimal
+
+import backends
+import columnar_catalog
+import product_search
+import recommendations
+import sessions
+
+SAMPLE_SIZE = 5
+
+
+def _backend():
+    return backends.get_backend()
+
+
+def _positive_int(value, name):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("{name} must be an integer".format(name=name))
+    if number <= 0:
+        raise ValueError("{name} must be positive".format(name=name))
+    return number
+
+
+def _price(value, name):
+    try:
+        price = decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        raise ValueError("{name} must be a number".format(name=name))
+    if not price.is_finite() or price < 0:
+        raise ValueError("{name} must be a non-negative number".format(name=name))
+    return price
+
+
+# ----------------------------------------------------------------------
+# Customer Queries
+# ----------------------------------------------------------------------
+def search_budget(max_price, k=SAMPLE_SIZE):
+    """
+    Returns up to k random (product_id, product_name, product_price) rows
+    costing at most max_price.
+    """
+    return _backend().sample_sets_max_price(_price(max_price, "max_price"),
+                                            _positive_int(k, "k"))
+
+
+def search_theme(theme_name, k=SAMPLE_SIZE):
+    """
+    Returns up to k random (product_id, product_name, product_price) sets
+    in the named theme.
+    """
+    return _backend().sample_sets_in_theme(theme_name, _positive_int(k, "k"))
+
+
+def search_name(query, max_price=None, in_stock=False, k=10):
+    """
+    Returns up to k (product_id, product_name, product_price) rows whose
+    names best match query, optionally costing at most max_price and in
+    stock. See product_search.py.
+    """
+    if not product_search.tokenize(query):
+        raise ValueError("query must contain a letter or digit")
+    return product_search.get_index().search(query, max_price, in_stock,
+                                             _positive_int(k, "k"))
+
+
+def browse(k=SAMPLE_SIZE, order_by="product_price", descending=False, **filters):
+    """
+    Returns up to k columnar_catalog.Record views of the products passing
+    every filter, cheapest first unless order_by says otherwise. See
+    ColumnarCatalog.select() for the filters.
+    """
+    return columnar_catalog.get_catalog().select(_positive_int(k, "k"), order_by,
+                                                 descending, **filters)
+
+
+def price_and_rating(product_id):
+    """
+    Returns (price, average rating) for a product; rating is 0 if unrated.
+    """
+    return _backend().get_price_and_rating(_positive_int(product_id, "product_id"))
+
+
+def recommend(product_ids, k=SAMPLE_SIZE, in_stock=False):
+    """
+    Returns up to k (product_id, product_name, product_price) rows of the
+    products most similar to product_ids, optionally only those in stock.
+    See recommendations.py.
+    """
+    return recommendations.get_recommender().recommend(
+        [_positive_int(product_id, "product_id") for product_id in product_ids],
+        _positive_int(k, "k"), in_stock)
+
+
+# ----------------------------------------------------------------------
+# Customer Actions
+# ----------------------------------------------------------------------
+def purchase(username, product_id):
+    """
+    Buys one product. Returns an inventory.PurchaseResult.
+    """
+    return _backend().make_purchase(_positive_int(product_id, "product_id"), username)
+
+
+def checkout(username, product_ids):
+    """
+    Buys a cart of products, all or nothing. Returns a checkout.CheckoutResult.
+    """
+    return _backend().checkout_cart([_positive_int(p, "product_id") for p in product_ids],
+                                    username)
+
+
+def request(username, product_id):
+    """
+    Requests more inventory of a product. Returns the new request ID.
+    """
+    return _backend().request_additional_inventory(
+        _positive_int(product_id, "product_id"), username)
+
+
+def review(username, purchase_id, rating, text=""):
+    """
+    Reviews one of username's purchases with a 1-5 rating. Raises
+    ValueError if the purchase isn't theirs or is already reviewed.
+    """
+    purchase_id = _positive_int(purchase_id, "purchase_id")
+    rating = _positive_int(rating, "rating")
+    if rating > 5:
+        raise ValueError("rating must be between 1 and 5")
+    if text is not None and len(text) > 500:
+        raise ValueError("review must be at most 500 characters")
+    reason = _backend().can_review_purchase(purchase_id, username)
+    if reason is not None:
+        raise ValueError(reason)
+    _backend().write_review(purchase_id, rating, text)
+
+
+# ----------------------------------------------------------------------
+# Employee Actions
+# ----------------------------------------------------------------------
+def fulfill(username, request_id):
+    """
+    Fulfills a request, adding one item of its product to inventory, and
+    logs that employee `username` fulfilled it.
+    Raises ValueError if the request doesn't exist or isn't open.
+    """
+    request_id = _positive_int(request_id, "request_id")
+    reason = _backend().fulfill_request(request_id, username)
+    if reason is not None:
+        raise ValueError(reason)
+
+
+def fulfill_bulk(username, product_id=None, request_ids=None, max_requests=None):
+    """
+    Fulfills many open requests in one transaction: all of a product's
+    requests, or those among request_ids, oldest first and at most
+    max_requests of them (e.g. the quantity that arrived).
+    Returns [(request_id, product_id)] for the requests fulfilled.
+    """
+    if product_id is None and request_ids is None:
+        raise ValueError("fulfill_bulk needs a product_id or request_ids")
+    if product_id is not None:
+        product_id = _positive_int(product_id, "product_id")
+    if request_ids is not None:
+        request_ids = [_positive_int(request_id, "request_id") for request_id in request_ids]
+    if max_requests is not None:
+        max_requests = _positive_int(max_requests, "max_requests")
+    return _backend().fulfill_requests_bulk(username, product_id, request_ids, max_requests)
+
+
+def revenue(start_date=None, end_date=None):
+    """
+    Returns (revenue, number of purchases) between two dates (inclusive),
+    or the all-time revenue (and None) if no dates are given.
+    Dates may be datetime.date objects or "YYYY-MM-DD" strings.
+    """
+    if start_date is None and end_date is None:
+        return (_backend().show_total_revenue(), None)
+
+    def to_date(value, default):
+        if value is None:
+            return default
+        if isinstance(value, datetime.date):
+            return value
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+    start = to_date(start_date, datetime.date(1000, 1, 1))
+    end = to_date(end_date, datetime.date.today())
+    return _backend().show_revenue_between(start, end)
+
+
+def revenue_by_theme(start_date, end_date):
+    """
+    Returns (theme_name, num_purchases, revenue) rows between two dates.
+    """
+    return _backend().show_revenue_by_theme(start_date, end_date)
+
+
+# ----------------------------------------------------------------------
+# Sessions
+# ----------------------------------------------------------------------
+def login(username, password, role=sessions.CUSTOMER):
+    """
+    Logs a customer (or, with role sessions.EMPLOYEE, an employee) in and
+    returns a session token. Raises ValueError if the username doesn't
+    have the role, the password is wrong, or there were too many failed
+    logins (see sessions.py).
+    """
+    status, session = sessions.get_manager().login(username, password, role)
+    if status != sessions.OK:
+        raise ValueError("login failed: {status}".format(status=status))
+    return session.token
+
+
+def session_user(token, role=sessions.CUSTOMER):
+    """
+    Returns the username of the session token (from login()), checked in
+    memory. Raises ValueError if it has expired, was ended, or isn't for
+    the role.
+    """
+    session = sessions.get_manager().validate(token, role)
+    if session is None:
+        raise ValueError("invalid or expired session")
+    return session.username
+
+
+def logout(token):
+    """
+    Ends a session.
+    """
+    sessions.get_manager().logout(token)
+
+
+def change_password(username, password):
+    """
+    Changes a user's password and ends their sessions.
+    """
+    if not password:
+        raise ValueError("password must not be empty")
+    sessions.get_manager().change_password(username, password)
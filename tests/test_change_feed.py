@@ -0,0 +1,180 @@
+"""
+Tests for change_feed.py: where a new Subscriber starts, waiting at a
+change_id still being committed, and telling one from a change that was
+trimmed before it was read.
+"""
+
+import pytest
+
+import change_feed
+import columnar_catalog
+
+
+class FakeFeed:
+    """
+    Stands in for a backend's inventory change feed, and the catalog it
+    logs. Changes are only visible once committed.
+    """
+
+    def __init__(self, quantities=None):
+        # product_id -> quantity
+        self.quantities = dict(quantities or {})
+        # change_id -> (product_id, quantity, delta), committed changes only
+        self.changes = {}
+        self.trimmed_upto = 0
+        self.loads = 0
+
+    def commit(self, change_id, product_id, delta):
+        self.quantities[product_id] = self.quantities.get(product_id, 0) + delta
+        self.changes[change_id] = (product_id, self.quantities[product_id], delta)
+
+    def recent_inventory_changes(self, n):
+        return sorted(self.changes, reverse=True)[:n]
+
+    def inventory_snapshot(self, n):
+        return self.recent_inventory_changes(n), sorted(self.quantities.items())
+
+    def inventory_changes(self, after_change_id, limit):
+        return [(change_id, ) + self.changes[change_id]
+                for change_id in sorted(self.changes) if change_id > after_change_id][:limit]
+
+    def inventory_trimmed_upto(self):
+        return self.trimmed_upto
+
+    def trim_inventory_changes(self, before, upto_change_id=None):
+        # Every change is older than before here; the newest is kept.
+        cutoff = max(self.changes) - 1
+        if upto_change_id is not None:
+            cutoff = min(cutoff, upto_change_id)
+        deleted = [change_id for change_id in self.changes if change_id <= cutoff]
+        for change_id in deleted:
+            del self.changes[change_id]
+        self.trimmed_upto = max(self.trimmed_upto, cutoff)
+        return len(deleted)
+
+    # Enough of the catalog for a ColumnarCatalog.
+    def catalog_version(self):
+        return 1
+
+    def catalog_columns(self):
+        self.loads += 1
+        return [(product_id, "Set", 1, quantity, None, 10, 2000, None)
+                for (product_id, quantity) in sorted(self.quantities.items())]
+
+    def theme_subtrees(self):
+        return []
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def subscribe(feed, watermark=0):
+    clock = Clock()
+    return change_feed.Subscriber(feed, watermark, gap_timeout=5, clock=clock), clock
+
+
+def versions(changes):
+    return [change.version for change in changes]
+
+
+def test_resume_point_stops_before_the_first_missing_change():
+    assert change_feed.resume_point([5, 1, 2, 4]) == (2, {4, 5})
+    assert change_feed.resume_point([3, 2, 1]) == (3, set())
+    assert change_feed.resume_point([]) == (0, set())
+
+
+def test_new_subscriber_starts_at_the_newest_change_it_can_trust():
+    feed = FakeFeed()
+    for change_id in (1, 2, 4):
+        feed.commit(change_id, change_id, 1)
+    subscriber = change_feed.Subscriber(feed)
+    assert subscriber.watermark == 2
+
+    # 3 was still being committed; 4 was already seen, so isn't returned.
+    feed.commit(3, 3, 1)
+    assert versions(subscriber.poll()) == [3]
+    assert subscriber.watermark == 4
+
+
+def test_poll_waits_for_a_late_change_and_applies_it_in_order():
+    feed = FakeFeed()
+    (subscriber, _) = subscribe(feed)
+    feed.commit(2, 7, 1)
+    assert subscriber.poll() == []
+    assert subscriber.waiting and subscriber.watermark == 0
+
+    feed.commit(1, 8, 1)
+    assert versions(subscriber.poll()) == [1, 2]
+    assert not subscriber.waiting
+
+
+def test_poll_skips_a_rolled_back_change_after_the_timeout():
+    feed = FakeFeed()
+    (subscriber, clock) = subscribe(feed)
+    feed.commit(1, 7, 1)
+    feed.commit(3, 7, 1)
+    assert versions(subscriber.poll()) == [1]
+    assert subscriber.waiting
+
+    clock.now = 6.0
+    assert versions(subscriber.poll()) == [3]
+    assert subscriber.watermark == 3
+
+
+def test_changes_trimmed_before_they_were_read_need_a_resync():
+    feed = FakeFeed({7: 0})
+    (subscriber, clock) = subscribe(feed)
+    for change_id in range(1, 6):
+        feed.commit(change_id, 7, 1)
+    change_feed.trim(feed, keep_days=-1)
+
+    # Only change 5 is left: returning it alone would lose four.
+    with pytest.raises(change_feed.FeedTrimmed):
+        subscriber.poll()
+    clock.now = 60.0
+    with pytest.raises(change_feed.FeedTrimmed):
+        subscriber.poll()
+
+    assert subscriber.snapshot() == {7: 5}
+    assert subscriber.poll() == []
+    feed.commit(6, 7, -1)
+    assert subscriber.poll() == [change_feed.Change(7, 4, -1, 6)]
+
+
+def test_trimming_up_to_the_watermark_still_waits_for_a_change_in_flight():
+    feed = FakeFeed()
+    (subscriber, _) = subscribe(feed)
+    for change_id in (1, 2, 3):
+        feed.commit(change_id, 7, 1)
+    assert versions(subscriber.poll()) == [3]
+
+    feed.commit(5, 7, 1)
+    change_feed.trim(feed, keep_days=-1, upto_change_id=subscriber.watermark)
+    assert subscriber.poll() == []
+    assert subscriber.waiting
+
+    feed.commit(4, 8, 1)
+    assert versions(subscriber.poll()) == [4, 5]
+
+
+def test_columnar_catalog_reloads_when_its_feed_was_trimmed():
+    feed = FakeFeed({1: 0, 2: 0})
+    catalog = columnar_catalog.ColumnarCatalog(feed, refresh_interval=0)
+    catalog.load()
+    feed.commit(1, 1, 3)
+    catalog.refresh(force=True)
+    assert catalog.count(in_stock=True) == 1
+    assert feed.loads == 1
+
+    for change_id in (2, 3):
+        feed.commit(change_id, 1, -1)
+    feed.commit(4, 2, 2)
+    change_feed.trim(feed, keep_days=-1)
+    catalog.refresh(force=True)
+    assert feed.loads == 2
+    assert {record.product_id: record.quantity for record in catalog.select()} == {1: 1, 2: 2}
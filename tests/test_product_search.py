@@ -0,0 +1,153 @@
+"""
+Tests for product_search.py: BM25 ranking, and refreshing the index from
+a product_changes log whose change_ids can show up out of order.
+"""
+
+import decimal
+
+import product_search
+
+
+class FakeCatalog:
+    """
+    Stands in for a backend's catalog and product_changes methods.
+    Changes are only visible once committed.
+    """
+
+    def __init__(self, products):
+        # product_id -> (product_name, product_price)
+        self.products = dict(products)
+        # change_id -> product_id, committed changes only
+        self.changes = {}
+
+    def commit(self, change_id, product_id, name=None, price="1.00"):
+        if name is None:
+            self.products.pop(product_id, None)
+        else:
+            self.products[product_id] = (name, decimal.Decimal(price))
+        self.changes[change_id] = product_id
+
+    def last_product_change(self):
+        return max(self.changes, default=0)
+
+    def product_changes(self, after_change_id):
+        return sorted((change_id, product_id) for (change_id, product_id) in self.changes.items()
+                      if change_id > after_change_id)
+
+    def catalog_products(self, product_ids=None):
+        if product_ids is None:
+            product_ids = self.products
+        return [(product_id, ) + self.products[product_id]
+                for product_id in sorted(product_ids) if product_id in self.products]
+
+    def in_stock(self, product_ids):
+        return set(product_ids)
+
+
+def make_index(products):
+    catalog = FakeCatalog((product_id, (name, decimal.Decimal(price)))
+                          for (product_id, name, price) in products)
+    index = product_search.ProductIndex(catalog, refresh_interval=0)
+    index.build()
+    return catalog, index
+
+
+def ids(rows):
+    return [row[0] for row in rows]
+
+
+def test_tokenize_keeps_single_letters_and_digits():
+    assert product_search.tokenize("Brick 2 x 4, Dark-Gray") == ["brick", "2", "x", "4", "dark", "gray"]
+
+
+def test_every_word_beats_some_words_and_shorter_names_rank_first():
+    (_, index) = make_index([
+        (1, "Brick 2 x 4", "0.10"),
+        (2, "Brick 2 x 4 with Pin Holes on Both Sides", "0.20"),
+        (3, "Brick 2 x 2", "0.10"),
+        (4, "Plate 2 x 4", "0.10"),
+    ])
+    assert ids(index.search("brick 2 x 4")) == [1, 2, 3, 4]
+
+
+def test_rarer_words_weigh_more():
+    (_, index) = make_index([
+        (1, "Red Brick", "1.00"),
+        (2, "Red Falcon", "1.00"),
+        (3, "Red Plate", "1.00"),
+        (4, "Blue Plate", "1.00"),
+    ])
+    # Neither name has both words; "falcon" is rarer than "red".
+    assert ids(index.search("red falcon", k=2)) == [2, 1]
+
+
+def test_last_word_matches_as_a_prefix():
+    (_, index) = make_index([
+        (1, "Millennium Falcon", "150.00"),
+        (2, "Mill", "1.00"),
+        (3, "Falcon Minifigure", "5.00"),
+    ])
+    assert ids(index.search("millen")) == [1]
+    # A word that is indexed matches only itself.
+    assert ids(index.search("mill")) == [2]
+    # Numbers aren't expanded.
+    assert index.search("150") == []
+
+
+def test_max_price():
+    (_, index) = make_index([(1, "Falcon", "150.00"), (2, "Falcon Decal", "2.50")])
+    assert ids(index.search("falcon", max_price="10")) == [2]
+
+
+def test_refresh_waits_for_a_change_committed_out_of_order():
+    (catalog, index) = make_index([(1, "Brick", "1.00"), (2, "Plate", "1.00")])
+    assert index.last_change == 0
+
+    # Change 1 is numbered but not committed when change 2 is read.
+    catalog.commit(2, 2, "Tile")
+    index.refresh()
+    assert ids(index.search("tile")) == [2]
+    assert index.last_change == 0
+
+    catalog.commit(1, 1, "Slope")
+    index.refresh()
+    assert ids(index.search("slope")) == [1]
+    assert index.search("brick") == []
+    assert index.last_change == 2
+
+
+def test_refresh_applies_each_change_once():
+    (catalog, index) = make_index([(1, "Brick", "1.00")])
+    catalog.commit(2, 1, "Slope")
+    index.refresh()
+    applied = []
+    catalog.catalog_products = lambda product_ids=None: applied.append(product_ids) or []
+    index.refresh()
+    assert applied == []
+
+
+def test_refresh_skips_a_change_that_never_commits():
+    (catalog, index) = make_index([(1, "Brick", "1.00")])
+    now = [0.0]
+    index._gaps = product_search.change_feed.GapTimer(timeout=5.0, clock=lambda: now[0])
+
+    catalog.commit(2, 1, "Slope")
+    index.refresh()
+    assert index.last_change == 0
+    now[0] = 5.0
+    index.refresh()
+    assert index.last_change == 2
+
+
+def test_build_starts_before_an_uncommitted_change():
+    catalog = FakeCatalog({1: ("Brick", decimal.Decimal("1.00"))})
+    catalog.commit(1, 1, "Brick")
+    catalog.commit(3, 1, "Brick")
+    index = product_search.ProductIndex(catalog, refresh_interval=0)
+    index.build()
+    assert index.last_change == 1
+
+    catalog.commit(2, 1, "Slope")
+    index.refresh()
+    assert ids(index.search("slope")) == [1]
+    assert index.last_change == 3
@@ -0,0 +1,263 @@
+"""
+Tests for recommendations.py: merging spilled pair sums, ranking and
+filling neighbor lists, and folding new purchases and reviews into the
+stored sums incrementally.
+"""
+
+import random
+
+import pytest
+
+import db
+import recommendations
+
+
+def random_baskets(n, num_products=12, seed=1):
+    rng = random.Random(seed)
+    baskets = []
+    for _ in range(n):
+        products = rng.sample(range(1, num_products + 1), rng.randint(1, 6))
+        baskets.append({product_id: rng.choice([1.0, 1 / 3, 5 / 3]) for product_id in products})
+    return baskets
+
+
+def summed(baskets, max_pairs):
+    sums = recommendations.PairSums(max_pairs)
+    try:
+        for basket in baskets:
+            sums.add(recommendations._trim(basket, recommendations.MAX_BASKET))
+        return list(sums.pairs()), list(sums.pairs()), sums.spills
+    finally:
+        sums.close()
+
+
+def test_spilled_runs_merge_to_the_in_memory_sums():
+    baskets = random_baskets(60)
+    (expected, _, spills) = summed(baskets, max_pairs=10 ** 6)
+    (merged, again, many_spills) = summed(baskets, max_pairs=3)
+    assert spills == 1 and many_spills > 10
+    assert [pair[:2] for pair in merged] == [pair[:2] for pair in expected]
+    assert [pair[2] for pair in merged] == pytest.approx([pair[2] for pair in expected])
+    # Sorted by pair, each pair once, and pairs() can be read again.
+    assert [pair[:2] for pair in merged] == sorted({pair[:2] for pair in merged})
+    assert again == merged
+
+
+def test_build_neighbors_does_not_depend_on_spilling():
+    baskets = random_baskets(80, seed=2)
+    groups = {product_id: ("theme", product_id % 3) for product_id in range(1, 13)}
+    (lists, norms) = recommendations.build_neighbors(baskets, groups, k=4)
+    (spilled, spilled_norms) = recommendations.build_neighbors(baskets, groups, k=4, max_pairs=5)
+    assert spilled_norms == pytest.approx(norms)
+    assert {p: [q for (q, _) in neighbors] for (p, neighbors) in spilled.items()} == \
+        {p: [q for (q, _) in neighbors] for (p, neighbors) in lists.items()}
+
+
+def test_neighbors_are_ranked_by_cosine_plus_affinity():
+    baskets = [{1: 1.0, 2: 1.0, 3: 1.0}, {1: 1.0, 2: 1.0}, {1: 1.0, 4: 1.0}]
+    groups = {1: ("theme", 1), 2: ("theme", 2), 3: ("theme", 2), 4: ("theme", 1)}
+    (lists, norms) = recommendations.build_neighbors(baskets, groups, k=2)
+    assert norms[1] == (3.0, 3) and norms[2] == (2.0, 2)
+    # 2 is bought with 1 twice; 4 only once, but shares 1's theme.
+    assert lists[1] == [(2, pytest.approx(2 / 6 ** 0.5)),
+                        (4, pytest.approx(1 / 3 ** 0.5 + recommendations.AFFINITY))]
+    # 3 was bought once, with 1 and 2; 2 has fewer buyers and 3's theme.
+    assert [q for (q, _) in lists[3]] == [2, 1]
+
+
+def test_fill_adds_the_groups_most_bought_products_below_affinity():
+    groups = {1: ("theme", 1), 2: ("theme", 1), 3: ("theme", 1), 4: ("theme", 1),
+              5: ("theme", 2)}
+    norms = {1: (1.0, 1), 2: (9.0, 9), 3: (4.0, 4), 4: (0.0, 0), 5: (50.0, 50)}
+    popular = recommendations.popular_by_group(groups, norms, k=3)
+    filled = recommendations._fill([(3, 0.5)], 1, groups, popular, 3)
+    # Not itself, not 3 twice, and not 5 from another theme.
+    assert [q for (q, _) in filled] == [3, 2, 4]
+    assert all(value < recommendations.AFFINITY for (_, value) in filled[1:])
+    assert recommendations._fill([(3, 0.5)], 5, groups, popular, 3) == [(3, 0.5)]
+
+
+class FakeStore:
+    """
+    Stands in for a backend's purchases, reviews and recommendation
+    tables. A purchase is only visible once committed.
+    """
+
+    def __init__(self, num_products=10):
+        self.num_products = num_products
+        # purchase_id -> (customer_username, product_id)
+        self.purchases = {}
+        # purchase_id -> (rating, review_seq)
+        self.reviews = {}
+        self.state = (0, 0, 0)
+        self.lists = {}
+        self.norms = {}
+        self.sums = {}
+
+    def buy(self, purchase_id, username, product_id):
+        self.purchases[purchase_id] = (username, product_id)
+
+    def review(self, purchase_id, rating):
+        seq = max((seq for (_, seq) in self.reviews.values()), default=0) + 1
+        self.reviews[purchase_id] = (rating, seq)
+
+    def catalog_columns(self):
+        return [(product_id, "Set", 1, 1, product_id % 3, 1, 2000, None)
+                for product_id in range(1, self.num_products + 1)]
+
+    def recent_interactions(self, n):
+        return (sorted(self.purchases, reverse=True)[:n],
+                sorted((seq for (_, seq) in self.reviews.values()), reverse=True)[:n])
+
+    def interactions_after(self, after):
+        return ([(purchase_id, username) for (purchase_id, (username, _))
+                 in sorted(self.purchases.items()) if purchase_id > after[0]],
+                sorted((seq, self.purchases[purchase_id][0])
+                       for (purchase_id, (_, seq)) in self.reviews.items() if seq > after[1]))
+
+    def interactions(self, usernames=None):
+        rows = []
+        for (purchase_id, (username, product_id)) in self.purchases.items():
+            if usernames is None or username in usernames:
+                (rating, seq) = self.reviews.get(purchase_id, (None, None))
+                rows.append((username, purchase_id, product_id, rating, seq))
+        return sorted(rows)
+
+    def recommendation_state(self):
+        return self.state
+
+    def interaction_norms(self):
+        return [(product_id, norm_sq, buyers)
+                for (product_id, (norm_sq, buyers)) in self.norms.items()]
+
+    def pair_sums(self, product_ids):
+        return [(p, q, dot) for ((p, q), dot) in self.sums.items()
+                if p in product_ids or q in product_ids]
+
+    def neighbor_lists(self, product_ids):
+        return [(p, q, value) for p in product_ids for (q, value) in self.lists.get(p, ())]
+
+    def neighbor_holders(self, product_ids):
+        return [(p, q) for (p, neighbors) in self.lists.items() for (q, _) in neighbors
+                if q in product_ids]
+
+    def save_neighbors(self, lists, norms, watermarks=None, clear=False, pair_sums=(),
+                       since=None):
+        if since is not None and self.state[:2] != tuple(since):
+            raise db.DatabaseError(msg="recommendation_state moved")
+        if clear:
+            (self.lists, self.norms, self.sums) = ({}, {}, {})
+        self.lists.update(lists)
+        for (product_id, norm) in norms.items():
+            self.norms.pop(product_id, None)
+            if norm[1] > 0:
+                self.norms[product_id] = norm
+        self.sums.update(((p, q), dot) for (p, q, dot) in pair_sums)
+        if watermarks is not None:
+            self.state = tuple(watermarks) + (self.state[2] + 1, )
+
+
+def rebuilt(store):
+    """
+    Returns a copy of store's data with its recommendations built from
+    scratch.
+    """
+    fresh = FakeStore(store.num_products)
+    (fresh.purchases, fresh.reviews) = (dict(store.purchases), dict(store.reviews))
+    recommendations.build(fresh, k=3)
+    return fresh
+
+
+def test_update_adds_the_same_sums_and_norms_as_a_full_build():
+    rng = random.Random(3)
+    store = FakeStore()
+    customers = ["ann", "bob", "cy", "di", "ed"]
+    for purchase_id in range(1, 31):
+        store.buy(purchase_id, rng.choice(customers), rng.randint(1, 10))
+    store.review(4, 5)
+    recommendations.build(store, k=3)
+
+    # New purchases, a customer's first, and reviews of old and new ones.
+    for purchase_id in range(31, 41):
+        store.buy(purchase_id, rng.choice(customers + ["fay"]), rng.randint(1, 10))
+    store.review(7, 1)
+    store.review(35, 4)
+    assert recommendations.update(store, k=3, gap_timeout=0) > 0
+    assert store.state[:2] == (40, 3)
+
+    fresh = rebuilt(store)
+    assert store.sums.keys() == fresh.sums.keys()
+    for (pair, dot) in fresh.sums.items():
+        assert store.sums[pair] == pytest.approx(dot)
+    assert store.norms.keys() == fresh.norms.keys()
+    for (product_id, (norm_sq, buyers)) in fresh.norms.items():
+        assert store.norms[product_id] == (pytest.approx(norm_sq), buyers)
+    for product_id in {product_id for (_, product_id) in store.purchases.values()}:
+        assert [q for (q, _) in store.lists[product_id]] == \
+            [q for (q, _) in fresh.lists[product_id]]
+
+    # Nothing new: nothing to do, and the version stays.
+    assert recommendations.update(store, k=3, gap_timeout=0) == 0
+    assert store.state[2] == 2
+
+
+def test_update_waits_for_a_purchase_still_being_committed():
+    store = FakeStore()
+    store.buy(1, "ann", 1)
+    recommendations.build(store, k=3)
+    store.buy(3, "ann", 3)
+    now = [0.0]
+
+    def sleep(seconds):
+        # Purchase 2 commits while the update waits for it.
+        store.buy(2, "bob", 2)
+        now[0] += seconds
+
+    recommendations.update(store, k=3, gap_timeout=5, clock=lambda: now[0], sleep=sleep)
+    assert store.state[:2] == (3, 0)
+    assert store.norms[2] == (1.0, 1)
+
+
+def test_update_skips_a_rolled_back_purchase_after_the_timeout():
+    store = FakeStore()
+    store.buy(1, "ann", 1)
+    recommendations.build(store, k=3)
+    store.buy(3, "ann", 3)
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    recommendations.update(store, k=3, gap_timeout=5, clock=lambda: now[0], sleep=sleep)
+    assert store.state[:2] == (3, 0)
+    assert now[0] >= 5
+    assert store.sums == {(1, 3): 1.0}
+
+
+def test_build_stops_before_a_purchase_still_being_committed():
+    store = FakeStore()
+    for purchase_id in (1, 2, 4):
+        store.buy(purchase_id, "ann", purchase_id)
+    recommendations.build(store, k=3)
+    assert store.state[:2] == (2, 0)
+    assert set(store.norms) == {1, 2}
+
+
+def test_concurrent_updates_do_not_both_apply():
+    store = FakeStore()
+    store.buy(1, "ann", 1)
+    recommendations.build(store, k=3)
+    store.buy(2, "ann", 2)
+    state = store.recommendation_state
+
+    def moved():
+        # Another update claims the watermarks after this one read them.
+        (purchases, reviews, version) = state()
+        store.recommendation_state = state
+        store.state = (2, reviews, version + 1)
+        return (purchases, reviews, version)
+
+    store.recommendation_state = moved
+    with pytest.raises(db.Error):
+        recommendations.update(store, k=3, gap_timeout=0)
+    assert store.sums == {}
@@ -0,0 +1,79 @@
+"""
+Tests for sessions.py: locking out repeated failed logins, whatever the
+username's case, and sweeping out expired state.
+"""
+
+import sessions
+
+
+class FakeUsers:
+    """
+    Stands in for a backend's sp_login, which ignores the username's
+    case. Counts the calls that reach the database.
+    """
+
+    def __init__(self, users):
+        # lower-cased username -> (password, role)
+        self.users = users
+        self.calls = 0
+
+    def sp_login(self, username, password, role):
+        self.calls += 1
+        user = self.users.get(username.lower())
+        if user is None or user[1] != role:
+            return sessions.NO_USER
+        return sessions.OK if user[0] == password else sessions.WRONG_PASSWORD
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def manager():
+    users = FakeUsers({"mfreeman": ("secret", sessions.CUSTOMER)})
+    clock = Clock()
+    return sessions.SessionManager(users, ttl=60, max_failures=5, failure_window=300,
+                                   clock=clock), users, clock
+
+
+def test_failed_logins_lock_out_every_spelling_of_the_username():
+    (logins, users, clock) = manager()
+    for _ in range(5):
+        assert logins.login("mfreeman", "guess", sessions.CUSTOMER)[0] == sessions.WRONG_PASSWORD
+    assert users.calls == 5
+
+    for username in ("mfreeman", "MFreeman", "mFreeman", "MFREEMAN"):
+        assert logins.login(username, "secret", sessions.CUSTOMER) == (sessions.LOCKED, None)
+        assert logins.retry_after(username) == 300
+    assert users.calls == 5
+
+    clock.now = 301.0
+    (status, session) = logins.login("MFREEMAN", "secret", sessions.CUSTOMER)
+    assert status == sessions.OK and session.username == "mfreeman"
+
+
+def test_revoke_ends_sessions_opened_under_any_case():
+    (logins, _, _) = manager()
+    (_, first) = logins.login("MFreeman", "secret", sessions.CUSTOMER)
+    (_, second) = logins.login("mfreeman", "secret", sessions.CUSTOMER)
+    assert logins.revoke("MFREEMAN") == 2
+    assert logins.validate(first.token) is None
+    assert logins.validate(second.token) is None
+
+
+def test_login_sweeps_out_expired_sessions_checks_and_failures():
+    (logins, _, clock) = manager()
+    logins.login("mfreeman", "secret", sessions.CUSTOMER)
+    logins.login("nobody", "guess", sessions.CUSTOMER)
+    assert logins._sessions and logins._verified and logins._failures
+
+    # Nobody validates the old session or tries "nobody" again.
+    clock.now = 1000.0
+    logins.login("other", "guess", sessions.CUSTOMER)
+    assert logins._sessions == {} and logins._verified == {}
+    assert list(logins._failures) == ["other"]
+    assert not logins._tokens
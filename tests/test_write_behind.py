@@ -0,0 +1,46 @@
+"""
+Tests for write_behind.py: flush() returning instead of hanging when the
+queue is full or closed.
+"""
+
+import threading
+
+import write_behind
+
+
+class SlowBackend:
+    """
+    Stands in for a backend's apply_writes, holding each group until
+    released.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def apply_writes(self, writes):
+        self.release.wait()
+        return [None] * len(writes)
+
+
+def test_flush_gives_up_when_the_queue_stays_full():
+    backend = SlowBackend()
+    writes = write_behind.WriteBehindQueue(backend, max_batch=1, max_pending=1)
+    # The first is being applied, the second fills the queue.
+    first = writes.submit("write_review", 1, 5, "")
+    writes.submit("write_review", 2, 5, "")
+    assert writes.flush(timeout=0.05) is False
+
+    backend.release.set()
+    assert writes.flush(timeout=5) is True
+    assert first.result() is None
+    writes.close()
+
+
+def test_flush_after_close_returns_false():
+    backend = SlowBackend()
+    backend.release.set()
+    writes = write_behind.WriteBehindQueue(backend)
+    writes.submit("request_additional_inventory", 1, "mfreeman")
+    writes.close()
+    assert writes.applied == 1
+    assert writes.flush() is False
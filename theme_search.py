@@ -0,0 +1,151 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+In-memory theme-name matcher for the theme search.
+
+The database only matches theme names exactly, so "star wars" finds the
+theme but "Star" or "Star Wrs" find nothing. ThemeIndex suggests theme
+names for whatever the customer typed, best first:
+
+  1. names equal to the query (ignoring case),
+  2. names starting with it, then names with a word starting with it
+     (both found by bisecting sorted key lists),
+  3. names sharing enough trigrams (three-letter pieces) with it, which
+     catches typos. A trigram -> names index means only names sharing at
+     least one trigram with the query are scored.
+
+There are only about 600 themes, so the index builds in milliseconds, and
+a lookup touches a few dozen names.
+"""
+
+import bisect
+import collections
+import csv
+
+# Fuzzy matches need at least this Jaccard similarity of trigram sets.
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams of text, lowercased and padded so that
+    the start and end of each word count too.
+    """
+    trigram_set = set()
+    for word in text.lower().split():
+        padded = "  " + word + " "
+        trigram_set.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigram_set
+
+
+class ThemeIndex:
+    """
+    Prefix and trigram indexes over a list of theme names.
+    """
+
+    def __init__(self, names):
+        # lowercased name -> name as stored (the first spelling seen)
+        self._names = {}
+        for name in names:
+            self._names.setdefault(name.lower(), name)
+
+        # Sorted (text, lowercased name) pairs for prefix lookups: the
+        # whole name, and each word of it.
+        self._full_keys = sorted((key, key) for key in self._names)
+        self._word_keys = sorted({(word, key) for key in self._names
+                                  for word in key.split()})
+
+        self._trigrams = {key: trigrams(key) for key in self._names}
+        self._postings = collections.defaultdict(list)
+        for key, key_trigrams in self._trigrams.items():
+            for trigram in key_trigrams:
+                self._postings[trigram].append(key)
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Builds the index from a themes.csv file (theme_id, theme_name, parent_id).
+        """
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls(row[1] for row in csv.reader(f) if len(row) >= 2)
+
+    @classmethod
+    def from_backend(cls, backend):
+        """
+        Builds the index from the themes in the database.
+        """
+        return cls(backend.theme_names())
+
+    def __len__(self):
+        return len(self._names)
+
+    def exact(self, query):
+        """
+        Returns the stored spelling of the theme called query, or None.
+        """
+        return self._names.get(" ".join(query.lower().split()))
+
+    @staticmethod
+    def _prefixed(pairs, prefix):
+        """
+        Yields the names of the (text, name) pairs whose text starts with
+        prefix, in order.
+        """
+        for (text, key) in pairs[bisect.bisect_left(pairs, (prefix, )):]:
+            if not text.startswith(prefix):
+                return
+            yield key
+
+    def _similar(self, query, limit, min_similarity):
+        """
+        Returns up to limit (similarity, lowercased name) pairs for names
+        sharing enough trigrams with query, most similar first.
+        """
+        query_trigrams = trigrams(query)
+        shared = collections.Counter()
+        for trigram in query_trigrams:
+            for key in self._postings.get(trigram, ()):
+                shared[key] += 1
+        scored = []
+        for key, count in shared.items():
+            similarity = count / (len(query_trigrams) + len(self._trigrams[key]) - count)
+            if similarity >= min_similarity:
+                scored.append((-similarity, key))
+        scored.sort()
+        return [(-negated, key) for (negated, key) in scored[:limit]]
+
+    def similar(self, query, limit=5, min_similarity=MIN_SIMILARITY):
+        """
+        Returns up to limit (name, similarity) pairs for names sharing
+        enough trigrams with query, most similar first.
+        """
+        return [(self._names[key], similarity)
+                for (similarity, key) in self._similar(query, limit, min_similarity)]
+
+    def match(self, query, limit=5):
+        """
+        Returns up to limit theme names for query: exact, then prefix,
+        then word-prefix, then fuzzy matches.
+        """
+        query = " ".join(query.lower().split())
+        if not query or not self._names:
+            return []
+        found = []
+        seen = set()
+
+        def add(keys):
+            for key in keys:
+                if len(found) >= limit:
+                    return
+                if key not in seen:
+                    seen.add(key)
+                    found.append(self._names[key])
+
+        if query in self._names:
+            add([query])
+        add(self._prefixed(self._full_keys, query))
+        add(self._prefixed(self._word_keys, query))
+        if len(found) < limit:
+            add(key for (_, key) in self._similar(query, limit, MIN_SIMILARITY))
+        return found
@@ -0,0 +1,211 @@
+"""
+Student name(s): Ellen Min, Gabriella Twombly
+Student email(s): emin@caltech.edu, gtwombly@caltech.edu
+
+A write-behind queue for reviews and inventory requests.
+
+Writing a review or a request is one small transaction, and committing it
+(an fsync on the server) is most of its cost. Neither needs to be visible
+the instant the customer presses enter, so the queue lets the caller carry
+on while a background thread applies the pending writes in groups: up to
+MAX_BATCH writes, or whatever has arrived within MAX_WAIT seconds of the
+first, go to the database in one transaction with one commit
+(backend.apply_writes). Each write has its own savepoint there, so one
+failing write (say, a duplicate review) doesn't undo the others.
+
+submit() returns a concurrent.futures.Future per write, which resolves to
+the write's result (the request ID for a request) or raises its database
+error. The queue holds at most MAX_PENDING writes; submit() blocks while it
+is full, so a stalled database slows callers down instead of piling up
+memory. flush() waits for everything submitted so far; close() flushes and
+stops the thread, and is called by the apps on quit.
+
+Used by app_client.py when LEGOS_WRITE_BEHIND=1.
+"""
+
+import atexit
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+import backends
+
+# The methods that may be queued.
+GROUP_WRITES = ("write_review", "request_additional_inventory")
+
+# A group is committed once it has MAX_BATCH writes, or MAX_WAIT seconds
+# after its first write arrived.
+MAX_BATCH = 64
+MAX_WAIT = 0.05
+
+# submit() blocks while this many writes are waiting.
+MAX_PENDING = 1024
+
+# Set LEGOS_WRITE_BEHIND=1 to queue reviews and requests in app_client.py.
+ENABLED = os.environ.get("LEGOS_WRITE_BEHIND") == "1"
+
+# Queued in place of a write to wake the thread for flush() and close().
+_FLUSH = object()
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Applies queued writes in group commits on a background thread.
+    """
+
+    def __init__(self, backend=None, max_batch=MAX_BATCH, max_wait=MAX_WAIT,
+                 max_pending=MAX_PENDING):
+        self.backend = backend or backends.get_backend()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.closed = False
+        # Counts for monitoring: writes applied, writes failed, commits.
+        self.applied = 0
+        self.failed = 0
+        self.commits = 0
+
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Callers
+    # ------------------------------------------------------------------
+    def submit(self, name, *args):
+        """
+        Queues backend.<name>(*args), one of GROUP_WRITES, and returns a
+        Future for its result. Blocks while the queue is full.
+        """
+        if name not in GROUP_WRITES:
+            raise ValueError("only {writes} can be queued".format(writes=", ".join(GROUP_WRITES)))
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._queue.put((name, args, future))
+        return future
+
+    def write_review(self, purchase_id, rating, review):
+        return self.submit("write_review", purchase_id, rating, review)
+
+    def request_additional_inventory(self, product_id, username):
+        return self.submit("request_additional_inventory", product_id, username)
+
+    def flush(self, timeout=None):
+        """
+        Waits until every write submitted so far is committed (or failed).
+        Returns False if timeout seconds passed first, or if the queue is
+        closed (close() has flushed it, or is about to).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = threading.Event()
+        # Under the lock, so close() can't queue _STOP ahead of the flush
+        # and leave nothing to set done.
+        with self._lock:
+            if self.closed:
+                return False
+            try:
+                self._queue.put((_FLUSH, done, None), timeout=timeout)
+            except queue.Full:
+                return False
+        return done.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def close(self, timeout=None):
+        """
+        Flushes the queue and stops the thread. Writes can't be submitted
+        afterwards.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.put((_STOP, None, None))
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # ------------------------------------------------------------------
+    # Background thread
+    # ------------------------------------------------------------------
+    def _run(self):
+        while True:
+            # Wait for the first write of a group, then take whatever else
+            # arrives before the group is full or max_wait has passed.
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.max_wait
+            while item[0] is not _FLUSH and item[0] is not _STOP:
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    item = None
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+                    break
+            if batch:
+                self._apply(batch)
+            if item is None:
+                continue
+            if item[0] is _STOP:
+                return
+            item[1].set()
+
+    def _apply(self, batch):
+        """
+        Commits batch, a list of (name, args, future), and resolves the
+        futures with each write's result or error.
+        """
+        writes = [(name, args) for (name, args, _) in batch]
+        try:
+            results = self.backend.apply_writes(writes)
+        except Exception as err:
+            # The whole group was lost (e.g. the connection dropped).
+            self.failed += len(batch)
+            for (_, _, future) in batch:
+                future.set_exception(err)
+            return
+        self.commits += 1
+        for ((_, _, future), result) in zip(batch, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                future.set_exception(result)
+            else:
+                self.applied += 1
+                future.set_result(result)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """
+    Returns the process-wide write-behind queue, started on first use and
+    flushed when the process exits.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None or _queue.closed:
+            _queue = WriteBehindQueue()
+            atexit.register(_queue.close)
+        return _queue
+
+
+def close():
+    """
+    Flushes and stops the process-wide queue, if it was started.
+    """
+    with _queue_lock:
+        if _queue is not None:
+            _queue.close()